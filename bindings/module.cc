@@ -3,64 +3,696 @@
 
 #include <aotriton/dtypes.h>
 #include <aotriton/flash.h>
+#include <aotriton/instrument.h>
+#include <aotriton/lookup_cache.h>
 #include <aotriton/runtime.h>
+#include <aotriton/trace.h>
 #include <aotriton/util.h>
 #include <pybind11/pybind11.h>
+#include <dlfcn.h>
 #include <pybind11/stl.h>
 #include <string>
+#include "tensor.h"
 
 namespace py = pybind11;
 
 namespace pyaotriton {
   namespace v2 {
     namespace flash {
+      void def_plans(py::module_& m) {
+        using aotriton::v2::flash::AttnBwdPlan;
+        using aotriton::v2::flash::AttnFwdPlan;
+        py::class_<AttnFwdPlan>(m, "AttnFwdPlan", "Reusable execution plan of Flash Attention Forward Pass")
+          .def(py::init<>())
+          .def("prepare",
+               &AttnFwdPlan::prepare,
+               py::arg("q"),
+               py::arg("k"),
+               py::arg("v"),
+               py::arg("b"),
+               py::arg("softmax_lse"),
+               py::arg("out"),
+               py::arg("dropout_p"),
+               py::arg("encoded_softmax"),
+               py::arg("is_causal"),
+               py::arg("window_left") = -1,
+               py::arg("window_right") = -1,
+               py::arg("stream") = nullptr)
+          .def("execute",
+               &AttnFwdPlan::execute,
+               py::arg("q"),
+               py::arg("k"),
+               py::arg("v"),
+               py::arg("b"),
+               py::arg("sm_scale"),
+               py::arg("softmax_lse"),
+               py::arg("out"),
+               py::arg("philox_seed"),
+               py::arg("philox_offset"),
+               py::arg("encoded_softmax"),
+               py::arg("stream") = nullptr)
+          .def_property_readonly("prepared", &AttnFwdPlan::prepared);
+        py::class_<AttnBwdPlan>(m, "AttnBwdPlan", "Reusable execution plan of Flash Attention Backward Pass")
+          .def(py::init<>())
+          .def("prepare",
+               &AttnBwdPlan::prepare,
+               py::arg("q"),
+               py::arg("k"),
+               py::arg("v"),
+               py::arg("b"),
+               py::arg("out"),
+               py::arg("dout"),
+               py::arg("dq"),
+               py::arg("dk"),
+               py::arg("dv"),
+               py::arg("db"),
+               py::arg("softmax_lse"),
+               py::arg("delta"),
+               py::arg("dropout_p"),
+               py::arg("is_causal"),
+               py::arg("window_left") = -1,
+               py::arg("window_right") = -1,
+               py::arg("stream") = nullptr)
+          .def("execute",
+               &AttnBwdPlan::execute,
+               py::arg("q"),
+               py::arg("k"),
+               py::arg("v"),
+               py::arg("b"),
+               py::arg("sm_scale"),
+               py::arg("out"),
+               py::arg("dout"),
+               py::arg("dq"),
+               py::arg("dk"),
+               py::arg("dv"),
+               py::arg("db"),
+               py::arg("softmax_lse"),
+               py::arg("delta"),
+               py::arg("philox_seed"),
+               py::arg("philox_offset"),
+               py::arg("stream") = nullptr,
+               py::arg("extargs") = nullptr)
+          .def_property_readonly("prepared", &AttnBwdPlan::prepared);
+      }
+
       void setup_module(py::module_& m) {
+        py::class_<aotriton::v2::flash::BwdExtraArguments>(m, "BwdExtraArguments")
+          .def(py::init<>())
+          .def_readwrite("concurrent_dq", &aotriton::v2::flash::BwdExtraArguments::concurrent_dq)
+          .def_readwrite("dropout_bitmask", &aotriton::v2::flash::BwdExtraArguments::dropout_bitmask)
+          .def_readwrite("dq_acc", &aotriton::v2::flash::BwdExtraArguments::dq_acc);
+        py::class_<aotriton::v2::flash::FwdExtraArguments>(m, "FwdExtraArguments")
+          .def(py::init<>())
+          .def_readwrite("dropout_bitmask", &aotriton::v2::flash::FwdExtraArguments::dropout_bitmask);
         m.def("check_gpu", &aotriton::v2::flash::check_gpu, py::arg("stream"));
-        m.def("attn_fwd",
-              &aotriton::v2::flash::attn_fwd,
-              "Flash Attention Forward Pass",
+        // Tensors can be T2/T4 objects, or any object supporting __dlpack__ or
+        // __cuda_array_interface__, which are read without Python code.
+        // The GIL is released while kernels are selected and launched.
+        m.def(
+          "attn_fwd",
+          [](py::handle q,
+             py::handle k,
+             py::handle v,
+             py::handle b,
+             float sm_scale,
+             py::handle softmax_lse,
+             py::handle out,
+             float dropout_p,
+             uint64_t philox_seed,
+             uint64_t philox_offset,
+             py::handle encoded_softmax,
+             bool is_causal,
+             int32_t window_left,
+             int32_t window_right,
+             py::handle stream,
+             const aotriton::v2::flash::FwdExtraArguments* extargs) {
+            TensorImporter importer(stream, q);
+            auto tq = importer.view<4>(q);
+            auto tk = importer.view<4>(k);
+            auto tv = importer.view<4>(v);
+            auto tb = importer.view<4>(b);
+            auto tlse = importer.view<2>(softmax_lse);
+            auto tout = importer.view<4>(out);
+            auto tes = importer.view<4>(encoded_softmax);
+            py::gil_scoped_release release;
+            return aotriton::v2::flash::attn_fwd(tq,
+                                                 tk,
+                                                 tv,
+                                                 tb,
+                                                 sm_scale,
+                                                 tlse,
+                                                 tout,
+                                                 dropout_p,
+                                                 philox_seed,
+                                                 philox_offset,
+                                                 tes,
+                                                 is_causal,
+                                                 window_left,
+                                                 window_right,
+                                                 importer.stream(),
+                                                 extargs);
+          },
+          "Flash Attention Forward Pass",
+          py::arg("q"),
+          py::arg("k"),
+          py::arg("v"),
+          py::arg("b"),
+          py::arg("sm_scale"),
+          py::arg("softmax_lse"),
+          py::arg("out"),
+          py::arg("dropout_p"),
+          py::arg("philox_seed"),
+          py::arg("philox_offset"),
+          py::arg("encoded_softmax"),
+          py::arg("is_causal"),
+          py::arg("window_left") = -1,
+          py::arg("window_right") = -1,
+          py::arg("stream") = py::none(),
+          py::arg("extargs") = nullptr);
+        m.def(
+          "attn_bwd",
+          [](py::handle q,
+             py::handle k,
+             py::handle v,
+             py::handle b,
+             float sm_scale,
+             py::handle out,
+             py::handle dout,
+             py::handle dq,
+             py::handle dk,
+             py::handle dv,
+             py::handle db,
+             py::handle softmax_lse,
+             py::handle delta,
+             float dropout_p,
+             uint64_t philox_seed,
+             uint64_t philox_offset,
+             bool is_causal,
+             int32_t window_left,
+             int32_t window_right,
+             py::handle stream,
+             const aotriton::v2::flash::BwdExtraArguments* extargs) {
+            TensorImporter importer(stream, q);
+            auto tq = importer.view<4>(q);
+            auto tk = importer.view<4>(k);
+            auto tv = importer.view<4>(v);
+            auto tb = importer.view<4>(b);
+            auto tout = importer.view<4>(out);
+            auto tdout = importer.view<4>(dout);
+            auto tdq = importer.view<4>(dq);
+            auto tdk = importer.view<4>(dk);
+            auto tdv = importer.view<4>(dv);
+            auto tdb = importer.view<4>(db);
+            auto tlse = importer.view<2>(softmax_lse);
+            auto tdelta = importer.view<2>(delta);
+            py::gil_scoped_release release;
+            return aotriton::v2::flash::attn_bwd(tq,
+                                                 tk,
+                                                 tv,
+                                                 tb,
+                                                 sm_scale,
+                                                 tout,
+                                                 tdout,
+                                                 tdq,
+                                                 tdk,
+                                                 tdv,
+                                                 tdb,
+                                                 tlse,
+                                                 tdelta,
+                                                 dropout_p,
+                                                 philox_seed,
+                                                 philox_offset,
+                                                 is_causal,
+                                                 window_left,
+                                                 window_right,
+                                                 importer.stream(),
+                                                 extargs);
+          },
+          "Flash Attention Backward Pass",
+          py::arg("q"),
+          py::arg("k"),
+          py::arg("v"),
+          py::arg("b"),
+          py::arg("sm_scale"),
+          py::arg("out"),
+          py::arg("dout"),
+          py::arg("dq"),
+          py::arg("dk"),
+          py::arg("dv"),
+          py::arg("db"),
+          py::arg("softmax_lse"),
+          py::arg("delta"),
+          py::arg("dropout_p"),
+          py::arg("philox_seed"),
+          py::arg("philox_offset"),
+          py::arg("is_causal"),
+          py::arg("window_left") = -1,
+          py::arg("window_right") = -1,
+          py::arg("stream") = py::none(),
+          py::arg("extargs") = nullptr);
+        // cu_seqlens_q/cu_seqlens_k are int32 tensors of num_seqs + 1 elements
+        m.def(
+          "attn_fwd_compact_varlen",
+          [](py::handle q,
+             py::handle k,
+             py::handle v,
+             py::handle b,
+             py::handle cu_seqlens_q,
+             py::handle cu_seqlens_k,
+             int32_t max_seqlen_q,
+             int32_t max_seqlen_k,
+             float sm_scale,
+             py::handle softmax_lse,
+             py::handle out,
+             float dropout_p,
+             uint64_t philox_seed,
+             uint64_t philox_offset,
+             py::handle encoded_softmax,
+             bool is_causal,
+             int32_t window_left,
+             int32_t window_right,
+             py::handle stream) {
+            TensorImporter importer(stream, q);
+            auto tq = importer.view<4>(q);
+            auto tk = importer.view<4>(k);
+            auto tv = importer.view<4>(v);
+            auto tb = importer.view<4>(b);
+            auto tcu_q = importer.view<1>(cu_seqlens_q);
+            auto tcu_k = importer.view<1>(cu_seqlens_k);
+            auto tlse = importer.view<2>(softmax_lse);
+            auto tout = importer.view<4>(out);
+            auto tes = importer.view<4>(encoded_softmax);
+            py::gil_scoped_release release;
+            return aotriton::v2::flash::attn_fwd_compact_varlen(tq,
+                                                                tk,
+                                                                tv,
+                                                                tb,
+                                                                tcu_q,
+                                                                tcu_k,
+                                                                max_seqlen_q,
+                                                                max_seqlen_k,
+                                                                sm_scale,
+                                                                tlse,
+                                                                tout,
+                                                                dropout_p,
+                                                                philox_seed,
+                                                                philox_offset,
+                                                                tes,
+                                                                is_causal,
+                                                                window_left,
+                                                                window_right,
+                                                                importer.stream());
+          },
+          "Flash Attention Forward Pass of packed variable-length sequences",
+          py::arg("q"),
+          py::arg("k"),
+          py::arg("v"),
+          py::arg("b"),
+          py::arg("cu_seqlens_q"),
+          py::arg("cu_seqlens_k"),
+          py::arg("max_seqlen_q"),
+          py::arg("max_seqlen_k"),
+          py::arg("sm_scale"),
+          py::arg("softmax_lse"),
+          py::arg("out"),
+          py::arg("dropout_p"),
+          py::arg("philox_seed"),
+          py::arg("philox_offset"),
+          py::arg("encoded_softmax"),
+          py::arg("is_causal"),
+          py::arg("window_left") = -1,
+          py::arg("window_right") = -1,
+          py::arg("stream") = py::none());
+        m.def(
+          "attn_bwd_compact_varlen",
+          [](py::handle q,
+             py::handle k,
+             py::handle v,
+             py::handle b,
+             py::handle cu_seqlens_q,
+             py::handle cu_seqlens_k,
+             int32_t max_seqlen_q,
+             int32_t max_seqlen_k,
+             float sm_scale,
+             py::handle out,
+             py::handle dout,
+             py::handle dq,
+             py::handle dk,
+             py::handle dv,
+             py::handle db,
+             py::handle softmax_lse,
+             py::handle delta,
+             float dropout_p,
+             uint64_t philox_seed,
+             uint64_t philox_offset,
+             bool is_causal,
+             int32_t window_left,
+             int32_t window_right,
+             py::handle stream,
+             const aotriton::v2::flash::BwdExtraArguments* extargs) {
+            TensorImporter importer(stream, q);
+            auto tq = importer.view<4>(q);
+            auto tk = importer.view<4>(k);
+            auto tv = importer.view<4>(v);
+            auto tb = importer.view<4>(b);
+            auto tcu_q = importer.view<1>(cu_seqlens_q);
+            auto tcu_k = importer.view<1>(cu_seqlens_k);
+            auto tout = importer.view<4>(out);
+            auto tdout = importer.view<4>(dout);
+            auto tdq = importer.view<4>(dq);
+            auto tdk = importer.view<4>(dk);
+            auto tdv = importer.view<4>(dv);
+            auto tdb = importer.view<4>(db);
+            auto tlse = importer.view<2>(softmax_lse);
+            auto tdelta = importer.view<2>(delta);
+            py::gil_scoped_release release;
+            return aotriton::v2::flash::attn_bwd_compact_varlen(tq,
+                                                                tk,
+                                                                tv,
+                                                                tb,
+                                                                tcu_q,
+                                                                tcu_k,
+                                                                max_seqlen_q,
+                                                                max_seqlen_k,
+                                                                sm_scale,
+                                                                tout,
+                                                                tdout,
+                                                                tdq,
+                                                                tdk,
+                                                                tdv,
+                                                                tdb,
+                                                                tlse,
+                                                                tdelta,
+                                                                dropout_p,
+                                                                philox_seed,
+                                                                philox_offset,
+                                                                is_causal,
+                                                                window_left,
+                                                                window_right,
+                                                                importer.stream(),
+                                                                extargs);
+          },
+          "Flash Attention Backward Pass of packed variable-length sequences",
+          py::arg("q"),
+          py::arg("k"),
+          py::arg("v"),
+          py::arg("b"),
+          py::arg("cu_seqlens_q"),
+          py::arg("cu_seqlens_k"),
+          py::arg("max_seqlen_q"),
+          py::arg("max_seqlen_k"),
+          py::arg("sm_scale"),
+          py::arg("out"),
+          py::arg("dout"),
+          py::arg("dq"),
+          py::arg("dk"),
+          py::arg("dv"),
+          py::arg("db"),
+          py::arg("softmax_lse"),
+          py::arg("delta"),
+          py::arg("dropout_p"),
+          py::arg("philox_seed"),
+          py::arg("philox_offset"),
+          py::arg("is_causal"),
+          py::arg("window_left") = -1,
+          py::arg("window_right") = -1,
+          py::arg("stream") = py::none(),
+          py::arg("extargs") = nullptr);
+        m.def(
+          "attn_fwd_fp8",
+          [](py::handle q,
+             py::handle k,
+             py::handle v,
+             float q_descale,
+             float k_descale,
+             float v_descale,
+             float sm_scale,
+             py::handle softmax_lse,
+             py::handle out,
+             bool is_causal,
+             int32_t window_left,
+             int32_t window_right,
+             py::handle stream) {
+            TensorImporter importer(stream, q);
+            auto tq = importer.view<4>(q);
+            auto tk = importer.view<4>(k);
+            auto tv = importer.view<4>(v);
+            auto tlse = importer.view<2>(softmax_lse);
+            auto tout = importer.view<4>(out);
+            py::gil_scoped_release release;
+            return aotriton::v2::flash::attn_fwd_fp8(tq,
+                                                     tk,
+                                                     tv,
+                                                     q_descale,
+                                                     k_descale,
+                                                     v_descale,
+                                                     sm_scale,
+                                                     tlse,
+                                                     tout,
+                                                     is_causal,
+                                                     window_left,
+                                                     window_right,
+                                                     importer.stream());
+          },
+          "FP8 Flash Attention Forward Pass",
+          py::arg("q"),
+          py::arg("k"),
+          py::arg("v"),
+          py::arg("q_descale"),
+          py::arg("k_descale"),
+          py::arg("v_descale"),
+          py::arg("sm_scale"),
+          py::arg("softmax_lse"),
+          py::arg("out"),
+          py::arg("is_causal"),
+          py::arg("window_left") = -1,
+          py::arg("window_right") = -1,
+          py::arg("stream") = py::none());
+        // Returns (hipError_t, shape), shape is all zeros if the bitmask should not be used
+        m.def(
+          "dropout_bitmask_shape",
+          [](py::handle q, py::handle k, float dropout_p, uint64_t budget_bytes) {
+            TensorImporter importer(py::none(), q);
+            auto tq = importer.view<4>(q);
+            auto tk = importer.view<4>(k);
+            std::array<uint64_t, 4> shape;
+            hipError_t err = aotriton::v2::flash::dropout_bitmask_shape(tq, tk, dropout_p, budget_bytes, &shape);
+            return py::make_tuple(err, py::make_tuple(shape[0], shape[1], shape[2], shape[3]));
+          },
+          "Shape of the dropout bitmask of q and k, if it fits in budget_bytes",
+          py::arg("q"),
+          py::arg("k"),
+          py::arg("dropout_p"),
+          py::arg("budget_bytes"));
+        // Returns (hipError_t, num_splits)
+        m.def(
+          "attn_fwd_decode_num_splits",
+          [](py::handle q, py::handle k, py::handle stream) {
+            TensorImporter importer(stream, q);
+            auto tq = importer.view<4>(q);
+            auto tk = importer.view<4>(k);
+            int32_t num_splits = 0;
+            hipError_t err = aotriton::v2::flash::attn_fwd_decode_num_splits(tq, tk, importer.stream(), &num_splits);
+            return py::make_tuple(err, num_splits);
+          },
+          "Number of seqlen_k splits of attn_fwd_decode on the device of the stream",
+          py::arg("q"),
+          py::arg("k"),
+          py::arg("stream") = py::none());
+        m.def(
+          "attn_fwd_decode",
+          [](py::handle q,
+             py::handle k,
+             py::handle v,
+             float sm_scale,
+             py::handle softmax_lse,
+             py::handle out,
+             py::handle out_partial,
+             py::handle lse_partial,
+             py::handle stream) {
+            TensorImporter importer(stream, q);
+            auto tq = importer.view<4>(q);
+            auto tk = importer.view<4>(k);
+            auto tv = importer.view<4>(v);
+            auto tlse = importer.view<2>(softmax_lse);
+            auto tout = importer.view<4>(out);
+            auto tout_partial = importer.view<4>(out_partial);
+            auto tlse_partial = importer.view<2>(lse_partial);
+            py::gil_scoped_release release;
+            return aotriton::v2::flash::attn_fwd_decode(tq,
+                                                        tk,
+                                                        tv,
+                                                        sm_scale,
+                                                        tlse,
+                                                        tout,
+                                                        tout_partial,
+                                                        tlse_partial,
+                                                        importer.stream());
+          },
+          "Split-KV Flash Attention Forward Pass for decoding",
+          py::arg("q"),
+          py::arg("k"),
+          py::arg("v"),
+          py::arg("sm_scale"),
+          py::arg("softmax_lse"),
+          py::arg("out"),
+          py::arg("out_partial"),
+          py::arg("lse_partial"),
+          py::arg("stream") = py::none());
+        m.def("prepare_attn_fwd_for_capture",
+              &aotriton::v2::flash::prepare_attn_fwd_for_capture,
+              "Select and load attn_fwd kernels so that calls with the same shapes can be captured",
               py::arg("q"),
               py::arg("k"),
               py::arg("v"),
-              py::arg("sm_scale"),
+              py::arg("b"),
               py::arg("softmax_lse"),
               py::arg("out"),
               py::arg("dropout_p"),
-              py::arg("philox_seed"),
-              py::arg("philox_offset"),
               py::arg("encoded_softmax"),
               py::arg("is_causal"),
+              py::arg("window_left") = -1,
+              py::arg("window_right") = -1,
               py::arg("stream") = nullptr);
-        m.def("attn_bwd",
-              &aotriton::v2::flash::attn_bwd,
-              "Flash Attention Backward Pass",
+        m.def("prepare_attn_bwd_for_capture",
+              &aotriton::v2::flash::prepare_attn_bwd_for_capture,
+              "Select and load attn_bwd kernels so that calls with the same shapes can be captured",
               py::arg("q"),
               py::arg("k"),
               py::arg("v"),
-              py::arg("sm_scale"),
+              py::arg("b"),
               py::arg("out"),
               py::arg("dout"),
               py::arg("dq"),
               py::arg("dk"),
               py::arg("dv"),
+              py::arg("db"),
               py::arg("softmax_lse"),
               py::arg("delta"),
               py::arg("dropout_p"),
-              py::arg("philox_seed"),
-              py::arg("philox_offset"),
               py::arg("is_causal"),
-              py::arg("stream") = nullptr);
+              py::arg("window_left") = -1,
+              py::arg("window_right") = -1,
+              py::arg("stream") = nullptr,
+              py::arg("extargs") = nullptr);
+        def_plans(m);
       }
     } // namespace flash
 
+    void def_lookup_cache(py::module_& m) {
+      py::class_<aotriton::v2::LookupCacheStats>(m, "LookupCacheStats")
+        .def(py::init<>())
+        .def_readonly("hits", &aotriton::v2::LookupCacheStats::hits)
+        .def_readonly("misses", &aotriton::v2::LookupCacheStats::misses)
+        .def("__repr__", [](const aotriton::v2::LookupCacheStats& stats) {
+          return "LookupCacheStats(hits=" + std::to_string(stats.hits) +
+                 ", misses=" + std::to_string(stats.misses) + ")";
+        });
+      m.def("set_lookup_cache_enabled", &aotriton::v2::set_lookup_cache_enabled, py::arg("enabled"));
+      m.def("get_lookup_cache_enabled", &aotriton::v2::get_lookup_cache_enabled);
+      m.def("get_lookup_cache_stats",
+            &aotriton::v2::get_lookup_cache_stats,
+            "Hits and misses of the kernel selection cache, keyed by kernel name");
+      m.def("reset_lookup_cache_stats", &aotriton::v2::reset_lookup_cache_stats);
+      m.def("clear_lookup_cache", &aotriton::v2::clear_lookup_cache);
+    }
+
+    void def_instrumentation(py::module_& m) {
+      py::enum_<aotriton::v2::InstrumentMode>(m, "InstrumentMode")
+        .value("kInstrumentOff", aotriton::v2::kInstrumentOff)
+        .value("kInstrumentCount", aotriton::v2::kInstrumentCount)
+        .value("kInstrumentTiming", aotriton::v2::kInstrumentTiming)
+        .export_values();
+      m.def("set_instrumentation", &aotriton::v2::set_instrumentation, py::arg("mode"));
+      m.def("get_instrumentation", &aotriton::v2::get_instrumentation);
+      m.def(
+        "get_instrumentation_snapshot",
+        [](bool synchronize) {
+          py::list ret;
+          for (const auto& r : aotriton::v2::get_instrumentation_snapshot(synchronize)) {
+            py::dict d;
+            d["kernel"] = r.kernel;
+            d["arch"] = r.arch;
+            d["functional"] = r.functional;
+            d["image_index"] = r.image_index;
+            d["image"] = r.image;
+            d["launches"] = r.launches;
+            d["timed_launches"] = r.timed_launches;
+            d["pending_timings"] = r.pending_timings;
+            d["total_ms"] = r.total_ms;
+            d["min_ms"] = r.min_ms;
+            d["max_ms"] = r.max_ms;
+            ret.append(d);
+          }
+          return ret;
+        },
+        "List of launch records, one dict per (kernel, arch, functional, image)",
+        py::arg("synchronize") = false);
+      m.def("get_instrumentation_json", &aotriton::v2::get_instrumentation_json, py::arg("synchronize") = false);
+      m.def("reset_instrumentation", &aotriton::v2::reset_instrumentation);
+    }
+
+    // Python callable currently registered as trace callback
+    py::object* py_trace_callback = nullptr;
+
+    void trace_trampoline(const aotriton::v2::TraceEvent& event, void*) {
+      py::gil_scoped_acquire gil;
+      if (!py_trace_callback)
+        return;
+      py::dict perf;
+      for (int32_t i = 0; i < event.num_perf_fields; i++)
+        perf[event.perf_names[i]] = event.perf_values[i];
+      py::dict d;
+      d["kernel"] = event.kernel;
+      d["image"] = event.image ? event.image : "";
+      d["arch"] = event.arch;
+      d["functional"] = event.functional;
+      d["image_index"] = event.image_index;
+      d["grid"] = py::make_tuple(event.grid.x, event.grid.y, event.grid.z);
+      d["stream"] = reinterpret_cast<intptr_t>(event.stream);
+      d["status"] = event.status;
+      d["perf"] = perf;
+      d["lookup_ns"] = event.lookup_ns;
+      try {
+        (*py_trace_callback)(d);
+      } catch (py::error_already_set& e) {
+        e.discard_as_unraisable("aotriton trace callback");
+      }
+    }
+
+    void def_trace(py::module_& m) {
+      m.def(
+        "set_trace_callback",
+        [](py::object callback) {
+          if (callback.is_none()) {
+            aotriton::v2::set_trace_callback(nullptr);
+          } else {
+            // Register before replacing the callable to avoid calling a
+            // dangling object. The previous one is intentionally leaked since
+            // another thread may be inside trace_trampoline.
+            py_trace_callback = new py::object(callback);
+            aotriton::v2::set_trace_callback(&trace_trampoline);
+          }
+        },
+        "Call callback(dict) after every kernel launch. Pass None to unregister.",
+        py::arg("callback"));
+    }
+
     void setup_module(py::module_& m) {
       py::module_ mod_flash = m.def_submodule("flash", "Flash Attention API");
       flash::setup_module(mod_flash);
+      def_lookup_cache(m);
+      def_instrumentation(m);
+      def_trace(m);
     }
   } // namespace v2
 
   void def_stream(py::module_& m) {
-    py::class_<aotriton::Stream>(m, "Stream").def(py::init<>());
+    py::class_<aotriton::Stream>(m, "Stream")
+      .def(py::init<>())
+      .def(py::init([](intptr_t stream) { return aotriton::Stream(reinterpret_cast<hipStream_t>(stream)); }),
+           "Wrap a native stream handle, e.g. torch.cuda.Stream.cuda_stream",
+           py::arg("stream"));
   }
 
   void def_dtype(py::module_& m) {
@@ -70,6 +702,8 @@ namespace pyaotriton {
       .EV(kFloat32)
       .EV(kFloat16)
       .EV(kBFloat16)
+      .EV(kFloat8e4m3fnuz)
+      .EV(kFloat8e5m2fnuz)
       .EV(kInt8)
       .EV(kInt16)
       .EV(kInt32)
@@ -96,6 +730,23 @@ namespace pyaotriton {
       .def_property_readonly("dtype", &aotriton::TensorView<Rank>::dtype);
   }
 
+  // Makes pyaotriton a package, so that the Python modules installed in the
+  // pyaotriton/ directory next to this extension (e.g. pyaotriton.torch) can
+  // be imported as submodules.
+  void def_package_path(py::module_& m) {
+    std::string dir = ".";
+    Dl_info info;
+    if (dladdr(reinterpret_cast<const void*>(&def_package_path), &info) && info.dli_fname) {
+      std::string fname(info.dli_fname);
+      auto slash = fname.rfind('/');
+      if (slash != std::string::npos)
+        dir = fname.substr(0, slash);
+    }
+    py::list path;
+    path.append(dir + "/pyaotriton");
+    m.attr("__path__") = path;
+  }
+
   void setup_module(py::module_& m) {
     m.doc() = "AOTriton Python binding";
     def_stream(m);
@@ -104,8 +755,10 @@ namespace pyaotriton {
     def_tensorview<4>(m, "T4");
     def_tensorview<2>(m, "T2");
     def_tensorview<1>(m, "T1");
+    def_tensor_import(m);
     py::module_ mod_v2api = m.def_submodule("v2", "v2 API namespace");
     v2::setup_module(mod_v2api);
+    def_package_path(m);
   }
 
 } // namespace pyaotriton
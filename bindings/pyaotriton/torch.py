@@ -0,0 +1,228 @@
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+'''
+PyTorch autograd function of Flash Attention on top of the AOT compiled
+kernels. No Triton installation is needed at runtime.
+
+    from pyaotriton.torch import attention
+    out = attention(q, k, v, causal=True)
+
+q, k, v are batch_size x num_heads x seqlen x head_size tensors on a ROCm
+device. k and v may have fewer heads than q (GQA/MQA), as long as the heads
+of q are a multiple of them. Kernels run on the current torch stream of the
+device of q.
+
+Per-shape execution plans (AttnFwdPlan/AttnBwdPlan) are cached per thread,
+so repeated calls with the same shapes, strides and dtypes skip the kernel
+selection. Scratch buffers (delta of the backward pass, and softmax_lse
+when no gradient is required) come from a per-stream workspace pool that
+keeps one growing buffer per stream and dtype.
+'''
+
+import math
+import threading
+from collections import OrderedDict
+
+import torch
+
+from pyaotriton import Stream, hipError_t, as_tensor_view
+from pyaotriton.v2.flash import AttnFwdPlan, AttnBwdPlan
+
+MAX_PLANS = 256
+MAX_WORKSPACES = 16
+
+class AOTritonError(RuntimeError):
+    def __init__(self, what, err):
+        super().__init__(f'{what} failed with {err}')
+        self.err = err
+
+def _check(what, err):
+    if err != hipError_t.hipSuccess:
+        raise AOTritonError(what, err)
+
+def _layout(t):
+    return None if t is None else (tuple(t.shape), t.stride(), t.dtype)
+
+class PlanCache(object):
+    '''
+    LRU cache of prepared plans. Plans are not thread-safe and each thread
+    owns its own cache.
+    '''
+
+    def __init__(self, max_plans=MAX_PLANS):
+        self._plans = OrderedDict()
+        self.max_plans = max_plans
+
+    def get(self, key, prepare):
+        plan = self._plans.get(key)
+        if plan is not None:
+            self._plans.move_to_end(key)
+            return plan
+        plan = prepare()
+        self._plans[key] = plan
+        if len(self._plans) > self.max_plans:
+            self._plans.popitem(last=False)
+        return plan
+
+    def clear(self):
+        self._plans.clear()
+
+    def __len__(self):
+        return len(self._plans)
+
+class WorkspacePool(object):
+    '''
+    Scratch buffers keyed by (stream, device, dtype). A buffer only grows, and
+    each request gets a view of its first elements, so cycling through shapes
+    keeps one buffer per key. The least recently used keys are evicted beyond
+    max_buffers, e.g. when streams are created and dropped.
+
+    A scratch tensor is only used by kernels on its stream, hence it can be
+    handed out again once the Python call that used it has returned.
+    '''
+
+    def __init__(self, max_buffers=MAX_WORKSPACES):
+        self._buffers = OrderedDict()
+        self.max_buffers = max_buffers
+
+    def get(self, stream, shape, dtype, device):
+        key = (stream, device, dtype)
+        numel = math.prod(shape)
+        buf = self._buffers.get(key)
+        if buf is None or buf.numel() < numel:
+            # Allocated on the current stream, which is the stream of the key.
+            # Freeing the old buffer is ordered after its pending kernels.
+            buf = torch.empty((numel,), dtype=dtype, device=device)
+            self._buffers[key] = buf
+        self._buffers.move_to_end(key)
+        if len(self._buffers) > self.max_buffers:
+            self._buffers.popitem(last=False)
+        return buf[:numel].view(shape)
+
+    def clear(self):
+        self._buffers.clear()
+
+    def __len__(self):
+        return len(self._buffers)
+
+_local = threading.local()
+
+def _state():
+    if not hasattr(_local, 'plans'):
+        _local.plans = PlanCache()
+        _local.workspace = WorkspacePool()
+    return _local
+
+def clear_caches():
+    '''Releases the plans and workspaces of the calling thread'''
+    state = _state()
+    state.plans.clear()
+    state.workspace.clear()
+
+def _current_stream(device):
+    return torch.cuda.current_stream(device).cuda_stream
+
+def _views(stream, *tensors):
+    # Non-owning TensorView objects. None becomes an empty T4. Tensors that
+    # require gradient cannot be exported through DLPack.
+    return [as_tensor_view(None if t is None else t.detach(), 4 if t is None else t.dim(), stream)
+            for t in tensors]
+
+def _prepare(plan_class, *args):
+    plan = plan_class()
+    _check(f'{plan_class.__name__}.prepare', plan.prepare(*args))
+    return plan
+
+def _philox(dropout_p):
+    if dropout_p <= 0.0:
+        return 0, 0
+    # Drawn on the host, so no device synchronization is needed
+    seed = int(torch.randint(0, 2 ** 62, (1,), dtype=torch.int64).item())
+    return seed, 0
+
+class _attention(torch.autograd.Function):
+
+    @staticmethod
+    def forward(ctx, q, k, v, causal, window_left, window_right, sm_scale, dropout_p, return_encoded_softmax,
+                needs_grad):
+        assert q.shape[-1] == k.shape[-1] and k.shape[-1] == v.shape[-1], 'Head sizes of q, k and v must match'
+        state = _state()
+        raw_stream = _current_stream(q.device)
+        stream = Stream(raw_stream)
+        batch, num_heads, seqlen_q, _ = q.shape
+        seqlen_k = k.shape[2]
+        o = torch.empty_like(q)
+        M_shape = (batch * num_heads, seqlen_q)
+        # softmax_lse is saved for the backward pass, or discarded
+        if needs_grad:
+            M = torch.empty(M_shape, dtype=torch.float32, device=q.device)
+        else:
+            M = state.workspace.get(raw_stream, M_shape, torch.float32, q.device)
+        encoded_softmax = None
+        if return_encoded_softmax:
+            encoded_softmax = torch.empty((batch, num_heads, seqlen_q, seqlen_k), dtype=q.dtype, device=q.device)
+        philox_seed, philox_offset = _philox(dropout_p)
+        tq, tk, tv, tb, tM, to, tes = _views(stream, q, k, v, None, M, o, encoded_softmax)
+        key = ('fwd', q.device, _layout(q), _layout(k), _layout(v), _layout(o), _layout(M),
+               _layout(encoded_softmax), bool(causal), int(window_left), int(window_right), float(dropout_p))
+        plan = state.plans.get(key, lambda: _prepare(AttnFwdPlan, tq, tk, tv, tb, tM, to,
+                                                      float(dropout_p), tes, bool(causal), int(window_left),
+                                                      int(window_right), stream))
+        err = plan.execute(tq, tk, tv, tb, float(sm_scale), tM, to, philox_seed, philox_offset, tes, stream)
+        _check('attn_fwd', err)
+        ctx.save_for_backward(q, k, v, o, M)
+        ctx.sm_scale = sm_scale
+        ctx.causal = causal
+        ctx.window_left = window_left
+        ctx.window_right = window_right
+        ctx.dropout_p = dropout_p
+        ctx.philox_seed = philox_seed
+        ctx.philox_offset = philox_offset
+        if encoded_softmax is not None:
+            ctx.mark_non_differentiable(encoded_softmax)
+        return o, encoded_softmax
+
+    @staticmethod
+    def backward(ctx, do, _):
+        q, k, v, o, M = ctx.saved_tensors
+        # e.g. the expanded gradient of loss.sum() has zero strides
+        if do.stride(-1) != 1:
+            do = do.contiguous()
+        state = _state()
+        raw_stream = _current_stream(q.device)
+        stream = Stream(raw_stream)
+        dq = torch.empty_like(q)
+        dk = torch.empty_like(k)
+        dv = torch.empty_like(v)
+        delta = state.workspace.get(raw_stream, M.shape, torch.float32, q.device)
+        tq, tk, tv, tb, to, tdo, tdq, tdk, tdv, tdb, tM, tdelta = _views(stream, q, k, v, None, o, do,
+                                                                         dq, dk, dv, None, M, delta)
+        key = ('bwd', q.device, _layout(q), _layout(k), _layout(v), _layout(o), _layout(do),
+               _layout(dq), _layout(dk), _layout(dv), _layout(M), bool(ctx.causal), int(ctx.window_left),
+               int(ctx.window_right), float(ctx.dropout_p))
+        plan = state.plans.get(key, lambda: _prepare(AttnBwdPlan, tq, tk, tv, tb, to, tdo, tdq, tdk, tdv, tdb,
+                                                      tM, tdelta, float(ctx.dropout_p), bool(ctx.causal),
+                                                      int(ctx.window_left), int(ctx.window_right), stream))
+        err = plan.execute(tq, tk, tv, tb, float(ctx.sm_scale), to, tdo, tdq, tdk, tdv, tdb, tM, tdelta,
+                           ctx.philox_seed, ctx.philox_offset, stream, None)
+        _check('attn_bwd', err)
+        return dq, dk, dv, None, None, None, None, None, None, None
+
+def attention(q, k, v, causal=False, sm_scale=None, dropout_p=0.0, return_encoded_softmax=False,
+              window_left=-1, window_right=-1):
+    '''
+    Returns the attention output, and the encoded softmax if
+    return_encoded_softmax is set. The encoded softmax (batch_size x num_heads
+    x seqlen_q x seqlen_k) is only allocated when requested, and is meant for
+    testing dropout. window_left/window_right restrict every query to a
+    sliding window of keys, and -1 leaves that side unbounded.
+    '''
+    if sm_scale is None:
+        sm_scale = 1.0 / math.sqrt(q.shape[-1])
+    needs_grad = torch.is_grad_enabled() and (q.requires_grad or k.requires_grad or v.requires_grad)
+    o, encoded_softmax = _attention.apply(q, k, v, causal, window_left, window_right, sm_scale, dropout_p,
+                                          return_encoded_softmax, needs_grad)
+    if return_encoded_softmax:
+        return o, encoded_softmax
+    return o
@@ -0,0 +1,287 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#include "tensor.h"
+#include <array>
+#include <string>
+#include <string_view>
+
+namespace pyaotriton {
+
+namespace {
+
+// DLPack ABI, unversioned (DLPack <= 0.8) capsules named "dltensor".
+// Declared here instead of depending on dlpack.h, the layout is stable.
+// FP8 type codes were added in DLPack 1.1, and may appear in either capsule.
+namespace dlpack {
+
+enum DLDeviceType : int32_t {
+  kDLCPU = 1,
+  kDLCUDA = 2,
+  kDLROCM = 10,
+};
+
+enum DLDataTypeCode : uint8_t {
+  kDLInt = 0,
+  kDLUInt = 1,
+  kDLFloat = 2,
+  kDLBfloat = 4,
+  kDLFloat8_e4m3fnuz = 11,
+  kDLFloat8_e5m2fnuz = 13,
+};
+
+struct DLDevice {
+  int32_t device_type;
+  int32_t device_id;
+};
+
+struct DLDataType {
+  uint8_t code;
+  uint8_t bits;
+  uint16_t lanes;
+};
+
+struct DLTensor {
+  void* data;
+  DLDevice device;
+  int32_t ndim;
+  DLDataType dtype;
+  int64_t* shape;
+  int64_t* strides;
+  uint64_t byte_offset;
+};
+
+struct DLManagedTensor {
+  DLTensor dl_tensor;
+  void* manager_ctx;
+  void (*deleter)(DLManagedTensor* self);
+};
+
+}
+
+aotriton::DType
+dtype_from_dlpack(const dlpack::DLDataType& dt) {
+  if (dt.lanes != 1)
+    return aotriton::kUnknown;
+  switch (dt.code) {
+    case dlpack::kDLFloat:
+      return dt.bits == 32 ? aotriton::kFloat32 : dt.bits == 16 ? aotriton::kFloat16 : aotriton::kUnknown;
+    case dlpack::kDLBfloat:
+      return dt.bits == 16 ? aotriton::kBFloat16 : aotriton::kUnknown;
+    case dlpack::kDLFloat8_e4m3fnuz:
+      return dt.bits == 8 ? aotriton::kFloat8e4m3fnuz : aotriton::kUnknown;
+    case dlpack::kDLFloat8_e5m2fnuz:
+      return dt.bits == 8 ? aotriton::kFloat8e5m2fnuz : aotriton::kUnknown;
+    case dlpack::kDLInt:
+      switch (dt.bits) {
+        case 8:
+          return aotriton::kInt8;
+        case 16:
+          return aotriton::kInt16;
+        case 32:
+          return aotriton::kInt32;
+        case 64:
+          return aotriton::kInt64;
+      }
+      break;
+    case dlpack::kDLUInt:
+      switch (dt.bits) {
+        case 8:
+          return aotriton::kUInt8;
+        case 16:
+          return aotriton::kUInt16;
+        case 32:
+          return aotriton::kUInt32;
+        case 64:
+          return aotriton::kUInt64;
+      }
+      break;
+  }
+  return aotriton::kUnknown;
+}
+
+// typestr of __cuda_array_interface__, e.g. "<f2". bfloat16 has no typestr.
+aotriton::DType
+dtype_from_typestr(std::string_view typestr, size_t* itemsize) {
+  if (typestr.size() != 3 || (typestr[0] != '<' && typestr[0] != '|'))
+    return aotriton::kUnknown;
+  *itemsize = typestr[2] - '0';
+  dlpack::DLDataType dt { 0, static_cast<uint8_t>(*itemsize * 8), 1 };
+  switch (typestr[1]) {
+    case 'f':
+      dt.code = dlpack::kDLFloat;
+      break;
+    case 'i':
+      dt.code = dlpack::kDLInt;
+      break;
+    case 'u':
+      dt.code = dlpack::kDLUInt;
+      break;
+    default:
+      return aotriton::kUnknown;
+  }
+  return dtype_from_dlpack(dt);
+}
+
+hipStream_t
+stream_from_cai(intptr_t stream) {
+  // 1 is the legacy default stream in the interface, which is the null stream
+  // of HIP. Other values, including 2 (per-thread default stream), are native
+  // handles.
+  return stream == 1 ? nullptr : reinterpret_cast<hipStream_t>(stream);
+}
+
+}
+
+TensorImporter::TensorImporter(py::handle stream, py::handle hint) {
+  if (stream.is_none()) {
+    if (hint && py::hasattr(hint, "__cuda_array_interface__")) {
+      py::dict cai = hint.attr("__cuda_array_interface__");
+      if (cai.contains("stream") && !cai["stream"].is_none())
+        stream_ = stream_from_cai(cai["stream"].cast<intptr_t>());
+    }
+  } else if (py::isinstance<aotriton::Stream>(stream)) {
+    stream_ = stream.cast<aotriton::Stream>().native();
+  } else {
+    stream_ = reinterpret_cast<hipStream_t>(stream.cast<intptr_t>());
+  }
+}
+
+TensorImporter::~TensorImporter() {
+  for (void* p : exported_) {
+    auto managed = static_cast<dlpack::DLManagedTensor*>(p);
+    if (managed->deleter)
+      managed->deleter(managed);
+  }
+}
+
+template<int Rank>
+aotriton::TensorView<Rank>
+TensorImporter::view(py::handle obj) {
+  if (py::isinstance<aotriton::TensorView<Rank>>(obj))
+    return obj.cast<aotriton::TensorView<Rank>>();
+  intptr_t base = 0;
+  std::array<uint64_t, Rank> sizes;
+  std::array<uint64_t, Rank> strides;
+  aotriton::DType dtype = aotriton::kUnknown;
+  sizes.fill(0);
+  strides.fill(1);
+  if (!obj.is_none())
+    import(obj, Rank, &base, sizes.data(), strides.data(), &dtype);
+  return aotriton::TensorView<Rank>(base, sizes, strides, dtype);
+}
+
+template aotriton::TensorView<1> TensorImporter::view<1>(py::handle);
+template aotriton::TensorView<2> TensorImporter::view<2>(py::handle);
+template aotriton::TensorView<4> TensorImporter::view<4>(py::handle);
+
+void
+TensorImporter::import(py::handle obj,
+                       int rank,
+                       intptr_t* base,
+                       uint64_t* sizes,
+                       uint64_t* strides,
+                       aotriton::DType* dtype) {
+  if (py::hasattr(obj, "__dlpack__"))
+    import_dlpack(obj, rank, base, sizes, strides, dtype);
+  else if (py::hasattr(obj, "__cuda_array_interface__"))
+    import_cai(obj, rank, base, sizes, strides, dtype);
+  else
+    throw py::type_error("Expect a TensorView, None, or an object with __dlpack__ or __cuda_array_interface__, got " +
+                         std::string(py::str(py::type::of(obj))));
+  if (*dtype == aotriton::kUnknown)
+    throw py::type_error("Unsupported tensor dtype");
+}
+
+void
+TensorImporter::import_dlpack(py::handle obj,
+                              int rank,
+                              intptr_t* base,
+                              uint64_t* sizes,
+                              uint64_t* strides,
+                              aotriton::DType* dtype) {
+  // torch refuses to export tensors that require gradient. The detached
+  // tensor shares the storage, and the capsule keeps it alive.
+  py::object exporter = py::reinterpret_borrow<py::object>(obj);
+  if (py::hasattr(obj, "requires_grad") && obj.attr("requires_grad").cast<bool>())
+    exporter = obj.attr("detach")();
+  // The producer makes its own work visible to stream_
+  py::capsule capsule = exporter.attr("__dlpack__")(py::arg("stream") = reinterpret_cast<intptr_t>(stream_));
+  auto managed = static_cast<dlpack::DLManagedTensor*>(PyCapsule_GetPointer(capsule.ptr(), "dltensor"));
+  if (!managed)
+    throw py::error_already_set();
+  // Consume the capsule, we are responsible for calling the deleter now
+  PyCapsule_SetName(capsule.ptr(), "used_dltensor");
+  exported_.push_back(managed);
+  const dlpack::DLTensor& t = managed->dl_tensor;
+  if (t.device.device_type != dlpack::kDLROCM && t.device.device_type != dlpack::kDLCUDA)
+    throw py::value_error("Tensors must be on a GPU device");
+  if (t.ndim != rank)
+    throw py::type_error("Expect a tensor of rank " + std::to_string(rank) + ", got rank " + std::to_string(t.ndim));
+  *base = reinterpret_cast<intptr_t>(t.data) + t.byte_offset;
+  int64_t compact = 1;
+  for (int i = rank - 1; i >= 0; i--) {
+    sizes[i] = t.shape[i];
+    strides[i] = t.strides ? t.strides[i] : compact;
+    compact *= t.shape[i];
+  }
+  *dtype = dtype_from_dlpack(t.dtype);
+}
+
+void
+TensorImporter::import_cai(py::handle obj,
+                           int rank,
+                           intptr_t* base,
+                           uint64_t* sizes,
+                           uint64_t* strides,
+                           aotriton::DType* dtype) {
+  py::dict cai = obj.attr("__cuda_array_interface__");
+  py::tuple shape = cai["shape"];
+  if (static_cast<int>(shape.size()) != rank)
+    throw py::type_error("Expect a tensor of rank " + std::to_string(rank) + ", got rank " +
+                         std::to_string(shape.size()));
+  size_t itemsize = 0;
+  *dtype = dtype_from_typestr(cai["typestr"].cast<std::string>(), &itemsize);
+  if (*dtype == aotriton::kUnknown)
+    return;
+  *base = py::tuple(cai["data"])[0].cast<intptr_t>();
+  bool has_strides = cai.contains("strides") && !cai["strides"].is_none();
+  py::tuple byte_strides = has_strides ? py::tuple(cai["strides"]) : py::tuple();
+  uint64_t compact = 1;
+  for (int i = rank - 1; i >= 0; i--) {
+    sizes[i] = shape[i].cast<uint64_t>();
+    if (has_strides) {
+      int64_t byte_stride = byte_strides[i].cast<int64_t>();
+      if (byte_stride % static_cast<int64_t>(itemsize) != 0)
+        throw py::value_error("Strides must be multiples of the item size");
+      strides[i] = byte_stride / static_cast<int64_t>(itemsize);
+    } else {
+      strides[i] = compact;
+    }
+    compact *= sizes[i];
+  }
+}
+
+void
+def_tensor_import(py::module_& m) {
+  m.def(
+    "as_tensor_view",
+    [](py::object obj, int rank, py::object stream) -> py::object {
+      TensorImporter importer(stream, obj);
+      switch (rank) {
+        case 1:
+          return py::cast(importer.view<1>(obj));
+        case 2:
+          return py::cast(importer.view<2>(obj));
+        case 4:
+          return py::cast(importer.view<4>(obj));
+      }
+      throw py::value_error("Unsupported tensor rank " + std::to_string(rank));
+    },
+    "Non-owning T1/T2/T4 of an object with __dlpack__ or __cuda_array_interface__",
+    py::arg("tensor"),
+    py::arg("rank"),
+    py::arg("stream") = py::none());
+}
+
+}
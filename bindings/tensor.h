@@ -0,0 +1,60 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#ifndef PYAOTRITON_TENSOR_H
+#define PYAOTRITON_TENSOR_H
+
+#include <aotriton/runtime.h>
+#include <aotriton/util.h>
+#include <pybind11/pybind11.h>
+#include <vector>
+
+namespace pyaotriton {
+
+namespace py = pybind11;
+
+// Builds TensorView objects directly from Python objects, without a Python
+// side conversion per tensor. Accepted objects are
+//   1. TensorView objects (T1/T2/T4), returned as-is
+//   2. Objects with __dlpack__ on a ROCm/CUDA device, e.g. torch.Tensor
+//   3. Objects with __cuda_array_interface__
+//   4. None, converted to an empty TensorView
+//
+// Tensors exported through DLPack are released when the importer is
+// destroyed, which must happen with the GIL held.
+class TensorImporter {
+public:
+  // stream: aotriton.Stream, int (native handle) or None.
+  // If None, the stream of __cuda_array_interface__ of `hint` is used if
+  // present, otherwise the null stream.
+  TensorImporter(py::handle stream, py::handle hint);
+  ~TensorImporter();
+  TensorImporter(const TensorImporter&) = delete;
+  TensorImporter& operator=(const TensorImporter&) = delete;
+
+  template<int Rank>
+  aotriton::TensorView<Rank> view(py::handle obj);
+
+  aotriton::Stream stream() const {
+    return aotriton::Stream(stream_);
+  }
+
+private:
+  hipStream_t stream_ = nullptr;
+  // DLManagedTensor* to be deleted
+  std::vector<void*> exported_;
+
+  void import(py::handle obj, int rank, intptr_t* base, uint64_t* sizes, uint64_t* strides, aotriton::DType* dtype);
+  void import_dlpack(py::handle obj, int rank, intptr_t* base, uint64_t* sizes, uint64_t* strides, aotriton::DType* dtype);
+  void import_cai(py::handle obj, int rank, intptr_t* base, uint64_t* sizes, uint64_t* strides, aotriton::DType* dtype);
+};
+
+extern template aotriton::TensorView<1> TensorImporter::view<1>(py::handle);
+extern template aotriton::TensorView<2> TensorImporter::view<2>(py::handle);
+extern template aotriton::TensorView<4> TensorImporter::view<4>(py::handle);
+
+void def_tensor_import(py::module_& m);
+
+}
+
+#endif
@@ -0,0 +1,230 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#ifndef AOTRITON_V2_INTERNAL_IMAGE_CACHE_H
+#define AOTRITON_V2_INTERNAL_IMAGE_CACHE_H
+
+#include <atomic>
+#include <cstdint>
+#include <cstdio>
+#include <dirent.h>
+#include <fcntl.h>
+#include <string>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#include <utility>
+#include <vector>
+
+// Note: this header must not depend on HIP or zstd headers, so the cache can
+//       be tested on the host with a fake decompressor.
+//
+// Cache of decompressed kernel images shared by all processes on a node.
+// Images are stored as files named after the hash of the compressed image.
+// The first process that decompresses an image publishes it with an atomic
+// rename, so readers never observe partially written files. Other processes
+// mmap the file instead of decompressing the image again.
+//
+// The cache never evicts. Once the total size of the cached images reaches
+// the cap, new images are decompressed in process memory as usual. The cap is
+// approximate: concurrent writers may overshoot it by one image each.
+
+namespace aotriton {
+
+struct ImageKey {
+  uint64_t hash;
+  uint64_t compressed_size;
+};
+
+// FNV-1a
+inline ImageKey image_key(const void* data, size_t size) {
+  uint64_t hash = 0xcbf29ce484222325ULL;
+  auto bytes = static_cast<const unsigned char*>(data);
+  for (size_t i = 0; i < size; i++) {
+    hash ^= bytes[i];
+    hash *= 0x100000001b3ULL;
+  }
+  return { hash, size };
+}
+
+// Read-only mapping of a whole file
+class MappedFile {
+public:
+  MappedFile() = default;
+  MappedFile(const MappedFile&) = delete;
+  MappedFile& operator=(const MappedFile&) = delete;
+  MappedFile(MappedFile&& other) {
+    *this = std::move(other);
+  }
+  MappedFile& operator=(MappedFile&& other) {
+    if (this != &other) {
+      reset();
+      std::swap(data_, other.data_);
+      std::swap(size_, other.size_);
+    }
+    return *this;
+  }
+  ~MappedFile() {
+    reset();
+  }
+
+  // Fails if the file cannot be mapped, its size is not expected_size, or it
+  // is not owned by the current user. The latter prevents loading images
+  // planted by other users into a world-writable directory like /dev/shm.
+  bool map(const std::string& path, size_t expected_size) {
+    reset();
+    int fd = ::open(path.c_str(), O_RDONLY | O_CLOEXEC);
+    if (fd < 0)
+      return false;
+    struct stat st;
+    void* addr = MAP_FAILED;
+    if (::fstat(fd, &st) == 0 && st.st_uid == ::geteuid() && st.st_size > 0 &&
+        static_cast<size_t>(st.st_size) == expected_size)
+      addr = ::mmap(nullptr, expected_size, PROT_READ, MAP_SHARED, fd, 0);
+    ::close(fd);
+    if (addr == MAP_FAILED)
+      return false;
+    data_ = addr;
+    size_ = expected_size;
+    return true;
+  }
+
+  void reset() {
+    if (data_)
+      ::munmap(data_, size_);
+    data_ = nullptr;
+    size_ = 0;
+  }
+
+  const void* data() const {
+    return data_;
+  }
+
+  size_t size() const {
+    return size_;
+  }
+
+private:
+  void* data_ = nullptr;
+  size_t size_ = 0;
+};
+
+class DecompressedImageCache {
+public:
+  // An empty directory disables the cache
+  DecompressedImageCache(std::string dir, uint64_t max_bytes)
+    : dir_(std::move(dir))
+    , max_bytes_(max_bytes) {
+  }
+
+  bool enabled() const {
+    return !dir_.empty();
+  }
+
+  std::string path_of(const ImageKey& key) const {
+    char name[64];
+    std::snprintf(name,
+                  sizeof(name),
+                  "%s%016llx-%llu.img",
+                  kPrefix,
+                  static_cast<unsigned long long>(key.hash),
+                  static_cast<unsigned long long>(key.compressed_size));
+    return dir_ + "/" + name;
+  }
+
+  bool lookup(const ImageKey& key, size_t decompressed_size, MappedFile* out) const {
+    return enabled() && out->map(path_of(key), decompressed_size);
+  }
+
+  // Best effort. Returns true if the image is in the cache afterwards.
+  bool store(const ImageKey& key, const void* data, size_t size) const {
+    if (!enabled())
+      return false;
+    std::string path = path_of(key);
+    // Complete entries are never rewritten. Others, e.g. from an
+    // incompatible build that happened to collide, are replaced.
+    struct stat st;
+    if (::stat(path.c_str(), &st) == 0 && static_cast<size_t>(st.st_size) == size)
+      return true;
+    if (usage() + size > max_bytes_)
+      return false;
+    static std::atomic<uint64_t> counter { 0 };
+    std::string tmp = path + ".tmp." + std::to_string(::getpid()) + "." + std::to_string(counter++);
+    int fd = ::open(tmp.c_str(), O_WRONLY | O_CREAT | O_EXCL | O_CLOEXEC, 0644);
+    if (fd < 0)
+      return false;
+    bool ok = write_all(fd, data, size);
+    ok = (::close(fd) == 0) && ok;
+    // Concurrent writers produce identical files, whichever rename comes
+    // last wins.
+    if (ok)
+      ok = ::rename(tmp.c_str(), path.c_str()) == 0;
+    if (!ok)
+      ::unlink(tmp.c_str());
+    return ok;
+  }
+
+  // Total size of cached images, including files being written
+  uint64_t usage() const {
+    uint64_t total = 0;
+    DIR* dir = ::opendir(dir_.c_str());
+    if (!dir)
+      return total;
+    while (struct dirent* entry = ::readdir(dir)) {
+      if (std::string(entry->d_name).rfind(kPrefix, 0) != 0)
+        continue;
+      struct stat st;
+      if (::fstatat(::dirfd(dir), entry->d_name, &st, 0) == 0)
+        total += st.st_size;
+    }
+    ::closedir(dir);
+    return total;
+  }
+
+private:
+  static constexpr const char* kPrefix = "aotriton-";
+  std::string dir_;
+  uint64_t max_bytes_;
+
+  static bool write_all(int fd, const void* data, size_t size) {
+    auto bytes = static_cast<const char*>(data);
+    while (size > 0) {
+      ssize_t n = ::write(fd, bytes, size);
+      if (n <= 0)
+        return false;
+      bytes += n;
+      size -= n;
+    }
+    return true;
+  }
+};
+
+// Returns the decompressed image, either mapped from the cache into `mapped`
+// or decompressed into `buffer` and then published to the cache.
+// decompress(void* dst, size_t size) returns false on failure.
+// Returns nullptr if decompression fails.
+template<typename Decompress>
+const void* decompress_cached(const DecompressedImageCache& cache,
+                              const void* compressed,
+                              size_t compressed_size,
+                              size_t decompressed_size,
+                              MappedFile* mapped,
+                              std::vector<char>* buffer,
+                              Decompress&& decompress) {
+  ImageKey key { 0, 0 };
+  if (cache.enabled()) {
+    key = image_key(compressed, compressed_size);
+    if (cache.lookup(key, decompressed_size, mapped))
+      return mapped->data();
+  }
+  buffer->resize(decompressed_size);
+  if (!decompress(buffer->data(), buffer->size()))
+    return nullptr;
+  if (cache.enabled())
+    cache.store(key, buffer->data(), buffer->size());
+  return buffer->data();
+}
+
+}
+
+#endif
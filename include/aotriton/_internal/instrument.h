@@ -0,0 +1,36 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#ifndef AOTRITON_V2_INTERNAL_INSTRUMENT_H
+#define AOTRITON_V2_INTERNAL_INSTRUMENT_H
+
+#include "../instrument.h"
+#include "../runtime.h"
+#include "../util.h"
+#include <atomic>
+#include <functional>
+
+namespace aotriton::v2 {
+
+extern std::atomic<int32_t> g_instrument_mode;
+
+inline bool
+instrument_enabled() {
+  return g_instrument_mode.load(std::memory_order_relaxed) != kInstrumentOff;
+}
+
+struct LaunchKey {
+  const char* kernel;
+  GpuArch arch;
+  int64_t functional;
+  int32_t image_index;
+  const char* image;
+};
+
+// Slow path of XxxContext::launch when instrumentation is enabled
+hipError_t
+instrument_launch(const LaunchKey& key, hipStream_t stream, const std::function<hipError_t()>& launch);
+
+} // namespace aotriton::v2
+
+#endif
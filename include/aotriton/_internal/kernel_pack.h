@@ -0,0 +1,115 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#ifndef AOTRITON_V2_INTERNAL_KERNEL_PACK_H
+#define AOTRITON_V2_INTERNAL_KERNEL_PACK_H
+
+#include <cstddef>
+#include <cstdint>
+#include <cstring>
+
+// Note: this header must not depend on HIP headers, so the parser can be
+//       tested on the host.
+//
+// Kernel pack layout (little endian), written by v2python/kernel_pack.py
+//   KernelPackHeader
+//   KernelPackEntry[count]
+//   Images, each starts at an offset aligned to kKernelPackAlignment
+
+namespace aotriton {
+
+constexpr char kKernelPackMagic[8] = { 'A', 'O', 'T', 'K', 'P', 'A', 'C', 'K' };
+constexpr uint32_t kKernelPackVersion = 1;
+constexpr uint64_t kKernelPackAlignment = 4096;
+
+struct KernelPackHeader {
+  char magic[8];
+  uint32_t version;
+  uint32_t count;
+};
+
+struct KernelPackEntry {
+  uint64_t offset;
+  uint64_t size;
+};
+
+static_assert(sizeof(KernelPackHeader) == 16);
+static_assert(sizeof(KernelPackEntry) == 16);
+
+// Read-only view of a kernel pack in memory. Does not own the memory.
+class KernelPackView {
+public:
+  // Returns false if the buffer is not a valid kernel pack. Every entry is
+  // validated here so image() can trust the table.
+  bool parse(const void* data, size_t size) {
+    data_ = nullptr;
+    count_ = 0;
+    KernelPackHeader header;
+    if (data == nullptr || size < sizeof(header))
+      return false;
+    std::memcpy(&header, data, sizeof(header));
+    if (std::memcmp(header.magic, kKernelPackMagic, sizeof(header.magic)) != 0)
+      return false;
+    if (header.version != kKernelPackVersion)
+      return false;
+    if ((size - sizeof(header)) / sizeof(KernelPackEntry) < header.count)
+      return false;
+    auto bytes = static_cast<const char*>(data);
+    for (uint32_t i = 0; i < header.count; i++) {
+      KernelPackEntry entry;
+      std::memcpy(&entry, bytes + sizeof(header) + i * sizeof(entry), sizeof(entry));
+      if (entry.offset % kKernelPackAlignment != 0)
+        return false;
+      if (entry.offset > size || entry.size > size - entry.offset)
+        return false;
+    }
+    data_ = bytes;
+    count_ = header.count;
+    return true;
+  }
+
+  uint32_t count() const {
+    return count_;
+  }
+
+  bool image(uint32_t index, const void** image, size_t* image_size) const {
+    if (index >= count_)
+      return false;
+    KernelPackEntry entry;
+    std::memcpy(&entry, data_ + sizeof(KernelPackHeader) + index * sizeof(entry), sizeof(entry));
+    *image = data_ + entry.offset;
+    *image_size = entry.size;
+    return true;
+  }
+
+private:
+  const char* data_ = nullptr;
+  uint32_t count_ = 0;
+};
+
+// Memory mapped kernel pack file.
+//
+// The file is searched in the directory named by environment variable
+// AOTRITON_KERNEL_PACK_DIR, or otherwise in the directory of the binary that
+// contains libaotriton_v2.
+//
+// Packs are mapped on first use and stay mapped until process exit. Pages are
+// read on demand, so only images that are actually loaded are read from
+// disk, and they are shared across processes through the page cache.
+class KernelPack {
+public:
+  // Returns nullptr if the pack cannot be found, mapped or parsed.
+  // Thread-safe.
+  static const KernelPack* open(const char* file_name);
+
+  const KernelPackView& view() const {
+    return view_;
+  }
+
+private:
+  KernelPackView view_;
+};
+
+}
+
+#endif
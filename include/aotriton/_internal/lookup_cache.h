@@ -0,0 +1,95 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#ifndef AOTRITON_V2_INTERNAL_LOOKUP_CACHE_H
+#define AOTRITON_V2_INTERNAL_LOOKUP_CACHE_H
+
+#include "../lookup_cache.h"
+#include <array>
+#include <atomic>
+#include <stddef.h>
+#include <stdint.h>
+
+namespace aotriton::v2 {
+
+extern std::atomic<bool> g_lookup_cache_enabled;
+extern std::atomic<uint64_t> g_lookup_cache_generation;
+
+inline bool
+lookup_cache_enabled() {
+  return g_lookup_cache_enabled.load(std::memory_order_relaxed);
+}
+
+// One instance per shim kernel, registered in a global list so that the
+// statistics can be collected by get_lookup_cache_stats()
+class LookupCacheCounters {
+public:
+  LookupCacheCounters(const char* kernel_name);
+
+  void hit() {
+    hits_.fetch_add(1, std::memory_order_relaxed);
+  }
+  void miss() {
+    misses_.fetch_add(1, std::memory_order_relaxed);
+  }
+
+  const char* kernel_name() const {
+    return kernel_name_;
+  }
+  LookupCacheStats stats() const;
+  void reset();
+
+private:
+  const char* kernel_name_;
+  std::atomic<uint64_t> hits_ { 0 };
+  std::atomic<uint64_t> misses_ { 0 };
+};
+
+// Direct-mapped cache, meant to be used as a thread_local object.
+// Training loops only use a handful of shapes, so a few slots are enough.
+// Entries written before the last clear_lookup_cache() call are ignored.
+template<size_t KeySize, typename Value, size_t kSlots = 16>
+class LookupCache {
+public:
+  using Key = std::array<int64_t, KeySize>;
+
+  const Value* find(const Key& key) const {
+    const Slot& slot = slots_[slot_index(key)];
+    if (slot.generation != current_generation() || slot.key != key)
+      return nullptr;
+    return &slot.value;
+  }
+
+  void insert(const Key& key, const Value& value) {
+    Slot& slot = slots_[slot_index(key)];
+    slot.generation = current_generation();
+    slot.key = key;
+    slot.value = value;
+  }
+
+private:
+  struct Slot {
+    uint64_t generation = 0; // Generation 0 is never valid
+    Key key;
+    Value value;
+  };
+
+  static uint64_t current_generation() {
+    return g_lookup_cache_generation.load(std::memory_order_relaxed);
+  }
+
+  static size_t slot_index(const Key& key) {
+    uint64_t h = 0xcbf29ce484222325ULL;
+    for (auto k : key) {
+      h ^= static_cast<uint64_t>(k);
+      h *= 0x100000001b3ULL;
+    }
+    return static_cast<size_t>(h ^ (h >> 29)) % kSlots;
+  }
+
+  Slot slots_[kSlots];
+};
+
+} // namespace aotriton::v2
+
+#endif
@@ -0,0 +1,98 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#ifndef AOTRITON_V2_INTERNAL_STREAM_FORK_H
+#define AOTRITON_V2_INTERNAL_STREAM_FORK_H
+
+#include <unordered_map>
+
+// Note: this header must not depend on HIP headers.
+//       The stream/event operations are abstracted by a Runtime adaptor so the
+//       ordering logic can be tested on the host with a stub runtime.
+//
+// Runtime provides
+//   types:     Error, Stream, Event, Device
+//   constants: kSuccess
+//   functions: Error stream_get_device(Stream, Device*)
+//              Error stream_create(Device, Stream*)
+//              Error event_create(Device, Event*)
+//              Error event_record(Event, Stream)
+//              Error stream_wait_event(Stream, Event)
+
+namespace aotriton {
+
+template<typename Runtime>
+struct ForkResources {
+  typename Runtime::Stream stream;
+  typename Runtime::Event fork_event;
+  typename Runtime::Event join_event;
+};
+
+// Secondary stream and events for the device of stream `primary`, created on
+// first use and cached per thread.
+// Resources are never destroyed: thread_local destructors may run after the
+// device runtime has been torn down at process exit.
+template<typename Runtime>
+typename Runtime::Error
+get_fork_resources(typename Runtime::Stream primary, ForkResources<Runtime>* out) {
+  using Error = typename Runtime::Error;
+  thread_local std::unordered_map<typename Runtime::Device, ForkResources<Runtime>> per_device;
+  typename Runtime::Device device;
+  Error err = Runtime::stream_get_device(primary, &device);
+  if (err != Runtime::kSuccess)
+    return err;
+  auto iter = per_device.find(device);
+  if (iter == per_device.end()) {
+    ForkResources<Runtime> res;
+    err = Runtime::stream_create(device, &res.stream);
+    if (err != Runtime::kSuccess)
+      return err;
+    err = Runtime::event_create(device, &res.fork_event);
+    if (err != Runtime::kSuccess)
+      return err;
+    err = Runtime::event_create(device, &res.join_event);
+    if (err != Runtime::kSuccess)
+      return err;
+    iter = per_device.emplace(device, res).first;
+  }
+  *out = iter->second;
+  return Runtime::kSuccess;
+}
+
+// Runs primary_work on `primary` and secondary_work on `res.stream`
+// concurrently, with the following dependencies:
+//
+//   primary:   record(fork) -> primary_work ---------------------> wait(join)
+//   secondary:        wait(fork) -> secondary_work -> record(join)
+//
+// Work launched on `primary` after this call observes the results of both.
+// The join is always performed, even if one of the works fails to launch.
+// Returns the first error of primary_work, secondary_work and the join.
+template<typename Runtime, typename PrimaryWork, typename SecondaryWork>
+typename Runtime::Error
+fork_join(typename Runtime::Stream primary,
+          const ForkResources<Runtime>& res,
+          PrimaryWork&& primary_work,
+          SecondaryWork&& secondary_work) {
+  using Error = typename Runtime::Error;
+  Error err = Runtime::event_record(res.fork_event, primary);
+  if (err != Runtime::kSuccess)
+    return err;
+  err = Runtime::stream_wait_event(res.stream, res.fork_event);
+  if (err != Runtime::kSuccess)
+    return err;
+  Error primary_err = primary_work(primary);
+  Error secondary_err = secondary_work(res.stream);
+  Error join_err = Runtime::event_record(res.join_event, res.stream);
+  if (join_err == Runtime::kSuccess)
+    join_err = Runtime::stream_wait_event(primary, res.join_event);
+  if (primary_err != Runtime::kSuccess)
+    return primary_err;
+  if (secondary_err != Runtime::kSuccess)
+    return secondary_err;
+  return join_err;
+}
+
+} // namespace aotriton
+
+#endif
@@ -0,0 +1,49 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#ifndef AOTRITON_V2_INTERNAL_TRACE_H
+#define AOTRITON_V2_INTERNAL_TRACE_H
+
+#include "../trace.h"
+#include <atomic>
+#include <chrono>
+
+namespace aotriton::v2 {
+
+struct TraceHook {
+  TraceCallback callback;
+  void* user_data;
+};
+
+extern std::atomic<const TraceHook*> g_trace_hook;
+
+inline const TraceHook*
+trace_hook() {
+  return g_trace_hook.load(std::memory_order_acquire);
+}
+
+// Measures the lifetime of this object into `out` if tracing is enabled
+class TraceTimer {
+public:
+  TraceTimer(uint64_t& out)
+    : out_(out)
+    , enabled_(trace_hook() != nullptr) {
+    if (enabled_)
+      begin_ = std::chrono::steady_clock::now();
+  }
+  ~TraceTimer() {
+    if (enabled_) {
+      auto elapsed = std::chrono::steady_clock::now() - begin_;
+      out_ = std::chrono::duration_cast<std::chrono::nanoseconds>(elapsed).count();
+    }
+  }
+
+private:
+  uint64_t& out_;
+  bool enabled_;
+  std::chrono::steady_clock::time_point begin_;
+};
+
+} // namespace aotriton::v2
+
+#endif
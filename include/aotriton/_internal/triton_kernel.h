@@ -11,30 +11,99 @@
 
 #include "../runtime.h"
 #if AOTRITON_USE_ZSTD
+#include "image_cache.h"
+#endif
+#include <atomic>
+#include <mutex>
 #include <vector>
+
+#if AOTRITON_USE_ZSTD
+struct ZSTD_DDict_s;
 #endif
 
 namespace aotriton {
 
+#if AOTRITON_USE_ZSTD
+// Zstd dictionary shared by the images of one kernel on one GPU.
+// An empty dictionary means the images were compressed without one.
+class ZstdDictionary {
+public:
+  ZstdDictionary(const void* data, size_t size);
+  ~ZstdDictionary();
+
+  // Digested dictionary, created on first use. Thread-safe.
+  // Returns nullptr if the dictionary is empty or cannot be digested.
+  const ZSTD_DDict_s* ddict();
+
+private:
+  const void* data_;
+  size_t size_;
+  std::once_flag once_;
+  ZSTD_DDict_s* ddict_ = nullptr;
+};
+#endif
+
+// Image stored in a kernel pack file rather than embedded in the library.
+// See _internal/kernel_pack.h
+struct PackedImage {
+  const char* pack_name;
+  uint32_t index;
+};
+
 class TritonKernel {
 public:
-  TritonKernel(const void* image, size_t image_size, dim3 block, int shared_memory_size);
+  TritonKernel(const void* image,
+               size_t image_size,
+               dim3 block,
+               int shared_memory_size,
+               const char* image_name = nullptr
+#if AOTRITON_USE_ZSTD
+               ,
+               ZstdDictionary* dictionary = nullptr
+#endif
+  );
 
+  // The image is fetched from the pack when the module is loaded.
+  TritonKernel(PackedImage packed_image,
+               dim3 block,
+               int shared_memory_size,
+               const char* image_name = nullptr
+#if AOTRITON_USE_ZSTD
+               ,
+               ZstdDictionary* dictionary = nullptr
+#endif
+  );
+
+  // Fails with hipErrorStreamCaptureUnsupported if the module has not been
+  // loaded and the stream is capturing, since loading is not capturable.
   hipError_t invoke(const char* kernel_name, dim3 grid, std::vector<void*>& args, hipStream_t stream);
 
+  // Load the module in advance. Thread-safe, no-op if already loaded.
+  hipError_t load(const char* kernel_name);
+
+  // Symbol name of the image, for diagnostics
+  const char* image_name() const {
+    return image_name_;
+  }
+
 #if AOTRITON_USE_ZSTD
   void clear_decompressed_image();
 #endif
 private:
   const void* kernel_image_ = nullptr;
   size_t image_size_ = 0;
+  PackedImage packed_image_ { nullptr, 0 };
   dim3 block_ { 256, 1, 1 };
+  std::mutex load_mutex_;
   hipModule_t mod_ = nullptr;
-  hipFunction_t fun_ = nullptr;
+  std::atomic<hipFunction_t> fun_ = nullptr;
   int shared_memory_size_;
+  const char* image_name_ = nullptr;
 #if AOTRITON_USE_ZSTD
+  ZstdDictionary* dictionary_ = nullptr;
   std::vector<char> decompressed_kernel_image_;
-  void* decompress_kernel();
+  MappedFile cached_kernel_image_;
+  const void* decompress_kernel();
 #endif
 };
 
@@ -4,6 +4,7 @@
 #ifndef AOTRITON_V2_INTERNAL_UTIL_H
 #define AOTRITON_V2_INTERNAL_UTIL_H
 
+#include <aotriton/util.h>
 #include <climits>
 #include <cstdint>
 
@@ -27,6 +28,97 @@ inline bool is_power_of_2(uint32_t x) {
   return (x != 0) && ((x & (x - 1)) == 0);
 }
 
+// BLOCK_DMODEL of the compiled attention kernels that covers head_size.
+// Sizes that are not powers of two are only compiled for exact head sizes
+// without bias or encoded softmax (split_allowed), other problems run with
+// the next power of two. Must match HEAD_DIMS and
+// FlashKernel.is_functional_disabled of v2python/rules/flash/_common.py.
+inline int32_t round_head_dim(int32_t head_size, bool split_allowed) {
+  constexpr int32_t kMinHeadDim = 16;
+  constexpr int32_t kSplitHeadDims[] = { 48, 80, 96, 160, 192 };
+  if (split_allowed)
+    for (int32_t d : kSplitHeadDims)
+      if (head_size == d)
+        return d;
+  return head_size <= kMinHeadDim ? kMinHeadDim : bit_ceil(head_size);
+}
+
+inline const char* gpu_arch_name(GpuArch arch) {
+  switch (arch) {
+    case GPU_ARCH_AMD_GFX90A:
+      return "gfx90a";
+    case GPU_ARCH_AMD_GFX942:
+      return "gfx942";
+    default:
+      return "unknown";
+  }
+}
+
+// Returns true if the stream is capturing, or if the capture status cannot be
+// determined (e.g. querying the legacy stream while another stream captures).
+// In both cases operations like module loading must be avoided.
+inline bool is_stream_capturing(hipStream_t stream) {
+  hipStreamCaptureStatus status = hipStreamCaptureStatusNone;
+  hipError_t err = hipStreamIsCapturing(stream, &status);
+  return err != hipSuccess || status != hipStreamCaptureStatusNone;
+}
+
+// Same sizes, strides and dtype. Data pointers are not compared.
+template<int Rank>
+bool same_layout(const TensorView<Rank>& lhs, const TensorView<Rank>& rhs) {
+  return lhs.sizes() == rhs.sizes() && lhs.strides() == rhs.strides() && lhs.dtype() == rhs.dtype();
+}
+
+// Optional inputs (e.g. the attention bias) must have the given dtype and a
+// contiguous last dimension. Empty tensors are accepted.
+template<int Rank>
+bool valid_optional_input(const TensorView<Rank>& t, DType dtype) {
+  return !t || (t.dtype() == dtype && t.stride(Rank - 1) == 1);
+}
+
+// The kernels are compiled for a unit stride along head_size, and take any
+// other strides as arguments (see Layouts in flash.h).
+template<typename... Tensors>
+bool contiguous_head_dim(const Tensors&... ts) {
+  return ((ts.stride(3) == 1) && ...);
+}
+
+// GQA/MQA: the heads of q are split into groups of equal size, and each group
+// shares one head of k and v.
+inline bool valid_head_groups(const TensorView<4>& q, const TensorView<4>& k, const TensorView<4>& v) {
+  return k.size(1) > 0 && k.size(1) == v.size(1) && q.size(1) % k.size(1) == 0;
+}
+
+// Dropout bitmasks are contiguous kInt32 tensors of
+// batch_size x num_heads x seqlen_q x cdiv(seqlen_k, 32), indexed with int32
+// offsets by the kernels. Empty tensors are accepted.
+inline bool valid_dropout_bitmask(const TensorView<4>& bitmask, const TensorView<4>& q, const TensorView<4>& k) {
+  if (!bitmask)
+    return true;
+  uint64_t words = cdiv<uint64_t>(k.size(2), 32);
+  return bitmask.dtype() == DType::kInt32 && bitmask.size(0) == q.size(0) && bitmask.size(1) == q.size(1) &&
+         bitmask.size(2) == q.size(2) && bitmask.size(3) == words && bitmask.stride(3) == 1 &&
+         bitmask.stride(2) == words && bitmask.stride(1) == q.size(2) * words &&
+         bitmask.stride(0) == q.size(1) * q.size(2) * words && q.size(0) * bitmask.stride(0) <= INT32_MAX;
+}
+
+// The fp32 dQ workspace of the fused backward pass is a contiguous kFloat32
+// tensor of the shape of q, cleared with a single memset. Empty tensors are
+// accepted.
+inline bool valid_dq_acc(const TensorView<4>& dq_acc, const TensorView<4>& q) {
+  if (!dq_acc)
+    return true;
+  return dq_acc.dtype() == DType::kFloat32 && dq_acc.sizes() == q.sizes() && dq_acc.stride(3) == 1 &&
+         dq_acc.stride(2) == q.size(3) && dq_acc.stride(1) == q.size(2) * q.size(3) &&
+         dq_acc.stride(0) == q.size(1) * q.size(2) * q.size(3);
+}
+
+// Sliding windows of attention: a negative size means unbounded, which is
+// passed to the kernels as a size that covers any pair of rows and columns.
+inline int32_t kernel_window_size(int32_t window, int64_t max_seqlen_q, int64_t max_seqlen_k) {
+  return window < 0 ? static_cast<int32_t>(max_seqlen_q + max_seqlen_k) : window;
+}
+
 }
 
 #endif
@@ -13,6 +13,9 @@ enum DType : int32_t {
   kFloat32 = 1,
   kFloat16 = 2,
   kBFloat16 = 3,
+  // FP8 formats of MI300, without infinities and negative zero
+  kFloat8e4m3fnuz = 4,
+  kFloat8e5m2fnuz = 5,
   kInt8 = 10,
   kInt16 = 11,
   kInt32 = 12,
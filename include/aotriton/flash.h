@@ -6,6 +6,8 @@
 
 #include "runtime.h"
 #include "util.h"
+#include <array>
+#include <memory>
 
 namespace aotriton::v2::flash {
 
@@ -16,10 +18,70 @@ using T4 = aotriton::TensorView<4>;
 using T2 = aotriton::TensorView<2>;
 using T1 = aotriton::TensorView<1>;
 
+// Layouts
+//
+// Tensors are documented as batch_size x num_heads x seqlen x head_size, but
+// q, k, v, out and their gradients may be any views of that shape with a
+// contiguous head_size dimension, and they need not share strides. Models
+// that keep batch_size x seqlen x num_heads x head_size tensors pass them
+// transposed, e.g. q.transpose(1, 2) in PyTorch, and a packed
+// batch_size x seqlen x 3 x num_heads x head_size QKV tensor is passed as
+// qkv[:, :, i].transpose(1, 2) for q, k and v, without copies. Other
+// tensors (softmax_lse, workspaces, bitmasks) keep their documented layouts.
+// Views with a strided head_size dimension are rejected with
+// hipErrorInvalidValue.
+//
+// Grouped-query/multi-query attention
+//
+// num_heads of q (and out, softmax_lse) must be a multiple of num_heads_k of
+// k and v. Head h of q attends to head h / (num_heads / num_heads_k) of k and
+// v, without replicating k and v. In the backward pass dk and dv have
+// num_heads_k heads and are reduced over the group of heads of q.
+// num_heads_k == num_heads is the regular multi-head attention.
+//
+// Attention bias
+//
+// b is added to the scaled scores q @ k^T * sm_scale before the softmax.
+// Broadcast dimensions (batch, heads or seqlen_q) may have zero strides, but
+// the seqlen_k dimension must be contiguous. The dtype of b must match q.
+// An empty b means no bias.
+//
+// Sliding-window attention
+//
+// Row i of q only attends to columns [i - window_left, i + window_right] of k,
+// counted from the top-left corner like is_causal. A negative size leaves
+// that side unbounded, and -1/-1 is the full attention. is_causal implies
+// window_right = 0. Blocks of k and v outside of the window are skipped.
+// Rows that attend to no column output zeros, and their softmax_lse is +inf.
+// Entries of encoded_softmax outside of the window are not written.
+//
+// Dropout bitmask
+//
+// With dropout, attn_fwd generates the dropout mask with Philox, and both
+// kernels of attn_bwd generate it again. Instead, attn_fwd can store the mask
+// with one bit per element into FwdExtraArguments::dropout_bitmask, and
+// attn_bwd loads it from BwdExtraArguments::dropout_bitmask.
+// The bitmask is a contiguous kInt32 tensor of
+// batch_size x num_heads x seqlen_q x cdiv(seqlen_k, 32), where bit j % 32 of
+// word j / 32 of row i is element (i, j) of the mask. attn_bwd must use the
+// dropout_p, philox_seed, philox_offset, is_causal and window of attn_fwd.
+//
+// dropout_bitmask_shape returns the shape of the bitmask of q and k in
+// *shape if dropout_p > 0 and the bitmask fits in budget_bytes, otherwise all
+// zeros, and the bitmask should be left empty.
+hipError_t
+dropout_bitmask_shape(T4 q, T4 k, float dropout_p, uint64_t budget_bytes, std::array<uint64_t, 4>* shape);
+
+struct FwdExtraArguments {
+  // Optional, see dropout bitmask
+  T4 dropout_bitmask;
+};
+
 hipError_t
 attn_fwd(T4 q, // batch_size x num_heads x seqlen_q x head_size
-         T4 k, // batch_size x num_heads x seqlen_k x head_size
-         T4 v, // batch_size x num_heads x seqlen_k x head_size
+         T4 k, // batch_size x num_heads_k x seqlen_k x head_size
+         T4 v, // batch_size x num_heads_k x seqlen_k x head_size
+         T4 b, // batch_size x num_heads x seqlen_q x seqlen_k, see attention bias below
          float sm_scale,
          T2 softmax_lse,
          T4 Out, // batch_size x num_heads x seqlen_q x head_size
@@ -28,25 +90,316 @@ attn_fwd(T4 q, // batch_size x num_heads x seqlen_q x head_size
          uint64_t philox_offset,
          T4 encoded_softmax,
          bool is_causal,
-         aotriton::Stream stream);
+         int32_t window_left,
+         int32_t window_right,
+         aotriton::Stream stream,
+         const FwdExtraArguments* extargs = nullptr);
+
+// Variable-length (packed) forward pass
+//
+// Sequences of one batch are packed along the seqlen dimension without
+// padding. Sequence i occupies rows [cu_seqlens_q[i], cu_seqlens_q[i+1]) of
+// q/out and rows [cu_seqlens_k[i], cu_seqlens_k[i+1]) of k/v.
+// cu_seqlens_q/cu_seqlens_k are int32 tensors of num_seqs + 1 elements.
+// softmax_lse and encoded_softmax keep the padded layout of dense problems,
+// and only the first seqlen_q (x seqlen_k) elements of each sequence are
+// written.
+// Bias is not supported, b must be empty.
+hipError_t
+attn_fwd_compact_varlen(T4 q, // 1 x num_heads x total_q x head_size
+                        T4 k, // 1 x num_heads_k x total_k x head_size
+                        T4 v, // 1 x num_heads_k x total_k x head_size
+                        T4 b, // must be empty
+                        T1 cu_seqlens_q,
+                        T1 cu_seqlens_k,
+                        int32_t max_seqlen_q,
+                        int32_t max_seqlen_k,
+                        float sm_scale,
+                        T2 softmax_lse, // (num_seqs * num_heads) x max_seqlen_q
+                        T4 Out, // 1 x num_heads x total_q x head_size
+                        float dropout_p,
+                        uint64_t philox_seed,
+                        uint64_t philox_offset,
+                        T4 encoded_softmax, // num_seqs x num_heads x max_seqlen_q x max_seqlen_k
+                        bool is_causal,
+                        int32_t window_left,
+                        int32_t window_right,
+                        aotriton::Stream stream);
+
+// FP8 forward pass for inference
+//
+// q, k and v are kFloat8e4m3fnuz or kFloat8e5m2fnuz, all of the same dtype,
+// and hold the quantized tensors q / q_descale, k / k_descale and
+// v / v_descale. out is kFloat16 or kBFloat16. The scores are computed from
+// the FP8 inputs and rescaled in fp32, and the softmax probabilities are
+// quantized to the dtype of v for the second matmul.
+// There is no bias, dropout or backward pass.
+hipError_t
+attn_fwd_fp8(T4 q, // batch_size x num_heads x seqlen_q x head_size
+             T4 k, // batch_size x num_heads_k x seqlen_k x head_size
+             T4 v, // batch_size x num_heads_k x seqlen_k x head_size
+             float q_descale,
+             float k_descale,
+             float v_descale,
+             float sm_scale,
+             T2 softmax_lse, // (batch_size * num_heads) x seqlen_q
+             T4 out, // batch_size x num_heads x seqlen_q x head_size
+             bool is_causal,
+             int32_t window_left,
+             int32_t window_right,
+             aotriton::Stream stream);
+
+// Split-KV forward pass for decoding
+//
+// Specialized for a tiny seqlen_q (e.g. 1 in autoregressive decoding), where
+// attn_fwd launches one workgroup per head and batch. seqlen_k is split into
+// num_splits chunks processed by separate workgroups, and the partial results
+// are merged with their log-sum-exp by a second kernel. There is no bias,
+// dropout or causal mask.
+//
+// attn_fwd_decode_num_splits picks num_splits from the CU count of the device
+// of stream and the problem size. The caller allocates the fp32 workspaces
+// with any num_splits >= 1:
+//   out_partial: (num_splits * batch_size) x num_heads x seqlen_q x head_size,
+//                the last dimension must be contiguous
+//   lse_partial: (num_splits * batch_size * num_heads) x seqlen_q, contiguous
+hipError_t
+attn_fwd_decode_num_splits(T4 q, T4 k, aotriton::Stream stream, int32_t* num_splits);
+
+hipError_t
+attn_fwd_decode(T4 q, // batch_size x num_heads x seqlen_q x head_size
+                T4 k, // batch_size x num_heads_k x seqlen_k x head_size
+                T4 v, // batch_size x num_heads_k x seqlen_k x head_size
+                float sm_scale,
+                T2 softmax_lse, // (batch_size * num_heads) x seqlen_q, contiguous kFloat32
+                T4 out, // batch_size x num_heads x seqlen_q x head_size, dtype of q
+                T4 out_partial,
+                T2 lse_partial,
+                aotriton::Stream stream);
+
+struct BwdExtraArguments {
+  // Launch bwd_kernel_dq on an internal secondary stream, concurrently with
+  // bwd_kernel_dk_dv. Both kernels only depend on bwd_preprocess and write
+  // disjoint outputs. The secondary stream is joined back before returning.
+  bool concurrent_dq = false;
+  // Optional, see dropout bitmask of attn_fwd. Not supported by
+  // attn_bwd_compact_varlen.
+  T4 dropout_bitmask;
+  // Optional contiguous kFloat32 workspace of the shape of q. Where the tuning
+  // database selects the fused backward kernel for the problem, it computes
+  // dK and dV, and accumulates dQ into dq_acc with atomics, instead of
+  // recomputing the attention in bwd_kernel_dq. Without dq_acc, or with db,
+  // the split kernels run. The contents of dq_acc are overwritten, and delta
+  // is not written if the kernel also computes delta. Ignored by AttnBwdPlan.
+  T4 dq_acc;
+};
 
+// db receives the gradient of b without broadcast, hence it must be a dense
+// batch_size x num_heads x seqlen_q x seqlen_k tensor even if b is broadcast,
+// and the caller reduces it over the broadcast dimensions. Entries masked out
+// by is_causal or the sliding window are not written. db requires b.
 hipError_t
 attn_bwd(T4 q, // batch_size x num_heads x seqlen_q x head_size
-         T4 k, // batch_size x num_heads x seqlen_k x head_size
-         T4 v, // batch_size x num_heads x seqlen_k x head_size
+         T4 k, // batch_size x num_heads_k x seqlen_k x head_size
+         T4 v, // batch_size x num_heads_k x seqlen_k x head_size
+         T4 b, // batch_size x num_heads x seqlen_q x seqlen_k, optional
          float sm_scale,
          T4 out,  // batch_size x num_heads x seqlen_q x head_size
          T4 dout, // batch_size x num_heads x seqlen_q x head_size
          T4 dq,   // batch_size x num_heads x seqlen_q x head_size
-         T4 dk,   // batch_size x num_heads x seqlen_q x head_size
-         T4 dv,   // batch_size x num_heads x seqlen_q x head_size
+         T4 dk,   // batch_size x num_heads_k x seqlen_k x head_size
+         T4 dv,   // batch_size x num_heads_k x seqlen_k x head_size
+         T4 db,   // batch_size x num_heads x seqlen_q x seqlen_k, optional
          T2 softmax_lse,
          T2 delta, // buffer, empty_like(softmax_lse)
          float dropout_p,
          uint64_t philox_seed,
          uint64_t philox_offset,
          bool is_causal,
-         aotriton::Stream stream);
+         int32_t window_left,
+         int32_t window_right,
+         aotriton::Stream stream,
+         const BwdExtraArguments* extargs = nullptr);
+
+// Variable-length (packed) backward pass, see attn_fwd_compact_varlen for
+// the layouts.
+hipError_t
+attn_bwd_compact_varlen(T4 q, // 1 x num_heads x total_q x head_size
+                        T4 k, // 1 x num_heads_k x total_k x head_size
+                        T4 v, // 1 x num_heads_k x total_k x head_size
+                        T4 b, // must be empty
+                        T1 cu_seqlens_q,
+                        T1 cu_seqlens_k,
+                        int32_t max_seqlen_q,
+                        int32_t max_seqlen_k,
+                        float sm_scale,
+                        T4 out,  // 1 x num_heads x total_q x head_size
+                        T4 dout, // 1 x num_heads x total_q x head_size
+                        T4 dq,   // 1 x num_heads x total_q x head_size
+                        T4 dk,   // 1 x num_heads_k x total_k x head_size
+                        T4 dv,   // 1 x num_heads_k x total_k x head_size
+                        T4 db,   // must be empty
+                        T2 softmax_lse, // (num_seqs * num_heads) x max_seqlen_q
+                        T2 delta, // buffer, empty_like(softmax_lse)
+                        float dropout_p,
+                        uint64_t philox_seed,
+                        uint64_t philox_offset,
+                        bool is_causal,
+                        int32_t window_left,
+                        int32_t window_right,
+                        aotriton::Stream stream,
+                        const BwdExtraArguments* extargs = nullptr);
+
+// Execution plans
+//
+// A plan resolves the kernel selection, grid and functional arguments for a
+// given problem (shapes, strides, dtypes, causal, dropout) once in prepare(),
+// and can be executed many times with tensors of the same shapes and strides
+// but different data pointers.
+//
+// prepare() only reads the metadata of tensors, except b, db and
+// encoded_softmax whose presence (non-null data pointer) is also part of the
+// plan.
+// execute() returns hipErrorInvalidValue if the tensors do not match the
+// prepared problem, or hipErrorNotReady if the plan has not been prepared.
+// The plan is bound to the GPU architecture of the stream passed to prepare().
+// prepare() also loads the kernel modules, hence it must not be called during
+// stream capture, but execute() can.
+class AttnFwdPlan {
+public:
+  AttnFwdPlan();
+  ~AttnFwdPlan();
+  AttnFwdPlan(AttnFwdPlan&&);
+  AttnFwdPlan& operator=(AttnFwdPlan&&);
+
+  hipError_t prepare(T4 q,
+                     T4 k,
+                     T4 v,
+                     T4 b,
+                     T2 softmax_lse,
+                     T4 Out,
+                     float dropout_p,
+                     T4 encoded_softmax,
+                     bool is_causal,
+                     int32_t window_left,
+                     int32_t window_right,
+                     aotriton::Stream stream);
+  hipError_t execute(T4 q,
+                     T4 k,
+                     T4 v,
+                     T4 b,
+                     float sm_scale,
+                     T2 softmax_lse,
+                     T4 Out,
+                     uint64_t philox_seed,
+                     uint64_t philox_offset,
+                     T4 encoded_softmax,
+                     aotriton::Stream stream);
+  bool prepared() const;
+
+private:
+  struct Impl;
+  std::unique_ptr<Impl> pimpl_;
+};
+
+class AttnBwdPlan {
+public:
+  AttnBwdPlan();
+  ~AttnBwdPlan();
+  AttnBwdPlan(AttnBwdPlan&&);
+  AttnBwdPlan& operator=(AttnBwdPlan&&);
+
+  hipError_t prepare(T4 q,
+                     T4 k,
+                     T4 v,
+                     T4 b,
+                     T4 out,
+                     T4 dout,
+                     T4 dq,
+                     T4 dk,
+                     T4 dv,
+                     T4 db,
+                     T2 softmax_lse,
+                     T2 delta,
+                     float dropout_p,
+                     bool is_causal,
+                     int32_t window_left,
+                     int32_t window_right,
+                     aotriton::Stream stream);
+  hipError_t execute(T4 q,
+                     T4 k,
+                     T4 v,
+                     T4 b,
+                     float sm_scale,
+                     T4 out,
+                     T4 dout,
+                     T4 dq,
+                     T4 dk,
+                     T4 dv,
+                     T4 db,
+                     T2 softmax_lse,
+                     T2 delta,
+                     uint64_t philox_seed,
+                     uint64_t philox_offset,
+                     aotriton::Stream stream,
+                     const BwdExtraArguments* extargs = nullptr);
+  bool prepared() const;
+
+private:
+  struct Impl;
+  std::unique_ptr<Impl> pimpl_;
+};
+
+// HIP graph capture
+//
+// Kernel selection queries the device on first use, and kernel modules are
+// loaded on first launch. Neither is allowed during stream capture, hence
+// the APIs above return hipErrorStreamCaptureUnsupported if they are
+// called on a capturing stream before being prepared.
+//
+// These functions select the kernels of one problem (shapes, strides,
+// dtypes, causal, dropout) and load their modules, so that attn_fwd/attn_bwd
+// calls with the same problem can be captured afterwards. Call them once per
+// shape outside of capture, with a stream on the target device. Executing
+// prepared AttnFwdPlan/AttnBwdPlan objects is also capture-safe.
+// Only tensor metadata is used, except the data pointers of b, db and
+// encoded_softmax (see execution plans).
+hipError_t
+prepare_attn_fwd_for_capture(T4 q,
+                             T4 k,
+                             T4 v,
+                             T4 b,
+                             T2 softmax_lse,
+                             T4 Out,
+                             float dropout_p,
+                             T4 encoded_softmax,
+                             bool is_causal,
+                             int32_t window_left,
+                             int32_t window_right,
+                             aotriton::Stream stream);
+
+// extargs must match the one used in attn_bwd. With concurrent_dq, the
+// secondary stream of the calling thread is also created here. With dq_acc,
+// the kernels of the fused path are also selected and loaded.
+hipError_t
+prepare_attn_bwd_for_capture(T4 q,
+                             T4 k,
+                             T4 v,
+                             T4 b,
+                             T4 out,
+                             T4 dout,
+                             T4 dq,
+                             T4 dk,
+                             T4 dv,
+                             T4 db,
+                             T2 softmax_lse,
+                             T2 delta,
+                             float dropout_p,
+                             bool is_causal,
+                             int32_t window_left,
+                             int32_t window_right,
+                             aotriton::Stream stream,
+                             const BwdExtraArguments* extargs = nullptr);
 
 } // aotriton::v2::flash
 
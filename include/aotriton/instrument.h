@@ -0,0 +1,67 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#ifndef AOTRITON_V2_API_INSTRUMENT_H
+#define AOTRITON_V2_API_INSTRUMENT_H
+
+#include <stdint.h>
+#include <string>
+#include <vector>
+
+namespace aotriton::v2 {
+
+// Launch instrumentation
+//
+// Off by default. Can be enabled with set_instrumentation(), or by setting
+// the environment variable AOTRITON_INSTRUMENT to "count" (or "1") or
+// "timing" before the library is loaded.
+//
+// Launches are counted per (kernel, arch, functional, image). Functional is
+// the godel number of functional arguments, and image is the index of the
+// compiled image selected by the autotune table, i.e. what the tuning
+// database chose for the shape.
+//
+// With timing enabled, each launch is surrounded by a pair of hipEvents and
+// the elapsed time is collected lazily by get_instrumentation_snapshot().
+// Launches on capturing streams are counted but never timed.
+enum InstrumentMode : int32_t {
+  kInstrumentOff = 0,
+  kInstrumentCount = 1,
+  kInstrumentTiming = 2,
+};
+
+struct LaunchRecord {
+  std::string kernel;    // Shim kernel name, e.g. "attn_fwd"
+  std::string arch;      // e.g. "gfx942"
+  int64_t functional = -1;
+  int32_t image_index = -1;
+  std::string image;     // Symbol name of compiled image
+  uint64_t launches = 0;
+  uint64_t timed_launches = 0;
+  uint64_t pending_timings = 0; // Timed launches not finished yet
+  double total_ms = 0.0;
+  double min_ms = 0.0;
+  double max_ms = 0.0;
+};
+
+void
+set_instrumentation(InstrumentMode mode);
+
+InstrumentMode
+get_instrumentation();
+
+// Pending timings are resolved if their events have completed.
+// If synchronize is true, waits for all pending events first.
+std::vector<LaunchRecord>
+get_instrumentation_snapshot(bool synchronize = false);
+
+std::string
+get_instrumentation_json(bool synchronize = false);
+
+// Discards all records, including pending timings
+void
+reset_instrumentation();
+
+} // namespace aotriton::v2
+
+#endif
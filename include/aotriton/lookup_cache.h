@@ -0,0 +1,43 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#ifndef AOTRITON_V2_API_LOOKUP_CACHE_H
+#define AOTRITON_V2_API_LOOKUP_CACHE_H
+
+#include <map>
+#include <stdint.h>
+#include <string>
+
+namespace aotriton::v2 {
+
+// Kernel selection memoization of XxxContext::lookup_optimal.
+//
+// Each kernel keeps a small per-thread cache keyed by
+// (arch, godel number, raw autotune keys). A hit skips the autotune table and
+// the binning code, and returns the selected TritonKernel and its perf fields
+// directly. The cache is enabled by default.
+struct LookupCacheStats {
+  uint64_t hits = 0;
+  uint64_t misses = 0;
+};
+
+void
+set_lookup_cache_enabled(bool enabled);
+
+bool
+get_lookup_cache_enabled();
+
+// Key: shim kernel name (e.g. "attn_fwd")
+std::map<std::string, LookupCacheStats>
+get_lookup_cache_stats();
+
+void
+reset_lookup_cache_stats();
+
+// Invalidates the cached selections of all threads.
+void
+clear_lookup_cache();
+
+} // namespace aotriton::v2
+
+#endif
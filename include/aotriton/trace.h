@@ -0,0 +1,41 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#ifndef AOTRITON_V2_API_TRACE_H
+#define AOTRITON_V2_API_TRACE_H
+
+#include "runtime.h"
+#include <stdint.h>
+
+namespace aotriton::v2 {
+
+// Launch tracing
+//
+// A registered callback is called after every kernel launch, on the
+// launching thread. Pointers in the event are only valid during the call.
+// Without a registered callback the cost per launch is one atomic load.
+struct TraceEvent {
+  const char* kernel;   // Shim kernel name, e.g. "attn_fwd"
+  const char* image;    // Symbol name of the selected compiled image
+  const char* arch;     // e.g. "gfx942"
+  int64_t functional;   // Godel number of functional arguments
+  int32_t image_index;  // Index of the image selected by the autotune table
+  dim3 grid;
+  hipStream_t stream;
+  hipError_t status;    // Result of the launch
+  int32_t num_perf_fields;
+  const char* const* perf_names;
+  const int32_t* perf_values;
+  // Time spent in lookup_optimal. 0 if the lookup happened before the callback was registered
+  uint64_t lookup_ns;
+};
+
+using TraceCallback = void (*)(const TraceEvent& event, void* user_data);
+
+// Pass nullptr to unregister
+void
+set_trace_callback(TraceCallback callback, void* user_data = nullptr);
+
+} // namespace aotriton::v2
+
+#endif
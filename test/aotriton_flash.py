@@ -6,6 +6,9 @@ from pyaotriton import T1, T2, T4, DType, Stream
 
 def cast_dtype(dtype):
     assert not dtype.is_complex
+    if 'float8' in str(dtype):
+        # torch.float8_e4m3fnuz -> DType.kFloat8e4m3fnuz
+        return getattr(DType, 'kFloat8' + str(dtype).split('float8_')[1])
     bits = dtype.itemsize * 8
     if dtype.is_floating_point:
         maintype = 'Float' if 'bfloat' not in str(dtype) else 'BFloat'
@@ -28,38 +31,48 @@ def mk_aotensor(q, if_empty_then_like=None):
         return klass(0, [0] * rank, [1] * rank, cast_dtype(if_empty_then_like.dtype))
     return klass(q.data_ptr(), tuple(q.size()), q.stride(), cast_dtype(q.dtype))
 
-def attn_fwd(q, k, v, sm_scale, M, o,
-             dropout_p, philox_seed, philox_offset, encoded_softmax, is_causal):
-    err = fa_forward(mk_aotensor(q),
-                     mk_aotensor(k),
-                     mk_aotensor(v),
+def attn_fwd(q, k, v, b, sm_scale, M, o,
+             dropout_p, philox_seed, philox_offset, encoded_softmax, is_causal,
+             window_left=-1, window_right=-1):
+    # Tensors are passed as-is and read through __dlpack__ in C++
+    err = fa_forward(q,
+                     k,
+                     v,
+                     b,
                      float(sm_scale),
-                     mk_aotensor(M),
-                     mk_aotensor(o),
+                     M,
+                     o,
                      float(dropout_p),
                      int(philox_seed),
                      int(philox_offset),
-                     mk_aotensor(encoded_softmax, if_empty_then_like=q),
+                     encoded_softmax,
                      is_causal,
+                     window_left,
+                     window_right,
                      Stream())
     print(f'{err=}')
 
-def attn_bwd(q, k, v, sm_scale, o, dout, dq, dk, dv, L, delta,
-             dropout_p, philox_seed, philox_offset, is_causal):
-    err = fa_backward(mk_aotensor(q),
-                      mk_aotensor(k),
-                      mk_aotensor(v),
+def attn_bwd(q, k, v, b, sm_scale, o, dout, dq, dk, dv, db, L, delta,
+             dropout_p, philox_seed, philox_offset, is_causal,
+             window_left=-1, window_right=-1):
+    err = fa_backward(q,
+                      k,
+                      v,
+                      b,
                       float(sm_scale),
-                      mk_aotensor(o),
-                      mk_aotensor(dout),
-                      mk_aotensor(dq),
-                      mk_aotensor(dk),
-                      mk_aotensor(dv),
-                      mk_aotensor(L),
-                      mk_aotensor(delta),
+                      o,
+                      dout,
+                      dq,
+                      dk,
+                      dv,
+                      db,
+                      L,
+                      delta,
                       float(dropout_p),
                       int(philox_seed),
                       int(philox_offset),
                       is_causal,
+                      window_left,
+                      window_right,
                       Stream())
     print(f'{err=}')
@@ -56,7 +56,7 @@ class _attention(torch.autograd.Function):
         philox_seed = 114514
         philox_offset = 1919810
 
-        attn_fwd(q, k, v, sm_scale, M, o,
+        attn_fwd(q, k, v, None, sm_scale, M, o,
                  dropout_p, philox_seed, philox_offset, encoded_softmax, causal);
 
         ctx.save_for_backward(q, k, v, o, M)
@@ -85,7 +85,7 @@ class _attention(torch.autograd.Function):
         delta = torch.empty_like(L)
         seqlen_q = q.shape[2]
         seqlen_k = k.shape[2]
-        attn_bwd(q, k, v, sm_scale, o, do, dq, dk, dv, L, delta,
+        attn_bwd(q, k, v, None, sm_scale, o, do, dq, dk, dv, None, L, delta,
                  dropout_p, philox_seed, philox_offset, causal);
         return dq, dk, dv, None, None, None, None, None, None
 
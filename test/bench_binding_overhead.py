@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+'''
+Host-side microbenchmark of the per-call cost of passing the six tensors of
+attn_fwd to pyaotriton, without launching kernels:
+
+  mk_aotensor:   T4/T2 objects built in Python, as test/aotriton_flash.py did
+  as_tensor_view: tensors read in C++ through __cuda_array_interface__, or
+                  __dlpack__ for torch tensors on a GPU
+
+Objects exposing __cuda_array_interface__ are faked, so no GPU is needed.
+torch GPU tensors are measured too if available.
+'''
+
+import argparse
+import timeit
+
+from pyaotriton import T2, T4, DType, as_tensor_view
+
+class FakeDeviceArray(object):
+    TYPESTR = { DType.kFloat16: '<f2', DType.kFloat32: '<f4' }
+
+    def __init__(self, shape, dtype):
+        self.shape = shape
+        self.dtype = dtype
+        strides = []
+        stride = 2 if dtype == DType.kFloat16 else 4
+        for s in reversed(shape):
+            strides.insert(0, stride)
+            stride *= s
+        self.__cuda_array_interface__ = {
+            'shape': shape,
+            'typestr': self.TYPESTR[dtype],
+            'data': (0x10000, False),
+            'strides': tuple(strides),
+            'version': 3,
+        }
+
+    # Mimics the torch.Tensor API used by mk_aotensor
+    def data_ptr(self):
+        return self.__cuda_array_interface__['data'][0]
+
+    def size(self):
+        return self.shape
+
+    def stride(self):
+        itemsize = 2 if self.dtype == DType.kFloat16 else 4
+        return tuple([s // itemsize for s in self.__cuda_array_interface__['strides']])
+
+def mk_aotensor(t):
+    klass = T4 if len(t.shape) == 4 else T2
+    return klass(t.data_ptr(), tuple(t.size()), t.stride(), t.dtype)
+
+def fwd_tensors(make, B=2, H=8, S=1024, D=64):
+    q, k, v, o = [make((B, H, S, D), 'fp16') for _ in range(4)]
+    M = make((B * H, S), 'fp32')
+    return q, k, v, o, M
+
+def bench(label, fn, number):
+    t = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f'{label:<40} {t * 1e6:8.2f} us/call')
+
+def parse():
+    p = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument("--number", type=int, default=20000, help="calls per measurement")
+    return p.parse_args()
+
+def main():
+    args = parse()
+    dtypes = { 'fp16': DType.kFloat16, 'fp32': DType.kFloat32 }
+    q, k, v, o, M = fwd_tensors(lambda shape, dt: FakeDeviceArray(shape, dtypes[dt]))
+    bench('fake CAI, mk_aotensor',
+          lambda: [mk_aotensor(t) for t in (q, k, v, o, M)], args.number)
+    bench('fake CAI, as_tensor_view',
+          lambda: [as_tensor_view(t, len(t.shape)) for t in (q, k, v, o, M)], args.number)
+    try:
+        import torch
+        has_gpu = torch.cuda.is_available()
+    except ImportError:
+        has_gpu = False
+    if not has_gpu:
+        print('torch GPU tensors: skipped, no GPU available')
+        return
+    from aotriton_flash import mk_aotensor as torch_mk_aotensor
+    torch_dtypes = { 'fp16': torch.float16, 'fp32': torch.float32 }
+    q, k, v, o, M = fwd_tensors(lambda shape, dt: torch.empty(shape, dtype=torch_dtypes[dt], device='cuda'))
+    bench('torch, mk_aotensor',
+          lambda: [torch_mk_aotensor(t) for t in (q, k, v, o, M)], args.number)
+    bench('torch, as_tensor_view (__dlpack__)',
+          lambda: [as_tensor_view(t, t.dim()) for t in (q, k, v, o, M)], args.number)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+// Host-only test of the node-wide decompressed image cache.
+// The decompressor is faked, and processes are simulated with fork().
+
+#include <aotriton/_internal/image_cache.h>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <string>
+#include <sys/wait.h>
+#include <vector>
+
+#define CHECK(cond)                                                                                           \
+  do {                                                                                                        \
+    if (!(cond)) {                                                                                            \
+      std::fprintf(stderr, "%s:%d: CHECK failed: %s\n", __FILE__, __LINE__, #cond);                          \
+      std::exit(1);                                                                                           \
+    }                                                                                                         \
+  } while (0)
+
+namespace {
+
+using namespace aotriton;
+
+// "Decompresses" by repeating the compressed bytes
+struct FakeDecompressor {
+  const std::string& compressed;
+  int* calls;
+  bool operator()(void* dst, size_t size) const {
+    *calls += 1;
+    auto out = static_cast<char*>(dst);
+    for (size_t i = 0; i < size; i++)
+      out[i] = compressed[i % compressed.size()];
+    return true;
+  }
+};
+
+std::string
+expected_image(const std::string& compressed, size_t size) {
+  std::string ret;
+  for (size_t i = 0; i < size; i++)
+    ret += compressed[i % compressed.size()];
+  return ret;
+}
+
+std::string
+make_temp_dir() {
+  char tmpl[] = "/tmp/aotriton_image_cache_XXXXXX";
+  CHECK(::mkdtemp(tmpl) != nullptr);
+  return tmpl;
+}
+
+void
+remove_dir(const std::string& path) {
+  std::string cmd = "rm -rf " + path;
+  CHECK(std::system(cmd.c_str()) == 0);
+}
+
+size_t
+count_files(const std::string& path) {
+  size_t n = 0;
+  DIR* dir = ::opendir(path.c_str());
+  CHECK(dir);
+  while (struct dirent* entry = ::readdir(dir))
+    n += entry->d_name[0] != '.';
+  ::closedir(dir);
+  return n;
+}
+
+// Returns the image as a string, and counts decompressions
+std::string
+load(const DecompressedImageCache& cache, const std::string& compressed, size_t size, int* calls, bool* mapped) {
+  MappedFile file;
+  std::vector<char> buffer;
+  auto image = decompress_cached(cache,
+                                 compressed.data(),
+                                 compressed.size(),
+                                 size,
+                                 &file,
+                                 &buffer,
+                                 FakeDecompressor { compressed, calls });
+  CHECK(image);
+  *mapped = file.data() != nullptr;
+  return std::string(static_cast<const char*>(image), size);
+}
+
+void
+test_disabled() {
+  DecompressedImageCache cache("", 1 << 20);
+  int calls = 0;
+  bool mapped;
+  std::string compressed = "disabled";
+  CHECK(load(cache, compressed, 100, &calls, &mapped) == expected_image(compressed, 100));
+  CHECK(load(cache, compressed, 100, &calls, &mapped) == expected_image(compressed, 100));
+  CHECK(calls == 2);
+  CHECK(!mapped);
+}
+
+void
+test_hit_after_miss() {
+  std::string dir = make_temp_dir();
+  std::string compressed = "kernel image";
+  int calls = 0;
+  bool mapped;
+  {
+    DecompressedImageCache cache(dir, 1 << 20);
+    CHECK(load(cache, compressed, 5000, &calls, &mapped) == expected_image(compressed, 5000));
+    CHECK(!mapped);
+  }
+  {
+    // Another "process"
+    DecompressedImageCache cache(dir, 1 << 20);
+    CHECK(load(cache, compressed, 5000, &calls, &mapped) == expected_image(compressed, 5000));
+    CHECK(mapped);
+  }
+  CHECK(calls == 1);
+  // Different image content, different entry
+  DecompressedImageCache cache(dir, 1 << 20);
+  CHECK(load(cache, "other image", 5000, &calls, &mapped) == expected_image("other image", 5000));
+  CHECK(calls == 2);
+  CHECK(count_files(dir) == 2);
+  remove_dir(dir);
+}
+
+void
+test_size_cap() {
+  std::string dir = make_temp_dir();
+  DecompressedImageCache cache(dir, 6000);
+  int calls = 0;
+  bool mapped;
+  load(cache, "first", 4000, &calls, &mapped);
+  // Would exceed the cap, decompressed but not cached
+  load(cache, "second", 4000, &calls, &mapped);
+  load(cache, "second", 4000, &calls, &mapped);
+  CHECK(!mapped);
+  CHECK(calls == 3);
+  CHECK(count_files(dir) == 1);
+  CHECK(cache.usage() == 4000);
+  remove_dir(dir);
+}
+
+void
+test_size_mismatch_rejected() {
+  std::string dir = make_temp_dir();
+  DecompressedImageCache cache(dir, 1 << 20);
+  std::string compressed = "truncated";
+  std::string path = cache.path_of(image_key(compressed.data(), compressed.size()));
+  FILE* f = std::fopen(path.c_str(), "wb");
+  CHECK(f);
+  std::fputs("short", f);
+  std::fclose(f);
+  int calls = 0;
+  bool mapped;
+  CHECK(load(cache, compressed, 1000, &calls, &mapped) == expected_image(compressed, 1000));
+  CHECK(!mapped);
+  CHECK(calls == 1);
+  // The invalid entry has been replaced
+  CHECK(load(cache, compressed, 1000, &calls, &mapped) == expected_image(compressed, 1000));
+  CHECK(mapped);
+  CHECK(calls == 1);
+  remove_dir(dir);
+}
+
+void
+test_concurrent_population() {
+  std::string dir = make_temp_dir();
+  std::string compressed = "shared by all ranks";
+  const size_t size = 1 << 20;
+  const int kProcesses = 8;
+  std::vector<pid_t> children;
+  for (int i = 0; i < kProcesses; i++) {
+    pid_t pid = ::fork();
+    CHECK(pid >= 0);
+    if (pid == 0) {
+      DecompressedImageCache cache(dir, 64 << 20);
+      int calls = 0;
+      bool mapped;
+      bool ok = load(cache, compressed, size, &calls, &mapped) == expected_image(compressed, size);
+      std::_Exit(ok ? 0 : 1);
+    }
+    children.push_back(pid);
+  }
+  for (pid_t pid : children) {
+    int status = 0;
+    CHECK(::waitpid(pid, &status, 0) == pid);
+    CHECK(WIFEXITED(status) && WEXITSTATUS(status) == 0);
+  }
+  // Exactly one complete entry and no leftover temporary files
+  CHECK(count_files(dir) == 1);
+  DecompressedImageCache cache(dir, 64 << 20);
+  int calls = 0;
+  bool mapped;
+  CHECK(load(cache, compressed, size, &calls, &mapped) == expected_image(compressed, size));
+  CHECK(mapped);
+  CHECK(calls == 0);
+  remove_dir(dir);
+}
+
+}
+
+int
+main() {
+  test_disabled();
+  test_hit_after_miss();
+  test_size_cap();
+  test_size_mismatch_rejected();
+  test_concurrent_population();
+  std::printf("PASS\n");
+  return 0;
+}
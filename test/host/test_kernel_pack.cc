@@ -0,0 +1,101 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+// Host-only test of the kernel pack parser.
+// Packs are built in memory with the layout written by v2python/kernel_pack.py
+
+#include <aotriton/_internal/kernel_pack.h>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <string>
+#include <vector>
+
+#define CHECK(cond)                                                                                           \
+  do {                                                                                                        \
+    if (!(cond)) {                                                                                            \
+      std::fprintf(stderr, "%s:%d: CHECK failed: %s\n", __FILE__, __LINE__, #cond);                          \
+      std::exit(1);                                                                                           \
+    }                                                                                                         \
+  } while (0)
+
+namespace {
+
+using namespace aotriton;
+
+std::vector<char>
+make_pack(const std::vector<std::string>& images) {
+  KernelPackHeader header;
+  std::memcpy(header.magic, kKernelPackMagic, sizeof(header.magic));
+  header.version = kKernelPackVersion;
+  header.count = images.size();
+  auto align = [](uint64_t x) { return (x + kKernelPackAlignment - 1) / kKernelPackAlignment * kKernelPackAlignment; };
+  uint64_t offset = align(sizeof(header) + images.size() * sizeof(KernelPackEntry));
+  std::vector<KernelPackEntry> table;
+  for (const auto& image : images) {
+    table.push_back({ offset, image.size() });
+    offset = align(offset + image.size());
+  }
+  std::vector<char> pack(images.empty() ? sizeof(header) : table.back().offset + table.back().size);
+  std::memcpy(pack.data(), &header, sizeof(header));
+  std::memcpy(pack.data() + sizeof(header), table.data(), table.size() * sizeof(KernelPackEntry));
+  for (size_t i = 0; i < images.size(); i++)
+    std::memcpy(pack.data() + table[i].offset, images[i].data(), images[i].size());
+  return pack;
+}
+
+void
+test_images() {
+  std::vector<std::string> images = { "first", std::string(5000, 'x'), "", "last" };
+  auto pack = make_pack(images);
+  KernelPackView view;
+  CHECK(view.parse(pack.data(), pack.size()));
+  CHECK(view.count() == images.size());
+  for (uint32_t i = 0; i < images.size(); i++) {
+    const void* image = nullptr;
+    size_t size = 0;
+    CHECK(view.image(i, &image, &size));
+    CHECK(size == images[i].size());
+    CHECK(std::string(static_cast<const char*>(image), size) == images[i]);
+  }
+  const void* image = nullptr;
+  size_t size = 0;
+  CHECK(!view.image(images.size(), &image, &size));
+}
+
+void
+test_rejects_corrupted() {
+  KernelPackView view;
+  auto pack = make_pack({ "abc", "defg" });
+  CHECK(!view.parse(pack.data(), sizeof(KernelPackHeader) - 1));
+  // Truncated image
+  CHECK(!view.parse(pack.data(), pack.size() - 1));
+  CHECK(view.count() == 0);
+  auto bad_magic = pack;
+  bad_magic[0] = 'X';
+  CHECK(!view.parse(bad_magic.data(), bad_magic.size()));
+  auto bad_version = pack;
+  reinterpret_cast<KernelPackHeader*>(bad_version.data())->version += 1;
+  CHECK(!view.parse(bad_version.data(), bad_version.size()));
+  auto bad_count = pack;
+  reinterpret_cast<KernelPackHeader*>(bad_count.data())->count = 1u << 30;
+  CHECK(!view.parse(bad_count.data(), bad_count.size()));
+  auto bad_offset = pack;
+  auto entries = reinterpret_cast<KernelPackEntry*>(bad_offset.data() + sizeof(KernelPackHeader));
+  entries[1].offset += 1;
+  CHECK(!view.parse(bad_offset.data(), bad_offset.size()));
+  auto bad_size = pack;
+  entries = reinterpret_cast<KernelPackEntry*>(bad_size.data() + sizeof(KernelPackHeader));
+  entries[1].size = UINT64_MAX;
+  CHECK(!view.parse(bad_size.data(), bad_size.size()));
+}
+
+}
+
+int
+main() {
+  test_images();
+  test_rejects_corrupted();
+  std::printf("PASS\n");
+  return 0;
+}
@@ -0,0 +1,210 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+// Host-only test of the fork/join ordering used by attn_bwd.
+// The stub runtime records every operation as a node of a happens-before
+// graph, so the test can check that dependencies are enforced by events
+// rather than by the order of host calls.
+
+#include <aotriton/_internal/stream_fork.h>
+#include <cstdio>
+#include <cstdlib>
+#include <set>
+#include <string>
+#include <vector>
+
+#define CHECK(cond)                                                                                           \
+  do {                                                                                                        \
+    if (!(cond)) {                                                                                            \
+      std::fprintf(stderr, "%s:%d: CHECK failed: %s\n", __FILE__, __LINE__, #cond);                          \
+      std::exit(1);                                                                                           \
+    }                                                                                                         \
+  } while (0)
+
+namespace {
+
+struct Op {
+  std::string name;
+  int stream;
+  std::vector<int> deps; // Indices of ops that must complete before this one
+};
+
+struct StubRuntime {
+  using Error = int;
+  using Stream = int;
+  using Event = int;
+  using Device = int;
+  static constexpr int kSuccess = 0;
+  static constexpr int kFailure = 1;
+
+  static std::vector<Op> ops;
+  static std::vector<int> stream_device;   // stream -> device
+  static std::vector<int> stream_last_op;  // stream -> last op, -1 if none
+  static std::vector<int> event_recorded;  // event -> op, -1 if not recorded
+  static int streams_created;
+  static int events_created;
+
+  static void reset(int nstreams) {
+    ops.clear();
+    stream_device.assign(nstreams, 0);
+    stream_last_op.assign(nstreams, -1);
+    event_recorded.clear();
+    streams_created = 0;
+    events_created = 0;
+  }
+
+  static int push(const std::string& name, Stream stream, std::vector<int> deps = {}) {
+    if (stream_last_op[stream] >= 0)
+      deps.push_back(stream_last_op[stream]);
+    ops.push_back({ name, stream, deps });
+    stream_last_op[stream] = ops.size() - 1;
+    return ops.size() - 1;
+  }
+
+  static Error stream_get_device(Stream stream, Device* device) {
+    *device = stream_device[stream];
+    return kSuccess;
+  }
+  static Error stream_create(Device device, Stream* stream) {
+    streams_created++;
+    stream_device.push_back(device);
+    stream_last_op.push_back(-1);
+    *stream = stream_device.size() - 1;
+    return kSuccess;
+  }
+  static Error event_create(Device, Event* event) {
+    events_created++;
+    event_recorded.push_back(-1);
+    *event = event_recorded.size() - 1;
+    return kSuccess;
+  }
+  static Error event_record(Event event, Stream stream) {
+    event_recorded[event] = push("record", stream);
+    return kSuccess;
+  }
+  static Error stream_wait_event(Stream stream, Event event) {
+    std::vector<int> deps;
+    if (event_recorded[event] >= 0)
+      deps.push_back(event_recorded[event]);
+    push("wait", stream, deps);
+    return kSuccess;
+  }
+};
+
+std::vector<Op> StubRuntime::ops;
+std::vector<int> StubRuntime::stream_device;
+std::vector<int> StubRuntime::stream_last_op;
+std::vector<int> StubRuntime::event_recorded;
+int StubRuntime::streams_created = 0;
+int StubRuntime::events_created = 0;
+
+int
+find_op(const std::string& name) {
+  for (size_t i = 0; i < StubRuntime::ops.size(); i++)
+    if (StubRuntime::ops[i].name == name)
+      return i;
+  return -1;
+}
+
+bool
+happens_before(int a, int b) {
+  std::vector<int> todo = { b };
+  std::set<int> seen;
+  while (!todo.empty()) {
+    int cur = todo.back();
+    todo.pop_back();
+    for (int dep : StubRuntime::ops[cur].deps) {
+      if (dep == a)
+        return true;
+      if (seen.insert(dep).second)
+        todo.push_back(dep);
+    }
+  }
+  return false;
+}
+
+using aotriton::fork_join;
+using aotriton::ForkResources;
+using aotriton::get_fork_resources;
+
+int
+launch(const std::string& name, int stream, int ret = StubRuntime::kSuccess) {
+  StubRuntime::push(name, stream);
+  return ret;
+}
+
+void
+test_dependency_ordering() {
+  StubRuntime::reset(1);
+  const int primary = 0;
+  ForkResources<StubRuntime> res;
+  CHECK(get_fork_resources<StubRuntime>(primary, &res) == StubRuntime::kSuccess);
+  CHECK(res.stream != primary);
+  launch("preprocess", primary);
+  int err = fork_join<StubRuntime>(
+      primary,
+      res,
+      [](int s) { return launch("dk_dv", s); },
+      [](int s) { return launch("dq", s); });
+  CHECK(err == StubRuntime::kSuccess);
+  launch("consumer", primary);
+
+  int preprocess = find_op("preprocess");
+  int dk_dv = find_op("dk_dv");
+  int dq = find_op("dq");
+  int consumer = find_op("consumer");
+  CHECK(StubRuntime::ops[dk_dv].stream == primary);
+  CHECK(StubRuntime::ops[dq].stream == res.stream);
+  // Both kernels consume delta produced by bwd_preprocess
+  CHECK(happens_before(preprocess, dk_dv));
+  CHECK(happens_before(preprocess, dq));
+  // dk_dv and dq are concurrent
+  CHECK(!happens_before(dk_dv, dq));
+  CHECK(!happens_before(dq, dk_dv));
+  // Subsequent work on the caller's stream observes both
+  CHECK(happens_before(dk_dv, consumer));
+  CHECK(happens_before(dq, consumer));
+}
+
+void
+test_join_on_failure() {
+  StubRuntime::reset(1);
+  const int primary = 0;
+  ForkResources<StubRuntime> res;
+  CHECK(get_fork_resources<StubRuntime>(primary, &res) == StubRuntime::kSuccess);
+  int err = fork_join<StubRuntime>(
+      primary,
+      res,
+      [](int s) { return launch("dk_dv", s); },
+      [](int s) { return launch("dq", s, StubRuntime::kFailure); });
+  CHECK(err == StubRuntime::kFailure);
+  launch("consumer", primary);
+  CHECK(happens_before(find_op("dq"), find_op("consumer")));
+}
+
+void
+test_resources_cached_per_device() {
+  StubRuntime::reset(2);
+  StubRuntime::stream_device[1] = 1;
+  ForkResources<StubRuntime> res0, res0_again, res1;
+  CHECK(get_fork_resources<StubRuntime>(0, &res0) == StubRuntime::kSuccess);
+  CHECK(get_fork_resources<StubRuntime>(0, &res0_again) == StubRuntime::kSuccess);
+  CHECK(get_fork_resources<StubRuntime>(1, &res1) == StubRuntime::kSuccess);
+  CHECK(res0.stream == res0_again.stream);
+  CHECK(res0.stream != res1.stream);
+  CHECK(StubRuntime::stream_device[res1.stream] == 1);
+  CHECK(StubRuntime::streams_created == 2);
+  CHECK(StubRuntime::events_created == 4);
+}
+
+}
+
+int
+main() {
+  // Must run first, before other tests cache the resources of device 0
+  test_resources_cached_per_device();
+  test_dependency_ordering();
+  test_join_on_failure();
+  std::printf("PASS\n");
+  return 0;
+}
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton import hipError_t
+from pyaotriton.v2.flash import attn_fwd, attn_bwd
+
+BATCH, N_HEADS, D_HEAD = 2, 4, 64
+
+def _ref_attention(q, k, v, b, causal, sm_scale):
+    p = torch.matmul(q.float(), k.float().transpose(2, 3)) * sm_scale + b.float()
+    if causal:
+        mask = torch.ones(q.shape[2], k.shape[2], dtype=torch.bool, device=q.device).tril()
+        p = p.masked_fill(~mask, float('-inf'))
+    p = torch.softmax(p, dim=-1)
+    return torch.matmul(p, v.float()).to(q.dtype)
+
+# Full bias, and biases broadcast over the batch, or the batch and seqlen_q
+BIAS_SHAPES = [
+    lambda sq, sk: (BATCH, N_HEADS, sq, sk),
+    lambda sq, sk: (1, N_HEADS, sq, sk),
+    lambda sq, sk: (1, N_HEADS, 1, sk),
+]
+
+@pytest.mark.parametrize('seqlen_q, seqlen_k', [(128, 128), (64, 200)])
+@pytest.mark.parametrize('bias_shape', BIAS_SHAPES)
+@pytest.mark.parametrize('causal', [False, True])
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+def test_bias(seqlen_q, seqlen_k, bias_shape, causal, dtype):
+    sm_scale = 0.5
+    q = torch.randn((BATCH, N_HEADS, seqlen_q, D_HEAD), dtype=dtype, device='cuda')
+    k = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    v = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    b = torch.randn(bias_shape(seqlen_q, seqlen_k), dtype=dtype, device='cuda')
+    # Broadcast dimensions have zero strides
+    b_full = b.expand(BATCH, N_HEADS, seqlen_q, seqlen_k)
+    out = torch.empty_like(q)
+    M = torch.empty((BATCH * N_HEADS, seqlen_q), dtype=torch.float32, device='cuda')
+    err = attn_fwd(q, k, v, b_full, sm_scale, M, out, 0.0, 0, 0, None, causal)
+    assert err == hipError_t.hipSuccess
+    dout = torch.randn_like(q)
+    dq, dk, dv = torch.empty_like(q), torch.empty_like(k), torch.empty_like(v)
+    # Masked entries of db are not written
+    db = torch.zeros((BATCH, N_HEADS, seqlen_q, seqlen_k), dtype=dtype, device='cuda')
+    delta = torch.empty_like(M)
+    err = attn_bwd(q, k, v, b_full, sm_scale, out, dout, dq, dk, dv, db, M, delta, 0.0, 0, 0, causal)
+    assert err == hipError_t.hipSuccess
+    q, k, v, b = [t.detach().requires_grad_() for t in (q, k, v, b)]
+    ref = _ref_attention(q, k, v, b.expand_as(db), causal, sm_scale)
+    ref.backward(dout)
+    atol = 2e-2 if dtype == torch.float16 else 5e-2
+    torch.testing.assert_close(out, ref, atol=atol, rtol=0)
+    for grad, ref_grad in zip((dq, dk, dv), (q.grad, k.grad, v.grad)):
+        torch.testing.assert_close(grad, ref_grad, atol=atol * 2, rtol=0)
+    # Caller reduces db over the broadcast dimensions
+    dims = [i for i, n in enumerate(b.shape) if n == 1 and db.shape[i] != 1]
+    db = db.float().sum(dim=dims, keepdim=True) if dims else db.float()
+    torch.testing.assert_close(db, b.grad.float(), atol=atol * 4, rtol=0)
+
+def test_bias_without_db():
+    q = torch.randn((BATCH, N_HEADS, 128, D_HEAD), dtype=torch.float16, device='cuda')
+    b = torch.randn((BATCH, N_HEADS, 128, 128), dtype=torch.float16, device='cuda')
+    out = torch.empty_like(q)
+    M = torch.empty((BATCH * N_HEADS, 128), dtype=torch.float32, device='cuda')
+    assert attn_fwd(q, q, q, b, 0.5, M, out, 0.0, 0, 0, None, False) == hipError_t.hipSuccess
+    dq, dk, dv = torch.empty_like(q), torch.empty_like(q), torch.empty_like(q)
+    err = attn_bwd(q, q, q, b, 0.5, out, torch.randn_like(q), dq, dk, dv, None, M, torch.empty_like(M),
+                   0.0, 0, 0, False)
+    assert err == hipError_t.hipSuccess
+
+def test_bias_rejects_bad_layout():
+    q = torch.randn((BATCH, N_HEADS, 128, D_HEAD), dtype=torch.float16, device='cuda')
+    out = torch.empty_like(q)
+    M = torch.empty((BATCH * N_HEADS, 128), dtype=torch.float32, device='cuda')
+    # Last dimension must be contiguous
+    b = torch.randn((BATCH, N_HEADS, 128, 128), dtype=torch.float16, device='cuda').transpose(2, 3)
+    assert attn_fwd(q, q, q, b, 0.5, M, out, 0.0, 0, 0, None, False) == hipError_t.hipErrorInvalidValue
+    # dtype must match q
+    b = torch.randn((BATCH, N_HEADS, 128, 128), dtype=torch.float32, device='cuda')
+    assert attn_fwd(q, q, q, b, 0.5, M, out, 0.0, 0, 0, None, False) == hipError_t.hipErrorInvalidValue
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton import hipError_t
+from pyaotriton.v2.flash import attn_fwd, attn_fwd_decode, attn_fwd_decode_num_splits
+
+BATCH, D_HEAD = 2, 64
+
+def _workspaces(q, num_splits):
+    batch, num_heads, seqlen_q, head_size = q.shape
+    out_partial = torch.empty((num_splits * batch, num_heads, seqlen_q, head_size),
+                              dtype=torch.float32, device=q.device)
+    lse_partial = torch.empty((num_splits * batch * num_heads, seqlen_q), dtype=torch.float32, device=q.device)
+    return out_partial, lse_partial
+
+@pytest.mark.parametrize('seqlen_q', [1, 4])
+@pytest.mark.parametrize('seqlen_k', [1, 200, 4096])
+@pytest.mark.parametrize('num_heads, num_heads_k', [(8, 8), (8, 2)])
+@pytest.mark.parametrize('num_splits', [None, 1, 5])
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+def test_decode_matches_attn_fwd(seqlen_q, seqlen_k, num_heads, num_heads_k, num_splits, dtype):
+    sm_scale = 0.125
+    q = torch.randn((BATCH, num_heads, seqlen_q, D_HEAD), dtype=dtype, device='cuda')
+    k = torch.randn((BATCH, num_heads_k, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    v = torch.randn((BATCH, num_heads_k, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    if num_splits is None:
+        err, num_splits = attn_fwd_decode_num_splits(q, k)
+        assert err == hipError_t.hipSuccess
+        assert num_splits >= 1
+    out = torch.empty_like(q)
+    M = torch.empty((BATCH * num_heads, seqlen_q), dtype=torch.float32, device='cuda')
+    err = attn_fwd_decode(q, k, v, sm_scale, M, out, *_workspaces(q, num_splits))
+    assert err == hipError_t.hipSuccess
+    ref_out = torch.empty_like(q)
+    ref_M = torch.empty_like(M)
+    err = attn_fwd(q, k, v, None, sm_scale, ref_M, ref_out, 0.0, 0, 0, None, False)
+    assert err == hipError_t.hipSuccess
+    torch.testing.assert_close(out, ref_out, atol=1e-2, rtol=0)
+    torch.testing.assert_close(M, ref_M, atol=1e-3, rtol=0)
+
+def test_decode_num_splits():
+    q = torch.randn((1, 1, 1, D_HEAD), dtype=torch.float16, device='cuda')
+    k = torch.randn((1, 1, 8192, D_HEAD), dtype=torch.float16, device='cuda')
+    err, num_splits = attn_fwd_decode_num_splits(q, k)
+    assert err == hipError_t.hipSuccess
+    assert num_splits > 1
+    # The grid is already large enough
+    q = torch.randn((64, 32, 1, D_HEAD), dtype=torch.float16, device='cuda')
+    k = torch.randn((64, 32, 8192, D_HEAD), dtype=torch.float16, device='cuda')
+    err, num_splits = attn_fwd_decode_num_splits(q, k)
+    assert err == hipError_t.hipSuccess
+    assert num_splits == 1
+
+def test_decode_rejects_bad_workspaces():
+    q = torch.randn((BATCH, 4, 1, D_HEAD), dtype=torch.float16, device='cuda')
+    k = torch.randn((BATCH, 4, 512, D_HEAD), dtype=torch.float16, device='cuda')
+    out = torch.empty_like(q)
+    M = torch.empty((BATCH * 4, 1), dtype=torch.float32, device='cuda')
+    out_partial, lse_partial = _workspaces(q, 2)
+    # Workspaces must be fp32
+    err = attn_fwd_decode(q, k, k, 0.5, M, out, out_partial.half(), lse_partial)
+    assert err == hipError_t.hipErrorInvalidValue
+    # num_splits of both workspaces must agree
+    err = attn_fwd_decode(q, k, k, 0.5, M, out, out_partial, _workspaces(q, 3)[1])
+    assert err == hipError_t.hipErrorInvalidValue
+
+def test_decode_rejects_bad_outputs():
+    q = torch.randn((BATCH, 4, 2, D_HEAD), dtype=torch.float16, device='cuda')
+    k = torch.randn((BATCH, 4, 512, D_HEAD), dtype=torch.float16, device='cuda')
+    out = torch.empty_like(q)
+    M = torch.empty((BATCH * 4, 2), dtype=torch.float32, device='cuda')
+    workspaces = _workspaces(q, 2)
+    # out must match q
+    err = attn_fwd_decode(q, k, k, 0.5, M, out[:, :2], *workspaces)
+    assert err == hipError_t.hipErrorInvalidValue
+    err = attn_fwd_decode(q, k, k, 0.5, M, out.bfloat16(), *workspaces)
+    assert err == hipError_t.hipErrorInvalidValue
+    # softmax_lse must be contiguous fp32 of (batch * num_heads) x seqlen_q
+    err = attn_fwd_decode(q, k, k, 0.5, M.half(), out, *workspaces)
+    assert err == hipError_t.hipErrorInvalidValue
+    err = attn_fwd_decode(q, k, k, 0.5, M[:, :1], out, *workspaces)
+    assert err == hipError_t.hipErrorInvalidValue
+    err = attn_fwd_decode(q, k, k, 0.5, M.t().contiguous().t(), out, *workspaces)
+    assert err == hipError_t.hipErrorInvalidValue
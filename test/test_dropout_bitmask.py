@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton import hipError_t
+from pyaotriton.v2.flash import (
+    attn_fwd,
+    attn_bwd,
+    dropout_bitmask_shape,
+    FwdExtraArguments,
+    BwdExtraArguments,
+)
+from aotriton_flash import mk_aotensor
+
+BATCH, N_HEADS, D_HEAD = 2, 4, 64
+DROPOUT_P = 0.5
+PHILOX_SEED, PHILOX_OFFSET = 0x1BF52, 0x1D4B42
+
+def unpack_bitmask(bitmask, seqlen_k):
+    shifts = torch.arange(32, dtype=torch.int32, device=bitmask.device)
+    bits = (bitmask.unsqueeze(-1) >> shifts) & 1
+    return bits.flatten(-2)[..., :seqlen_k] != 0
+
+def test_dropout_bitmask_shape():
+    q = torch.empty((BATCH, N_HEADS, 100, D_HEAD), dtype=torch.float16, device='cuda')
+    k = torch.empty((BATCH, N_HEADS, 33, D_HEAD), dtype=torch.float16, device='cuda')
+    nbytes = BATCH * N_HEADS * 100 * 2 * 4
+    err, shape = dropout_bitmask_shape(q, k, DROPOUT_P, nbytes)
+    assert err == hipError_t.hipSuccess
+    assert shape == (BATCH, N_HEADS, 100, 2)
+    _, shape = dropout_bitmask_shape(q, k, DROPOUT_P, nbytes - 1)
+    assert shape == (0, 0, 0, 0)
+    _, shape = dropout_bitmask_shape(q, k, 0.0, nbytes)
+    assert shape == (0, 0, 0, 0)
+
+def run_fwd(q, k, v, causal, bitmask=None, encoded_softmax=None):
+    out = torch.empty_like(q)
+    M = torch.empty((q.shape[0] * q.shape[1], q.shape[2]), dtype=torch.float32, device=q.device)
+    extargs = FwdExtraArguments()
+    if bitmask is not None:
+        extargs.dropout_bitmask = mk_aotensor(bitmask)
+    err = attn_fwd(q, k, v, None, 0.5, M, out, DROPOUT_P, PHILOX_SEED, PHILOX_OFFSET, encoded_softmax, causal,
+                   extargs=extargs)
+    assert err == hipError_t.hipSuccess
+    return out, M
+
+def run_bwd(q, k, v, out, M, dout, causal, bitmask=None):
+    dq, dk, dv = torch.empty_like(q), torch.empty_like(k), torch.empty_like(v)
+    extargs = BwdExtraArguments()
+    if bitmask is not None:
+        extargs.dropout_bitmask = mk_aotensor(bitmask)
+    err = attn_bwd(q, k, v, None, 0.5, out, dout, dq, dk, dv, None, M, torch.empty_like(M),
+                   DROPOUT_P, PHILOX_SEED, PHILOX_OFFSET, causal, extargs=extargs)
+    assert err == hipError_t.hipSuccess
+    return dq, dk, dv
+
+@pytest.mark.parametrize('seqlen_q, seqlen_k', [(128, 128), (64, 300), (143, 587), (200, 16)])
+@pytest.mark.parametrize('causal', [False, True])
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+def test_dropout_bitmask(seqlen_q, seqlen_k, causal, dtype):
+    q = torch.randn((BATCH, N_HEADS, seqlen_q, D_HEAD), dtype=dtype, device='cuda')
+    k = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    v = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    err, shape = dropout_bitmask_shape(q, k, DROPOUT_P, 1 << 30)
+    assert err == hipError_t.hipSuccess
+    # Garbage must not leak into the mask
+    bitmask = torch.full(shape, -1, dtype=torch.int32, device='cuda')
+    encoded_softmax = torch.empty((BATCH, N_HEADS, seqlen_q, seqlen_k), dtype=dtype, device='cuda')
+    out, M = run_fwd(q, k, v, causal, bitmask, encoded_softmax)
+    ref_out, ref_M = run_fwd(q, k, v, causal)
+    torch.testing.assert_close(out, ref_out, atol=0, rtol=0)
+    if not causal:
+        # The sign bits of encoded_softmax are the dropped elements
+        keep = unpack_bitmask(bitmask, seqlen_k)
+        assert torch.equal(keep, ~torch.signbit(encoded_softmax))
+    dout = torch.randn_like(q)
+    grads = run_bwd(q, k, v, out, M, dout, causal, bitmask)
+    ref_grads = run_bwd(q, k, v, ref_out, ref_M, dout, causal)
+    for grad, ref_grad in zip(grads, ref_grads):
+        torch.testing.assert_close(grad, ref_grad, atol=0, rtol=0)
+
+def test_invalid_dropout_bitmask():
+    q = torch.randn((BATCH, N_HEADS, 64, D_HEAD), dtype=torch.float16, device='cuda')
+    out = torch.empty_like(q)
+    M = torch.empty((BATCH * N_HEADS, 64), dtype=torch.float32, device='cuda')
+    extargs = FwdExtraArguments()
+    # One word short
+    bitmask = torch.empty((BATCH, N_HEADS, 64, 1), dtype=torch.int32, device='cuda')
+    extargs.dropout_bitmask = mk_aotensor(bitmask)
+    err = attn_fwd(q, q, q, None, 0.5, M, out, DROPOUT_P, PHILOX_SEED, PHILOX_OFFSET, None, False,
+                   extargs=extargs)
+    assert err == hipError_t.hipErrorInvalidValue
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton import hipError_t
+from pyaotriton.v2.flash import attn_fwd_fp8
+from aotriton_flash import mk_aotensor
+
+BATCH, N_HEADS = 2, 4
+
+def quantize(t, dtype):
+    # Per-tensor scale mapping the absolute maximum to the largest FP8 value
+    descale = t.abs().max().item() / torch.finfo(dtype).max
+    return (t / descale).to(dtype), descale
+
+def ref_attention(q, k, v, sm_scale, causal):
+    s = (q @ k.transpose(-2, -1)) * sm_scale
+    if causal:
+        seqlen_q, seqlen_k = s.shape[-2:]
+        mask = torch.ones((seqlen_q, seqlen_k), dtype=torch.bool, device=q.device).tril()
+        s = s.masked_fill(~mask, float('-inf'))
+    return torch.softmax(s, dim=-1) @ v
+
+@pytest.mark.parametrize('seqlen_q, seqlen_k', [(128, 128), (64, 300), (200, 96)])
+@pytest.mark.parametrize('D_HEAD', [64, 80, 128])
+@pytest.mark.parametrize('causal', [False, True])
+@pytest.mark.parametrize('fp8_dtype', [torch.float8_e4m3fnuz, torch.float8_e5m2fnuz])
+@pytest.mark.parametrize('out_dtype', [torch.float16, torch.bfloat16])
+def test_fp8(seqlen_q, seqlen_k, D_HEAD, causal, fp8_dtype, out_dtype):
+    sm_scale = D_HEAD ** -0.5
+    q = torch.randn((BATCH, N_HEADS, seqlen_q, D_HEAD), device='cuda')
+    k = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), device='cuda')
+    v = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), device='cuda')
+    (q8, q_descale), (k8, k_descale), (v8, v_descale) = [quantize(t, fp8_dtype) for t in (q, k, v)]
+    out = torch.empty((BATCH, N_HEADS, seqlen_q, D_HEAD), dtype=out_dtype, device='cuda')
+    M = torch.empty((BATCH * N_HEADS, seqlen_q), dtype=torch.float32, device='cuda')
+    # torch does not export FP8 tensors through DLPack
+    err = attn_fwd_fp8(mk_aotensor(q8), mk_aotensor(k8), mk_aotensor(v8),
+                       q_descale, k_descale, v_descale, sm_scale,
+                       mk_aotensor(M), mk_aotensor(out), causal)
+    assert err == hipError_t.hipSuccess
+    # Only the quantization of the softmax probabilities is not in the reference
+    ref_out = ref_attention(q8.float() * q_descale, k8.float() * k_descale, v8.float() * v_descale, sm_scale, causal)
+    atol = 5e-2 if fp8_dtype == torch.float8_e4m3fnuz else 1e-1
+    torch.testing.assert_close(out.float(), ref_out, atol=atol, rtol=0)
+
+def test_fp8_rejects_bad_dtypes():
+    q8 = torch.randn((BATCH, N_HEADS, 128, 64), device='cuda').to(torch.float8_e4m3fnuz)
+    out = torch.empty((BATCH, N_HEADS, 128, 64), dtype=torch.float16, device='cuda')
+    M = torch.empty((BATCH * N_HEADS, 128), dtype=torch.float32, device='cuda')
+    T = mk_aotensor
+    # Q/K/V must be FP8 of the same format
+    err = attn_fwd_fp8(T(out), T(out), T(out), 1.0, 1.0, 1.0, 0.5, T(M), T(out), False)
+    assert err == hipError_t.hipErrorInvalidValue
+    err = attn_fwd_fp8(T(q8), T(q8.view(torch.float8_e5m2fnuz)), T(q8), 1.0, 1.0, 1.0, 0.5, T(M), T(out), False)
+    assert err == hipError_t.hipErrorInvalidValue
+    # Out must be fp16 or bf16
+    err = attn_fwd_fp8(T(q8), T(q8), T(q8), 1.0, 1.0, 1.0, 0.5, T(M), T(q8), False)
+    assert err == hipError_t.hipErrorInvalidValue
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton import hipError_t
+from pyaotriton.v2.flash import (
+    attn_fwd,
+    attn_bwd,
+    BwdExtraArguments,
+)
+from aotriton_flash import mk_aotensor
+
+BATCH, N_HEADS = 2, 4
+
+def run_fwd(q, k, v, causal):
+    out = torch.empty_like(q)
+    M = torch.empty((q.shape[0] * q.shape[1], q.shape[2]), dtype=torch.float32, device=q.device)
+    err = attn_fwd(q, k, v, None, 0.5, M, out, 0.0, 0, 0, None, causal)
+    assert err == hipError_t.hipSuccess
+    return out, M
+
+def run_bwd(q, k, v, out, M, dout, causal, dq_acc=None):
+    dq, dk, dv = torch.empty_like(q), torch.empty_like(k), torch.empty_like(v)
+    extargs = BwdExtraArguments()
+    if dq_acc is not None:
+        extargs.dq_acc = mk_aotensor(dq_acc)
+    err = attn_bwd(q, k, v, None, 0.5, out, dout, dq, dk, dv, None, M, torch.empty_like(M),
+                   0.0, 0, 0, causal, extargs=extargs)
+    return err, (dq, dk, dv)
+
+@pytest.mark.parametrize('seqlen_q, seqlen_k', [(128, 128), (64, 300), (143, 587), (200, 16)])
+@pytest.mark.parametrize('D_HEAD', [64, 72])
+@pytest.mark.parametrize('causal', [False, True])
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+def test_fused_bwd(seqlen_q, seqlen_k, D_HEAD, causal, dtype):
+    q = torch.randn((BATCH, N_HEADS, seqlen_q, D_HEAD), dtype=dtype, device='cuda')
+    k = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    v = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    out, M = run_fwd(q, k, v, causal)
+    dout = torch.randn_like(q)
+    # Garbage must be cleared before the accumulation
+    dq_acc = torch.full(q.shape, float('nan'), dtype=torch.float32, device='cuda')
+    err, grads = run_bwd(q, k, v, out, M, dout, causal, dq_acc)
+    assert err == hipError_t.hipSuccess
+    err, ref_grads = run_bwd(q, k, v, out, M, dout, causal)
+    assert err == hipError_t.hipSuccess
+    # Atomics accumulate dQ in a different order
+    atol, rtol = (1e-2, 1e-2) if dtype == torch.float16 else (2e-2, 2e-2)
+    for grad, ref_grad in zip(grads, ref_grads):
+        torch.testing.assert_close(grad, ref_grad, atol=atol, rtol=rtol)
+
+def test_invalid_dq_acc():
+    q = torch.randn((BATCH, N_HEADS, 64, 64), dtype=torch.float16, device='cuda')
+    out, M = run_fwd(q, q, q, False)
+    # Must be fp32
+    dq_acc = torch.empty_like(q)
+    err, _ = run_bwd(q, q, q, out, M, torch.randn_like(q), False, dq_acc)
+    assert err == hipError_t.hipErrorInvalidValue
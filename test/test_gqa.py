@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton import hipError_t
+from pyaotriton.v2.flash import attn_fwd, attn_bwd
+
+BATCH, D_HEAD = 2, 64
+
+# (num_heads of q, num_heads of k/v): GQA, MQA and MHA
+HEADS = [(8, 2), (4, 1), (4, 4)]
+
+@pytest.mark.parametrize('n_heads_q, n_heads_k', HEADS)
+@pytest.mark.parametrize('seqlen_q, seqlen_k', [(128, 128), (64, 200)])
+@pytest.mark.parametrize('causal', [False, True])
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+def test_gqa_matches_replicated_kv(n_heads_q, n_heads_k, seqlen_q, seqlen_k, causal, dtype):
+    sm_scale = 0.5
+    group_size = n_heads_q // n_heads_k
+    q = torch.randn((BATCH, n_heads_q, seqlen_q, D_HEAD), dtype=dtype, device='cuda')
+    k = torch.randn((BATCH, n_heads_k, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    v = torch.randn((BATCH, n_heads_k, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    out = torch.empty_like(q)
+    M = torch.empty((BATCH * n_heads_q, seqlen_q), dtype=torch.float32, device='cuda')
+    err = attn_fwd(q, k, v, None, sm_scale, M, out, 0.0, 0, 0, None, causal)
+    assert err == hipError_t.hipSuccess
+    dout = torch.randn_like(q)
+    dq, dk, dv = torch.empty_like(q), torch.empty_like(k), torch.empty_like(v)
+    err = attn_bwd(q, k, v, None, sm_scale, out, dout, dq, dk, dv, None, M, torch.empty_like(M),
+                   0.0, 0, 0, causal)
+    assert err == hipError_t.hipSuccess
+    # Reference: regular multi-head attention on replicated K/V
+    rep_k = k.repeat_interleave(group_size, dim=1).contiguous()
+    rep_v = v.repeat_interleave(group_size, dim=1).contiguous()
+    ref_out = torch.empty_like(q)
+    ref_M = torch.empty_like(M)
+    err = attn_fwd(q, rep_k, rep_v, None, sm_scale, ref_M, ref_out, 0.0, 0, 0, None, causal)
+    assert err == hipError_t.hipSuccess
+    torch.testing.assert_close(out, ref_out, atol=0, rtol=0)
+    torch.testing.assert_close(M, ref_M, atol=0, rtol=0)
+    ref_dq, ref_dk, ref_dv = torch.empty_like(q), torch.empty_like(rep_k), torch.empty_like(rep_v)
+    err = attn_bwd(q, rep_k, rep_v, None, sm_scale, ref_out, dout, ref_dq, ref_dk, ref_dv, None,
+                   ref_M, torch.empty_like(ref_M), 0.0, 0, 0, causal)
+    assert err == hipError_t.hipSuccess
+    atol = 1e-2 if dtype == torch.float16 else 5e-2
+    torch.testing.assert_close(dq, ref_dq, atol=0, rtol=0)
+    def reduce_group(t):
+        return t.float().view(BATCH, n_heads_k, group_size, *t.shape[2:]).sum(dim=2)
+    torch.testing.assert_close(dk.float(), reduce_group(ref_dk), atol=atol * group_size, rtol=0)
+    torch.testing.assert_close(dv.float(), reduce_group(ref_dv), atol=atol * group_size, rtol=0)
+
+def test_gqa_rejects_uneven_groups():
+    q = torch.randn((BATCH, 6, 128, D_HEAD), dtype=torch.float16, device='cuda')
+    k = torch.randn((BATCH, 4, 128, D_HEAD), dtype=torch.float16, device='cuda')
+    out = torch.empty_like(q)
+    M = torch.empty((BATCH * 6, 128), dtype=torch.float32, device='cuda')
+    err = attn_fwd(q, k, k, None, 0.5, M, out, 0.0, 0, 0, None, False)
+    assert err == hipError_t.hipErrorInvalidValue
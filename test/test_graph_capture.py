@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton import Stream, hipError_t
+from pyaotriton.v2.flash import (
+    attn_fwd as fa_forward,
+    attn_bwd as fa_backward,
+    prepare_attn_fwd_for_capture,
+    prepare_attn_bwd_for_capture,
+    BwdExtraArguments,
+)
+from aotriton_flash import mk_aotensor
+
+def _fwd_args(q, k, v, M, o, stream):
+    null = mk_aotensor(None, if_empty_then_like=q)
+    return (mk_aotensor(q), mk_aotensor(k), mk_aotensor(v), null, 0.5, mk_aotensor(M), mk_aotensor(o),
+            0.0, 0, 0, null, False, -1, -1, stream)
+
+@pytest.mark.parametrize('seqlen', [128, 384])
+def test_capture_prepared_fwd(seqlen):
+    BATCH, N_HEADS, D_HEAD = 2, 4, 64
+    dtype = torch.float16
+    q = torch.randn((BATCH, N_HEADS, seqlen, D_HEAD), dtype=dtype, device='cuda')
+    k = torch.randn_like(q)
+    v = torch.randn_like(q)
+    o = torch.empty_like(q)
+    M = torch.empty((BATCH * N_HEADS, seqlen), dtype=torch.float32, device='cuda')
+    side = torch.cuda.Stream()
+    null = mk_aotensor(None, if_empty_then_like=q)
+    err = prepare_attn_fwd_for_capture(mk_aotensor(q), mk_aotensor(k), mk_aotensor(v), null, mk_aotensor(M),
+                                       mk_aotensor(o), 0.0, null, False, -1, -1,
+                                       Stream(side.cuda_stream))
+    assert err == hipError_t.hipSuccess
+    graph = torch.cuda.CUDAGraph()
+    with torch.cuda.graph(graph, stream=side):
+        err = fa_forward(*_fwd_args(q, k, v, M, o, Stream(side.cuda_stream)))
+    assert err == hipError_t.hipSuccess
+    ref_o = torch.empty_like(o)
+    ref_M = torch.empty_like(M)
+    for _ in range(2):
+        q.copy_(torch.randn_like(q))
+        graph.replay()
+        torch.cuda.synchronize()
+        err = fa_forward(*_fwd_args(q, k, v, ref_M, ref_o, Stream()))
+        torch.cuda.synchronize()
+        assert err == hipError_t.hipSuccess
+        torch.testing.assert_close(o, ref_o, atol=0, rtol=0)
+
+@pytest.mark.parametrize('seqlen', [128, 384])
+def test_capture_prepared_fused_bwd(seqlen):
+    BATCH, N_HEADS, D_HEAD = 2, 4, 64
+    dtype = torch.float16
+    q = torch.randn((BATCH, N_HEADS, seqlen, D_HEAD), dtype=dtype, device='cuda')
+    k = torch.randn_like(q)
+    v = torch.randn_like(q)
+    o = torch.empty_like(q)
+    M = torch.empty((BATCH * N_HEADS, seqlen), dtype=torch.float32, device='cuda')
+    err = fa_forward(*_fwd_args(q, k, v, M, o, Stream()))
+    assert err == hipError_t.hipSuccess
+    dout = torch.randn_like(q)
+    delta = torch.empty_like(M)
+    dq, dk, dv = torch.empty_like(q), torch.empty_like(k), torch.empty_like(v)
+    dq_acc = torch.empty(q.shape, dtype=torch.float32, device='cuda')
+    extargs = BwdExtraArguments()
+    extargs.dq_acc = mk_aotensor(dq_acc)
+    null = mk_aotensor(None, if_empty_then_like=q)
+    def bwd_args(dq, dk, dv, stream):
+        return (mk_aotensor(q), mk_aotensor(k), mk_aotensor(v), null, 0.5, mk_aotensor(o), mk_aotensor(dout),
+                mk_aotensor(dq), mk_aotensor(dk), mk_aotensor(dv), null, mk_aotensor(M), mk_aotensor(delta),
+                0.0, 0, 0, False, -1, -1, stream)
+    side = torch.cuda.Stream()
+    err = prepare_attn_bwd_for_capture(mk_aotensor(q), mk_aotensor(k), mk_aotensor(v), null, mk_aotensor(o),
+                                       mk_aotensor(dout), mk_aotensor(dq), mk_aotensor(dk), mk_aotensor(dv),
+                                       null, mk_aotensor(M), mk_aotensor(delta), 0.0, False, -1, -1,
+                                       Stream(side.cuda_stream), extargs)
+    assert err == hipError_t.hipSuccess
+    graph = torch.cuda.CUDAGraph()
+    with torch.cuda.graph(graph, stream=side):
+        err = fa_backward(*bwd_args(dq, dk, dv, Stream(side.cuda_stream)), extargs)
+    assert err == hipError_t.hipSuccess
+    graph.replay()
+    torch.cuda.synchronize()
+    ref_dq, ref_dk, ref_dv = torch.empty_like(q), torch.empty_like(k), torch.empty_like(v)
+    err = fa_backward(*bwd_args(ref_dq, ref_dk, ref_dv, Stream()), extargs)
+    torch.cuda.synchronize()
+    assert err == hipError_t.hipSuccess
+    # dQ is accumulated with atomics
+    torch.testing.assert_close(dq, ref_dq, atol=1e-2, rtol=1e-2)
+    torch.testing.assert_close(dk, ref_dk, atol=0, rtol=0)
+    torch.testing.assert_close(dv, ref_dv, atol=0, rtol=0)
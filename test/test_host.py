@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+'''
+Runs the host-only C++ tests under test/host/. These tests do not need a GPU
+or the HIP SDK, only a C++20 compiler.
+'''
+
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+TEST_DIR = Path(__file__).resolve().parent
+REPO_DIR = TEST_DIR.parent
+HOST_TESTS = sorted((TEST_DIR / 'host').glob('test_*.cc'))
+
+def find_cxx():
+    for cxx in [os.environ.get('CXX'), 'c++', 'g++', 'clang++']:
+        if cxx and shutil.which(cxx):
+            return cxx
+    return None
+
+@pytest.mark.parametrize('source', HOST_TESTS, ids=[p.stem for p in HOST_TESTS])
+def test_host(source, tmp_path):
+    cxx = find_cxx()
+    if cxx is None:
+        pytest.skip('No C++ compiler available')
+    exe = tmp_path / source.stem
+    subprocess.run([cxx, '-std=c++20', '-O1', '-I', str(REPO_DIR / 'include'), str(source), '-o', str(exe)],
+                   check=True)
+    subprocess.run([str(exe)], check=True)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import json
+import pytest
+import torch
+
+from pyaotriton.v2 import (
+    InstrumentMode,
+    set_instrumentation,
+    get_instrumentation_snapshot,
+    get_instrumentation_json,
+    reset_instrumentation,
+)
+from aotriton_flash import attn_fwd
+
+def _run_fwd(seqlen, D_HEAD=64, dtype=torch.float16):
+    q = torch.randn((2, 4, seqlen, D_HEAD), dtype=dtype, device='cuda')
+    k = torch.randn_like(q)
+    v = torch.randn_like(q)
+    o = torch.empty_like(q)
+    M = torch.empty((2 * 4, seqlen), dtype=torch.float32, device='cuda')
+    attn_fwd(q, k, v, None, 0.5, M, o, 0.0, 0, 0, None, False)
+
+def _fwd_records(records):
+    return [r for r in records if r['kernel'] == 'attn_fwd']
+
+@pytest.fixture
+def instrumentation():
+    reset_instrumentation()
+    yield
+    set_instrumentation(InstrumentMode.kInstrumentOff)
+    reset_instrumentation()
+
+def test_off_by_default(instrumentation):
+    _run_fwd(128)
+    assert not get_instrumentation_snapshot()
+
+def test_count(instrumentation):
+    set_instrumentation(InstrumentMode.kInstrumentCount)
+    for _ in range(3):
+        _run_fwd(128)
+    records = _fwd_records(get_instrumentation_snapshot())
+    assert len(records) == 1
+    assert records[0]['launches'] == 3
+    assert records[0]['timed_launches'] == 0
+    assert records[0]['image']
+    exported = json.loads(get_instrumentation_json())
+    assert _fwd_records(exported['launches']) == records
+
+def test_timing(instrumentation):
+    set_instrumentation(InstrumentMode.kInstrumentTiming)
+    for _ in range(2):
+        _run_fwd(256)
+    records = _fwd_records(get_instrumentation_snapshot(synchronize=True))
+    assert len(records) == 1
+    r = records[0]
+    assert r['launches'] == 2
+    assert r['timed_launches'] == 2
+    assert r['pending_timings'] == 0
+    assert 0.0 < r['min_ms'] <= r['max_ms']
+    assert r['total_ms'] >= r['max_ms']
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import struct
+
+from v2python.kernel_pack import (
+    ALIGNMENT,
+    HEADER,
+    ENTRY,
+    KernelPackBuilder,
+    write_kernel_pack,
+    read_kernel_pack,
+)
+
+def test_roundtrip(tmp_path):
+    contents = [b'\x7fELF' + bytes(range(256)) * 20, b'', b'zstd frame']
+    builder = KernelPackBuilder('MI300X')
+    for i, data in enumerate(contents):
+        fn = tmp_path / f'image{i}.hsaco'
+        fn.write_bytes(data)
+        assert builder.add(fn) == i
+    # Same file, same index
+    assert builder.add(tmp_path / 'image1.hsaco') == 1
+    pack = tmp_path / builder.file_name
+    write_kernel_pack(pack, builder.files)
+    assert read_kernel_pack(pack) == contents
+    raw = pack.read_bytes()
+    for i in range(len(contents)):
+        offset, size = ENTRY.unpack_from(raw, HEADER.size + i * ENTRY.size)
+        assert offset % ALIGNMENT == 0
+        assert size == len(contents[i])
+
+def test_manifest(tmp_path):
+    builder = KernelPackBuilder('MI200')
+    files = []
+    for i in range(3):
+        fn = tmp_path / f'image{i}.hsaco'
+        fn.write_bytes(struct.pack('<I', i))
+        builder.add(fn)
+        files.append(fn)
+    manifest = tmp_path / 'pack.manifest'
+    builder.write_manifest(manifest)
+    assert manifest.read_text().split() == [str(fn) for fn in files]
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton import hipError_t
+from pyaotriton.v2.flash import attn_fwd, attn_bwd
+
+BATCH, N_HEADS = 2, 4
+
+def run_attn(q, k, v, dout, causal, out, dq, dk, dv):
+    M = torch.empty((q.shape[0] * q.shape[1], q.shape[2]), dtype=torch.float32, device=q.device)
+    err = attn_fwd(q, k, v, None, 0.5, M, out, 0.0, 0, 0, None, causal)
+    assert err == hipError_t.hipSuccess
+    err = attn_bwd(q, k, v, None, 0.5, out, dout, dq, dk, dv, None, M, torch.empty_like(M),
+                   0.0, 0, 0, causal)
+    assert err == hipError_t.hipSuccess
+    return M
+
+def bshd(shape, dtype):
+    '''batch x seqlen x heads x head_size storage, viewed as BHSD'''
+    B, H, S, D = shape
+    return torch.empty((B, S, H, D), dtype=dtype, device='cuda').transpose(1, 2)
+
+def packed_qkv(shape, dtype):
+    '''Views of q, k and v into one packed batch x seqlen x 3 x heads x head_size tensor'''
+    B, H, S, D = shape
+    qkv = torch.empty((B, S, 3, H, D), dtype=dtype, device='cuda')
+    return qkv, [qkv[:, :, i].transpose(1, 2) for i in range(3)]
+
+@pytest.mark.parametrize('seqlen', [128, 143])
+@pytest.mark.parametrize('D_HEAD', [64, 72])
+@pytest.mark.parametrize('layout', ['bshd', 'packed_qkv'])
+@pytest.mark.parametrize('causal', [False, True])
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+def test_layouts(seqlen, D_HEAD, layout, causal, dtype):
+    shape = (BATCH, N_HEADS, seqlen, D_HEAD)
+    if layout == 'bshd':
+        q, k, v = [bshd(shape, dtype) for _ in range(3)]
+        dq, dk, dv = [bshd(shape, dtype) for _ in range(3)]
+        for t in (q, k, v):
+            t.copy_(torch.randn(shape, dtype=dtype, device='cuda'))
+    else:
+        qkv, (q, k, v) = packed_qkv(shape, dtype)
+        qkv.copy_(torch.randn(qkv.shape, dtype=dtype, device='cuda'))
+        dqkv, (dq, dk, dv) = packed_qkv(shape, dtype)
+    out = bshd(shape, dtype)
+    dout = bshd(shape, dtype)
+    dout.copy_(torch.randn(shape, dtype=dtype, device='cuda'))
+    M = run_attn(q, k, v, dout, causal, out, dq, dk, dv)
+    # Reference: the same problem in the documented contiguous layout
+    ref_q, ref_k, ref_v, ref_dout = [t.contiguous() for t in (q, k, v, dout)]
+    ref_out = torch.empty_like(ref_q)
+    ref_dq, ref_dk, ref_dv = [torch.empty_like(ref_q) for _ in range(3)]
+    ref_M = run_attn(ref_q, ref_k, ref_v, ref_dout, causal, ref_out, ref_dq, ref_dk, ref_dv)
+    # Only the addressing differs
+    torch.testing.assert_close(M, ref_M, atol=0, rtol=0)
+    for t, ref in zip((out, dq, dk, dv), (ref_out, ref_dq, ref_dk, ref_dv)):
+        torch.testing.assert_close(t, ref, atol=0, rtol=0)
+
+def test_strided_head_dim():
+    q = torch.randn((BATCH, N_HEADS, 64, 128), dtype=torch.float16, device='cuda')[..., ::2]
+    out = torch.empty_like(q)
+    M = torch.empty((BATCH * N_HEADS, 64), dtype=torch.float32, device='cuda')
+    err = attn_fwd(q, q, q, None, 0.5, M, out, 0.0, 0, 0, None, False)
+    assert err == hipError_t.hipErrorInvalidValue
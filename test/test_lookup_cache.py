@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton.v2 import (
+    get_lookup_cache_stats,
+    reset_lookup_cache_stats,
+    clear_lookup_cache,
+    set_lookup_cache_enabled,
+)
+from aotriton_flash import attn_fwd
+
+def _run_fwd(seqlen_q, seqlen_k, D_HEAD=64, dtype=torch.float16):
+    q = torch.randn((2, 4, seqlen_q, D_HEAD), dtype=dtype, device='cuda')
+    k = torch.randn((2, 4, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    v = torch.randn((2, 4, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    o = torch.empty_like(q)
+    M = torch.empty((2 * 4, seqlen_q), dtype=torch.float32, device='cuda')
+    attn_fwd(q, k, v, None, 0.5, M, o, 0.0, 0, 0, None, False)
+    return o
+
+def _fwd_stats():
+    return get_lookup_cache_stats()['attn_fwd']
+
+def test_lookup_cache_hit_miss():
+    set_lookup_cache_enabled(True)
+    clear_lookup_cache()
+    reset_lookup_cache_stats()
+    _run_fwd(128, 128)
+    stats = _fwd_stats()
+    assert stats.misses == 1 and stats.hits == 0
+    for _ in range(3):
+        _run_fwd(128, 128)
+    stats = _fwd_stats()
+    assert stats.misses == 1 and stats.hits == 3
+    # New shape must not reuse the cached selection
+    _run_fwd(256, 128)
+    assert _fwd_stats().misses == 2
+    clear_lookup_cache()
+    _run_fwd(128, 128)
+    assert _fwd_stats().misses == 3
+
+def test_lookup_cache_disabled():
+    reset_lookup_cache_stats()
+    set_lookup_cache_enabled(False)
+    try:
+        _run_fwd(128, 128)
+        stats = _fwd_stats()
+        assert stats.misses == 0 and stats.hits == 0
+    finally:
+        set_lookup_cache_enabled(True)
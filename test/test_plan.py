@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton import Stream, hipError_t
+from pyaotriton.v2.flash import AttnFwdPlan, AttnBwdPlan
+from aotriton_flash import mk_aotensor, attn_fwd, attn_bwd
+
+def _mk_inputs(BATCH, N_HEADS, seqlen_q, seqlen_k, D_HEAD, dtype):
+    q = torch.randn((BATCH, N_HEADS, seqlen_q, D_HEAD), dtype=dtype, device='cuda')
+    k = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    v = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    return q, k, v
+
+@pytest.mark.parametrize('causal', [False, True])
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+def test_fwd_plan(causal, dtype):
+    BATCH, N_HEADS, seqlen_q, seqlen_k, D_HEAD = 2, 4, 128, 256, 64
+    sm_scale = 0.5
+    q, k, v = _mk_inputs(BATCH, N_HEADS, seqlen_q, seqlen_k, D_HEAD, dtype)
+    M = torch.empty((BATCH * N_HEADS, seqlen_q), dtype=torch.float32, device='cuda')
+    out = torch.empty_like(q)
+    null = mk_aotensor(None, if_empty_then_like=q)
+    plan = AttnFwdPlan()
+    assert not plan.prepared
+    err = plan.prepare(mk_aotensor(q), mk_aotensor(k), mk_aotensor(v), null, mk_aotensor(M), mk_aotensor(out),
+                       0.0, null, causal, -1, -1, Stream())
+    assert err == hipError_t.hipSuccess
+    assert plan.prepared
+    ref_out = torch.empty_like(q)
+    ref_M = torch.empty_like(M)
+    for _ in range(3):
+        # New data pointers for every execution
+        q, k, v = _mk_inputs(BATCH, N_HEADS, seqlen_q, seqlen_k, D_HEAD, dtype)
+        err = plan.execute(mk_aotensor(q), mk_aotensor(k), mk_aotensor(v), null, sm_scale, mk_aotensor(M),
+                           mk_aotensor(out), 0, 0, null, Stream())
+        assert err == hipError_t.hipSuccess
+        attn_fwd(q, k, v, None, sm_scale, ref_M, ref_out, 0.0, 0, 0, None, causal)
+        torch.testing.assert_close(out, ref_out, atol=0, rtol=0)
+    # Shape mismatch must be rejected
+    q2, k2, v2 = _mk_inputs(BATCH, N_HEADS, seqlen_q * 2, seqlen_k, D_HEAD, dtype)
+    err = plan.execute(mk_aotensor(q2), mk_aotensor(k2), mk_aotensor(v2), null, sm_scale, mk_aotensor(M),
+                       mk_aotensor(out), 0, 0, null, Stream())
+    assert err == hipError_t.hipErrorInvalidValue
+
+@pytest.mark.parametrize('causal', [False, True])
+def test_bwd_plan(causal):
+    BATCH, N_HEADS, seqlen_q, seqlen_k, D_HEAD = 2, 4, 128, 128, 64
+    dtype = torch.float16
+    sm_scale = 0.5
+    q, k, v = _mk_inputs(BATCH, N_HEADS, seqlen_q, seqlen_k, D_HEAD, dtype)
+    M = torch.empty((BATCH * N_HEADS, seqlen_q), dtype=torch.float32, device='cuda')
+    out = torch.empty_like(q)
+    attn_fwd(q, k, v, None, sm_scale, M, out, 0.0, 0, 0, None, causal)
+    dout = torch.randn_like(q)
+    dq, dk, dv = torch.empty_like(q), torch.empty_like(k), torch.empty_like(v)
+    delta = torch.empty_like(M)
+    tensors = lambda: [mk_aotensor(t, if_empty_then_like=q) for t in (q, k, v, None, out, dout, dq, dk, dv, None, M, delta)]
+    plan = AttnBwdPlan()
+    err = plan.prepare(*tensors(), 0.0, causal, -1, -1, Stream())
+    assert err == hipError_t.hipSuccess
+    aq, ak, av, ab, aout, adout, adq, adk, adv, adb, aM, adelta = tensors()
+    err = plan.execute(aq, ak, av, ab, sm_scale, aout, adout, adq, adk, adv, adb, aM, adelta, 0, 0, Stream())
+    assert err == hipError_t.hipSuccess
+    ref_dq, ref_dk, ref_dv = torch.empty_like(q), torch.empty_like(k), torch.empty_like(v)
+    ref_delta = torch.empty_like(M)
+    attn_bwd(q, k, v, None, sm_scale, out, dout, ref_dq, ref_dk, ref_dv, None, M, ref_delta, 0.0, 0, 0, causal)
+    torch.testing.assert_close(dq, ref_dq, atol=0, rtol=0)
+    torch.testing.assert_close(dk, ref_dk, atol=0, rtol=0)
+    torch.testing.assert_close(dv, ref_dv, atol=0, rtol=0)
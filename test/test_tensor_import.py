@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton import Stream, hipError_t, as_tensor_view
+from pyaotriton.v2.flash import attn_fwd as fa_forward
+from aotriton_flash import mk_aotensor, cast_dtype
+
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16, torch.float32])
+@pytest.mark.parametrize('transpose', [False, True])
+def test_as_tensor_view(dtype, transpose):
+    t = torch.empty((2, 4, 128, 64), dtype=dtype, device='cuda')
+    if transpose:
+        t = t.transpose(1, 2)
+    ref = mk_aotensor(t)
+    view = as_tensor_view(t, 4)
+    assert view.sizes == ref.sizes
+    assert view.strides == ref.strides
+    assert view.data_ptr == ref.data_ptr
+    assert view.dtype == cast_dtype(dtype)
+
+def test_as_tensor_view_offset():
+    base = torch.empty((8, 64), dtype=torch.float16, device='cuda')
+    t = base[2:]
+    assert as_tensor_view(t, 2).data_ptr == t.data_ptr()
+
+def test_as_tensor_view_requires_grad():
+    t = torch.empty((2, 4, 128, 64), dtype=torch.float16, device='cuda', requires_grad=True)
+    ref = mk_aotensor(t)
+    view = as_tensor_view(t, 4)
+    assert view.data_ptr == ref.data_ptr
+    assert view.strides == ref.strides
+
+def test_rejects():
+    with pytest.raises(TypeError):
+        as_tensor_view(torch.empty((2, 4), device='cuda'), 4)
+    with pytest.raises(ValueError):
+        as_tensor_view(torch.empty((2, 4)), 2)
+
+@pytest.mark.parametrize('causal', [False, True])
+def test_attn_fwd_torch_tensors(causal):
+    BATCH, N_HEADS, seqlen_q, seqlen_k, D_HEAD = 2, 4, 128, 256, 64
+    dtype = torch.float16
+    sm_scale = 0.5
+    q = torch.randn((BATCH, N_HEADS, seqlen_q, D_HEAD), dtype=dtype, device='cuda')
+    k = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    v = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    M = torch.empty((BATCH * N_HEADS, seqlen_q), dtype=torch.float32, device='cuda')
+    out = torch.empty_like(q)
+    err = fa_forward(q, k, v, None, sm_scale, M, out, 0.0, 0, 0, None, causal)
+    assert err == hipError_t.hipSuccess
+    ref_M = torch.empty_like(M)
+    ref_out = torch.empty_like(out)
+    null = mk_aotensor(None, if_empty_then_like=q)
+    err = fa_forward(mk_aotensor(q), mk_aotensor(k), mk_aotensor(v), null, sm_scale, mk_aotensor(ref_M),
+                     mk_aotensor(ref_out), 0.0, 0, 0, null, causal, -1, -1, Stream())
+    assert err == hipError_t.hipSuccess
+    torch.testing.assert_close(out, ref_out, atol=0, rtol=0)
+    torch.testing.assert_close(M, ref_M, atol=0, rtol=0)
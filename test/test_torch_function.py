@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+import pyaotriton.torch as aotorch
+
+def _ref_attention(q, k, v, causal, sm_scale):
+    p = torch.matmul(q.float(), k.float().transpose(2, 3)) * sm_scale
+    if causal:
+        mask = torch.ones(q.shape[2], k.shape[2], dtype=torch.bool, device=q.device).tril()
+        p = p.masked_fill(~mask, float('-inf'))
+    p = torch.softmax(p, dim=-1)
+    return torch.matmul(p, v.float()).to(q.dtype)
+
+def _mk_inputs(seqlen_q, seqlen_k, dtype, requires_grad):
+    shape_q = (2, 4, seqlen_q, 64)
+    shape_k = (2, 4, seqlen_k, 64)
+    q = torch.randn(shape_q, dtype=dtype, device='cuda', requires_grad=requires_grad)
+    k = torch.randn(shape_k, dtype=dtype, device='cuda', requires_grad=requires_grad)
+    v = torch.randn(shape_k, dtype=dtype, device='cuda', requires_grad=requires_grad)
+    return q, k, v
+
+@pytest.mark.parametrize('causal', [False, True])
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+def test_forward_backward(causal, dtype):
+    sm_scale = 0.5
+    q, k, v = _mk_inputs(128, 128, dtype, True)
+    dout = torch.randn_like(q)
+    out = aotorch.attention(q, k, v, causal=causal, sm_scale=sm_scale)
+    out.backward(dout)
+    grads = q.grad, k.grad, v.grad
+    q.grad, k.grad, v.grad = None, None, None
+    ref = _ref_attention(q, k, v, causal, sm_scale)
+    ref.backward(dout)
+    atol = 2e-2 if dtype == torch.float16 else 5e-2
+    torch.testing.assert_close(out, ref, atol=atol, rtol=0)
+    for grad, ref_grad in zip(grads, (q.grad, k.grad, v.grad)):
+        torch.testing.assert_close(grad, ref_grad, atol=atol * 2, rtol=0)
+
+def test_plans_reused():
+    aotorch.clear_caches()
+    for _ in range(3):
+        q, k, v = _mk_inputs(128, 256, torch.float16, True)
+        aotorch.attention(q, k, v).sum().backward()
+    # One forward and one backward plan
+    assert len(aotorch._state().plans) == 2
+
+def test_workspace_pool_bounded():
+    aotorch.clear_caches()
+    with torch.no_grad():
+        for seqlen_q in [64, 256, 128, 32, 256, 17]:
+            q, k, v = _mk_inputs(seqlen_q, 128, torch.float16, False)
+            ref = _ref_attention(q, k, v, False, 0.5)
+            out = aotorch.attention(q, k, v, sm_scale=0.5)
+            torch.testing.assert_close(out, ref, atol=2e-2, rtol=0)
+    # One buffer of the current stream, sized for the largest softmax_lse
+    pool = aotorch._state().workspace
+    assert len(pool) == 1
+    assert next(iter(pool._buffers.values())).numel() == 2 * 4 * 256
+    pool = aotorch.WorkspacePool(max_buffers=2)
+    for stream in range(5):
+        pool.get(stream, (4, 16), torch.float32, q.device)
+    assert len(pool) == 2
+
+def test_inference_no_encoded_softmax():
+    q, k, v = _mk_inputs(128, 128, torch.float16, False)
+    with torch.no_grad():
+        out = aotorch.attention(q, k, v)
+    assert isinstance(out, torch.Tensor)
+    out, encoded_softmax = aotorch.attention(q, k, v, return_encoded_softmax=True)
+    assert encoded_softmax.shape == (2, 4, 128, 128)
+
+def test_current_stream():
+    q, k, v = _mk_inputs(128, 128, torch.float16, False)
+    ref = aotorch.attention(q, k, v)
+    s = torch.cuda.Stream()
+    s.wait_stream(torch.cuda.current_stream())
+    with torch.cuda.stream(s):
+        out = aotorch.attention(q, k, v)
+    torch.cuda.current_stream().wait_stream(s)
+    torch.testing.assert_close(out, ref, atol=0, rtol=0)
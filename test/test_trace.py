@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton.v2 import set_trace_callback
+from aotriton_flash import attn_fwd, attn_bwd
+
+def test_trace_fwd_bwd():
+    BATCH, N_HEADS, seqlen, D_HEAD = 2, 4, 256, 64
+    q = torch.randn((BATCH, N_HEADS, seqlen, D_HEAD), dtype=torch.float16, device='cuda')
+    k = torch.randn_like(q)
+    v = torch.randn_like(q)
+    o = torch.empty_like(q)
+    M = torch.empty((BATCH * N_HEADS, seqlen), dtype=torch.float32, device='cuda')
+    events = []
+    set_trace_callback(events.append)
+    try:
+        attn_fwd(q, k, v, None, 0.5, M, o, 0.0, 0, 0, None, False)
+        dout = torch.randn_like(q)
+        dq, dk, dv = torch.empty_like(q), torch.empty_like(k), torch.empty_like(v)
+        delta = torch.empty_like(M)
+        attn_bwd(q, k, v, None, 0.5, o, dout, dq, dk, dv, None, M, delta, 0.0, 0, 0, False)
+    finally:
+        set_trace_callback(None)
+    assert [e['kernel'] for e in events] == ['attn_fwd', 'bwd_preprocess', 'bwd_kernel_dk_dv', 'bwd_kernel_dq']
+    fwd = events[0]
+    assert fwd['image']
+    assert fwd['image_index'] >= 0
+    assert fwd['lookup_ns'] > 0
+    assert set(fwd['perf'].keys()) == {'BLOCK_M', 'BLOCK_N', 'pre_load_v'}
+    assert fwd['grid'] == ((seqlen + fwd['perf']['BLOCK_M'] - 1) // fwd['perf']['BLOCK_M'], N_HEADS, BATCH)
+    # Unregistered callback must not be called
+    attn_fwd(q, k, v, None, 0.5, M, o, 0.0, 0, 0, None, False)
+    assert len(events) == 4
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton import hipError_t
+from pyaotriton.v2.flash import attn_fwd, attn_bwd, attn_fwd_compact_varlen, attn_bwd_compact_varlen
+
+N_HEADS = 4
+D_HEAD = 64
+
+def _cu_seqlens(seqlens):
+    cu = [0]
+    for n in seqlens:
+        cu.append(cu[-1] + n)
+    return torch.tensor(cu, dtype=torch.int32, device='cuda')
+
+def _packed(seqlens, dtype):
+    return torch.randn((1, N_HEADS, sum(seqlens), D_HEAD), dtype=dtype, device='cuda')
+
+SEQLENS = [
+    ([128, 64, 17, 200], [128, 64, 17, 200]),
+    ([32, 100, 1], [64, 100, 33]),
+]
+
+@pytest.mark.parametrize('seqlens_q, seqlens_k', SEQLENS)
+@pytest.mark.parametrize('causal', [False, True])
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+def test_varlen_matches_dense(seqlens_q, seqlens_k, causal, dtype):
+    sm_scale = 0.5
+    num_seqs = len(seqlens_q)
+    max_q, max_k = max(seqlens_q), max(seqlens_k)
+    cu_q, cu_k = _cu_seqlens(seqlens_q), _cu_seqlens(seqlens_k)
+    q = _packed(seqlens_q, dtype)
+    k = _packed(seqlens_k, dtype)
+    v = _packed(seqlens_k, dtype)
+    out = torch.empty_like(q)
+    M = torch.empty((num_seqs * N_HEADS, max_q), dtype=torch.float32, device='cuda')
+    err = attn_fwd_compact_varlen(q, k, v, None, cu_q, cu_k, max_q, max_k, sm_scale, M, out,
+                                  0.0, 0, 0, None, causal)
+    assert err == hipError_t.hipSuccess
+    dout = torch.randn_like(q)
+    dq, dk, dv = torch.empty_like(q), torch.empty_like(k), torch.empty_like(v)
+    delta = torch.empty_like(M)
+    err = attn_bwd_compact_varlen(q, k, v, None, cu_q, cu_k, max_q, max_k, sm_scale, out, dout,
+                                  dq, dk, dv, None, M, delta, 0.0, 0, 0, causal)
+    assert err == hipError_t.hipSuccess
+    M = M.view(num_seqs, N_HEADS, max_q)
+    for i in range(num_seqs):
+        sq = slice(cu_q[i].item(), cu_q[i + 1].item())
+        sk = slice(cu_k[i].item(), cu_k[i + 1].item())
+        seq_q, seq_k, seq_v = [t[:, :, s].contiguous() for t, s in ((q, sq), (k, sk), (v, sk))]
+        ref_out = torch.empty_like(seq_q)
+        ref_M = torch.empty((N_HEADS, seqlens_q[i]), dtype=torch.float32, device='cuda')
+        err = attn_fwd(seq_q, seq_k, seq_v, None, sm_scale, ref_M, ref_out, 0.0, 0, 0, None, causal)
+        assert err == hipError_t.hipSuccess
+        torch.testing.assert_close(out[:, :, sq], ref_out, atol=1e-2, rtol=0)
+        torch.testing.assert_close(M[i, :, :seqlens_q[i]], ref_M, atol=1e-3, rtol=0)
+        seq_dout = dout[:, :, sq].contiguous()
+        ref_dq, ref_dk, ref_dv = torch.empty_like(seq_q), torch.empty_like(seq_k), torch.empty_like(seq_v)
+        err = attn_bwd(seq_q, seq_k, seq_v, None, sm_scale, ref_out, seq_dout, ref_dq, ref_dk, ref_dv,
+                       None, ref_M, torch.empty_like(ref_M), 0.0, 0, 0, causal)
+        assert err == hipError_t.hipSuccess
+        torch.testing.assert_close(dq[:, :, sq], ref_dq, atol=5e-2, rtol=0)
+        torch.testing.assert_close(dk[:, :, sk], ref_dk, atol=5e-2, rtol=0)
+        torch.testing.assert_close(dv[:, :, sk], ref_dv, atol=5e-2, rtol=0)
+
+def test_varlen_rejects_bad_cu_seqlens():
+    q = _packed([16, 16], torch.float16)
+    out = torch.empty_like(q)
+    M = torch.empty((2 * N_HEADS, 16), dtype=torch.float32, device='cuda')
+    cu = _cu_seqlens([16, 16]).to(torch.int64)
+    err = attn_fwd_compact_varlen(q, q, q, None, cu, cu, 16, 16, 0.5, M, out, 0.0, 0, 0, None, False)
+    assert err == hipError_t.hipErrorInvalidValue
+
+def test_varlen_rejects_bias():
+    q = _packed([16, 16], torch.float16)
+    out = torch.empty_like(q)
+    M = torch.empty((2 * N_HEADS, 16), dtype=torch.float32, device='cuda')
+    b = torch.zeros((2, N_HEADS, 16, 16), dtype=torch.float16, device='cuda')
+    cu = _cu_seqlens([16, 16])
+    err = attn_fwd_compact_varlen(q, q, q, b, cu, cu, 16, 16, 0.5, M, out, 0.0, 0, 0, None, False)
+    assert err == hipError_t.hipErrorInvalidValue
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+import pytest
+import torch
+
+from pyaotriton import hipError_t
+from pyaotriton.v2.flash import attn_fwd, attn_bwd
+
+BATCH, N_HEADS, D_HEAD = 2, 4, 64
+
+def window_mask(seqlen_q, seqlen_k, window_left, window_right, causal):
+    i = torch.arange(seqlen_q, device='cuda')[:, None]
+    j = torch.arange(seqlen_k, device='cuda')[None, :]
+    mask = torch.ones((seqlen_q, seqlen_k), dtype=torch.bool, device='cuda')
+    if window_left >= 0:
+        mask &= j >= i - window_left
+    if window_right >= 0:
+        mask &= j <= i + window_right
+    if causal:
+        mask &= j <= i
+    return mask
+
+def ref_attention(q, k, v, sm_scale, mask):
+    s = (q.float() @ k.float().transpose(-2, -1)) * sm_scale
+    s = s.masked_fill(~mask, float('-inf'))
+    # Rows without any key output zeros
+    p = torch.softmax(s, dim=-1).nan_to_num(0.0)
+    return p @ v.float()
+
+@pytest.mark.parametrize('seqlen_q, seqlen_k', [(128, 128), (64, 300), (200, 96)])
+@pytest.mark.parametrize('window_left, window_right', [(0, 0), (16, -1), (-1, 16), (37, 5), (100, 100)])
+@pytest.mark.parametrize('causal', [False, True])
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+def test_window(seqlen_q, seqlen_k, window_left, window_right, causal, dtype):
+    sm_scale = 0.5
+    q = torch.randn((BATCH, N_HEADS, seqlen_q, D_HEAD), dtype=dtype, device='cuda')
+    k = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    v = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), dtype=dtype, device='cuda')
+    out = torch.empty_like(q)
+    M = torch.empty((BATCH * N_HEADS, seqlen_q), dtype=torch.float32, device='cuda')
+    err = attn_fwd(q, k, v, None, sm_scale, M, out, 0.0, 0, 0, None, causal, window_left, window_right)
+    assert err == hipError_t.hipSuccess
+    mask = window_mask(seqlen_q, seqlen_k, window_left, window_right, causal)
+    rq, rk, rv = [t.detach().clone().requires_grad_() for t in (q, k, v)]
+    ref_out = ref_attention(rq, rk, rv, sm_scale, mask)
+    atol = 1e-2 if dtype == torch.float16 else 5e-2
+    torch.testing.assert_close(out.float(), ref_out, atol=atol, rtol=0)
+    empty_rows = ~mask.any(dim=-1)
+    assert torch.isposinf(M.view(BATCH, N_HEADS, seqlen_q)[:, :, empty_rows]).all()
+    dout = torch.randn_like(q)
+    dq, dk, dv = torch.empty_like(q), torch.empty_like(k), torch.empty_like(v)
+    err = attn_bwd(q, k, v, None, sm_scale, out, dout, dq, dk, dv, None, M, torch.empty_like(M),
+                   0.0, 0, 0, causal, window_left, window_right)
+    assert err == hipError_t.hipSuccess
+    ref_dq, ref_dk, ref_dv = torch.autograd.grad(ref_out, (rq, rk, rv), dout.float())
+    torch.testing.assert_close(dq.float(), ref_dq.float(), atol=atol * 5, rtol=0)
+    torch.testing.assert_close(dk.float(), ref_dk.float(), atol=atol * 5, rtol=0)
+    torch.testing.assert_close(dv.float(), ref_dv.float(), atol=atol * 5, rtol=0)
+
+@pytest.mark.parametrize('causal', [False, True])
+def test_unbounded_window_is_full_attention(causal):
+    q = torch.randn((BATCH, N_HEADS, 256, D_HEAD), dtype=torch.float16, device='cuda')
+    k = torch.randn_like(q)
+    v = torch.randn_like(q)
+    out = torch.empty_like(q)
+    M = torch.empty((BATCH * N_HEADS, 256), dtype=torch.float32, device='cuda')
+    err = attn_fwd(q, k, v, None, 0.5, M, out, 0.0, 0, 0, None, causal, 1000, 1000)
+    assert err == hipError_t.hipSuccess
+    ref_out = torch.empty_like(q)
+    ref_M = torch.empty_like(M)
+    err = attn_fwd(q, k, v, None, 0.5, ref_M, ref_out, 0.0, 0, 0, None, causal)
+    assert err == hipError_t.hipSuccess
+    torch.testing.assert_close(out, ref_out, atol=0, rtol=0)
+    torch.testing.assert_close(M, ref_M, atol=0, rtol=0)
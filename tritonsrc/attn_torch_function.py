@@ -9,7 +9,8 @@ from flash import attn_fwd as bare_attn_fwd
 from flash import (
     bwd_preprocess as bare_bwd_preprocess,
     bwd_kernel_dk_dv as bare_bwd_kernel_dk_dv,
-    bwd_kernel_dq as bare_bwd_kernel_dq
+    bwd_kernel_dq as bare_bwd_kernel_dq,
+    bwd_postprocess as bare_bwd_postprocess,
 )
 
 VERBOSE=False
@@ -20,6 +21,15 @@ def is_power_of_two(n: int) -> bool:
 def is_supported_by_tl_dot(n: int) -> bool:
     return is_power_of_two(n) and n >= 16
 
+# BLOCK_DMODEL of the kernels, see HEAD_DIMS of v2python/rules/flash/_common.py
+HEAD_DIMS = [16, 32, 48, 64, 80, 96, 128, 160, 192, 256]
+
+def round_head_dim(n: int) -> int:
+    for d in HEAD_DIMS:
+        if n <= d:
+            return d
+    return 2 ** (n - 1).bit_length()
+
 TRITON_CONFIG_LIST_FWD = [
        triton.Config({'BLOCK_M': 128, 'BLOCK_N': 64, 'waves_per_eu': 0, 'PRE_LOAD_V': True}, num_stages=1, num_warps=4),
        triton.Config({'BLOCK_M': 128, 'BLOCK_N': 64, 'waves_per_eu': 1, 'PRE_LOAD_V': True}, num_stages=1, num_warps=4),
@@ -52,13 +62,17 @@ def tuned_attn_fwd(
     stride_vz, stride_vh, stride_vk, stride_vn,
     stride_oz, stride_oh, stride_om, stride_on,
     stride_bz, stride_bh, stride_bm, stride_bn,
+    num_head_q, num_head_k,
     cu_seqlens_q, cu_seqlens_k,
     max_seqlens_q, max_seqlens_k,
-    head_dim_q, head_dim_k,
+    head_dim,
+    window_left, window_right,
     dropout_p,
     philox_seed,
     philox_offset_base,
     encoded_softmax,
+    dropout_bitmask,
+    q_descale, k_descale, v_descale,
     VARLEN: tl.constexpr,
     STAGE: tl.constexpr,
     BLOCK_M: tl.constexpr,
@@ -77,19 +91,23 @@ def tuned_attn_fwd(
             stride_vz, stride_vh, stride_vk, stride_vn,
             stride_oz, stride_oh, stride_om, stride_on,
             stride_bz, stride_bh, stride_bm, stride_bn,
+            num_head_q, num_head_k,
             cu_seqlens_q, cu_seqlens_k,
             max_seqlens_q, max_seqlens_k,
-            head_dim_q, head_dim_k,
+            head_dim,
+            window_left, window_right,
             dropout_p,
             philox_seed,
             philox_offset_base,
             encoded_softmax,
+            dropout_bitmask,
+            q_descale, k_descale, v_descale,
             VARLEN,
             STAGE,
             BLOCK_M,
             BLOCK_DMODEL,
             BLOCK_N,
-            PRE_LOAD_V=PRE_LOAD_V,
+            pre_load_v=PRE_LOAD_V,
             ENABLE_DROPOUT=ENABLE_DROPOUT,
             RETURN_ENCODED_SOFTMAX=RETURN_ENCODED_SOFTMAX,
             BIAS_TYPE=BIAS_TYPE,
@@ -114,190 +132,278 @@ TRITON_CONFIG_LIST_BWD_SMALL_BLOCK = [
 
 @triton.autotune(
    configs=TRITON_CONFIG_LIST_BWD_LARGE_BLOCK,
-   key=['max_seqlens_q', 'max_seqlens_k'],
+   key=['max_seqlens_q', 'max_seqlens_k', 'FUSED_DQ', 'INLINE_DELTA'],
 )
 @triton.jit
 def large_tuned_bwd_kernel_dk_dv(
-    Q, K, V, sm_scale, Out, DO,
-    DK, DV,
+    Q, K, V, B, sm_scale, Out, DO,
+    DK, DV, DQ_ACC,
     L,
     D,
     stride_qz, stride_qh, stride_qm, stride_qk,
     stride_kz, stride_kh, stride_kn, stride_kk,
     stride_vz, stride_vh, stride_vk, stride_vn,
     stride_oz, stride_oh, stride_om, stride_ok,
+    stride_doz, stride_doh, stride_dom, stride_dok,
+    stride_bz, stride_bh, stride_bm, stride_bn,
     stride_dkz, stride_dkh, stride_dkn, stride_dkk,
     stride_dvz, stride_dvh, stride_dvk, stride_dvn,
+    stride_dqz, stride_dqh, stride_dqm, stride_dqk,
+    num_head_q, num_head_k,
+    cu_seqlens_q, cu_seqlens_k,
     max_seqlens_q, max_seqlens_k,
     head_dim,
+    window_left, window_right,
     dropout_p,
     philox_seed,
     philox_offset_base,
+    dropout_bitmask,
     BLOCK_M: tl.constexpr, BLOCK_DMODEL: tl.constexpr,
     BLOCK_N: tl.constexpr,
     CAUSAL: tl.constexpr,
     ENABLE_DROPOUT: tl.constexpr,
+    BIAS_TYPE: tl.constexpr,
     PADDED_HEAD: tl.constexpr,
+    VARLEN: tl.constexpr,
+    FUSED_DQ: tl.constexpr,
+    INLINE_DELTA: tl.constexpr,
 ):
-    bare_bwd_kernel_dk_dv(Q, K, V, sm_scale, Out, DO,
-            DK, DV,
+    bare_bwd_kernel_dk_dv(Q, K, V, B, sm_scale, Out, DO,
+            DK, DV, DQ_ACC,
             L,
             D,
             stride_qz, stride_qh, stride_qm, stride_qk,
             stride_kz, stride_kh, stride_kn, stride_kk,
             stride_vz, stride_vh, stride_vk, stride_vn,
             stride_oz, stride_oh, stride_om, stride_ok,
+            stride_doz, stride_doh, stride_dom, stride_dok,
+            stride_bz, stride_bh, stride_bm, stride_bn,
             stride_dkz, stride_dkh, stride_dkn, stride_dkk,
             stride_dvz, stride_dvh, stride_dvk, stride_dvn,
+            stride_dqz, stride_dqh, stride_dqm, stride_dqk,
+            num_head_q, num_head_k,
+            cu_seqlens_q, cu_seqlens_k,
             max_seqlens_q, max_seqlens_k,
             head_dim,
+            window_left, window_right,
             dropout_p,
             philox_seed,
             philox_offset_base,
+            dropout_bitmask,
             BLOCK_M, BLOCK_DMODEL,
             BLOCK_N,
             CAUSAL,
             ENABLE_DROPOUT,
+            BIAS_TYPE=BIAS_TYPE,
             PADDED_HEAD=PADDED_HEAD,
+            VARLEN=VARLEN,
+            FUSED_DQ=FUSED_DQ,
+            INLINE_DELTA=INLINE_DELTA,
             )
 
 @triton.autotune(
    configs=TRITON_CONFIG_LIST_BWD_SMALL_BLOCK,
-   key=['max_seqlens_q', 'max_seqlens_k'],
+   key=['max_seqlens_q', 'max_seqlens_k', 'FUSED_DQ', 'INLINE_DELTA'],
 )
 @triton.jit
 def small_tuned_bwd_kernel_dk_dv(
-    Q, K, V, sm_scale, Out, DO,
-    DK, DV,
+    Q, K, V, B, sm_scale, Out, DO,
+    DK, DV, DQ_ACC,
     L,
     D,
     stride_qz, stride_qh, stride_qm, stride_qk,
     stride_kz, stride_kh, stride_kn, stride_kk,
     stride_vz, stride_vh, stride_vk, stride_vn,
     stride_oz, stride_oh, stride_om, stride_ok,
+    stride_doz, stride_doh, stride_dom, stride_dok,
+    stride_bz, stride_bh, stride_bm, stride_bn,
+    stride_dkz, stride_dkh, stride_dkn, stride_dkk,
+    stride_dvz, stride_dvh, stride_dvk, stride_dvn,
+    stride_dqz, stride_dqh, stride_dqm, stride_dqk,
+    num_head_q, num_head_k,
+    cu_seqlens_q, cu_seqlens_k,
     max_seqlens_q, max_seqlens_k,
     head_dim,
+    window_left, window_right,
     dropout_p,
     philox_seed,
     philox_offset_base,
+    dropout_bitmask,
     BLOCK_M: tl.constexpr, BLOCK_DMODEL: tl.constexpr,
     BLOCK_N: tl.constexpr,
     CAUSAL: tl.constexpr,
     ENABLE_DROPOUT: tl.constexpr,
+    BIAS_TYPE: tl.constexpr,
     PADDED_HEAD: tl.constexpr,
+    VARLEN: tl.constexpr,
+    FUSED_DQ: tl.constexpr,
+    INLINE_DELTA: tl.constexpr,
 ):
-    bare_bwd_kernel_dk_dv(Q, K, V, sm_scale, Out, DO,
-            DK, DV,
+    bare_bwd_kernel_dk_dv(Q, K, V, B, sm_scale, Out, DO,
+            DK, DV, DQ_ACC,
             L,
             D,
             stride_qz, stride_qh, stride_qm, stride_qk,
             stride_kz, stride_kh, stride_kn, stride_kk,
             stride_vz, stride_vh, stride_vk, stride_vn,
             stride_oz, stride_oh, stride_om, stride_ok,
+            stride_doz, stride_doh, stride_dom, stride_dok,
+            stride_bz, stride_bh, stride_bm, stride_bn,
+            stride_dkz, stride_dkh, stride_dkn, stride_dkk,
+            stride_dvz, stride_dvh, stride_dvk, stride_dvn,
+            stride_dqz, stride_dqh, stride_dqm, stride_dqk,
+            num_head_q, num_head_k,
+            cu_seqlens_q, cu_seqlens_k,
             max_seqlens_q, max_seqlens_k,
             head_dim,
+            window_left, window_right,
             dropout_p,
             philox_seed,
             philox_offset_base,
+            dropout_bitmask,
             BLOCK_M, BLOCK_DMODEL,
             BLOCK_N,
             CAUSAL,
             ENABLE_DROPOUT,
+            BIAS_TYPE=BIAS_TYPE,
             PADDED_HEAD=PADDED_HEAD,
+            VARLEN=VARLEN,
+            FUSED_DQ=FUSED_DQ,
+            INLINE_DELTA=INLINE_DELTA,
             )
 
 @triton.autotune(
    configs=TRITON_CONFIG_LIST_BWD_LARGE_BLOCK,
-   key=['max_seqlens_q', 'max_seqlens_k'],
+   key=['max_seqlens_q', 'max_seqlens_k', 'INLINE_DELTA'],
 )
 @triton.jit
 def large_tuned_bwd_kernel_dq(
-    Q, K, V, sm_scale, Out, DO,
-    DQ,
+    Q, K, V, B, sm_scale, Out, DO,
+    DQ, DB,
     L,
     D,
     stride_qz, stride_qh, stride_qm, stride_qk,
     stride_kz, stride_kh, stride_kn, stride_kk,
     stride_vz, stride_vh, stride_vk, stride_vn,
     stride_oz, stride_oh, stride_om, stride_ok,
+    stride_doz, stride_doh, stride_dom, stride_dok,
     stride_dqz, stride_dqh, stride_dqm, stride_dqk,
+    stride_bz, stride_bh, stride_bm, stride_bn,
+    stride_dbz, stride_dbh, stride_dbm, stride_dbn,
+    num_head_q, num_head_k,
+    cu_seqlens_q, cu_seqlens_k,
     max_seqlens_q, max_seqlens_k,
     head_dim,
+    window_left, window_right,
     dropout_p,
     philox_seed,
     philox_offset_base,
+    dropout_bitmask,
     BLOCK_M: tl.constexpr, BLOCK_DMODEL: tl.constexpr,
     BLOCK_N: tl.constexpr,
     CAUSAL: tl.constexpr,
     ENABLE_DROPOUT: tl.constexpr,
+    BIAS_TYPE: tl.constexpr,
     PADDED_HEAD: tl.constexpr,
+    VARLEN: tl.constexpr,
+    INLINE_DELTA: tl.constexpr,
 ):
-    bare_bwd_kernel_dq(Q, K, V, sm_scale, Out, DO,
-        DQ,
+    bare_bwd_kernel_dq(Q, K, V, B, sm_scale, Out, DO,
+        DQ, DB,
         L,
         D,
         stride_qz, stride_qh, stride_qm, stride_qk,
         stride_kz, stride_kh, stride_kn, stride_kk,
         stride_vz, stride_vh, stride_vk, stride_vn,
         stride_oz, stride_oh, stride_om, stride_ok,
+        stride_doz, stride_doh, stride_dom, stride_dok,
         stride_dqz, stride_dqh, stride_dqm, stride_dqk,
+        stride_bz, stride_bh, stride_bm, stride_bn,
+        stride_dbz, stride_dbh, stride_dbm, stride_dbn,
+        num_head_q, num_head_k,
+        cu_seqlens_q, cu_seqlens_k,
         max_seqlens_q, max_seqlens_k,
         head_dim,
+        window_left, window_right,
         dropout_p,
         philox_seed,
         philox_offset_base,
+        dropout_bitmask,
         BLOCK_M, BLOCK_DMODEL,
         BLOCK_N,
         CAUSAL,
         ENABLE_DROPOUT,
+        BIAS_TYPE=BIAS_TYPE,
         PADDED_HEAD=PADDED_HEAD,
+        VARLEN=VARLEN,
+        INLINE_DELTA=INLINE_DELTA,
         )
 
 @triton.autotune(
    configs=TRITON_CONFIG_LIST_BWD_SMALL_BLOCK,
-   key=['max_seqlens_q', 'max_seqlens_k'],
+   key=['max_seqlens_q', 'max_seqlens_k', 'INLINE_DELTA'],
 )
 @triton.jit
 def small_tuned_bwd_kernel_dq(
-    Q, K, V, sm_scale, Out, DO,
-    DQ,
+    Q, K, V, B, sm_scale, Out, DO,
+    DQ, DB,
     L,
     D,
     stride_qz, stride_qh, stride_qm, stride_qk,
     stride_kz, stride_kh, stride_kn, stride_kk,
     stride_vz, stride_vh, stride_vk, stride_vn,
     stride_oz, stride_oh, stride_om, stride_ok,
+    stride_doz, stride_doh, stride_dom, stride_dok,
     stride_dqz, stride_dqh, stride_dqm, stride_dqk,
+    stride_bz, stride_bh, stride_bm, stride_bn,
+    stride_dbz, stride_dbh, stride_dbm, stride_dbn,
+    num_head_q, num_head_k,
+    cu_seqlens_q, cu_seqlens_k,
     max_seqlens_q, max_seqlens_k,
     head_dim,
+    window_left, window_right,
     dropout_p,
     philox_seed,
     philox_offset_base,
+    dropout_bitmask,
     BLOCK_M: tl.constexpr, BLOCK_DMODEL: tl.constexpr,
     BLOCK_N: tl.constexpr,
     CAUSAL: tl.constexpr,
     ENABLE_DROPOUT: tl.constexpr,
+    BIAS_TYPE: tl.constexpr,
     PADDED_HEAD: tl.constexpr,
+    VARLEN: tl.constexpr,
+    INLINE_DELTA: tl.constexpr,
 ):
-    bare_bwd_kernel_dq(Q, K, V, sm_scale, Out, DO,
-        DQ,
+    bare_bwd_kernel_dq(Q, K, V, B, sm_scale, Out, DO,
+        DQ, DB,
         L,
         D,
         stride_qz, stride_qh, stride_qm, stride_qk,
         stride_kz, stride_kh, stride_kn, stride_kk,
         stride_vz, stride_vh, stride_vk, stride_vn,
         stride_oz, stride_oh, stride_om, stride_ok,
+        stride_doz, stride_doh, stride_dom, stride_dok,
         stride_dqz, stride_dqh, stride_dqm, stride_dqk,
+        stride_bz, stride_bh, stride_bm, stride_bn,
+        stride_dbz, stride_dbh, stride_dbm, stride_dbn,
+        num_head_q, num_head_k,
+        cu_seqlens_q, cu_seqlens_k,
         max_seqlens_q, max_seqlens_k,
         head_dim,
+        window_left, window_right,
         dropout_p,
         philox_seed,
         philox_offset_base,
+        dropout_bitmask,
         BLOCK_M, BLOCK_DMODEL,
         BLOCK_N,
         CAUSAL,
         ENABLE_DROPOUT,
+        BIAS_TYPE=BIAS_TYPE,
         PADDED_HEAD=PADDED_HEAD,
+        VARLEN=VARLEN,
+        INLINE_DELTA=INLINE_DELTA,
         )
 
 class _attention(torch.autograd.Function):
@@ -307,17 +413,27 @@ class _attention(torch.autograd.Function):
 
     @staticmethod
     def forward(ctx, q, k, v, causal, sm_scale, dropout_p, return_encoded_softmax,
-                autotune=False, return_autotune=False):
+                autotune=False, return_autotune=False, window_left=-1, window_right=-1,
+                descale=None, out_dtype=None, use_dropout_bitmask=False, inline_delta=False,
+                fused_dq=False):
         dtype = q.dtype
+        # FP8 inputs take the per-tensor descale factors (q, k, v), and write
+        # out_dtype, fp16 by default
+        is_fp8 = dtype in (torch.float8_e4m3fnuz, torch.float8_e5m2fnuz)
+        q_descale, k_descale, v_descale = descale if descale is not None else (1.0, 1.0, 1.0)
+        if out_dtype is None:
+            out_dtype = torch.float16 if is_fp8 else dtype
         # shape constraints
         Lq, Lk, Lv = q.shape[-1], k.shape[-1], v.shape[-1]
         assert Lq == Lk and Lk == Lv
-        head_dim_rounded = 2 ** (Lk - 1).bit_length()
-        head_dim_rounded = max(16, head_dim_rounded)
+        head_dim_rounded = round_head_dim(Lk)
         padded_head = head_dim_rounded != Lk
         max_seqlens_q = q.shape[2]
         max_seqlens_k = k.shape[2]
-        o = torch.zeros_like(q)
+        # Negative window sizes are unbounded
+        ctx.window_left = window_left if window_left >= 0 else max_seqlens_q + max_seqlens_k
+        ctx.window_right = window_right if window_right >= 0 else max_seqlens_q + max_seqlens_k
+        o = torch.zeros_like(q, dtype=out_dtype)
         if torch.version.hip is None:
             BLOCK_M = 128
             BLOCK_N = 64 if Lk <= 64 else 32
@@ -335,6 +451,12 @@ class _attention(torch.autograd.Function):
             encoded_softmax = torch.ones((q.shape[0], q.shape[1], q.shape[2], k.shape[2]), device=q.device, dtype=_attention.DEBUG_MASK_DTYPE) * 114.514
         else:
             encoded_softmax = None
+        # Keeps the dropout mask with one bit per element for the backward pass
+        if use_dropout_bitmask and dropout_p > 0.0:
+            dropout_bitmask = torch.zeros((q.shape[0], q.shape[1], q.shape[2], triton.cdiv(k.shape[2], 32)),
+                                          device=q.device, dtype=torch.int32)
+        else:
+            dropout_bitmask = None
         if False or VERBOSE:
             print(f'{q.shape=}')
             print(f'{k.shape=}')
@@ -378,16 +500,23 @@ class _attention(torch.autograd.Function):
                 v.stride(0), v.stride(1), v.stride(2), v.stride(3),
                 o.stride(0), o.stride(1), o.stride(2), o.stride(3),
                 0, 0, 0, 0,
+                num_head_q=q.shape[1],
+                num_head_k=k.shape[1],
                 cu_seqlens_q=None,
                 cu_seqlens_k=None,
                 max_seqlens_q=q.shape[2],
                 max_seqlens_k=k.shape[2],
-                head_dim_q=Lq,
-                head_dim_k=Lk,
+                head_dim=Lk,
+                window_left=ctx.window_left,
+                window_right=ctx.window_right,
                 dropout_p=dropout_p,
                 philox_seed=philox_seed,
                 philox_offset_base=philox_offset,
                 encoded_softmax=encoded_softmax,
+                dropout_bitmask=dropout_bitmask,
+                q_descale=q_descale,
+                k_descale=k_descale,
+                v_descale=v_descale,
                 VARLEN=False,
                 STAGE=stage,
                 BLOCK_DMODEL=head_dim_rounded,
@@ -413,22 +542,29 @@ class _attention(torch.autograd.Function):
                 v.stride(0), v.stride(1), v.stride(2), v.stride(3),
                 o.stride(0), o.stride(1), o.stride(2), o.stride(3),
                 0, 0, 0, 0,
+                num_head_q=q.shape[1],
+                num_head_k=k.shape[1],
                 cu_seqlens_q=None,
                 cu_seqlens_k=None,
                 max_seqlens_q=q.shape[2],
                 max_seqlens_k=k.shape[2],
-                head_dim_q=Lq,
-                head_dim_k=Lk,
+                head_dim=Lk,
+                window_left=ctx.window_left,
+                window_right=ctx.window_right,
                 dropout_p=dropout_p,
                 philox_seed=philox_seed,
                 philox_offset_base=philox_offset,
                 encoded_softmax=encoded_softmax,
+                dropout_bitmask=dropout_bitmask,
+                q_descale=q_descale,
+                k_descale=k_descale,
+                v_descale=v_descale,
                 VARLEN=False,
                 STAGE=stage,
                 BLOCK_M=BLOCK_M,
                 BLOCK_DMODEL=head_dim_rounded,
                 BLOCK_N=BLOCK_N,
-                PRE_LOAD_V=False,
+                pre_load_v=False,
                 ENABLE_DROPOUT=dropout_p > 0.0,
                 RETURN_ENCODED_SOFTMAX=RETURN_ENCODED_SOFTMAX,
                 BIAS_TYPE=0,
@@ -486,8 +622,12 @@ class _attention(torch.autograd.Function):
         ctx.head_dim = Lk
         ctx.causal = causal
         ctx.dropout_p = dropout_p
+        ctx.is_fp8 = is_fp8
         ctx.philox_seed = philox_seed
         ctx.philox_offset = philox_offset
+        ctx.dropout_bitmask = dropout_bitmask
+        ctx.inline_delta = inline_delta
+        ctx.fused_dq = fused_dq
         ctx.encoded_softmax = encoded_softmax # FIXME: for debugging only
         ctx.tuning_result = [tuning_result] if tuning_result is not None else None
         return o, encoded_softmax, ctx.tuning_result
@@ -495,12 +635,14 @@ class _attention(torch.autograd.Function):
     @staticmethod
     def backward(ctx, do, _, fwd_tuning_result):
         q, k, v, o, L = ctx.saved_tensors
+        assert not ctx.is_fp8, "FP8 attention is forward only"
         # if q.shape[-1] <= 32:
         Lq, Lk, Lv = q.shape[-1], k.shape[-1], v.shape[-1]
         assert Lq == Lk and Lk == Lv and Lk == ctx.head_dim
-        head_dim_rounded = 2 ** (ctx.head_dim - 1).bit_length()
-        head_dim_rounded = max(16, head_dim_rounded)
+        head_dim_rounded = round_head_dim(ctx.head_dim)
         padded_head = head_dim_rounded != ctx.head_dim
+        # bwd_preprocess only supports power-of-two head dimensions
+        preprocess_head_dim = max(16, 2 ** (ctx.head_dim - 1).bit_length())
 
         dq = torch.zeros_like(q, dtype=torch.float32)
         dk = torch.empty_like(k)
@@ -518,15 +660,19 @@ class _attention(torch.autograd.Function):
         return_autotune = ctx.tuning_result is not None
 
         grid_prep = (triton.cdiv(do.shape[2], BLOCK), do.shape[1], do.shape[0])
-        bare_bwd_preprocess[grid_prep](
-            o, do, delta,
-            o.stride(0), o.stride(1), o.stride(2), o.stride(3),
-            do.stride(0), do.stride(1), do.stride(2), do.stride(3),
-            max_seqlens_q,
-            Lk,
-            BLOCK_M=BLOCK, D_HEAD=head_dim_rounded,
-            PADDED_HEAD=padded_head, # FIXME: irregular head dimension
-        )
+        # Not needed if both kernels compute delta in place (INLINE_DELTA)
+        def launch_preprocess():
+            bare_bwd_preprocess[grid_prep](
+                o, do, delta,
+                o.stride(0), o.stride(1), o.stride(2), o.stride(3),
+                do.stride(0), do.stride(1), do.stride(2), do.stride(3),
+                None,
+                max_seqlens_q,
+                Lk,
+                BLOCK_M=BLOCK, D_HEAD=preprocess_head_dim,
+                PADDED_HEAD=preprocess_head_dim != ctx.head_dim,
+                VARLEN=False,
+            )
         if False or VERBOSE:
             print(f'{q.shape=} {q.stride()=}')
             print(f'{k.shape=} {k.stride()=}')
@@ -540,6 +686,8 @@ class _attention(torch.autograd.Function):
             print(f'{delta=}')
             print(f'{BLOCK=}')
         dq = torch.zeros_like(q)
+        b = None
+        db = None
         if ctx.autotune:
             use_small_block = ctx.dropout_p > 0.0
             if use_small_block:
@@ -557,89 +705,189 @@ class _attention(torch.autograd.Function):
             BLOCK_M = 32
             BLOCK_N = 16
         # debug_mask = torch.zeros((q.shape[0], q.shape[1], max_seqlens_q, max_seqlens_k), device=q.device, dtype=ctx.encoded_softmax.dtype)
+        # dK/dV of a K/V head are reduced over its group of Q heads
         grid_dk_dv = lambda META: (
             triton.cdiv(max_seqlens_k, META['BLOCK_N']),
+            k.shape[1],
+            q.shape[0],
+        )
+        grid_dq = lambda META: (
+            triton.cdiv(max_seqlens_q, META['BLOCK_M']),
             q.shape[1],
             q.shape[0],
         )
-        if k.requires_grad and v.requires_grad:
-            if ctx.autotune:
-                tuned_bwd_kernel_dk_dv[grid_dk_dv](
-                    q, k, v, ctx.sm_scale,
-                    o, do,
-                    dk, dv,
-                    L, delta,
-                    q.stride(0), q.stride(1), q.stride(2), q.stride(3),
-                    k.stride(0), k.stride(1), k.stride(2), k.stride(3),
-                    v.stride(0), v.stride(1), v.stride(2), v.stride(3),
-                    do.stride(0), do.stride(1), do.stride(2), do.stride(3),
-                    dk.stride(0), dk.stride(1), dk.stride(2), dk.stride(3),
-                    dv.stride(0), dv.stride(1), dv.stride(2), dv.stride(3),
-                    max_seqlens_q=max_seqlens_q,
-                    max_seqlens_k=max_seqlens_k,
-                    head_dim=Lk,
-                    dropout_p=ctx.dropout_p,
-                    philox_seed=ctx.philox_seed,
-                    philox_offset_base=ctx.philox_offset,
-                    # debug_mask=debug_mask,
-                    BLOCK_DMODEL=head_dim_rounded,
-                    CAUSAL=ctx.causal,
-                    ENABLE_DROPOUT=ctx.dropout_p > 0.0,
-                    PADDED_HEAD=padded_head,
+        # With dq_acc, bwd_kernel_dk_dv also accumulates dQ (FUSED_DQ)
+        def launch_dk_dv(kernel, inline_delta, dq_acc=None, **kwargs):
+            kernel[grid_dk_dv](
+                q, k, v, b, ctx.sm_scale,
+                o, do,
+                dk, dv, dq_acc,
+                L, delta,
+                q.stride(0), q.stride(1), q.stride(2), q.stride(3),
+                k.stride(0), k.stride(1), k.stride(2), k.stride(3),
+                v.stride(0), v.stride(1), v.stride(2), v.stride(3),
+                o.stride(0), o.stride(1), o.stride(2), o.stride(3),
+                do.stride(0), do.stride(1), do.stride(2), do.stride(3),
+                0, 0, 0, 0,
+                dk.stride(0), dk.stride(1), dk.stride(2), dk.stride(3),
+                dv.stride(0), dv.stride(1), dv.stride(2), dv.stride(3),
+                *(dq_acc.stride() if dq_acc is not None else (0, 0, 0, 0)),
+                num_head_q=q.shape[1],
+                num_head_k=k.shape[1],
+                cu_seqlens_q=None,
+                cu_seqlens_k=None,
+                max_seqlens_q=max_seqlens_q,
+                max_seqlens_k=max_seqlens_k,
+                head_dim=Lk,
+                window_left=ctx.window_left,
+                window_right=ctx.window_right,
+                dropout_p=ctx.dropout_p,
+                philox_seed=ctx.philox_seed,
+                philox_offset_base=ctx.philox_offset,
+                dropout_bitmask=ctx.dropout_bitmask,
+                # debug_mask=debug_mask,
+                BLOCK_DMODEL=head_dim_rounded,
+                CAUSAL=ctx.causal,
+                ENABLE_DROPOUT=ctx.dropout_p > 0.0,
+                BIAS_TYPE=0,
+                PADDED_HEAD=padded_head,
+                VARLEN=False,
+                FUSED_DQ=dq_acc is not None,
+                INLINE_DELTA=inline_delta,
+                **kwargs,
+            )
+        def launch_dq(kernel, inline_delta, **kwargs):
+            kernel[grid_dq](
+                q, k, v, b, ctx.sm_scale,
+                o, do,
+                dq, db,
+                L, delta,
+                q.stride(0), q.stride(1), q.stride(2), q.stride(3),
+                k.stride(0), k.stride(1), k.stride(2), k.stride(3),
+                v.stride(0), v.stride(1), v.stride(2), v.stride(3),
+                o.stride(0), o.stride(1), o.stride(2), o.stride(3),
+                do.stride(0), do.stride(1), do.stride(2), do.stride(3),
+                dq.stride(0), dq.stride(1), dq.stride(2), dq.stride(3),
+                0, 0, 0, 0,
+                0, 0, 0, 0,
+                num_head_q=q.shape[1],
+                num_head_k=k.shape[1],
+                cu_seqlens_q=None,
+                cu_seqlens_k=None,
+                max_seqlens_q=max_seqlens_q,
+                max_seqlens_k=max_seqlens_k,
+                head_dim=Lk,
+                window_left=ctx.window_left,
+                window_right=ctx.window_right,
+                dropout_p=ctx.dropout_p,
+                philox_seed=ctx.philox_seed,
+                philox_offset_base=ctx.philox_offset,
+                dropout_bitmask=ctx.dropout_bitmask,
+                BLOCK_DMODEL=head_dim_rounded,
+                CAUSAL=ctx.causal,
+                ENABLE_DROPOUT=ctx.dropout_p > 0.0,
+                BIAS_TYPE=0,
+                PADDED_HEAD=padded_head,
+                VARLEN=False,
+                INLINE_DELTA=inline_delta,
+                **kwargs,
+            )
+        def launch_postprocess(dq_acc):
+            bare_bwd_postprocess[grid_prep](
+                dq_acc, dq,
+                dq_acc.stride(0), dq_acc.stride(1), dq_acc.stride(2), dq_acc.stride(3),
+                dq.stride(0), dq.stride(1), dq.stride(2), dq.stride(3),
+                None,
+                max_seqlens_q,
+                Lk,
+                BLOCK_M=BLOCK, D_HEAD=preprocess_head_dim,
+                PADDED_HEAD=preprocess_head_dim != ctx.head_dim,
+                VARLEN=False,
+            )
+        if ctx.autotune:
+            # The fused bwd_kernel_dk_dv replaces bwd_kernel_dq, and kernels
+            # with INLINE_DELTA replace bwd_preprocess, hence the variants only
+            # compete as a whole. The fused one is timed with the zeroing of
+            # dq_acc and bwd_postprocess like attn_bwd runs it
+            dq_acc = torch.empty_like(q, dtype=torch.float32)
+            need_dk_dv = k.requires_grad and v.requires_grad
+            def run_bwd(fused_dq, inline_delta):
+                if not inline_delta:
+                    launch_preprocess()
+                if fused_dq:
+                    dq_acc.zero_()
+                    launch_dk_dv(tuned_bwd_kernel_dk_dv, inline_delta, dq_acc)
+                    launch_postprocess(dq_acc)
+                    return
+                if need_dk_dv:
+                    launch_dk_dv(tuned_bwd_kernel_dk_dv, inline_delta)
+                if q.requires_grad:
+                    launch_dq(tuned_bwd_kernel_dq, inline_delta)
+            fused_choices = [False, True] if need_dk_dv and q.requires_grad else [False]
+            variants = [(fused_dq, inline_delta) for fused_dq in fused_choices for inline_delta in [False, True]]
+            best_configs = {}
+            timings = {}
+            for variant in variants:
+                fused_dq, _ = variant
+                run_bwd(*variant)  # Autotunes the kernels of the variant
+                best_configs[variant] = (
+                    tuned_bwd_kernel_dk_dv.get_best_config() if need_dk_dv else None,
+                    tuned_bwd_kernel_dq.get_best_config() if q.requires_grad and not fused_dq else None,
                 )
-                if return_autotune:
-                    dkdv_best_config = tuned_bwd_kernel_dk_dv.get_best_config()
-                    inputs = {
-                        'Q.shape' : list(q.shape),
-                        'Q.dtype' : str(q.dtype),
-                        'N_HEADS' : q.shape[1],
-                        'max_seqlens_q': max_seqlens_q,
-                        'max_seqlens_k': max_seqlens_k,
-                        'head_dim' : ctx.BLOCK_DMODEL,
-                        'BLOCK_DMODEL' : head_dim_rounded,
-                        'CAUSAL'  : ctx.causal,
-                        'ENABLE_DROPOUT' : ctx.dropout_p > 0.0,
-                    }
-                    tuned_kernel = dict(dkdv_best_config.kwargs)
-                    compiler_options = {
-                        'num_warps' : dkdv_best_config.num_warps,
-                        'num_stages': dkdv_best_config.num_stages,
-                    }
-                    tuning_result = {
-                        'kernel_name' : 'bwd_kernel_dk_dv',
+                timings[variant] = triton.testing.do_bench(lambda: run_bwd(*variant))
+            best = min(timings, key=timings.get)
+            run_bwd(*best)
+            if return_autotune:
+                inputs = {
+                    'Q.shape' : list(q.shape),
+                    'Q.dtype' : str(q.dtype),
+                    'N_HEADS' : q.shape[1],
+                    'max_seqlens_q': max_seqlens_q,
+                    'max_seqlens_k': max_seqlens_k,
+                    'head_dim' : ctx.head_dim,
+                    'BLOCK_DMODEL' : head_dim_rounded,
+                    'CAUSAL'  : ctx.causal,
+                    'ENABLE_DROPOUT' : ctx.dropout_p > 0.0,
+                }
+                def tuning_result(kernel_name, best_config, **perf):
+                    return {
+                        'kernel_name' : kernel_name,
                         'inputs' : inputs,
-                        'tuned_kernel' : tuned_kernel,
-                        'compiler_options' : compiler_options,
+                        'tuned_kernel' : dict(best_config.kwargs, **perf),
+                        'compiler_options' : {
+                            'num_warps' : best_config.num_warps,
+                            'num_stages': best_config.num_stages,
+                        },
                     }
-                    ctx.tuning_result.append(tuning_result)
-                    print(f'{id(ctx.tuning_result)=}')
-            else:
-                bare_bwd_kernel_dk_dv[grid_dk_dv](
-                    q, k, v, ctx.sm_scale,
-                    o, do,
-                    dk, dv,
-                    L, delta,
-                    q.stride(0), q.stride(1), q.stride(2), q.stride(3),
-                    k.stride(0), k.stride(1), k.stride(2), k.stride(3),
-                    v.stride(0), v.stride(1), v.stride(2), v.stride(3),
-                    do.stride(0), do.stride(1), do.stride(2), do.stride(3),
-                    dk.stride(0), dk.stride(1), dk.stride(2), dk.stride(3),
-                    dv.stride(0), dv.stride(1), dv.stride(2), dv.stride(3),
-                    max_seqlens_q=max_seqlens_q,
-                    max_seqlens_k=max_seqlens_k,
-                    head_dim=Lk,
-                    dropout_p=ctx.dropout_p,
-                    philox_seed=ctx.philox_seed,
-                    philox_offset_base=ctx.philox_offset,
-                    # debug_mask=debug_mask,
-                    BLOCK_M=BLOCK_M, BLOCK_N=BLOCK_N,
-                    BLOCK_DMODEL=head_dim_rounded,
-                    CAUSAL=ctx.causal,
-                    num_warps=4,
-                    num_stages=1,
-                    ENABLE_DROPOUT=ctx.dropout_p > 0.0,
-                    PADDED_HEAD=padded_head,
-                )
+                # attn_bwd falls back to the split kernels without dq_acc, so
+                # bwd_kernel_dq keeps the config of the best split variant
+                best_split = min([v for v in variants if not v[0]], key=timings.get)
+                if need_dk_dv:
+                    ctx.tuning_result.append(tuning_result('bwd_kernel_dk_dv', best_configs[best][0],
+                                                           FUSED_DQ=best[0], INLINE_DELTA=best[1]))
+                if q.requires_grad:
+                    ctx.tuning_result.append(tuning_result('bwd_kernel_dq', best_configs[best_split][1],
+                                                           INLINE_DELTA=best_split[1]))
+        else:
+            if not ctx.inline_delta:
+                launch_preprocess()
+            if ctx.fused_dq and q.requires_grad and k.requires_grad and v.requires_grad:
+                dq_acc = torch.zeros_like(q, dtype=torch.float32)
+                launch_dk_dv(bare_bwd_kernel_dk_dv, ctx.inline_delta, dq_acc,
+                             BLOCK_M=BLOCK_M, BLOCK_N=BLOCK_N,
+                             num_warps=4,
+                             num_stages=1)
+                launch_postprocess(dq_acc)
+            elif k.requires_grad and v.requires_grad:
+                launch_dk_dv(bare_bwd_kernel_dk_dv, ctx.inline_delta,
+                             BLOCK_M=BLOCK_M, BLOCK_N=BLOCK_N,
+                             num_warps=4,
+                             num_stages=1)
+            if q.requires_grad and not (ctx.fused_dq and k.requires_grad and v.requires_grad):
+                launch_dq(bare_bwd_kernel_dq, ctx.inline_delta,
+                          BLOCK_M=BLOCK_M, BLOCK_N=BLOCK_N,
+                          num_warps=4, waves_per_eu=1,
+                          num_stages=1)
         # mask_allclose = torch.allclose(debug_mask < 0, ctx.encoded_softmax < 0)
         if False:
             mask_allclose = torch.allclose(torch.abs(debug_mask), torch.abs(ctx.encoded_softmax)) # Stores QK
@@ -657,85 +905,7 @@ class _attention(torch.autograd.Function):
                     print(f'2nd block fwd mask: {ctx.encoded_softmax[0,0, 16:]}')
             # print(f'Full q: {q}', file=sys.stderr)
             # assert mask_allclose
-        grid_dq = lambda META: (
-            triton.cdiv(max_seqlens_q, META['BLOCK_M']),
-            q.shape[1],
-            q.shape[0],
-        )
-        if q.requires_grad:
-            if ctx.autotune:
-                tuned_bwd_kernel_dq[grid_dq](
-                    q, k, v, ctx.sm_scale,
-                    o, do,
-                    dq,
-                    L, delta,
-                    q.stride(0), q.stride(1), q.stride(2), q.stride(3),
-                    k.stride(0), k.stride(1), k.stride(2), k.stride(3),
-                    v.stride(0), v.stride(1), v.stride(2), v.stride(3),
-                    do.stride(0), do.stride(1), do.stride(2), do.stride(3),
-                    dq.stride(0), dq.stride(1), dq.stride(2), dq.stride(3),
-                    max_seqlens_q=max_seqlens_q,
-                    max_seqlens_k=max_seqlens_k,
-                    head_dim=Lk,
-                    dropout_p=ctx.dropout_p,
-                    philox_seed=ctx.philox_seed,
-                    philox_offset_base=ctx.philox_offset,
-                    BLOCK_DMODEL=head_dim_rounded,
-                    CAUSAL=ctx.causal,
-                    ENABLE_DROPOUT=ctx.dropout_p > 0.0,
-                    PADDED_HEAD=padded_head,
-                )
-                if return_autotune:
-                    dq_best_config = tuned_bwd_kernel_dq.get_best_config()
-                    inputs = {
-                        'Q.shape' : list(q.shape),
-                        'Q.dtype' : str(q.dtype),
-                        'N_HEADS' : q.shape[1],
-                        'max_seqlens_q': max_seqlens_q,
-                        'max_seqlens_k': max_seqlens_k,
-                        'head_dim' : ctx.BLOCK_DMODEL,
-                        'BLOCK_DMODEL' : head_dim_rounded,
-                        'CAUSAL'  : ctx.causal,
-                        'ENABLE_DROPOUT' : ctx.dropout_p > 0.0,
-                    }
-                    tuned_kernel = dict(dq_best_config.kwargs)
-                    compiler_options = {
-                        'num_warps' : dq_best_config.num_warps,
-                        'num_stages': dq_best_config.num_stages,
-                    }
-                    tuning_result = {
-                        'kernel_name' : 'bwd_kernel_dq',
-                        'inputs' : inputs,
-                        'tuned_kernel' : tuned_kernel,
-                        'compiler_options' : compiler_options,
-                    }
-                    ctx.tuning_result.append(tuning_result)
-            else:
-                bare_bwd_kernel_dq[grid_dq](
-                    q, k, v, ctx.sm_scale,
-                    o, do,
-                    dq,
-                    L, delta,
-                    q.stride(0), q.stride(1), q.stride(2), q.stride(3),
-                    k.stride(0), k.stride(1), k.stride(2), k.stride(3),
-                    v.stride(0), v.stride(1), v.stride(2), v.stride(3),
-                    do.stride(0), do.stride(1), do.stride(2), do.stride(3),
-                    dq.stride(0), dq.stride(1), dq.stride(2), dq.stride(3),
-                    max_seqlens_q=max_seqlens_q,
-                    max_seqlens_k=max_seqlens_k,
-                    head_dim=Lk,
-                    dropout_p=ctx.dropout_p,
-                    philox_seed=ctx.philox_seed,
-                    philox_offset_base=ctx.philox_offset,
-                    BLOCK_M=BLOCK_M, BLOCK_N=BLOCK_N,
-                    BLOCK_DMODEL=head_dim_rounded,
-                    CAUSAL=ctx.causal,
-                    num_warps=4, waves_per_eu=1,
-                    num_stages=1,
-                    ENABLE_DROPOUT=ctx.dropout_p > 0.0,
-                    PADDED_HEAD=padded_head,
-                )
         # print(h.asm["ttgir"])
-        return dq, dk, dv, None, None, None, None, None, None
+        return dq, dk, dv, None, None, None, None, None, None, None, None, None, None, None, None, None
 
 attention = _attention.apply
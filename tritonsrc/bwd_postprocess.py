@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+"""
+Fused Attention
+===============
+
+This is a Triton implementation of the Flash Attention v2 algorithm from Tri Dao (https://tridao.me/publications/flash2/flash2.pdf)
+
+Extra Credits:
+- Original flash attention paper (https://arxiv.org/abs/2205.14135)
+- Rabe and Staats (https://arxiv.org/pdf/2112.05682v2.pdf)
+- Adam P. Goucher for simplified vector math
+
+"""
+import triton
+import triton.language as tl
+
+
+# Converts the fp32 dQ accumulated by bwd_kernel_dk_dv (FUSED_DQ) to the
+# dtype of DQ
+@triton.jit
+def bwd_postprocess(
+    DQ_ACC, DQ,
+    stride_accz, stride_acch, stride_accm, stride_accn,
+    stride_dqz, stride_dqh, stride_dqm, stride_dqn,
+    cu_seqlens_q,
+    max_seqlens_q,
+    head_dim,
+    BLOCK_M: tl.constexpr,
+    D_HEAD: tl.constexpr,
+    PADDED_HEAD: tl.constexpr,
+    VARLEN: tl.constexpr,
+):
+    off_m = tl.program_id(0) * BLOCK_M
+    off_h = tl.program_id(1) # head index
+    off_z = tl.program_id(2) # batch index
+    if VARLEN:
+        cu_seqlens_q_start = tl.load(cu_seqlens_q + off_z)
+        cu_seqlens_q_end = tl.load(cu_seqlens_q + off_z + 1)
+        seqlen_q = cu_seqlens_q_end - cu_seqlens_q_start
+        if off_m >= seqlen_q:
+            return
+        batch_index = 0
+    else:
+        cu_seqlens_q_start = 0
+        seqlen_q = max_seqlens_q
+        batch_index = off_z
+    acc_offset = off_h * stride_acch + batch_index * stride_accz + cu_seqlens_q_start * stride_accm
+    ACC_block_ptr = tl.make_block_ptr(
+        base=DQ_ACC + acc_offset,
+        shape=(seqlen_q, head_dim),
+        strides=(stride_accm, stride_accn),
+        offsets=(off_m, 0),
+        block_shape=(BLOCK_M, D_HEAD),
+        order=(1, 0)
+    )
+    dq_offset = off_h * stride_dqh + batch_index * stride_dqz + cu_seqlens_q_start * stride_dqm
+    DQ_block_ptr = tl.make_block_ptr(
+        base=DQ + dq_offset,
+        shape=(seqlen_q, head_dim),
+        strides=(stride_dqm, stride_dqn),
+        offsets=(off_m, 0),
+        block_shape=(BLOCK_M, D_HEAD),
+        order=(1, 0)
+    )
+    dq = tl.load(ACC_block_ptr, boundary_check=(0,1), padding_option="zero")
+    tl.store(DQ_block_ptr, dq.to(DQ.type.element_ty), boundary_check=(0,1))
@@ -24,11 +24,13 @@ def bwd_preprocess(
     Delta,
     stride_oz, stride_oh, stride_om, stride_on,
     stride_doz, stride_doh, stride_dom, stride_don,
-    seqlen_q,
+    cu_seqlens_q,
+    max_seqlens_q,
     head_dim,
     BLOCK_M: tl.constexpr,
     D_HEAD: tl.constexpr,
     PADDED_HEAD: tl.constexpr,
+    VARLEN: tl.constexpr,
 ):
     # off_m = tl.program_id(0) * BLOCK_M + tl.arange(0, BLOCK_M)
     # off_n = tl.arange(0, D_HEAD)
@@ -36,7 +38,18 @@ def bwd_preprocess(
     off_h = tl.program_id(1) # head index
     off_z = tl.program_id(2) # batch index
     num_h = tl.num_programs(1)
-    o_offset = off_h * stride_oh + off_z * stride_oz
+    if VARLEN:
+        cu_seqlens_q_start = tl.load(cu_seqlens_q + off_z)
+        cu_seqlens_q_end = tl.load(cu_seqlens_q + off_z + 1)
+        seqlen_q = cu_seqlens_q_end - cu_seqlens_q_start
+        if off_m >= seqlen_q:
+            return
+        batch_index = 0
+    else:
+        cu_seqlens_q_start = 0
+        seqlen_q = max_seqlens_q
+        batch_index = off_z
+    o_offset = off_h * stride_oh + batch_index * stride_oz + cu_seqlens_q_start * stride_om
     O_block_ptr = tl.make_block_ptr(
         base=Out + o_offset,
         shape=(seqlen_q, head_dim),
@@ -45,7 +58,7 @@ def bwd_preprocess(
         block_shape=(BLOCK_M, D_HEAD),
         order=(1, 0)
     )
-    do_offset = off_h * stride_doh + off_z * stride_doz
+    do_offset = off_h * stride_doh + batch_index * stride_doz + cu_seqlens_q_start * stride_dom
     DO_block_ptr = tl.make_block_ptr(
         base=DO + do_offset,
         shape=(seqlen_q, head_dim),
@@ -64,7 +77,7 @@ def bwd_preprocess(
     # write-back, shape (q.shape[0] * q.shape[1], q.shape[2])
     off_zh = off_z * num_h + off_h * 1
     # Check for OOB accesses
-    delta_ptrs = Delta + off_zh * seqlen_q + off_m + tl.arange(0, BLOCK_M)
+    delta_ptrs = Delta + off_zh * max_seqlens_q + off_m + tl.arange(0, BLOCK_M)
     overflow = off_m + BLOCK_M - seqlen_q
     if overflow > 0:
         boundary = tl.full((BLOCK_M, ), BLOCK_M - overflow, dtype=tl.int32)
@@ -16,7 +16,7 @@ Extra Credits:
 """
 import triton
 import triton.language as tl
-from fwd_kernel import dropout_mask, dropout_rng, dropout_offsets
+from fwd_kernel import dropout_mask, dropout_rng, dropout_offsets, load_dropout_bitmask
 
 # Helper function, but not always usable due to compiler bugs (esp. used with tl.trans)
 @triton.jit
@@ -29,82 +29,92 @@ def dot(BLOCK_M : tl.constexpr, QDIM : tl.constexpr, KDIM : tl.constexpr, q, k):
 # TODO: Remove Unused 'Out' Argument from kernels below
 @triton.jit
 def bwd_kernel_dk_dv(
-    Q, K, V, sm_scale, Out, DO,
-    DK, DV,
+    Q, K, V, B, sm_scale, Out, DO,
+    DK, DV, DQ_ACC,
     L,
     D,
     stride_qz, stride_qh, stride_qm, stride_qk,
     stride_kz, stride_kh, stride_kn, stride_kk,
     stride_vz, stride_vh, stride_vk, stride_vn,
     stride_oz, stride_oh, stride_om, stride_ok,
+    stride_doz, stride_doh, stride_dom, stride_dok,
+    stride_bz, stride_bh, stride_bm, stride_bn,
     stride_dkz, stride_dkh, stride_dkn, stride_dkk,
     stride_dvz, stride_dvh, stride_dvk, stride_dvn,
+    stride_dqz, stride_dqh, stride_dqm, stride_dqk,
+    num_head_q, num_head_k,
+    cu_seqlens_q, cu_seqlens_k,
     max_seqlens_q, max_seqlens_k,
     head_dim,
+    window_left, window_right,
     dropout_p,
     philox_seed,
     philox_offset_base,
+    dropout_bitmask,
     BLOCK_M: tl.constexpr,
     BLOCK_DMODEL: tl.constexpr,
     BLOCK_N: tl.constexpr,
     CAUSAL: tl.constexpr,
     ENABLE_DROPOUT: tl.constexpr,
+    BIAS_TYPE: tl.constexpr,
     PADDED_HEAD: tl.constexpr,
+    VARLEN: tl.constexpr,
+    FUSED_DQ: tl.constexpr,
+    INLINE_DELTA: tl.constexpr,
 ):
     start_m = tl.program_id(0) * BLOCK_N
-    off_h = tl.program_id(1) # head index
+    off_h_k = tl.program_id(1) # head index of K/V
     off_z = tl.program_id(2) # batch index
-    num_h = tl.num_programs(1)
     num_z = tl.num_programs(2)
-    # TODO: Support varlen here
-    seqlen_q = max_seqlens_q
-    seqlen_k = max_seqlens_k
+    # GQA/MQA: programs run over the heads of K and V, and dK/dV are reduced
+    # over the group_size heads of Q that share the same K/V head.
+    group_size = num_head_q // num_head_k
+    if VARLEN:
+        cu_seqlens_q_start = tl.load(cu_seqlens_q + off_z)
+        cu_seqlens_q_end = tl.load(cu_seqlens_q + off_z + 1)
+        seqlen_q = cu_seqlens_q_end - cu_seqlens_q_start
+        cu_seqlens_k_start = tl.load(cu_seqlens_k + off_z)
+        cu_seqlens_k_end = tl.load(cu_seqlens_k + off_z + 1)
+        seqlen_k = cu_seqlens_k_end - cu_seqlens_k_start
+        # The grid covers max_seqlens_k
+        if start_m >= seqlen_k:
+            return
+        batch_index = 0
+    else:
+        cu_seqlens_q_start = 0
+        cu_seqlens_k_start = 0
+        seqlen_q = max_seqlens_q
+        seqlen_k = max_seqlens_k
+        batch_index = off_z
     # initialize offsets
     offs_m = start_m + tl.arange(0, BLOCK_N)
     offs_n = tl.arange(0, BLOCK_M)
-    # Initialize pointers to Q, K, V
-    # Q is consumed depending on block ID. Every block uses
-    # previous block offset by BLOCK_M x D_HEAD.
-    q_offset = off_h * stride_qh + off_z * stride_qz
-    Q_block_ptr = tl.make_block_ptr(
-        base=Q + q_offset,
-        shape=(seqlen_q, head_dim),
-        strides=(stride_qm, stride_qk),
-        offsets=(0, 0),
-        block_shape=(BLOCK_M, BLOCK_DMODEL),
-        order=(1, 0)
-    )
-    k_offset = off_h * stride_kh + off_z * stride_kz
+    # Split of non-power-of-two BLOCK_DMODEL, see attn_fwd
+    if (BLOCK_DMODEL & (BLOCK_DMODEL - 1)) == 0:
+        BLOCK_DMODEL_MAIN = BLOCK_DMODEL
+        BLOCK_DMODEL_TAIL = 0
+    else:
+        BLOCK_DMODEL_MAIN = BLOCK_DMODEL & (BLOCK_DMODEL - 1)
+        BLOCK_DMODEL_TAIL = BLOCK_DMODEL - BLOCK_DMODEL_MAIN
+    # Initialize pointers to K, V
+    k_offset = off_h_k * stride_kh + batch_index * stride_kz + cu_seqlens_k_start * stride_kn
     KT_block_ptr = tl.make_block_ptr(
         base=K + k_offset,
         shape=(head_dim, seqlen_k),
         strides=(stride_kk, stride_kn),
         offsets=(0, start_m),
-        block_shape=(BLOCK_DMODEL, BLOCK_N),
+        block_shape=(BLOCK_DMODEL_MAIN, BLOCK_N),
         order=(0, 1)
     )
-    v_offset = off_h * stride_vh + off_z * stride_vz
+    v_offset = off_h_k * stride_vh + batch_index * stride_vz + cu_seqlens_k_start * stride_vk
     VT_block_ptr = tl.make_block_ptr(
         base=V + v_offset,
         shape=(head_dim, seqlen_k),
         strides=(stride_vn, stride_vk),
         offsets=(0, start_m),
-        block_shape=(BLOCK_DMODEL, BLOCK_N),
+        block_shape=(BLOCK_DMODEL_MAIN, BLOCK_N),
         order=(0, 1)
     )
-    do_offset = off_h * stride_oh + off_z * stride_oz
-    DO_block_ptr = tl.make_block_ptr(
-        base=DO + do_offset,
-        shape=(seqlen_q, head_dim),
-        strides=(stride_om, stride_ok),
-        offsets=(0, 0),
-        block_shape=(BLOCK_M, BLOCK_DMODEL),
-        order=(1, 0)
-    )
-    off_zh = off_z * num_h + off_h * 1
-    # pointer to row-wise quantities in value-like data
-    D_ptrs = D + off_zh * seqlen_q
-    l_ptrs = L + off_zh * seqlen_q
     qk_scale = sm_scale * 1.44269504089
     # load k and v: they will stay in SRAM throughout
     # (BLOCK_DMODEL, BLOCK_N)
@@ -118,16 +128,42 @@ def bwd_kernel_dk_dv(
         vt = tl.load(VT_block_ptr, boundary_check=(1,0), padding_option="zero")
     else:
         vt = tl.load(VT_block_ptr, boundary_check=(1,), padding_option="zero")
-    dv = tl.zeros([BLOCK_N, BLOCK_DMODEL], dtype=tl.float32)
-    dk = tl.zeros([BLOCK_N, BLOCK_DMODEL], dtype=tl.float32)
-    # This lower loop bound is because of the causal mask. We create a lower triangular
-    # result. The upper triangular is -inf (becomes 0 when we do e^x). As such, it can
-    # be ignored in the GEMM.
-    lo = (start_m // BLOCK_M) * BLOCK_M if CAUSAL else 0
-    hi = seqlen_q
-    Q_block_ptr = tl.advance(Q_block_ptr, (lo, 0))
-    DO_block_ptr = tl.advance(DO_block_ptr, (lo, 0))
-    batch_philox_offset = philox_offset_base + off_zh * seqlen_q * seqlen_k
+    dv = tl.zeros([BLOCK_N, BLOCK_DMODEL_MAIN], dtype=tl.float32)
+    dk = tl.zeros([BLOCK_N, BLOCK_DMODEL_MAIN], dtype=tl.float32)
+    if BLOCK_DMODEL_TAIL > 0:
+        KT_tail_block_ptr = tl.make_block_ptr(
+            base=K + k_offset,
+            shape=(head_dim, seqlen_k),
+            strides=(stride_kk, stride_kn),
+            offsets=(BLOCK_DMODEL_MAIN, start_m),
+            block_shape=(BLOCK_DMODEL_TAIL, BLOCK_N),
+            order=(0, 1)
+        )
+        VT_tail_block_ptr = tl.make_block_ptr(
+            base=V + v_offset,
+            shape=(head_dim, seqlen_k),
+            strides=(stride_vn, stride_vk),
+            offsets=(BLOCK_DMODEL_MAIN, start_m),
+            block_shape=(BLOCK_DMODEL_TAIL, BLOCK_N),
+            order=(0, 1)
+        )
+        if PADDED_HEAD:
+            kt_tail = tl.load(KT_tail_block_ptr, boundary_check=(1,0), padding_option="zero")
+            vt_tail = tl.load(VT_tail_block_ptr, boundary_check=(1,0), padding_option="zero")
+        else:
+            kt_tail = tl.load(KT_tail_block_ptr, boundary_check=(1,), padding_option="zero")
+            vt_tail = tl.load(VT_tail_block_ptr, boundary_check=(1,), padding_option="zero")
+        kt_tail = (kt_tail * qk_scale).to(KT_tail_block_ptr.type.element_ty)
+        dv_tail = tl.zeros([BLOCK_N, BLOCK_DMODEL_TAIL], dtype=tl.float32)
+        dk_tail = tl.zeros([BLOCK_N, BLOCK_DMODEL_TAIL], dtype=tl.float32)
+    # Causal attention is a window with window_right == 0
+    if CAUSAL:
+        window_right = 0
+    # Key j is attended by rows [j - window_right, j + window_left]. Blocks of Q
+    # outside the window of this block of K are -inf (becomes 0 when we do
+    # e^x). As such, they can be ignored in the GEMM.
+    lo = (max(0, start_m - window_right) // BLOCK_M) * BLOCK_M
+    hi = min(seqlen_q, start_m + BLOCK_N + window_left)
     '''
            K1   K2      (d)V      dO
     Q1    qk11 qk12     (d)v1     dO1
@@ -145,173 +181,417 @@ def bwd_kernel_dk_dv(
     start_m: select k and dV
     start_n: select q and dO
     '''
-    # loop over q (seqlen_q, dhead), do (seqlen_q, d_head)
-    for start_n in range(lo, hi, BLOCK_M):
-        offs_m_curr = offs_n[:, None] + start_n # (BLOCK_M, 1)
-        # -- load q, do --
-        # TODO: It is more optimal to do OOB check only in the last iter.
-        # (BLOCK_M, BLOCK_DMODEL), offs = (BLOCK_M * iter, 0) = (start_n, 0)
-        if PADDED_HEAD:
-            q = tl.load(Q_block_ptr, boundary_check=(0,1), padding_option="zero")
-        else:
-            q = tl.load(Q_block_ptr, boundary_check=(0,), padding_option="zero")
-        # do: (BLOCK_M, BLOCK_DMODEL)
-        if PADDED_HEAD:
-            do = tl.load(DO_block_ptr, boundary_check=(0,1), padding_option="zero")
-        else:
-            do = tl.load(DO_block_ptr, boundary_check=(0,), padding_option="zero")
-        # -- compute qk ----
-        qk = tl.zeros([BLOCK_M, BLOCK_N], dtype=tl.float32)
-        # TODO: These two checks can be optimized to occur on the last iter.
-        overflow_size = start_n + BLOCK_M - seqlen_q
-        if overflow_size > 0:
-            boundary_n = tl.full((BLOCK_N, ), seqlen_q, dtype=tl.int32)
-            mask = offs_m_curr < boundary_n[None, :]
-            qk = tl.where(mask, qk, float("-inf"))
-        if CAUSAL:
-            qk = tl.where(offs_m_curr >= offs_m[None, :], qk, float("-inf"))
-        # q.offs = (start_n, 0), k.offs = (0, start_m)
-        qk += dot(BLOCK_M, BLOCK_DMODEL, BLOCK_DMODEL, q, kt) # (BLOCK_M, BLOCK_N)
-        # Check for OOB accesses on D and LSE
-        boundary = tl.full((BLOCK_M, ), BLOCK_M - overflow_size, dtype=tl.int32)
-        d_lse_ptrs_mask = boundary > tl.arange(0, BLOCK_M)
-        d_lse_padding = tl.full((BLOCK_M, ), 0, dtype=tl.float32)
-        Di = tl.load(D_ptrs + offs_m_curr,
-                     mask=d_lse_ptrs_mask[:, None],
-                     other=d_lse_padding[:, None])
-        l_i = tl.load(l_ptrs + offs_m_curr,
-                      mask=d_lse_ptrs_mask[:,None],
-                      other=d_lse_padding[:, None])
-        p = tl.math.exp2(qk - l_i) # (BLOCK_M, BLOCK_N)
-        # -- compute dv ----
+    for off_h in range(off_h_k * group_size, off_h_k * group_size + group_size):
+        # Q is consumed depending on block ID. Every block uses
+        # previous block offset by BLOCK_M x D_HEAD.
+        q_offset = off_h * stride_qh + batch_index * stride_qz + cu_seqlens_q_start * stride_qm
+        Q_block_ptr = tl.make_block_ptr(
+            base=Q + q_offset,
+            shape=(seqlen_q, head_dim),
+            strides=(stride_qm, stride_qk),
+            offsets=(lo, 0),
+            block_shape=(BLOCK_M, BLOCK_DMODEL_MAIN),
+            order=(1, 0)
+        )
+        do_offset = off_h * stride_doh + batch_index * stride_doz + cu_seqlens_q_start * stride_dom
+        DO_block_ptr = tl.make_block_ptr(
+            base=DO + do_offset,
+            shape=(seqlen_q, head_dim),
+            strides=(stride_dom, stride_dok),
+            offsets=(lo, 0),
+            block_shape=(BLOCK_M, BLOCK_DMODEL_MAIN),
+            order=(1, 0)
+        )
+        if BLOCK_DMODEL_TAIL > 0:
+            Q_tail_block_ptr = tl.make_block_ptr(
+                base=Q + q_offset,
+                shape=(seqlen_q, head_dim),
+                strides=(stride_qm, stride_qk),
+                offsets=(lo, BLOCK_DMODEL_MAIN),
+                block_shape=(BLOCK_M, BLOCK_DMODEL_TAIL),
+                order=(1, 0)
+            )
+            DO_tail_block_ptr = tl.make_block_ptr(
+                base=DO + do_offset,
+                shape=(seqlen_q, head_dim),
+                strides=(stride_dom, stride_dok),
+                offsets=(lo, BLOCK_DMODEL_MAIN),
+                block_shape=(BLOCK_M, BLOCK_DMODEL_TAIL),
+                order=(1, 0)
+            )
+        if INLINE_DELTA:
+            o_offset = off_h * stride_oh + batch_index * stride_oz + cu_seqlens_q_start * stride_om
+            O_block_ptr = tl.make_block_ptr(
+                base=Out + o_offset,
+                shape=(seqlen_q, head_dim),
+                strides=(stride_om, stride_ok),
+                offsets=(lo, 0),
+                block_shape=(BLOCK_M, BLOCK_DMODEL_MAIN),
+                order=(1, 0)
+            )
+            if BLOCK_DMODEL_TAIL > 0:
+                O_tail_block_ptr = tl.make_block_ptr(
+                    base=Out + o_offset,
+                    shape=(seqlen_q, head_dim),
+                    strides=(stride_om, stride_ok),
+                    offsets=(lo, BLOCK_DMODEL_MAIN),
+                    block_shape=(BLOCK_M, BLOCK_DMODEL_TAIL),
+                    order=(1, 0)
+                )
+        off_zh = off_z * num_head_q + off_h * 1
+        # pointer to row-wise quantities in value-like data
+        D_ptrs = D + off_zh * max_seqlens_q
+        l_ptrs = L + off_zh * max_seqlens_q
+        if BIAS_TYPE == 1:
+            B_block_ptr = tl.make_block_ptr(
+                    base=B + off_h * stride_bh + off_z * stride_bz,
+                    shape=(seqlen_q, seqlen_k),
+                    strides=(stride_bm, stride_bn),
+                    offsets=(lo, start_m),
+                    block_shape=(BLOCK_M, BLOCK_N),
+                    order=(1, 0)
+                    )
+        batch_philox_offset = philox_offset_base + off_zh * max_seqlens_q * max_seqlens_k
+        # dropout_bitmask is optional, see attn_fwd
+        load_bitmask = False
+        bitmask_ptr = 0
         if ENABLE_DROPOUT:
-            philox_offset = batch_philox_offset + start_n * seqlen_k + start_m
-            keep = dropout_mask(philox_seed, philox_offset, dropout_p, BLOCK_M, BLOCK_N, seqlen_k)
-            # CAVEAT: do NOT update p, ds needs the original p
+            if dropout_bitmask is not None:
+                load_bitmask = dropout_bitmask.to(tl.uint64, bitcast=True) != 0
+                bitmask_ptr = dropout_bitmask + off_zh * max_seqlens_q * tl.cdiv(max_seqlens_k, 32)
+        # FUSED_DQ: dQ is accumulated into the fp32 DQ_ACC with atomics. Without
+        # DQ_ACC, bwd_kernel_dq computes dQ instead.
+        store_dq = False
+        if FUSED_DQ:
+            dq_offset = off_h * stride_dqh + batch_index * stride_dqz + cu_seqlens_q_start * stride_dqm
+            if DQ_ACC is not None:
+                store_dq = DQ_ACC.to(tl.uint64, bitcast=True) != 0
+        # loop over q (seqlen_q, dhead), do (seqlen_q, d_head)
+        for start_n in range(lo, hi, BLOCK_M):
+            offs_m_curr = offs_n[:, None] + start_n # (BLOCK_M, 1)
+            # -- load q, do --
+            # TODO: It is more optimal to do OOB check only in the last iter.
+            # (BLOCK_M, BLOCK_DMODEL), offs = (BLOCK_M * iter, 0) = (start_n, 0)
+            if PADDED_HEAD:
+                q = tl.load(Q_block_ptr, boundary_check=(0,1), padding_option="zero")
+            else:
+                q = tl.load(Q_block_ptr, boundary_check=(0,), padding_option="zero")
+            # do: (BLOCK_M, BLOCK_DMODEL)
+            if PADDED_HEAD:
+                do = tl.load(DO_block_ptr, boundary_check=(0,1), padding_option="zero")
+            else:
+                do = tl.load(DO_block_ptr, boundary_check=(0,), padding_option="zero")
+            if BLOCK_DMODEL_TAIL > 0:
+                if PADDED_HEAD:
+                    q_tail = tl.load(Q_tail_block_ptr, boundary_check=(0,1), padding_option="zero")
+                    do_tail = tl.load(DO_tail_block_ptr, boundary_check=(0,1), padding_option="zero")
+                else:
+                    q_tail = tl.load(Q_tail_block_ptr, boundary_check=(0,), padding_option="zero")
+                    do_tail = tl.load(DO_tail_block_ptr, boundary_check=(0,), padding_option="zero")
+            # -- compute qk ----
+            qk = tl.zeros([BLOCK_M, BLOCK_N], dtype=tl.float32)
+            # TODO: These two checks can be optimized to occur on the last iter.
+            overflow_size = start_n + BLOCK_M - seqlen_q
+            if overflow_size > 0:
+                boundary_n = tl.full((BLOCK_N, ), seqlen_q, dtype=tl.int32)
+                mask = offs_m_curr < boundary_n[None, :]
+                qk = tl.where(mask, qk, float("-inf"))
+            # Only blocks partially outside the window need the mask
+            if (start_n + BLOCK_M - 1 - window_left > start_m) | (start_m + BLOCK_N - 1 > start_n + window_right):
+                window_mask = (offs_m[None, :] >= offs_m_curr - window_left) & \
+                              (offs_m[None, :] <= offs_m_curr + window_right)
+                qk = tl.where(window_mask, qk, float("-inf"))
+            # q.offs = (start_n, 0), k.offs = (0, start_m)
+            qk += dot(BLOCK_M, BLOCK_DMODEL_MAIN, BLOCK_DMODEL_MAIN, q, kt) # (BLOCK_M, BLOCK_N)
+            if BLOCK_DMODEL_TAIL > 0:
+                qk += dot(BLOCK_M, BLOCK_DMODEL_TAIL, BLOCK_DMODEL_TAIL, q_tail, kt_tail)
+            if BIAS_TYPE == 1:
+                bias = tl.load(B_block_ptr, boundary_check=(0,1), padding_option="zero")
+                qk += bias * 1.44269504089
+            # Check for OOB accesses on D and LSE
+            boundary = tl.full((BLOCK_M, ), BLOCK_M - overflow_size, dtype=tl.int32)
+            d_lse_ptrs_mask = boundary > tl.arange(0, BLOCK_M)
+            d_lse_padding = tl.full((BLOCK_M, ), 0, dtype=tl.float32)
+            if INLINE_DELTA:
+                # delta = rowsum(O * dO) of bwd_preprocess, computed in place
+                if PADDED_HEAD:
+                    o = tl.load(O_block_ptr, boundary_check=(0,1), padding_option="zero")
+                else:
+                    o = tl.load(O_block_ptr, boundary_check=(0,), padding_option="zero")
+                Di = tl.sum(o.to(tl.float32) * do.to(tl.float32), axis=1)[:, None]
+                if BLOCK_DMODEL_TAIL > 0:
+                    if PADDED_HEAD:
+                        o_tail = tl.load(O_tail_block_ptr, boundary_check=(0,1), padding_option="zero")
+                    else:
+                        o_tail = tl.load(O_tail_block_ptr, boundary_check=(0,), padding_option="zero")
+                    Di += tl.sum(o_tail.to(tl.float32) * do_tail.to(tl.float32), axis=1)[:, None]
+            else:
+                Di = tl.load(D_ptrs + offs_m_curr,
+                             mask=d_lse_ptrs_mask[:, None],
+                             other=d_lse_padding[:, None])
+            l_i = tl.load(l_ptrs + offs_m_curr,
+                          mask=d_lse_ptrs_mask[:,None],
+                          other=d_lse_padding[:, None])
+            p = tl.math.exp2(qk - l_i) # (BLOCK_M, BLOCK_N)
+            # -- compute dv ----
+            if ENABLE_DROPOUT:
+                if load_bitmask:
+                    keep = load_dropout_bitmask(bitmask_ptr, start_n, start_m, BLOCK_M, BLOCK_N,
+                                                seqlen_q, tl.cdiv(max_seqlens_k, 32))
+                else:
+                    keep = dropout_mask(philox_seed, batch_philox_offset + start_n * max_seqlens_k + start_m,
+                                        dropout_p, BLOCK_M, BLOCK_N, max_seqlens_k)
+                # CAVEAT: do NOT update p, ds needs the original p
+                p_dropped = tl.where(keep, p / (1 - dropout_p), 0.0)
+            else:
+                p_dropped = p
             if BLOCK_M == 1:
-                dv += tl.where(keep, p / (1 - dropout_p), 0.0).to(Q.dtype.element_ty) * do
+                dv += p_dropped.to(Q.dtype.element_ty) * do
+                if BLOCK_DMODEL_TAIL > 0:
+                    dv_tail += p_dropped.to(Q.dtype.element_ty) * do_tail
             else:
-                dv += tl.dot(tl.trans(tl.where(keep, p / (1 - dropout_p), 0.0)).to(Q.dtype.element_ty), do)
-        else:
+                dv += tl.dot(tl.trans(p_dropped).to(Q.dtype.element_ty), do)
+                if BLOCK_DMODEL_TAIL > 0:
+                    dv_tail += tl.dot(tl.trans(p_dropped).to(Q.dtype.element_ty), do_tail)
+            dp = tl.zeros([BLOCK_M, BLOCK_N], dtype=tl.float32)
+            # compute dp = dot(do, vt)
+            # dp += dot(BLOCK_M, BLOCK_DMODEL, BLOCK_DMODEL, do, vt)
+            # do.shape = (BLOCK_M, BLOCK_DMODEL) vt.shape = (BLOCK_DMODEL, BLOCK_N)
+            dp += tl.dot(do, vt)
+            if BLOCK_DMODEL_TAIL > 0:
+                dp += tl.dot(do_tail, vt_tail)
+            if ENABLE_DROPOUT:
+                dp = tl.where(keep, dp / (1 - dropout_p), 0)
+            # compute ds = p * (dp - delta[:, None])
+            ds = p * (dp - Di) # (BLOCK_M, BLOCK_N)
+            # compute dk
             if BLOCK_M == 1:
-                dv += p.to(Q.dtype.element_ty) * do
+                dk += ds.to(Q.dtype.element_ty) * q
+                if BLOCK_DMODEL_TAIL > 0:
+                    dk_tail += ds.to(Q.dtype.element_ty) * q_tail
             else:
-                # dv += tl.dot(tl.trans(p.to(do.dtype)), do)
-                dv += tl.dot(tl.trans(p).to(do.dtype), do)
-        dp = tl.zeros([BLOCK_M, BLOCK_N], dtype=tl.float32)
-        # compute dp = dot(do, vt)
-        # dp += dot(BLOCK_M, BLOCK_DMODEL, BLOCK_DMODEL, do, vt)
-        # do.shape = (BLOCK_M, BLOCK_DMODEL) vt.shape = (BLOCK_DMODEL, BLOCK_N)
-        dp += tl.dot(do, vt)
-        if ENABLE_DROPOUT:
-            dp = tl.where(keep, dp / (1 - dropout_p), 0)
-        # compute ds = p * (dp - delta[:, None])
-        ds = p * (dp - Di) # (BLOCK_M, BLOCK_N)
-        # compute dk
-        if BLOCK_M == 1:
-            dk += ds.to(Q.dtype.element_ty) * q
-        else:
-            # ds.shape = (BLOCK_M, BLOCK_N), q.shape = (BLOCK_M, BLOCK_DMODEL)
-            dk += tl.dot(tl.trans(ds.to(Q.dtype.element_ty)), q) # (BLOCK_N, BLOCK_DMODEL)
-        # update pointers
-        Q_block_ptr = tl.advance(Q_block_ptr, (BLOCK_M, 0))
-        DO_block_ptr = tl.advance(DO_block_ptr, (BLOCK_M, 0)) # Debug DO accessing problems
+                # ds.shape = (BLOCK_M, BLOCK_N), q.shape = (BLOCK_M, BLOCK_DMODEL)
+                dk += tl.dot(tl.trans(ds.to(Q.dtype.element_ty)), q) # (BLOCK_N, BLOCK_DMODEL)
+                if BLOCK_DMODEL_TAIL > 0:
+                    dk_tail += tl.dot(tl.trans(ds.to(Q.dtype.element_ty)), q_tail)
+            if store_dq:
+                # kt is scaled by sm_scale * log2(e), and ln(2) = 1 / log2(e)
+                dq_rows = start_n + offs_n
+                offs_d = tl.arange(0, BLOCK_DMODEL_MAIN)
+                dq_ptrs = DQ_ACC + dq_offset + dq_rows[:, None] * stride_dqm + offs_d[None, :] * stride_dqk
+                dq_mask = (dq_rows[:, None] < seqlen_q) & (offs_d[None, :] < head_dim)
+                if BLOCK_M == 1:
+                    dq = tl.sum(ds * kt.to(tl.float32), axis=1)[None, :]
+                else:
+                    dq = tl.dot(ds.to(Q.dtype.element_ty), tl.trans(kt))
+                tl.atomic_add(dq_ptrs, dq * 0.6931471805599453, mask=dq_mask)
+                if BLOCK_DMODEL_TAIL > 0:
+                    offs_d_tail = BLOCK_DMODEL_MAIN + tl.arange(0, BLOCK_DMODEL_TAIL)
+                    dq_tail_ptrs = DQ_ACC + dq_offset + dq_rows[:, None] * stride_dqm + offs_d_tail[None, :] * stride_dqk
+                    dq_tail_mask = (dq_rows[:, None] < seqlen_q) & (offs_d_tail[None, :] < head_dim)
+                    if BLOCK_M == 1:
+                        dq_tail = tl.sum(ds * kt_tail.to(tl.float32), axis=1)[None, :]
+                    else:
+                        dq_tail = tl.dot(ds.to(Q.dtype.element_ty), tl.trans(kt_tail))
+                    tl.atomic_add(dq_tail_ptrs, dq_tail * 0.6931471805599453, mask=dq_tail_mask)
+            # update pointers
+            Q_block_ptr = tl.advance(Q_block_ptr, (BLOCK_M, 0))
+            DO_block_ptr = tl.advance(DO_block_ptr, (BLOCK_M, 0)) # Debug DO accessing problems
+            if BLOCK_DMODEL_TAIL > 0:
+                Q_tail_block_ptr = tl.advance(Q_tail_block_ptr, (BLOCK_M, 0))
+                DO_tail_block_ptr = tl.advance(DO_tail_block_ptr, (BLOCK_M, 0))
+            if INLINE_DELTA:
+                O_block_ptr = tl.advance(O_block_ptr, (BLOCK_M, 0))
+                if BLOCK_DMODEL_TAIL > 0:
+                    O_tail_block_ptr = tl.advance(O_tail_block_ptr, (BLOCK_M, 0))
+            if BIAS_TYPE == 1:
+                B_block_ptr = tl.advance(B_block_ptr, (BLOCK_M, 0))
     # initialize pointers to output
-    dk_offset = off_h * stride_dkh + off_z * stride_dkz
+    dk_offset = off_h_k * stride_dkh + batch_index * stride_dkz + cu_seqlens_k_start * stride_dkn
     DK_block_ptr = tl.make_block_ptr(
         base=DK + dk_offset,
         shape=(seqlen_k, head_dim),
         strides=(stride_dkn, stride_dkk),
         offsets=(start_m, 0),
-        block_shape=(BLOCK_N, BLOCK_DMODEL),
+        block_shape=(BLOCK_N, BLOCK_DMODEL_MAIN),
         order=(1, 0)
     )
-    dv_offset = off_h * stride_dvh + off_z * stride_dvz
+    dv_offset = off_h_k * stride_dvh + batch_index * stride_dvz + cu_seqlens_k_start * stride_dvk
     DV_block_ptr = tl.make_block_ptr(
         base=DV + dv_offset,
         shape=(seqlen_k, head_dim),
         strides=(stride_dvk, stride_dvn),
         offsets=(start_m, 0),
-        block_shape=(BLOCK_N, BLOCK_DMODEL),
+        block_shape=(BLOCK_N, BLOCK_DMODEL_MAIN),
         order=(1, 0)
     )
     tl.store(DK_block_ptr, (dk * sm_scale).to(DK.type.element_ty), boundary_check=(0,1))
     tl.store(DV_block_ptr, dv.to(DV.type.element_ty), boundary_check=(0,1))
+    if BLOCK_DMODEL_TAIL > 0:
+        DK_tail_block_ptr = tl.make_block_ptr(
+            base=DK + dk_offset,
+            shape=(seqlen_k, head_dim),
+            strides=(stride_dkn, stride_dkk),
+            offsets=(start_m, BLOCK_DMODEL_MAIN),
+            block_shape=(BLOCK_N, BLOCK_DMODEL_TAIL),
+            order=(1, 0)
+        )
+        DV_tail_block_ptr = tl.make_block_ptr(
+            base=DV + dv_offset,
+            shape=(seqlen_k, head_dim),
+            strides=(stride_dvk, stride_dvn),
+            offsets=(start_m, BLOCK_DMODEL_MAIN),
+            block_shape=(BLOCK_N, BLOCK_DMODEL_TAIL),
+            order=(1, 0)
+        )
+        tl.store(DK_tail_block_ptr, (dk_tail * sm_scale).to(DK.type.element_ty), boundary_check=(0,1))
+        tl.store(DV_tail_block_ptr, dv_tail.to(DV.type.element_ty), boundary_check=(0,1))
 
 @triton.jit
 def bwd_kernel_dq(
-    Q, K, V, sm_scale, Out, DO,
-    DQ,
+    Q, K, V, B, sm_scale, Out, DO,
+    DQ, DB,
     L,
     D,
     stride_qz, stride_qh, stride_qm, stride_qk,
     stride_kz, stride_kh, stride_kn, stride_kk,
     stride_vz, stride_vh, stride_vk, stride_vn,
     stride_oz, stride_oh, stride_om, stride_ok,
+    stride_doz, stride_doh, stride_dom, stride_dok,
     stride_dqz, stride_dqh, stride_dqm, stride_dqk,
+    stride_bz, stride_bh, stride_bm, stride_bn,
+    stride_dbz, stride_dbh, stride_dbm, stride_dbn,
+    num_head_q, num_head_k,
+    cu_seqlens_q, cu_seqlens_k,
     max_seqlens_q, max_seqlens_k,
     head_dim,
+    window_left, window_right,
     dropout_p,
     philox_seed,
     philox_offset_base,
+    dropout_bitmask,
     BLOCK_M: tl.constexpr, BLOCK_DMODEL: tl.constexpr,
     BLOCK_N: tl.constexpr,
     CAUSAL: tl.constexpr,
     ENABLE_DROPOUT: tl.constexpr,
+    BIAS_TYPE: tl.constexpr,
     PADDED_HEAD: tl.constexpr,
+    VARLEN: tl.constexpr,
+    INLINE_DELTA: tl.constexpr,
 ):
     start_m = tl.program_id(0) * BLOCK_M
     off_h = tl.program_id(1) # head index
     off_z = tl.program_id(2) # batch index
-    num_h = tl.num_programs(1)
     num_z = tl.num_programs(2)
-    # TODO: Support varlen here
-    seqlen_q = max_seqlens_q
-    seqlen_k = max_seqlens_k
+    # GQA/MQA: group_size heads of Q share the same K/V head
+    off_h_k = off_h // (num_head_q // num_head_k)
+    if VARLEN:
+        cu_seqlens_q_start = tl.load(cu_seqlens_q + off_z)
+        cu_seqlens_q_end = tl.load(cu_seqlens_q + off_z + 1)
+        seqlen_q = cu_seqlens_q_end - cu_seqlens_q_start
+        # The grid covers max_seqlens_q
+        if start_m >= seqlen_q:
+            return
+        cu_seqlens_k_start = tl.load(cu_seqlens_k + off_z)
+        cu_seqlens_k_end = tl.load(cu_seqlens_k + off_z + 1)
+        seqlen_k = cu_seqlens_k_end - cu_seqlens_k_start
+        batch_index = 0
+    else:
+        cu_seqlens_q_start = 0
+        cu_seqlens_k_start = 0
+        seqlen_q = max_seqlens_q
+        seqlen_k = max_seqlens_k
+        batch_index = off_z
     # initialize offsets
     offs_m = start_m + tl.arange(0, BLOCK_M)
     offs_n = tl.arange(0, BLOCK_N)
+    # Split of non-power-of-two BLOCK_DMODEL, see attn_fwd
+    if (BLOCK_DMODEL & (BLOCK_DMODEL - 1)) == 0:
+        BLOCK_DMODEL_MAIN = BLOCK_DMODEL
+        BLOCK_DMODEL_TAIL = 0
+    else:
+        BLOCK_DMODEL_MAIN = BLOCK_DMODEL & (BLOCK_DMODEL - 1)
+        BLOCK_DMODEL_TAIL = BLOCK_DMODEL - BLOCK_DMODEL_MAIN
     # Initialize pointers to Q, K, V
-    q_offset = off_h * stride_qh + off_z * stride_qz
+    q_offset = off_h * stride_qh + batch_index * stride_qz + cu_seqlens_q_start * stride_qm
     Q_block_ptr = tl.make_block_ptr(
         base=Q + q_offset,
         shape=(seqlen_q, head_dim),
         strides=(stride_qm, stride_qk),
         offsets=(start_m, 0),
-        block_shape=(BLOCK_M, BLOCK_DMODEL),
+        block_shape=(BLOCK_M, BLOCK_DMODEL_MAIN),
         order=(1, 0)
     )
-    k_offset = off_h * stride_kh + off_z * stride_kz
+    k_offset = off_h_k * stride_kh + batch_index * stride_kz + cu_seqlens_k_start * stride_kn
+    # Causal attention is a window with window_right == 0
+    if CAUSAL:
+        window_right = 0
+    # loop over the keys within the windows of this block, [lo, hi)
+    lo = (max(0, start_m - window_left) // BLOCK_N) * BLOCK_N
+    hi = min(seqlen_k, start_m + BLOCK_M + window_right)
     K_block_ptr = tl.make_block_ptr(
         base=K + k_offset,
         shape=(head_dim, seqlen_k),
         strides=(stride_kk, stride_kn),
-        offsets=(0, 0),
-        block_shape=(BLOCK_DMODEL, BLOCK_N),
+        offsets=(0, lo),
+        block_shape=(BLOCK_DMODEL_MAIN, BLOCK_N),
         order=(0, 1)
     )
-    v_offset = off_h * stride_vh + off_z * stride_vz
+    v_offset = off_h_k * stride_vh + batch_index * stride_vz + cu_seqlens_k_start * stride_vk
     V_block_ptr = tl.make_block_ptr(
         base=V + v_offset,
         shape=(head_dim, seqlen_k),
         strides=(stride_vn, stride_vk),
-        offsets=(0, 0),
-        block_shape=(BLOCK_DMODEL, BLOCK_N),
+        offsets=(0, lo),
+        block_shape=(BLOCK_DMODEL_MAIN, BLOCK_N),
         order=(0, 1)
     )
-    do_offset = off_h * stride_oh + off_z * stride_oz
+    do_offset = off_h * stride_doh + batch_index * stride_doz + cu_seqlens_q_start * stride_dom
     DO_block_ptr = tl.make_block_ptr(
         base=DO + do_offset,
         shape=(seqlen_q, head_dim),
-        strides=(stride_om, stride_ok),
+        strides=(stride_dom, stride_dok),
         offsets=(start_m, 0),
-        block_shape=(BLOCK_M, BLOCK_DMODEL),
+        block_shape=(BLOCK_M, BLOCK_DMODEL_MAIN),
         order=(1, 0)
     )
-    off_zh = off_z * num_h + off_h * 1
+    if BLOCK_DMODEL_TAIL > 0:
+        Q_tail_block_ptr = tl.make_block_ptr(
+            base=Q + q_offset,
+            shape=(seqlen_q, head_dim),
+            strides=(stride_qm, stride_qk),
+            offsets=(start_m, BLOCK_DMODEL_MAIN),
+            block_shape=(BLOCK_M, BLOCK_DMODEL_TAIL),
+            order=(1, 0)
+        )
+        K_tail_block_ptr = tl.make_block_ptr(
+            base=K + k_offset,
+            shape=(head_dim, seqlen_k),
+            strides=(stride_kk, stride_kn),
+            offsets=(BLOCK_DMODEL_MAIN, lo),
+            block_shape=(BLOCK_DMODEL_TAIL, BLOCK_N),
+            order=(0, 1)
+        )
+        V_tail_block_ptr = tl.make_block_ptr(
+            base=V + v_offset,
+            shape=(head_dim, seqlen_k),
+            strides=(stride_vn, stride_vk),
+            offsets=(BLOCK_DMODEL_MAIN, lo),
+            block_shape=(BLOCK_DMODEL_TAIL, BLOCK_N),
+            order=(0, 1)
+        )
+        DO_tail_block_ptr = tl.make_block_ptr(
+            base=DO + do_offset,
+            shape=(seqlen_q, head_dim),
+            strides=(stride_dom, stride_dok),
+            offsets=(start_m, BLOCK_DMODEL_MAIN),
+            block_shape=(BLOCK_M, BLOCK_DMODEL_TAIL),
+            order=(1, 0)
+        )
+    off_zh = off_z * num_head_q + off_h * 1
     # pointer to row-wise quantities in value-like data
-    D_ptrs = D + off_zh * seqlen_q
-    l_ptrs = L + off_zh * seqlen_q
+    D_ptrs = D + off_zh * max_seqlens_q
+    l_ptrs = L + off_zh * max_seqlens_q
     qk_scale = sm_scale * 1.44269504089
     # load q and do: they will stay in SRAM throughout
     if PADDED_HEAD:
@@ -323,18 +603,82 @@ def bwd_kernel_dq(
         do = tl.load(DO_block_ptr, boundary_check=(0,1), padding_option="zero")
     else:
         do = tl.load(DO_block_ptr, boundary_check=(0,), padding_option="zero")
+    if BLOCK_DMODEL_TAIL > 0:
+        if PADDED_HEAD:
+            q_tail = tl.load(Q_tail_block_ptr, boundary_check=(0,1), padding_option="zero")
+            do_tail = tl.load(DO_tail_block_ptr, boundary_check=(0,1), padding_option="zero")
+        else:
+            q_tail = tl.load(Q_tail_block_ptr, boundary_check=(0,), padding_option="zero")
+            do_tail = tl.load(DO_tail_block_ptr, boundary_check=(0,), padding_option="zero")
+        q_tail = (q_tail * qk_scale).to(Q_tail_block_ptr.type.element_ty)
     # Check for OOB accesses on D and LSE
     overflow_size_q = start_m + BLOCK_M - seqlen_q
     boundary = tl.full((BLOCK_M, ), BLOCK_M - overflow_size_q, dtype=tl.int32)
     d_lse_ptrs_mask = boundary > tl.arange(0, BLOCK_M)
     d_lse_padding = tl.full((BLOCK_M, ), 0, dtype=tl.float32)
-    Di = tl.load(D_ptrs + offs_m, mask=d_lse_ptrs_mask, other=d_lse_padding)
+    if INLINE_DELTA:
+        # delta = rowsum(O * dO) of bwd_preprocess, computed in place
+        o_offset = off_h * stride_oh + batch_index * stride_oz + cu_seqlens_q_start * stride_om
+        O_block_ptr = tl.make_block_ptr(
+            base=Out + o_offset,
+            shape=(seqlen_q, head_dim),
+            strides=(stride_om, stride_ok),
+            offsets=(start_m, 0),
+            block_shape=(BLOCK_M, BLOCK_DMODEL_MAIN),
+            order=(1, 0)
+        )
+        if PADDED_HEAD:
+            o = tl.load(O_block_ptr, boundary_check=(0,1), padding_option="zero")
+        else:
+            o = tl.load(O_block_ptr, boundary_check=(0,), padding_option="zero")
+        Di = tl.sum(o.to(tl.float32) * do.to(tl.float32), axis=1)
+        if BLOCK_DMODEL_TAIL > 0:
+            O_tail_block_ptr = tl.make_block_ptr(
+                base=Out + o_offset,
+                shape=(seqlen_q, head_dim),
+                strides=(stride_om, stride_ok),
+                offsets=(start_m, BLOCK_DMODEL_MAIN),
+                block_shape=(BLOCK_M, BLOCK_DMODEL_TAIL),
+                order=(1, 0)
+            )
+            if PADDED_HEAD:
+                o_tail = tl.load(O_tail_block_ptr, boundary_check=(0,1), padding_option="zero")
+            else:
+                o_tail = tl.load(O_tail_block_ptr, boundary_check=(0,), padding_option="zero")
+            Di += tl.sum(o_tail.to(tl.float32) * do_tail.to(tl.float32), axis=1)
+    else:
+        Di = tl.load(D_ptrs + offs_m, mask=d_lse_ptrs_mask, other=d_lse_padding)
     l_i = tl.load(l_ptrs + offs_m, mask=d_lse_ptrs_mask, other=d_lse_padding)
-    dq = tl.zeros([BLOCK_M, BLOCK_DMODEL], dtype=tl.float32)
-    # loop over k, v
-    lo = 0
-    hi = min(start_m + BLOCK_M, seqlen_k) if CAUSAL else seqlen_k
-    batch_philox_offset = philox_offset_base + off_zh * seqlen_q * seqlen_k
+    dq = tl.zeros([BLOCK_M, BLOCK_DMODEL_MAIN], dtype=tl.float32)
+    if BLOCK_DMODEL_TAIL > 0:
+        dq_tail = tl.zeros([BLOCK_M, BLOCK_DMODEL_TAIL], dtype=tl.float32)
+    batch_philox_offset = philox_offset_base + off_zh * max_seqlens_q * max_seqlens_k
+    # dropout_bitmask is optional, see attn_fwd
+    load_bitmask = False
+    bitmask_ptr = 0
+    if ENABLE_DROPOUT:
+        if dropout_bitmask is not None:
+            load_bitmask = dropout_bitmask.to(tl.uint64, bitcast=True) != 0
+            bitmask_ptr = dropout_bitmask + off_zh * max_seqlens_q * tl.cdiv(max_seqlens_k, 32)
+    if BIAS_TYPE == 1:
+        B_block_ptr = tl.make_block_ptr(
+                base=B + off_h * stride_bh + off_z * stride_bz,
+                shape=(seqlen_q, seqlen_k),
+                strides=(stride_bm, stride_bn),
+                offsets=(start_m, lo),
+                block_shape=(BLOCK_M, BLOCK_N),
+                order=(1, 0)
+                )
+        # dB is optional. It has the full shape of the bias, without broadcast
+        store_db = DB.to(tl.uint64, bitcast=True) != 0
+        DB_block_ptr = tl.make_block_ptr(
+                base=DB + off_h * stride_dbh + off_z * stride_dbz,
+                shape=(seqlen_q, seqlen_k),
+                strides=(stride_dbm, stride_dbn),
+                offsets=(start_m, lo),
+                block_shape=(BLOCK_M, BLOCK_N),
+                order=(1, 0)
+                )
     '''
            K1   K2      (d)V      dO
     Q1    qk11 qk12     (d)v1     dO1
@@ -353,11 +697,26 @@ def bwd_kernel_dq(
         else:
             kt = tl.load(K_block_ptr, boundary_check=(1,), padding_option="zero")
             vt = tl.load(V_block_ptr, boundary_check=(1,), padding_option="zero")
+        if BLOCK_DMODEL_TAIL > 0:
+            if PADDED_HEAD:
+                kt_tail = tl.load(K_tail_block_ptr, boundary_check=(1,0), padding_option="zero")
+                vt_tail = tl.load(V_tail_block_ptr, boundary_check=(1,0), padding_option="zero")
+            else:
+                kt_tail = tl.load(K_tail_block_ptr, boundary_check=(1,), padding_option="zero")
+                vt_tail = tl.load(V_tail_block_ptr, boundary_check=(1,), padding_option="zero")
         # -- compute qk ----
         # q.offs = (start_m, 0), k.offs = (0, start_n)
-        qk = dot(BLOCK_M, BLOCK_DMODEL, BLOCK_DMODEL, q, kt)
-        if CAUSAL:
-            qk = tl.where(offs_m[:, None] >= (offs_n[None, :] + start_n), qk, float("-inf"))
+        qk = dot(BLOCK_M, BLOCK_DMODEL_MAIN, BLOCK_DMODEL_MAIN, q, kt)
+        if BLOCK_DMODEL_TAIL > 0:
+            qk += dot(BLOCK_M, BLOCK_DMODEL_TAIL, BLOCK_DMODEL_TAIL, q_tail, kt_tail)
+        if BIAS_TYPE == 1:
+            bias = tl.load(B_block_ptr, boundary_check=(0,1), padding_option="zero")
+            qk += bias * 1.44269504089
+        # Only blocks partially outside the window need the mask
+        if (start_m + BLOCK_M - 1 - window_left > start_n) | (start_n + BLOCK_N - 1 > start_m + window_right):
+            window_mask = (offs_n[None, :] + start_n >= offs_m[:, None] - window_left) & \
+                          (offs_n[None, :] + start_n <= offs_m[:, None] + window_right)
+            qk = tl.where(window_mask, qk, float("-inf"))
         overflow_size_k = start_n + BLOCK_N - seqlen_k
         boundary_n = tl.full((BLOCK_M, ), seqlen_k, dtype=tl.int32)
         size_n = start_n + tl.arange(0, BLOCK_N)
@@ -366,32 +725,62 @@ def bwd_kernel_dq(
         p = tl.math.exp2(qk - l_i[:, None])
         # compute dp = dot(v, do)
         dp = tl.zeros([BLOCK_M, BLOCK_N], dtype=tl.float32)
-        dp += dot(BLOCK_M, BLOCK_DMODEL, BLOCK_DMODEL, do, vt)
+        dp += dot(BLOCK_M, BLOCK_DMODEL_MAIN, BLOCK_DMODEL_MAIN, do, vt)
+        if BLOCK_DMODEL_TAIL > 0:
+            dp += dot(BLOCK_M, BLOCK_DMODEL_TAIL, BLOCK_DMODEL_TAIL, do_tail, vt_tail)
         if ENABLE_DROPOUT:
-            philox_offset = batch_philox_offset + start_m * seqlen_k + start_n
-            keep = dropout_mask(philox_seed, philox_offset, dropout_p, BLOCK_M, BLOCK_N, seqlen_k)
+            if load_bitmask:
+                keep = load_dropout_bitmask(bitmask_ptr, start_m, start_n, BLOCK_M, BLOCK_N,
+                                            seqlen_q, tl.cdiv(max_seqlens_k, 32))
+            else:
+                keep = dropout_mask(philox_seed, batch_philox_offset + start_m * max_seqlens_k + start_n,
+                                    dropout_p, BLOCK_M, BLOCK_N, max_seqlens_k)
             dp = tl.where(keep, dp / (1 - dropout_p), 0)
         # compute ds = p * (dp - delta[:, None])
         ds = p * (dp - Di[:, None])
+        if BIAS_TYPE == 1:
+            # ds is the gradient of the scaled and biased scores
+            if store_db:
+                tl.store(DB_block_ptr, ds.to(DB.type.element_ty), boundary_check=(0,1))
         # compute dq. Unfortunately we cannot avoid transpose here as this loop
         # uses k both normal and transpose.
         if BLOCK_M == 1:
-            dq += tl.view(kt, [BLOCK_DMODEL]) * ds.to(Q.type.element_ty)
+            dq += tl.view(kt, [BLOCK_DMODEL_MAIN]) * ds.to(Q.type.element_ty)
+            if BLOCK_DMODEL_TAIL > 0:
+                dq_tail += tl.view(kt_tail, [BLOCK_DMODEL_TAIL]) * ds.to(Q.type.element_ty)
         else:
             # ds.shape = (BLOCK_M, BLOCK_N), kt.shape = (BLOCK_DMODEL, BLOCK_N)
             dq += tl.dot(ds.to(Q.type.element_ty), tl.trans(kt)) # (BLOCK_M, BLOCK_DMODEL)
+            if BLOCK_DMODEL_TAIL > 0:
+                dq_tail += tl.dot(ds.to(Q.type.element_ty), tl.trans(kt_tail))
         # update pointers
         K_block_ptr = tl.advance(K_block_ptr, (0, BLOCK_N))
         V_block_ptr = tl.advance(V_block_ptr, (0, BLOCK_N))
+        if BLOCK_DMODEL_TAIL > 0:
+            K_tail_block_ptr = tl.advance(K_tail_block_ptr, (0, BLOCK_N))
+            V_tail_block_ptr = tl.advance(V_tail_block_ptr, (0, BLOCK_N))
+        if BIAS_TYPE == 1:
+            B_block_ptr = tl.advance(B_block_ptr, (0, BLOCK_N))
+            DB_block_ptr = tl.advance(DB_block_ptr, (0, BLOCK_N))
     # initialize pointers to output
-    dq_offset = off_h * stride_dqh + off_z * stride_dqz
+    dq_offset = off_h * stride_dqh + batch_index * stride_dqz + cu_seqlens_q_start * stride_dqm
     DQ_block_ptr = tl.make_block_ptr(
         base=DQ + dq_offset,
         shape=(seqlen_q, head_dim),
         strides=(stride_dqm, stride_dqk),
         offsets=(start_m, 0),
-        block_shape=(BLOCK_M, BLOCK_DMODEL),
+        block_shape=(BLOCK_M, BLOCK_DMODEL_MAIN),
         order=(1, 0)
     )
     tl.store(DQ_block_ptr, (dq * sm_scale).to(DQ_block_ptr.type.element_ty), boundary_check=(0,1))
+    if BLOCK_DMODEL_TAIL > 0:
+        DQ_tail_block_ptr = tl.make_block_ptr(
+            base=DQ + dq_offset,
+            shape=(seqlen_q, head_dim),
+            strides=(stride_dqm, stride_dqk),
+            offsets=(start_m, BLOCK_DMODEL_MAIN),
+            block_shape=(BLOCK_M, BLOCK_DMODEL_TAIL),
+            order=(1, 0)
+        )
+        tl.store(DQ_tail_block_ptr, (dq_tail * sm_scale).to(DQ_tail_block_ptr.type.element_ty), boundary_check=(0,1))
 
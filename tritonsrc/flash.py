@@ -19,4 +19,6 @@ import triton.language as tl
 
 from fwd_kernel import attn_fwd
 from bwd_preprocess import bwd_preprocess
+from bwd_postprocess import bwd_postprocess
 from bwd_split_kernel import bwd_kernel_dk_dv, bwd_kernel_dq
+from fwd_kernel_split import attn_fwd_split, attn_fwd_split_reduce
@@ -28,50 +28,129 @@ def dropout_offsets(philox_seed, philox_offset, dropout_p, m, n, stride):
     ns = tl.arange(0, n)
     return philox_offset + ms[:, None] * stride + ns[None, :]
 
+# tl.interleave, which assembles the four outputs of one Philox call into
+# consecutive columns, was added in Triton 3.0. Older Triton, including the
+# pinned third_party/triton, takes the slow path of dropout_rng.
+USE_RANDINT4X = tl.constexpr(hasattr(tl, 'interleave'))
+
 @triton.jit
 def dropout_rng(philox_seed, philox_offset, dropout_p, m, n, stride):
-    rng_offsets = dropout_offsets(philox_seed, philox_offset, dropout_p, m, n, stride).to(tl.uint32)
-    # TODO: use tl.randint for better performance
-    return tl.rand(philox_seed, rng_offsets)
+    '''
+    Random uint32 of an m x n tile of the dropout mask.
+
+    Element (i, j) is word j % 4 of the Philox counter of element (i, j - j % 4),
+    so the tile must start on a multiple of 4 columns. Tiles of any shape and
+    origin generate the same values, which keeps the masks of the forward
+    and both backward kernels identical.
+
+    With tl.interleave (Triton 3.0 and later) one Philox call covers four
+    columns. Otherwise every element runs its own Philox call and keeps one
+    word of it, which yields the same values at four times the cost.
+    '''
+    if USE_RANDINT4X:
+        ms = tl.arange(0, m)
+        ks = tl.arange(0, n // 4)
+        rng_offsets = (philox_offset + ms[:, None] * stride + ks[None, :] * 4).to(tl.uint32)
+        r0, r1, r2, r3 = tl.randint4x(philox_seed, rng_offsets)
+        rng_output = tl.interleave(tl.interleave(r0, r2), tl.interleave(r1, r3))
+    else:
+        ns = tl.arange(0, n)
+        rng_offsets = dropout_offsets(philox_seed, philox_offset, dropout_p, m, n, stride) - (ns % 4)[None, :]
+        r0, r1, r2, r3 = tl.randint4x(philox_seed, rng_offsets.to(tl.uint32))
+        word = (ns % 4)[None, :]
+        rng_output = tl.where(word == 0, r0, tl.where(word == 1, r1, tl.where(word == 2, r2, r3)))
+    return rng_output
 
 @triton.jit
 def dropout_mask(philox_seed, philox_offset, dropout_p, m, n, stride):
     rng_output = dropout_rng(philox_seed, philox_offset, dropout_p, m, n, stride)
-    rng_keep = rng_output > dropout_p
+    # Compare the top 24 bits as integers, dropout_p * 2^24 is exact in fp32
+    rng_keep = (rng_output >> 8).to(tl.int32) >= (dropout_p * 16777216.0).to(tl.int32)
     return rng_keep
 
+# Dropout bitmask: the dropout mask of each (batch, head) packed into rows of
+# cdiv(max_seqlens_k, 32) int32 words. Bit j % 32 of word j // 32 of row i is
+# element (i, j). The forward pass stores it and the backward kernels load it
+# instead of running Philox again.
+@triton.jit
+def store_dropout_bitmask(bitmask_ptr, keep, start_m, start_n, m, n, rows, words_per_row):
+    '''
+    Packs the m x n tile of keep at (start_m, start_n) into the bitmask.
+
+    Tiles narrower than one word share it with their neighbours, and OR their
+    bits into it. The bitmask must be zeroed beforehand in this case.
+    '''
+    ms = start_m + tl.arange(0, m)
+    ns = tl.arange(0, n)
+    ones = tl.full([n], 1, dtype=tl.int32)
+    # Bits are disjoint, so the sum of a row is its OR
+    bits = tl.where(keep, (ones << (ns % 32))[None, :], 0)
+    if n >= 32:
+        for w in tl.static_range(n // 32):
+            word = tl.sum(tl.where((ns // 32 == w)[None, :], bits, 0), axis=1)
+            word_index = start_n // 32 + w
+            tl.store(bitmask_ptr + ms * words_per_row + word_index, word,
+                     mask=(ms < rows) & (word_index < words_per_row))
+    else:
+        word = tl.sum(bits, axis=1)
+        tl.atomic_or(bitmask_ptr + ms * words_per_row + start_n // 32, word, mask=ms < rows)
+
+@triton.jit
+def load_dropout_bitmask(bitmask_ptr, start_m, start_n, m, n, rows, words_per_row):
+    '''
+    keep of the m x n tile at (start_m, start_n), see store_dropout_bitmask
+    '''
+    ms = start_m + tl.arange(0, m)
+    ns = start_n + tl.arange(0, n)
+    word_index = ns // 32
+    words = tl.load(bitmask_ptr + ms[:, None] * words_per_row + word_index[None, :],
+                    mask=(ms[:, None] < rows) & (word_index[None, :] < words_per_row),
+                    other=0)
+    return ((words >> (ns % 32)[None, :]) & 1) != 0
+
 @triton.jit
 def attn_fwd_inner(
-    acc, l_i, m_i, q,
-    K_block_ptr, V_block_ptr,
+    acc, acc_tail, l_i, m_i, q, q_tail,
+    K_block_ptr, K_tail_block_ptr, V_block_ptr, V_tail_block_ptr,
     start_m,
     seqlen_q,
     seqlen_k_low,
     seqlen_k_high,
     k_padded,
+    window_left,
+    window_right,
     dropout_p,
     dropout_seqlen_k,
     philox_seed,
     batch_philox_offset,
+    bitmask_ptr,
+    store_bitmask,
     encoded_softmax_block_ptr,
+    bias_block_ptr,
+    qk_scale,
     BLOCK_M: tl.constexpr,
-    BLOCK_DMODEL: tl.constexpr,
+    BLOCK_DMODEL_TAIL: tl.constexpr,
     BLOCK_N: tl.constexpr,
-    CAUSAL: tl.constexpr,
     offs_m: tl.constexpr,
     offs_n: tl.constexpr,
     pre_load_v: tl.constexpr,
     ENABLE_DROPOUT: tl.constexpr,
     RETURN_ENCODED_SOFTMAX: tl.constexpr,
-    MARGINAL_BLOCK: tl.constexpr,  # MARGINAL_BLOCK = CAUSAL or k_padded
+    BIAS_TYPE: tl.constexpr,
+    MARGINAL_BLOCK: tl.constexpr,  # Blocks partially outside the window, or padded blocks
     PADDED_HEAD: tl.constexpr,
+    IS_FP8: tl.constexpr,
 ):
     lo, hi = seqlen_k_low, seqlen_k_high
-    if MARGINAL_BLOCK:
-        K_block_ptr = tl.advance(K_block_ptr, (0, lo))
-        V_block_ptr = tl.advance(V_block_ptr, (lo, 0))
-        if RETURN_ENCODED_SOFTMAX:
-            encoded_softmax_block_ptr = tl.advance(encoded_softmax_block_ptr, (0, lo))
+    K_block_ptr = tl.advance(K_block_ptr, (0, lo))
+    V_block_ptr = tl.advance(V_block_ptr, (lo, 0))
+    if BLOCK_DMODEL_TAIL > 0:
+        K_tail_block_ptr = tl.advance(K_tail_block_ptr, (0, lo))
+        V_tail_block_ptr = tl.advance(V_tail_block_ptr, (lo, 0))
+    if RETURN_ENCODED_SOFTMAX:
+        encoded_softmax_block_ptr = tl.advance(encoded_softmax_block_ptr, (0, lo))
+    if BIAS_TYPE == 1:
+        bias_block_ptr = tl.advance(bias_block_ptr, (0, lo))
     # loop over k, v and update accumulator
     for start_n in range(lo, hi, BLOCK_N):
         # -- compute qk ----
@@ -79,37 +158,66 @@ def attn_fwd_inner(
         if MARGINAL_BLOCK and k_padded:
             if PADDED_HEAD:
                 k = tl.load(K_block_ptr, boundary_check=(1,0), padding_option="zero")
+                if BLOCK_DMODEL_TAIL > 0:
+                    k_tail = tl.load(K_tail_block_ptr, boundary_check=(1,0), padding_option="zero")
             else:
                 k = tl.load(K_block_ptr, boundary_check=(1,), padding_option="zero")
+                if BLOCK_DMODEL_TAIL > 0:
+                    k_tail = tl.load(K_tail_block_ptr, boundary_check=(1,), padding_option="zero")
         else:
             if PADDED_HEAD:
                 k = tl.load(K_block_ptr, boundary_check=(0,), padding_option="zero")
+                if BLOCK_DMODEL_TAIL > 0:
+                    k_tail = tl.load(K_tail_block_ptr, boundary_check=(0,), padding_option="zero")
             else:
                 k = tl.load(K_block_ptr)
+                if BLOCK_DMODEL_TAIL > 0:
+                    k_tail = tl.load(K_tail_block_ptr)
         if pre_load_v:
             if MARGINAL_BLOCK and k_padded:
-                if PADDED_HEAD:
-                    v = tl.load(V_block_ptr, boundary_check=(0,1), padding_option="zero")
-                else:
-                    v = tl.load(V_block_ptr, boundary_check=(0,1), padding_option="zero")
+                v = tl.load(V_block_ptr, boundary_check=(0,1), padding_option="zero")
+                if BLOCK_DMODEL_TAIL > 0:
+                    v_tail = tl.load(V_tail_block_ptr, boundary_check=(0,1), padding_option="zero")
             else:
                 if PADDED_HEAD:
                     v = tl.load(V_block_ptr, boundary_check=(1,), padding_option="zero")
+                    if BLOCK_DMODEL_TAIL > 0:
+                        v_tail = tl.load(V_tail_block_ptr, boundary_check=(1,), padding_option="zero")
                 else:
                     v = tl.load(V_block_ptr)
+                    if BLOCK_DMODEL_TAIL > 0:
+                        v_tail = tl.load(V_tail_block_ptr)
         qk = tl.zeros([BLOCK_M, BLOCK_N], dtype=tl.float32)
         if MARGINAL_BLOCK:
-            if CAUSAL:
-                mask = offs_m[:, None] >= (start_n + offs_n[None, :])
-                qk = tl.where(mask, qk, float("-inf"))
+            # Row i attends to keys [i - window_left, i + window_right]
+            size_n = start_n + offs_n[None, :]
+            mask = (size_n >= offs_m[:, None] - window_left) & (size_n <= offs_m[:, None] + window_right)
+            qk = tl.where(mask, qk, float("-inf"))
             if k_padded:
                 boundary_m = tl.full([BLOCK_M], seqlen_k_high, dtype=tl.int32)
                 size_n = start_n + offs_n[None,:]
                 mask = size_n < boundary_m[:,None]
                 qk = tl.where(mask, qk, float("-inf"))
-        qk += tl.dot(q, k)
+        if IS_FP8:
+            # FP8 q is not pre-scaled, see attn_fwd
+            qk += tl.dot(q, k) * qk_scale
+            if BLOCK_DMODEL_TAIL > 0:
+                qk += tl.dot(q_tail, k_tail) * qk_scale
+        else:
+            qk += tl.dot(q, k)
+            if BLOCK_DMODEL_TAIL > 0:
+                qk += tl.dot(q_tail, k_tail)
+        if BIAS_TYPE == 1:
+            # qk is scaled by sm_scale * log2(e), the bias needs log2(e) only
+            bias = tl.load(bias_block_ptr, boundary_check=(0,1), padding_option="zero")
+            qk += bias * 1.44269504089
         m_ij = tl.maximum(m_i, tl.max(qk, 1))
-        qk = qk - m_ij[:, None]
+        if MARGINAL_BLOCK:
+            # Rows may have no key of the window in this block, or so far
+            m_ij_safe = tl.where(m_ij == float("-inf"), 0.0, m_ij)
+        else:
+            m_ij_safe = m_ij
+        qk = qk - m_ij_safe[:, None]
         p = tl.math.exp2(qk)
         # CAVEAT: Must update l_ij before applying dropout
         l_ij = tl.sum(p, 1)
@@ -119,6 +227,9 @@ def attn_fwd_inner(
         if ENABLE_DROPOUT:
             philox_offset = batch_philox_offset + start_m * BLOCK_M * dropout_seqlen_k + start_n
             keep = dropout_mask(philox_seed, philox_offset, dropout_p, BLOCK_M, BLOCK_N, dropout_seqlen_k)
+            if store_bitmask:
+                store_dropout_bitmask(bitmask_ptr, keep, start_m * BLOCK_M, start_n, BLOCK_M, BLOCK_N,
+                                      seqlen_q, tl.cdiv(dropout_seqlen_k, 32))
             if RETURN_ENCODED_SOFTMAX:
                 tl.store(encoded_softmax_block_ptr, tl.where(keep, p, -p).to(encoded_softmax_block_ptr.type.element_ty), boundary_check=(0,1))
             p = tl.where(keep, p, 0.0)
@@ -127,19 +238,24 @@ def attn_fwd_inner(
                      p.to(encoded_softmax_block_ptr.type.element_ty),
                      boundary_check=(0,1))
         # -- update output accumulator --
-        alpha = tl.math.exp2(m_i - m_ij)
+        alpha = tl.math.exp2(m_i - m_ij_safe)
         acc = acc * alpha[:, None]
+        if BLOCK_DMODEL_TAIL > 0:
+            acc_tail = acc_tail * alpha[:, None]
         if not pre_load_v:
             if MARGINAL_BLOCK and k_padded:
-                if PADDED_HEAD:
-                    v = tl.load(V_block_ptr, boundary_check=(0,1), padding_option="zero")
-                else:
-                    v = tl.load(V_block_ptr, boundary_check=(0,1), padding_option="zero")
+                v = tl.load(V_block_ptr, boundary_check=(0,1), padding_option="zero")
+                if BLOCK_DMODEL_TAIL > 0:
+                    v_tail = tl.load(V_tail_block_ptr, boundary_check=(0,1), padding_option="zero")
             else:
                 if PADDED_HEAD:
                     v = tl.load(V_block_ptr, boundary_check=(1,), padding_option="zero")
+                    if BLOCK_DMODEL_TAIL > 0:
+                        v_tail = tl.load(V_tail_block_ptr, boundary_check=(1,), padding_option="zero")
                 else:
                     v = tl.load(V_block_ptr)
+                    if BLOCK_DMODEL_TAIL > 0:
+                        v_tail = tl.load(V_tail_block_ptr)
         # -- update m_i and l_i
         l_i = l_i * alpha + l_ij
         # update m_i and l_i
@@ -147,25 +263,37 @@ def attn_fwd_inner(
         acc += tl.dot(p.to(V_block_ptr.type.element_ty), v)
         V_block_ptr = tl.advance(V_block_ptr, (BLOCK_N, 0))
         K_block_ptr = tl.advance(K_block_ptr, (0, BLOCK_N))
+        if BLOCK_DMODEL_TAIL > 0:
+            acc_tail += tl.dot(p.to(V_tail_block_ptr.type.element_ty), v_tail)
+            V_tail_block_ptr = tl.advance(V_tail_block_ptr, (BLOCK_N, 0))
+            K_tail_block_ptr = tl.advance(K_tail_block_ptr, (0, BLOCK_N))
         if RETURN_ENCODED_SOFTMAX:
             encoded_softmax_block_ptr = tl.advance(encoded_softmax_block_ptr, (0, BLOCK_N))
-    return acc, l_i, m_i
+        if BIAS_TYPE == 1:
+            bias_block_ptr = tl.advance(bias_block_ptr, (0, BLOCK_N))
+    return acc, acc_tail, l_i, m_i
 
 
 @triton.jit
 def attn_fwd(
-    Q, K, V, sm_scale, M, Out,
+    Q, K, V, B, sm_scale, M, Out,
     stride_qz, stride_qh, stride_qm, stride_qk,
     stride_kz, stride_kh, stride_kn, stride_kk,
     stride_vz, stride_vh, stride_vk, stride_vn,
     stride_oz, stride_oh, stride_om, stride_on,
-    seqlen_q,
-    seqlen_k,
+    stride_bz, stride_bh, stride_bm, stride_bn,
+    num_head_q, num_head_k,
+    cu_seqlens_q, cu_seqlens_k,
+    max_seqlens_q, max_seqlens_k,
     head_dim,
+    window_left, window_right,
     dropout_p,
     philox_seed,
     philox_offset_base,
     encoded_softmax,
+    dropout_bitmask,
+    q_descale, k_descale, v_descale,
+    VARLEN: tl.constexpr,
     STAGE: tl.constexpr,
     BLOCK_M: tl.constexpr,
     BLOCK_DMODEL: tl.constexpr,
@@ -173,13 +301,47 @@ def attn_fwd(
     pre_load_v: tl.constexpr,
     ENABLE_DROPOUT: tl.constexpr,
     RETURN_ENCODED_SOFTMAX: tl.constexpr,
+    BIAS_TYPE: tl.constexpr,
     PADDED_HEAD: tl.constexpr,
 ):
-    start_m = tl.program_id(0)
-    off_h = tl.program_id(1) # head index
-    off_z = tl.program_id(2) # batch index
-    num_h = tl.num_programs(1)
     num_z = tl.num_programs(2)
+    if STAGE == 3:
+        # Workgroups are dispatched in the order of the linearized program id.
+        # With causal attention the work of a block grows with start_m, so the
+        # last blocks of every head and batch are dispatched first, and the
+        # light blocks fill the gaps at the end instead of leaving stragglers.
+        num_m = tl.num_programs(0)
+        num_h = tl.num_programs(1)
+        pid = tl.program_id(0) + (tl.program_id(1) + tl.program_id(2) * num_h) * num_m
+        start_m = num_m - 1 - pid // (num_h * num_z)
+        off_h = pid % num_h # head index
+        off_z = (pid // num_h) % num_z # batch index
+    else:
+        start_m = tl.program_id(0)
+        off_h = tl.program_id(1) # head index
+        off_z = tl.program_id(2) # batch index
+    # GQA/MQA: group_size heads of Q share the same K/V head
+    off_h_k = off_h // (num_head_q // num_head_k)
+    # VARLEN: Q/K/V/Out are packed as (1, num_heads, total_tokens, head_dim),
+    # sequence off_z occupies [cu_seqlens[off_z], cu_seqlens[off_z + 1]).
+    # M and encoded_softmax keep the padded (num_z * num_head_q, max_seqlens_q) layout.
+    if VARLEN:
+        cu_seqlens_q_start = tl.load(cu_seqlens_q + off_z)
+        cu_seqlens_q_end = tl.load(cu_seqlens_q + off_z + 1)
+        seqlen_q = cu_seqlens_q_end - cu_seqlens_q_start
+        # The grid covers max_seqlens_q, shorter sequences have idle blocks
+        if start_m * BLOCK_M >= seqlen_q:
+            return
+        cu_seqlens_k_start = tl.load(cu_seqlens_k + off_z)
+        cu_seqlens_k_end = tl.load(cu_seqlens_k + off_z + 1)
+        seqlen_k = cu_seqlens_k_end - cu_seqlens_k_start
+        batch_index = 0
+    else:
+        cu_seqlens_q_start = 0
+        cu_seqlens_k_start = 0
+        seqlen_q = max_seqlens_q
+        seqlen_k = max_seqlens_k
+        batch_index = off_z
     if start_m * BLOCK_M + BLOCK_M > seqlen_q:
         q_padded = True
     else:
@@ -193,45 +355,91 @@ def attn_fwd(
     else:
         k_padded = False
         seqlen_k_faligned = seqlen_k
+    # Blocks of Triton must have power-of-two sizes. Other BLOCK_DMODEL are
+    # split into a power-of-two main part and a power-of-two tail along the
+    # head dimension, e.g. 96 = 64 + 32, and PADDED_HEAD applies to both.
+    if (BLOCK_DMODEL & (BLOCK_DMODEL - 1)) == 0:
+        BLOCK_DMODEL_MAIN = BLOCK_DMODEL
+        BLOCK_DMODEL_TAIL = 0
+    else:
+        BLOCK_DMODEL_MAIN = BLOCK_DMODEL & (BLOCK_DMODEL - 1)
+        BLOCK_DMODEL_TAIL = BLOCK_DMODEL - BLOCK_DMODEL_MAIN
 
-    q_offset = off_h * stride_qh + off_z * stride_qz
+    q_offset = off_h * stride_qh + batch_index * stride_qz + cu_seqlens_q_start * stride_qm
     Q_block_ptr = tl.make_block_ptr(
         base=Q + q_offset,
         shape=(seqlen_q, head_dim),
         strides=(stride_qm, stride_qk),
         offsets=(start_m * BLOCK_M, 0),
-        block_shape=(BLOCK_M, BLOCK_DMODEL),
+        block_shape=(BLOCK_M, BLOCK_DMODEL_MAIN),
         order=(1, 0)
     )
-    k_offset = off_h * stride_kh + off_z * stride_kz
+    k_offset = off_h_k * stride_kh + batch_index * stride_kz + cu_seqlens_k_start * stride_kn
     K_block_ptr = tl.make_block_ptr(
         base=K + k_offset,
         shape=(head_dim, seqlen_k),
         strides=(stride_kk, stride_kn),
         offsets=(0, 0),
-        block_shape=(BLOCK_DMODEL, BLOCK_N),
+        block_shape=(BLOCK_DMODEL_MAIN, BLOCK_N),
         order=(0, 1)
     )
-    v_offset = off_h * stride_vh + off_z * stride_vz
+    v_offset = off_h_k * stride_vh + batch_index * stride_vz + cu_seqlens_k_start * stride_vk
     V_block_ptr = tl.make_block_ptr(
         base=V + v_offset,
         shape=(seqlen_k, head_dim),
         strides=(stride_vk, stride_vn),
         offsets=(0, 0),
-        block_shape=(BLOCK_N, BLOCK_DMODEL),
+        block_shape=(BLOCK_N, BLOCK_DMODEL_MAIN),
         order=(1, 0)
     )
+    if BLOCK_DMODEL_TAIL > 0:
+        Q_tail_block_ptr = tl.make_block_ptr(
+            base=Q + q_offset,
+            shape=(seqlen_q, head_dim),
+            strides=(stride_qm, stride_qk),
+            offsets=(start_m * BLOCK_M, BLOCK_DMODEL_MAIN),
+            block_shape=(BLOCK_M, BLOCK_DMODEL_TAIL),
+            order=(1, 0)
+        )
+        K_tail_block_ptr = tl.make_block_ptr(
+            base=K + k_offset,
+            shape=(head_dim, seqlen_k),
+            strides=(stride_kk, stride_kn),
+            offsets=(BLOCK_DMODEL_MAIN, 0),
+            block_shape=(BLOCK_DMODEL_TAIL, BLOCK_N),
+            order=(0, 1)
+        )
+        V_tail_block_ptr = tl.make_block_ptr(
+            base=V + v_offset,
+            shape=(seqlen_k, head_dim),
+            strides=(stride_vk, stride_vn),
+            offsets=(0, BLOCK_DMODEL_MAIN),
+            block_shape=(BLOCK_N, BLOCK_DMODEL_TAIL),
+            order=(1, 0)
+        )
+    else:
+        K_tail_block_ptr = 0
+        V_tail_block_ptr = 0
     # initialize offsets
     offs_m = start_m * BLOCK_M + tl.arange(0, BLOCK_M)
     offs_n = tl.arange(0, BLOCK_N)
     # initialize pointer to m and l
     m_i = tl.zeros([BLOCK_M], dtype=tl.float32) - float("inf")
     l_i = tl.zeros([BLOCK_M], dtype=tl.float32) + 1.0
-    acc = tl.zeros([BLOCK_M, BLOCK_DMODEL], dtype=tl.float32)
+    acc = tl.zeros([BLOCK_M, BLOCK_DMODEL_MAIN], dtype=tl.float32)
+    if BLOCK_DMODEL_TAIL > 0:
+        acc_tail = tl.zeros([BLOCK_M, BLOCK_DMODEL_TAIL], dtype=tl.float32)
+    else:
+        acc_tail = 0
     # scale sm_scale by log_2(e) and use
     # 2^x instead of exp in the loop because CSE and LICM
     # don't work as expected with `exp` in the loop
     qk_scale = sm_scale * 1.44269504089
+    # FP8 Q/K/V carry per-tensor scales. q * qk_scale may not be representable
+    # in FP8, so the scales are applied to qk in fp32 instead.
+    IS_FP8 = Q.type.element_ty.is_fp8()
+    if IS_FP8:
+        qk_scale = qk_scale * q_descale * k_descale
     # load q: it will stay in SRAM throughout on NV GPUs but in VGPRs on AMD GPUs
     if q_padded:
         if PADDED_HEAD:
@@ -243,80 +451,154 @@ def attn_fwd(
             q = tl.load(Q_block_ptr, boundary_check=(1,), padding_option="zero")
         else:
             q = tl.load(Q_block_ptr)
-    q = (q * qk_scale).to(Q_block_ptr.type.element_ty)
+    if not IS_FP8:
+        q = (q * qk_scale).to(Q_block_ptr.type.element_ty)
+    if BLOCK_DMODEL_TAIL > 0:
+        if q_padded:
+            if PADDED_HEAD:
+                q_tail = tl.load(Q_tail_block_ptr, boundary_check=(0,1), padding_option="zero")
+            else:
+                q_tail = tl.load(Q_tail_block_ptr, boundary_check=(0,), padding_option="zero")
+        else:
+            if PADDED_HEAD:
+                q_tail = tl.load(Q_tail_block_ptr, boundary_check=(1,), padding_option="zero")
+            else:
+                q_tail = tl.load(Q_tail_block_ptr)
+        if not IS_FP8:
+            q_tail = (q_tail * qk_scale).to(Q_tail_block_ptr.type.element_ty)
+    else:
+        q_tail = 0
     # stage 1: off-band
     # For causal = True, STAGE = 3 and attn_fwd_inner gets 1 as its STAGE
     # For causal = False, STAGE = 1, and attn_fwd_inner gets 3 as its STAGE
-    off_zh = off_z * num_h + off_h * 1
+    off_zh = off_z * num_head_q + off_h * 1
     if ENABLE_DROPOUT:
-        batch_philox_offset = philox_offset_base + off_zh * seqlen_q * seqlen_k
+        batch_philox_offset = philox_offset_base + off_zh * max_seqlens_q * max_seqlens_k
     else:
         batch_philox_offset = 0
+    # dropout_bitmask is optional: None for the Triton kernels of tritonsrc,
+    # or null for the compiled ones
+    store_bitmask = False
+    bitmask_ptr = 0
+    if ENABLE_DROPOUT:
+        if dropout_bitmask is not None:
+            store_bitmask = dropout_bitmask.to(tl.uint64, bitcast=True) != 0
+            bitmask_ptr = dropout_bitmask + off_zh * max_seqlens_q * tl.cdiv(max_seqlens_k, 32)
     if RETURN_ENCODED_SOFTMAX:
         encoded_softmax_block_ptr = tl.make_block_ptr(
-                base=encoded_softmax + off_zh * seqlen_q * seqlen_k,
+                base=encoded_softmax + off_zh * max_seqlens_q * max_seqlens_k,
                 shape=(seqlen_q, seqlen_k),
-                strides=(seqlen_k, 1),
+                strides=(max_seqlens_k, 1),
                 offsets=(start_m * BLOCK_M, 0),
                 block_shape=(BLOCK_M, BLOCK_N),
                 order=(1, 0)
                 )
     else:
         encoded_softmax_block_ptr = 0
+    # BIAS_TYPE == 1: B is (batch, num_heads, seqlen_q, seqlen_k), broadcast
+    # dimensions have zero strides. For VARLEN, sequence off_z uses B[off_z].
+    if BIAS_TYPE == 1:
+        bias_block_ptr = tl.make_block_ptr(
+                base=B + off_h * stride_bh + off_z * stride_bz,
+                shape=(seqlen_q, seqlen_k),
+                strides=(stride_bm, stride_bn),
+                offsets=(start_m * BLOCK_M, 0),
+                block_shape=(BLOCK_M, BLOCK_N),
+                order=(1, 0)
+                )
+    else:
+        bias_block_ptr = 0
 
+    # Causal attention is a window with window_right == 0
     if STAGE == 3:
-        CAUSAL = True
-    else:
-        CAUSAL = False
-    # Stage 1: off-band (for causal) or non-boundary (for irregular seqlen_k) blocks
-    if CAUSAL:
-        # Causal = True
-        seqlen_k_low = 0
-        seqlen_k_high = min(seqlen_k_faligned, start_m * BLOCK_M)
-    else:
-        # Causal = False
-        seqlen_k_low = 0
-        seqlen_k_high = seqlen_k_faligned
-    acc, l_i, m_i = attn_fwd_inner(
-        acc, l_i, m_i, q, K_block_ptr, V_block_ptr,
-        start_m, seqlen_q, seqlen_k_low, seqlen_k_high, False,
-        dropout_p, seqlen_k, philox_seed, batch_philox_offset, encoded_softmax_block_ptr,
-        BLOCK_M, BLOCK_DMODEL, BLOCK_N,
-        False, offs_m, offs_n,
+        window_right = 0
+    # Keys of [band_lo, band_hi) are within the window of some rows in this
+    # block, and keys of [solid_lo, solid_hi) are within the windows of all
+    # rows. Blocks outside the band are skipped.
+    band_lo = (max(0, start_m * BLOCK_M - window_left) // BLOCK_N) * BLOCK_N
+    band_hi = min(seqlen_k, start_m * BLOCK_M + BLOCK_M + window_right)
+    solid_lo = tl.cdiv(max(band_lo, start_m * BLOCK_M + BLOCK_M - 1 - window_left), BLOCK_N) * BLOCK_N
+    solid_hi = (min(seqlen_k_faligned, start_m * BLOCK_M + window_right + 1) // BLOCK_N) * BLOCK_N
+    if solid_hi <= solid_lo:
+        solid_lo = band_lo
+        solid_hi = band_lo
+    # Stage 1: blocks on the left edge of the window
+    acc, acc_tail, l_i, m_i = attn_fwd_inner(
+        acc, acc_tail, l_i, m_i, q, q_tail,
+        K_block_ptr, K_tail_block_ptr, V_block_ptr, V_tail_block_ptr,
+        start_m, seqlen_q, band_lo, solid_lo, False, window_left, window_right,
+        dropout_p, max_seqlens_k, philox_seed, batch_philox_offset,
+        bitmask_ptr, store_bitmask, encoded_softmax_block_ptr,
+        bias_block_ptr, qk_scale,
+        BLOCK_M, BLOCK_DMODEL_TAIL, BLOCK_N,
+        offs_m, offs_n,
         pre_load_v,
         ENABLE_DROPOUT,
         RETURN_ENCODED_SOFTMAX,
+        BIAS_TYPE,
+        MARGINAL_BLOCK=True,
+        PADDED_HEAD=PADDED_HEAD,
+        IS_FP8=IS_FP8,
+    )
+    # Stage 2: blocks within the window of every row, without masks
+    tl.debug_barrier()
+    acc, acc_tail, l_i, m_i = attn_fwd_inner(
+        acc, acc_tail, l_i, m_i, q, q_tail,
+        K_block_ptr, K_tail_block_ptr, V_block_ptr, V_tail_block_ptr,
+        start_m, seqlen_q, solid_lo, solid_hi, False, window_left, window_right,
+        dropout_p, max_seqlens_k, philox_seed, batch_philox_offset,
+        bitmask_ptr, store_bitmask, encoded_softmax_block_ptr,
+        bias_block_ptr, qk_scale,
+        BLOCK_M, BLOCK_DMODEL_TAIL, BLOCK_N,
+        offs_m, offs_n,
+        pre_load_v,
+        ENABLE_DROPOUT,
+        RETURN_ENCODED_SOFTMAX,
+        BIAS_TYPE,
         MARGINAL_BLOCK=False,
         PADDED_HEAD=PADDED_HEAD,
+        IS_FP8=IS_FP8,
+    )
+    # Stage 3: on-band (for causal), right edge of the window, or boundary blocks
+    # barrier makes it easier for compielr to schedule the
+    # loops independently
+    tl.debug_barrier()
+    acc, acc_tail, l_i, m_i = attn_fwd_inner(
+        acc, acc_tail, l_i, m_i, q, q_tail,
+        K_block_ptr, K_tail_block_ptr, V_block_ptr, V_tail_block_ptr,
+        start_m, seqlen_q, solid_hi, band_hi, k_padded, window_left, window_right,
+        dropout_p, max_seqlens_k, philox_seed, batch_philox_offset,
+        bitmask_ptr, store_bitmask, encoded_softmax_block_ptr,
+        bias_block_ptr, qk_scale,
+        BLOCK_M, BLOCK_DMODEL_TAIL, BLOCK_N,
+        offs_m, offs_n,
+        pre_load_v,
+        ENABLE_DROPOUT,
+        RETURN_ENCODED_SOFTMAX,
+        BIAS_TYPE,
+        MARGINAL_BLOCK=True,
+        PADDED_HEAD=PADDED_HEAD,
+        IS_FP8=IS_FP8,
     )
-    # Stage 2: on-band or boundary blocks
-    if CAUSAL or k_padded:
-        seqlen_k_low = seqlen_k_high
-        if CAUSAL:
-            seqlen_k_high = min(seqlen_k, start_m * BLOCK_M + BLOCK_M)
-        else:
-            seqlen_k_high = seqlen_k
-        # barrier makes it easier for compielr to schedule the
-        # two loops independently
-        tl.debug_barrier()
-        acc, l_i, m_i = attn_fwd_inner(
-            acc, l_i, m_i, q, K_block_ptr, V_block_ptr,
-            start_m, seqlen_q, seqlen_k_low, seqlen_k_high, k_padded,
-            dropout_p, seqlen_k, philox_seed, batch_philox_offset, encoded_softmax_block_ptr,
-            BLOCK_M, BLOCK_DMODEL, BLOCK_N,
-            CAUSAL, offs_m, offs_n,
-            pre_load_v,
-            ENABLE_DROPOUT,
-            RETURN_ENCODED_SOFTMAX,
-            MARGINAL_BLOCK=True,
-            PADDED_HEAD=PADDED_HEAD,
-        )
     # epilogue
+    # Rows without any key in the window write zeros, and +inf to M so that
+    # the backward pass ignores them
+    empty = m_i == float("-inf")
+    l_i = tl.where(empty, 1.0, l_i)
+    m_i = tl.where(empty, float("inf"), m_i)
     # write back m
     acc = acc / l_i[:, None]
     if ENABLE_DROPOUT:
         acc = acc / (1 - dropout_p)
-    m_ptrs = M + off_zh * seqlen_q + offs_m
+    if IS_FP8:
+        acc = acc * v_descale
+    if BLOCK_DMODEL_TAIL > 0:
+        acc_tail = acc_tail / l_i[:, None]
+        if ENABLE_DROPOUT:
+            acc_tail = acc_tail / (1 - dropout_p)
+        if IS_FP8:
+            acc_tail = acc_tail * v_descale
+    m_ptrs = M + off_zh * max_seqlens_q + offs_m
     # Check for last block_M
     if q_padded:
         overflow_size = (start_m * BLOCK_M + BLOCK_M) - seqlen_q
@@ -327,13 +609,13 @@ def attn_fwd(
     else:
         tl.store(m_ptrs, m_i + tl.math.log2(l_i))
     # write back O
-    o_offset = off_h * stride_oh + off_z * stride_oz
+    o_offset = off_h * stride_oh + batch_index * stride_oz + cu_seqlens_q_start * stride_om
     O_block_ptr = tl.make_block_ptr(
         base=Out + o_offset,
         shape=(seqlen_q, head_dim),
         strides=(stride_om, stride_on),
         offsets=(start_m * BLOCK_M, 0),
-        block_shape=(BLOCK_M, BLOCK_DMODEL),
+        block_shape=(BLOCK_M, BLOCK_DMODEL_MAIN),
         order=(1, 0)
     )
     if q_padded:
@@ -346,3 +628,22 @@ def attn_fwd(
             tl.store(O_block_ptr, acc.to(Out.type.element_ty), boundary_check=(1,))
         else:
             tl.store(O_block_ptr, acc.to(Out.type.element_ty))
+    if BLOCK_DMODEL_TAIL > 0:
+        O_tail_block_ptr = tl.make_block_ptr(
+            base=Out + o_offset,
+            shape=(seqlen_q, head_dim),
+            strides=(stride_om, stride_on),
+            offsets=(start_m * BLOCK_M, BLOCK_DMODEL_MAIN),
+            block_shape=(BLOCK_M, BLOCK_DMODEL_TAIL),
+            order=(1, 0)
+        )
+        if q_padded:
+            if PADDED_HEAD:
+                tl.store(O_tail_block_ptr, acc_tail.to(Out.type.element_ty), boundary_check=(0,1))
+            else:
+                tl.store(O_tail_block_ptr, acc_tail.to(Out.type.element_ty), boundary_check=(0,))
+        else:
+            if PADDED_HEAD:
+                tl.store(O_tail_block_ptr, acc_tail.to(Out.type.element_ty), boundary_check=(1,))
+            else:
+                tl.store(O_tail_block_ptr, acc_tail.to(Out.type.element_ty))
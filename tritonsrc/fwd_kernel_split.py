@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+"""
+Split-KV Forward Attention
+==========================
+
+Forward pass for decoding, where seqlen_q is tiny (usually 1) and the grid of
+attn_fwd has a single block per (head, batch). seqlen_k is split into
+num_splits chunks processed by separate programs (Flash-Decoding,
+https://crfm.stanford.edu/2023/10/12/flashdecoding.html).
+
+attn_fwd_split writes the normalized output and the log-sum-exp of each chunk
+into fp32 workspaces, and attn_fwd_split_reduce merges the chunks with their
+log-sum-exp. Both log-sum-exps are in base 2, like M of attn_fwd.
+
+Workspace layouts, with z' = split * batch_size + z:
+    Out_partial: (num_splits * batch_size) x num_heads x seqlen_q x head_dim
+    M_partial: (num_splits * batch_size * num_heads) x seqlen_q
+"""
+
+import triton
+import triton.language as tl
+
+@triton.jit
+def attn_fwd_split(
+    Q, K, V, sm_scale, Out_partial, M_partial,
+    stride_qz, stride_qh, stride_qm, stride_qk,
+    stride_kz, stride_kh, stride_kn, stride_kk,
+    stride_vz, stride_vh, stride_vk, stride_vn,
+    stride_opz, stride_oph, stride_opm, stride_opn,
+    num_head_q, num_head_k,
+    seqlen_q, seqlen_k,
+    head_dim,
+    num_splits,
+    BLOCK_M: tl.constexpr,
+    BLOCK_DMODEL: tl.constexpr,
+    BLOCK_N: tl.constexpr,
+    PADDED_HEAD: tl.constexpr,
+):
+    start_m = tl.program_id(0) // num_splits
+    split = tl.program_id(0) % num_splits
+    off_h = tl.program_id(1) # head index
+    off_z = tl.program_id(2) # batch index
+    num_z = tl.num_programs(2)
+    off_h_k = off_h // (num_head_q // num_head_k)
+    # Chunks are aligned to BLOCK_N, trailing chunks may be empty
+    split_size = tl.cdiv(tl.cdiv(seqlen_k, num_splits), BLOCK_N) * BLOCK_N
+    lo = split * split_size
+    hi = tl.minimum(lo + split_size, seqlen_k)
+
+    Q_block_ptr = tl.make_block_ptr(
+        base=Q + off_h * stride_qh + off_z * stride_qz,
+        shape=(seqlen_q, head_dim),
+        strides=(stride_qm, stride_qk),
+        offsets=(start_m * BLOCK_M, 0),
+        block_shape=(BLOCK_M, BLOCK_DMODEL),
+        order=(1, 0)
+    )
+    K_block_ptr = tl.make_block_ptr(
+        base=K + off_h_k * stride_kh + off_z * stride_kz,
+        shape=(head_dim, seqlen_k),
+        strides=(stride_kk, stride_kn),
+        offsets=(0, lo),
+        block_shape=(BLOCK_DMODEL, BLOCK_N),
+        order=(0, 1)
+    )
+    V_block_ptr = tl.make_block_ptr(
+        base=V + off_h_k * stride_vh + off_z * stride_vz,
+        shape=(seqlen_k, head_dim),
+        strides=(stride_vk, stride_vn),
+        offsets=(lo, 0),
+        block_shape=(BLOCK_N, BLOCK_DMODEL),
+        order=(1, 0)
+    )
+    offs_m = start_m * BLOCK_M + tl.arange(0, BLOCK_M)
+    offs_n = tl.arange(0, BLOCK_N)
+    m_i = tl.zeros([BLOCK_M], dtype=tl.float32) - float("inf")
+    l_i = tl.zeros([BLOCK_M], dtype=tl.float32)
+    acc = tl.zeros([BLOCK_M, BLOCK_DMODEL], dtype=tl.float32)
+    qk_scale = sm_scale * 1.44269504089
+    # Rows past seqlen_q are padded, their results are not stored
+    if PADDED_HEAD:
+        q = tl.load(Q_block_ptr, boundary_check=(0,1), padding_option="zero")
+    else:
+        q = tl.load(Q_block_ptr, boundary_check=(0,), padding_option="zero")
+    q = (q * qk_scale).to(Q_block_ptr.type.element_ty)
+    for start_n in range(lo, hi, BLOCK_N):
+        # The chunk ends at hi, which is not aligned for the last chunk
+        if PADDED_HEAD:
+            k = tl.load(K_block_ptr, boundary_check=(1,0), padding_option="zero")
+            v = tl.load(V_block_ptr, boundary_check=(0,1), padding_option="zero")
+        else:
+            k = tl.load(K_block_ptr, boundary_check=(1,), padding_option="zero")
+            v = tl.load(V_block_ptr, boundary_check=(0,), padding_option="zero")
+        qk = tl.dot(q, k)
+        qk = tl.where(start_n + offs_n[None, :] < hi, qk, float("-inf"))
+        m_ij = tl.maximum(m_i, tl.max(qk, 1))
+        p = tl.math.exp2(qk - m_ij[:, None])
+        alpha = tl.math.exp2(m_i - m_ij)
+        acc = acc * alpha[:, None]
+        l_i = l_i * alpha + tl.sum(p, 1)
+        m_i = m_ij
+        acc += tl.dot(p.to(V_block_ptr.type.element_ty), v)
+        K_block_ptr = tl.advance(K_block_ptr, (0, BLOCK_N))
+        V_block_ptr = tl.advance(V_block_ptr, (BLOCK_N, 0))
+    # Empty chunks store a zero output and a -inf log-sum-exp, and get zero
+    # weights in attn_fwd_split_reduce
+    empty = l_i == 0.0
+    acc = acc / tl.where(empty, 1.0, l_i)[:, None]
+    lse = tl.where(empty, float("-inf"), m_i + tl.math.log2(l_i))
+    off_zp = split * num_z + off_z
+    m_ptrs = M_partial + (off_zp * num_head_q + off_h) * seqlen_q + offs_m
+    tl.store(m_ptrs, lse, mask=offs_m < seqlen_q)
+    O_block_ptr = tl.make_block_ptr(
+        base=Out_partial + off_zp * stride_opz + off_h * stride_oph,
+        shape=(seqlen_q, head_dim),
+        strides=(stride_opm, stride_opn),
+        offsets=(start_m * BLOCK_M, 0),
+        block_shape=(BLOCK_M, BLOCK_DMODEL),
+        order=(1, 0)
+    )
+    tl.store(O_block_ptr, acc, boundary_check=(0,1))
+
+@triton.jit
+def attn_fwd_split_reduce(
+    Out_partial, M_partial, Out, M,
+    stride_opz, stride_oph, stride_opm, stride_opn,
+    stride_oz, stride_oh, stride_om, stride_on,
+    num_head_q,
+    seqlen_q,
+    head_dim,
+    num_splits,
+    BLOCK_M: tl.constexpr,
+    BLOCK_DMODEL: tl.constexpr,
+    PADDED_HEAD: tl.constexpr,
+):
+    start_m = tl.program_id(0)
+    off_h = tl.program_id(1) # head index
+    off_z = tl.program_id(2) # batch index
+    num_z = tl.num_programs(2)
+    offs_m = start_m * BLOCK_M + tl.arange(0, BLOCK_M)
+    offs_d = tl.arange(0, BLOCK_DMODEL)
+    mask_m = offs_m < seqlen_q
+    if PADDED_HEAD:
+        mask_o = mask_m[:, None] & (offs_d[None, :] < head_dim)
+    else:
+        mask_o = mask_m[:, None]
+    off_zh = off_z * num_head_q + off_h
+    op_ptrs = Out_partial + off_z * stride_opz + off_h * stride_oph + \
+              offs_m[:, None] * stride_opm + offs_d[None, :] * stride_opn
+    mp_ptrs = M_partial + off_zh * seqlen_q + offs_m
+    m_i = tl.zeros([BLOCK_M], dtype=tl.float32) - float("inf")
+    l_i = tl.zeros([BLOCK_M], dtype=tl.float32)
+    acc = tl.zeros([BLOCK_M, BLOCK_DMODEL], dtype=tl.float32)
+    # The first chunk is never empty, hence m_i is finite after it.
+    # Padded rows load zeros instead of -inf to avoid NaNs.
+    for split in range(0, num_splits):
+        lse = tl.load(mp_ptrs, mask=mask_m, other=0.0)
+        o = tl.load(op_ptrs, mask=mask_o, other=0.0)
+        m_ij = tl.maximum(m_i, lse)
+        alpha = tl.math.exp2(m_i - m_ij)
+        w = tl.math.exp2(lse - m_ij)
+        acc = acc * alpha[:, None] + o * w[:, None]
+        l_i = l_i * alpha + w
+        m_i = m_ij
+        op_ptrs += num_z * stride_opz
+        mp_ptrs += num_z * num_head_q * seqlen_q
+    acc = acc / l_i[:, None]
+    tl.store(M + off_zh * seqlen_q + offs_m, m_i + tl.math.log2(l_i), mask=mask_m)
+    o_ptrs = Out + off_z * stride_oz + off_h * stride_oh + \
+             offs_m[:, None] * stride_om + offs_d[None, :] * stride_on
+    tl.store(o_ptrs, acc.to(Out.type.element_ty), mask=mask_o)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+'''
+Cost of the dropout RNG: throughput of the fwd and bwd passes with dropout
+enabled, against dropout_p = 0. With the bitmask, the backward pass loads the
+mask stored by the forward pass instead of running Philox.
+'''
+
+import torch
+
+import triton
+from attn_torch_function import attention
+
+BATCH, N_HEADS, D_HEAD = 4, 16, 64
+configs = []
+for mode in ['fwd', 'bwd']:
+    for causal in [False, True]:
+        configs.append(triton.testing.Benchmark(
+            x_names=['N_CTX'],
+            x_vals=[2**i for i in range(10, 15)],
+            line_arg='variant',
+            line_vals=['none', 'philox', 'bitmask'],
+            line_names=['dropout_p=0', 'dropout_p=0.5', 'dropout_p=0.5 (bitmask)'],
+            styles=[('blue', '-'), ('red', '-'), ('green', '-')],
+            ylabel='TFLOPS',
+            plot_name=f'dropout-batch{BATCH}-head{N_HEADS}-d{D_HEAD}-{mode}-causal={causal}',
+            args={
+                'H': N_HEADS,
+                'BATCH': BATCH,
+                'D_HEAD': D_HEAD,
+                'dtype': torch.float16,
+                'mode': mode,
+                'causal': causal,
+                })
+        )
+
+
+@triton.testing.perf_report(configs)
+def bench_dropout(BATCH, H, N_CTX, D_HEAD, causal, mode, variant, dtype=torch.float16, device="cuda"):
+    warmup = 25
+    rep = 100
+    q = torch.randn((BATCH, H, N_CTX, D_HEAD), dtype=dtype, device=device, requires_grad=True)
+    k = torch.randn((BATCH, H, N_CTX, D_HEAD), dtype=dtype, device=device, requires_grad=True)
+    v = torch.randn((BATCH, H, N_CTX, D_HEAD), dtype=dtype, device=device, requires_grad=True)
+    sm_scale = 1.3
+    dropout_p = 0.0 if variant == 'none' else 0.5
+    use_dropout_bitmask = variant == 'bitmask'
+    return_encoded_softmax = False
+    fn = lambda: attention(q, k, v, causal, sm_scale, dropout_p, return_encoded_softmax,
+                           False, False, -1, -1, None, None, use_dropout_bitmask)[0]
+    if mode == 'bwd':
+        o = fn()
+        do = torch.randn_like(o)
+        fn = lambda: o.backward(do, retain_graph=True)
+    ms = triton.testing.do_bench(fn, warmup=warmup, rep=rep)
+    flops_per_matmul = 2. * BATCH * H * N_CTX * N_CTX * D_HEAD
+    total_flops = 2 * flops_per_matmul
+    if causal:
+        total_flops *= 0.5
+    if mode == 'bwd':
+        total_flops *= 2.5  # 2.0(bwd) + 0.5(recompute)
+    return total_flops / ms * 1e-9
+
+
+bench_dropout.run(save_path='.', print_data=True)
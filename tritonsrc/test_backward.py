@@ -87,7 +87,7 @@ def query_key_value_clones(query: torch.Tensor, key: torch.Tensor, value: torch.
 # @pytest.mark.parametrize('seqlen_q', [1, 4, 32, 128, 256, 512, 1024, 7, 394, 250, 399, 511, 1019])
 # @pytest.mark.parametrize('seqlen_k', [1, 4, 32, 128, 256, 512, 1024, 3, 217, 339, 313, 491, 988])
 # PyTorch set
-@pytest.mark.parametrize('D_HEAD', [8, 16, 21, 32, 64, 72, 96, 128, 160, 192, 203, 256])
+@pytest.mark.parametrize('D_HEAD', [8, 16, 21, 32, 48, 64, 72, 80, 96, 128, 160, 192, 203, 256])
 @pytest.mark.parametrize('seqlen_q', [4, 8, 64, 143, 256, 512, 1024, 2048])
 @pytest.mark.parametrize('seqlen_k', [4, 8, 64, 128, 256, 587, 1024, 2048])
 # Currently debugging
@@ -263,3 +263,29 @@ def test_op_bwd(BATCH, N_HEADS, D_HEAD, seqlen_q, seqlen_k, causal, sm_scale, dr
         print(f'{err_idx=}')
         print(f'{tri_dq[err_idx]=} {ref_dq[err_idx]=} error = {torch.abs(tri_dq[err_idx] - ref_dq[err_idx])}')
     assert dk_allclose and dv_allclose and dq_allclose, f'{dk_allclose=} {dv_allclose=} {dq_allclose=}'
+
+# Covers every FUSED_DQ x INLINE_DELTA combination of bwd_kernel_dk_dv, as
+# selectable through the tuning database
+@pytest.mark.parametrize('D_HEAD', [16, 72, 128])
+@pytest.mark.parametrize('seqlen_q', [4, 143, 1024])
+@pytest.mark.parametrize('seqlen_k', [4, 587, 1024])
+@pytest.mark.parametrize('causal', [False, True])
+@pytest.mark.parametrize('dropout_p', [0.0, 0.5])
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+@pytest.mark.parametrize('fused_dq, inline_delta', [(False, True), (True, False), (True, True)])
+def test_bwd_variants(D_HEAD, seqlen_q, seqlen_k, causal, dropout_p, dtype, fused_dq, inline_delta):
+    torch.manual_seed(20)
+    q = torch.empty((2, 4, seqlen_q, D_HEAD), dtype=dtype, device="cuda").normal_(mean=0., std=0.5)
+    k = torch.empty((2, 4, seqlen_k, D_HEAD), dtype=dtype, device="cuda").normal_(mean=0., std=0.5)
+    v = torch.empty((2, 4, seqlen_k, D_HEAD), dtype=dtype, device="cuda").normal_(mean=0., std=0.5)
+    dout = torch.randn_like(q)
+    def grads(fused_dq, inline_delta):
+        q_, k_, v_ = query_key_value_clones(q.requires_grad_(), k.requires_grad_(), v.requires_grad_())
+        out, _, _ = attention(q_, k_, v_, causal, 1.2, dropout_p, False, False, False,
+                              -1, -1, None, None, False, inline_delta, fused_dq)
+        out.backward(dout)
+        return q_.grad, k_.grad, v_.grad
+    # Reference: bwd_preprocess, bwd_kernel_dk_dv and bwd_kernel_dq. Only the
+    # computation of delta and the order of the dQ accumulation differ.
+    for grad, ref_grad in zip(grads(fused_dq, inline_delta), grads(False, False)):
+        torch.testing.assert_close(grad, ref_grad, atol=2e-2, rtol=2e-2)
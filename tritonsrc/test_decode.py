@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+'''
+Checks the split-KV decode kernels against a NumPy reference. Runs on the CPU
+with the Triton interpreter, no GPU is needed.
+'''
+
+import os
+os.environ['TRITON_INTERPRET'] = '1'
+
+import numpy as np
+import pytest
+import torch
+import triton
+
+from fwd_kernel_split import attn_fwd_split, attn_fwd_split_reduce
+
+BLOCK_M = 16
+BLOCK_N = 64
+
+def decode_attention(q, k, v, sm_scale, num_splits):
+    batch, num_heads, seqlen_q, head_dim = q.shape
+    seqlen_k = k.shape[2]
+    block_dmodel = max(16, triton.next_power_of_2(head_dim))
+    out = torch.empty_like(q)
+    M = torch.empty((batch * num_heads, seqlen_q), dtype=torch.float32)
+    out_partial = torch.empty((num_splits * batch, num_heads, seqlen_q, head_dim), dtype=torch.float32)
+    M_partial = torch.empty((num_splits * batch * num_heads, seqlen_q), dtype=torch.float32)
+    grid = (triton.cdiv(seqlen_q, BLOCK_M) * num_splits, num_heads, batch)
+    attn_fwd_split[grid](
+        q, k, v, sm_scale, out_partial, M_partial,
+        *q.stride(), *k.stride(), *v.stride(), *out_partial.stride(),
+        num_heads, k.shape[1],
+        seqlen_q, seqlen_k,
+        head_dim,
+        num_splits,
+        BLOCK_M=BLOCK_M,
+        BLOCK_DMODEL=block_dmodel,
+        BLOCK_N=BLOCK_N,
+        PADDED_HEAD=block_dmodel != head_dim,
+    )
+    grid = (triton.cdiv(seqlen_q, BLOCK_M), num_heads, batch)
+    attn_fwd_split_reduce[grid](
+        out_partial, M_partial, out, M,
+        *out_partial.stride(), *out.stride(),
+        num_heads,
+        seqlen_q,
+        head_dim,
+        num_splits,
+        BLOCK_M=BLOCK_M,
+        BLOCK_DMODEL=block_dmodel,
+        PADDED_HEAD=block_dmodel != head_dim,
+    )
+    return out, M
+
+def ref_attention(q, k, v, sm_scale):
+    q, k, v = [t.float().numpy().astype(np.float64) for t in (q, k, v)]
+    group_size = q.shape[1] // k.shape[1]
+    k = np.repeat(k, group_size, axis=1)
+    v = np.repeat(v, group_size, axis=1)
+    s = q @ k.swapaxes(2, 3) * sm_scale
+    m = s.max(axis=-1, keepdims=True)
+    p = np.exp(s - m)
+    l = p.sum(axis=-1, keepdims=True)
+    # M of attn_fwd is the log-sum-exp in base 2
+    lse = (m + np.log(l)) / np.log(2)
+    return p @ v / l, lse.reshape(q.shape[0] * q.shape[1], q.shape[2])
+
+@pytest.mark.parametrize('seqlen_q', [1, 4])
+@pytest.mark.parametrize('seqlen_k', [1, 100, 1024])
+@pytest.mark.parametrize('num_splits', [1, 3, 8])
+@pytest.mark.parametrize('num_heads, num_heads_k', [(4, 4), (4, 1)])
+@pytest.mark.parametrize('head_dim', [64, 40])
+def test_split_kv(seqlen_q, seqlen_k, num_splits, num_heads, num_heads_k, head_dim):
+    torch.manual_seed(0)
+    batch = 2
+    sm_scale = 1.0 / head_dim ** 0.5
+    q = torch.randn((batch, num_heads, seqlen_q, head_dim), dtype=torch.float16)
+    k = torch.randn((batch, num_heads_k, seqlen_k, head_dim), dtype=torch.float16)
+    v = torch.randn((batch, num_heads_k, seqlen_k, head_dim), dtype=torch.float16)
+    out, M = decode_attention(q, k, v, sm_scale, num_splits)
+    ref_out, ref_M = ref_attention(q, k, v, sm_scale)
+    np.testing.assert_allclose(out.float().numpy(), ref_out, atol=1e-2, rtol=0)
+    np.testing.assert_allclose(M.numpy(), ref_M, atol=1e-3, rtol=0)
@@ -55,3 +55,22 @@ def test_tune_fwd(teardown, BATCH, N_HEADS, D_HEAD, seqlen_q, seqlen_k, causal,
     dout = torch.randn_like(q)
     tri_out.backward(dout)
     BestConfigRecord.best_config_database += best_configs
+
+@pytest.mark.parametrize('BATCH', [4])
+@pytest.mark.parametrize('N_HEADS', [4])
+@pytest.mark.parametrize('D_HEAD', [16,32,64,128,256])
+@pytest.mark.parametrize('seqlen_q', [128,256,512,1024])
+@pytest.mark.parametrize('seqlen_k', [128,256,512,1024])
+@pytest.mark.parametrize('causal', [True, False])
+@pytest.mark.parametrize('dtype', [torch.float8_e4m3fnuz, torch.float8_e5m2fnuz])
+@pytest.mark.parametrize('sm_scale', [1.2])
+def test_tune_fwd_fp8(teardown, BATCH, N_HEADS, D_HEAD, seqlen_q, seqlen_k, causal, sm_scale, dtype):
+    # FP8 attention is forward only
+    q = torch.randn((BATCH, N_HEADS, seqlen_q, D_HEAD), device="cuda").to(dtype)
+    k = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), device="cuda").to(dtype)
+    v = torch.randn((BATCH, N_HEADS, seqlen_k, D_HEAD), device="cuda").to(dtype)
+    autotune = True
+    return_autotune = True
+    tri_out, encoded_softmax, best_configs = attention(q, k, v, causal, sm_scale, 0.0, False, autotune, return_autotune,
+                                                       -1, -1, (1.0, 1.0, 1.0))
+    BestConfigRecord.best_config_database += best_configs
@@ -19,11 +19,18 @@ def parse():
     p.add_argument("--build_dir", type=str, default='build/', help="build directory")
     p.add_argument("--python", type=str, default=None, help="python binary to run compile.py")
     p.add_argument("--enable_zstd", type=str, default=None, help="Use zstd to compress the compiled kernel")
+    p.add_argument("--zstd_dictionary", action='store_true', help="Train a zstd dictionary per kernel and GPU, and compress the kernels with it. Requires --enable_zstd")
     # p.add_argument("--autotune_data", type=str, default=None, help="Autotune results generated by tune_flash.py")
     args = p.parse_args()
+    if args.zstd_dictionary:
+        assert args.enable_zstd is not None, '--zstd_dictionary requires --enable_zstd'
     # print(args)
     return args
 
+# Dictionaries larger than ~100KiB hardly improve the compression ratio of
+# kernel images but slow down the training
+ZSTD_MAX_DICTIONARY_SIZE = 112640
+
 def gen_from_object(args, o : 'ObjectFileDescription', makefile):
     target_fn = f'{o.KERNEL_FAMILY}/gpu_kernel_image.{o.SHIM_KERNEL_NAME}/{o._hsaco_kernel_path.name}'
     print('#', o.human_readable_signature, file=makefile)
@@ -37,11 +44,31 @@ def gen_from_object(args, o : 'ObjectFileDescription', makefile):
         target_gpu = 'native'
     cmd += f" --signature '{o.signature}'"
     print('\t', cmd, file=makefile)
-    if args.enable_zstd is not None:
+    if args.enable_zstd is not None and not args.zstd_dictionary:
         print('\t', f'{args.enable_zstd} -f {o.obj.absolute()}', '\n', file=makefile)
     print('', file=makefile)
     return target_fn
 
+def gen_zstd_dictionary(args, k, gpu, outpath, objs, makefile):
+    # Training fails if there are too few samples. In this case the
+    # dictionary is left empty and the images are compressed without it.
+    dict_fn = outpath / k.zstd_dictionary_name(gpu)
+    target_dict = str(dict_fn.relative_to(Path(args.build_dir)))
+    hsaco_targets = [target_fn for target_fn, _ in objs]
+    print(target_dict, ':', ' '.join(hsaco_targets), file=makefile)
+    cmd = f'{args.enable_zstd} -q -f --train {" ".join([str(o.obj.absolute()) for _, o in objs])}'
+    cmd += f' --maxdict={ZSTD_MAX_DICTIONARY_SIZE} -o {dict_fn.absolute()}'
+    cmd += f' || (rm -f {dict_fn.absolute()} && touch {dict_fn.absolute()})'
+    print('\t', cmd, '\n', file=makefile)
+    all_targets = []
+    for target_fn, o in objs:
+        print(f'{target_fn}.zst', ':', target_fn, target_dict, file=makefile)
+        cmd  = f'if [ -s {dict_fn.absolute()} ]; then {args.enable_zstd} -q -f -D {dict_fn.absolute()} {o.obj.absolute()};'
+        cmd += f' else {args.enable_zstd} -q -f {o.obj.absolute()}; fi'
+        print('\t', cmd, '\n', file=makefile)
+        all_targets.append(f'{target_fn}.zst')
+    return all_targets
+
 def gen_from_kernel(args, k, build_dir, makefile):
     outpath = build_dir / k.KERNEL_FAMILY / f'gpu_kernel_image.{k.SHIM_KERNEL_NAME}'
     outpath.mkdir(parents=True, exist_ok=True)
@@ -54,8 +81,15 @@ def gen_from_kernel(args, k, build_dir, makefile):
         if k.SHIM_KERNEL_NAME == 'attn_fwd':
             assert not ktd.empty
     k.set_target_gpus(arches)
+    per_gpu_objs = {}
     for o in k.gen_all_object_files(outpath, tuned_db=ktd):
-        all_targets.append(gen_from_object(args, o, object_rules))
+        target_fn = gen_from_object(args, o, object_rules)
+        all_targets.append(target_fn)
+        per_gpu_objs.setdefault(o.target_gpu, {})[target_fn] = o
+    if args.zstd_dictionary:
+        all_targets = []
+        for gpu, objs in per_gpu_objs.items():
+            all_targets += gen_zstd_dictionary(args, k, gpu, outpath, list(objs.items()), object_rules)
     print(target_all, ': ', end='', file=makefile)
     for t in all_targets:
         print(t, end=' ', file=makefile)
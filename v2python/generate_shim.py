@@ -3,6 +3,7 @@
 
 from .rules import kernels as triton_kernels
 from .tuning_database import KernelTuningDatabase
+from .kernel_pack import KernelPackBuilder
 import io
 import shutil
 import argparse
@@ -12,6 +13,7 @@ SOURCE_PATH = Path(__file__).resolve()
 CSRC = (SOURCE_PATH.parent.parent / 'v2src').absolute()
 INCBIN = (SOURCE_PATH.parent.parent / 'third_party/incbin/').absolute()
 COMMON_INCLUDE = (SOURCE_PATH.parent.parent / 'include/').absolute()
+KERNEL_PACK = (SOURCE_PATH.parent / 'kernel_pack.py').absolute()
 # COMPILER = SOURCE_PATH.parent / 'compile.py'
 COMPILER = 'hipcc'
 LINKER = 'ar'
@@ -25,8 +27,13 @@ def parse():
     p.add_argument("--build_dir", type=str, default='build/', help="build directory")
     p.add_argument("--archive_only", action='store_true', help='Only generate archive library instead of shared library. No linking with dependencies.')
     p.add_argument("--enable_zstd", type=str, default=None, help="Use zstd to compress the compiled kernel")
+    p.add_argument("--zstd_dictionary", action='store_true', help='Kernels were compressed with per-kernel zstd dictionaries (generate_compile --zstd_dictionary). Requires --enable_zstd')
+    p.add_argument("--kernel_pack", action='store_true', help='Store kernel images in one memory-mapped pack file per GPU instead of embedding them into the library')
     args = p.parse_args()
+    if args.zstd_dictionary:
+        assert args.enable_zstd is not None, '--zstd_dictionary requires --enable_zstd'
     args._build_root = Path(args.build_dir)
+    args._kernel_packs = {}
     # print(args)
     return args
 
@@ -168,6 +175,7 @@ class ShimMakefileGenerator(MakefileGenerator):
 
     def write_conclude(self):
         f = self._out
+        self.write_kernel_packs()
         all_object_files = ' '.join([str(p) for p in self.list_of_output_object_files])
         for s in self._library_suffixes:
             fn = f'{LIBRARY_NAME}{s}'
@@ -178,6 +186,20 @@ class ShimMakefileGenerator(MakefileGenerator):
                 print('\t', COMPILER, ' -g -shared -fPIC -o ', fn, all_object_files, file=f)
             print('\n\n', file=f)
 
+    def write_kernel_packs(self):
+        f = self._out
+        packs = []
+        for gpu, builder in self._args._kernel_packs.items():
+            manifest = self._build_dir / (builder.file_name + '.manifest')
+            builder.write_manifest(manifest)
+            pack = builder.file_name
+            print(pack, ':', manifest.name, ' '.join([str(fn) for fn in builder.files]), file=f)
+            cmd = f'python {KERNEL_PACK} --manifest {manifest.absolute()} --output {(self._build_dir / pack).absolute()}'
+            print('\t', cmd, '\n', file=f)
+            packs.append(pack)
+        if packs:
+            print(self._grand_target, ':', ' '.join(packs), '\n\n', file=f)
+
     '''
     @property
     def _object_relative_paths(self):
@@ -263,6 +285,8 @@ class KernelShimGenerator(MakefileSegmentGenerator):
             if debug_counter >= 2:
                 break
             '''
+        if args.zstd_dictionary:
+            yield ZstdDictionaryGenerator(args, self.children_out, k, self._shim_path, p)
 
         for o in k.gen_all_object_files(p, tuned_db=ktd, sancheck_fileexists=True):
             yield ObjectShimCodeGenerator(self._args, k, o)
@@ -288,8 +312,13 @@ class AutotuneCodeGenerator(MakefileSegmentGenerator):
 
     def write_body(self):
         # Write the code to file
+        kernel_pack = None
+        if self._args.kernel_pack:
+            kernel_pack = self._args._kernel_packs.setdefault(self._gpu, KernelPackBuilder(self._gpu))
         self._ofn = self._lut.write_lut_source(self._outdir,
-                                               compressed=self._args.enable_zstd is not None)
+                                               compressed=self._args.enable_zstd is not None,
+                                               kernel_pack=kernel_pack,
+                                               zstd_dictionary=self._args.zstd_dictionary)
         self._obj_fn = self._ofn.with_suffix('.o')
         self._makefile_target = self._obj_fn.relative_to(self._build_dir)
         # Write the Makefile segment
@@ -302,6 +331,46 @@ class AutotuneCodeGenerator(MakefileSegmentGenerator):
     def list_of_self_object_files(self) -> 'list[Path]':
         return [self._makefile_target]
 
+class ZstdDictionaryGenerator(MakefileSegmentGenerator):
+    '''
+    Embeds the zstd dictionaries of one kernel, one per target GPU.
+    Dictionaries are small, hence they are embedded even if kernel images
+    are stored in a kernel pack.
+    '''
+    def __init__(self, args, fileout, k, outdir, kernel_image_dir):
+        super().__init__(args, fileout)
+        self._build_dir = Path(args.build_dir)
+        self._kdesc = k
+        self._ofn = outdir / f'zstd_dictionary.{k.SHIM_KERNEL_NAME}.cc'
+        self._kernel_image_dir = kernel_image_dir
+
+    def write_body(self):
+        k = self._kdesc
+        dict_files = []
+        with open(self._ofn, 'w') as f:
+            print('#define INCBIN_PREFIX g_aotriton_zstd_dictionary_', file=f)
+            print('#define INCBIN_STYLE INCBIN_STYLE_SNAKE', file=f)
+            print('', file=f)
+            print('#include <aotriton/_internal/triton_kernel.h>', file=f)
+            print('#include <incbin.h>', file=f)
+            print('', file=f)
+            for gpu in k._target_gpus:
+                fn = (self._kernel_image_dir / k.zstd_dictionary_name(gpu)).absolute()
+                name = f'{k.KERNEL_FAMILY}_{k.SHIM_KERNEL_NAME}_{gpu}'
+                print(f'INCBIN({name}, "{fn}");', file=f)
+                print(f'aotriton::ZstdDictionary {k.zstd_dictionary_symbol(gpu)}(g_aotriton_zstd_dictionary_{name}_data,',
+                      f'g_aotriton_zstd_dictionary_{name}_size);', file=f)
+                dict_files.append(str(fn))
+        self._obj_fn = self._ofn.with_suffix('.o')
+        self._makefile_target = self._obj_fn.relative_to(self._build_dir)
+        print(self._makefile_target, ':', self._ofn.relative_to(self._build_dir), ' '.join(dict_files), file=self._out)
+        cmd  = self._cc_cmd + f' {self._ofn.absolute()} -o {self._obj_fn.absolute()} -c'
+        print('\t', cmd, '\n', file=self._out)
+
+    @property
+    def list_of_self_object_files(self) -> 'list[Path]':
+        return [self._makefile_target]
+
 # FIXME: a better name.
 #        This class name is legacy and now it's only used to store
 #        ObjectFileDescription objects to keep record of metadata for compiled
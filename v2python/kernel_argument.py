@@ -17,6 +17,8 @@ class ArgumentMetadata(object):
     DTYPE_NUMBER = {
         'fp16' : 'DType::kFloat16',
         'bf16' : 'DType::kBFloat16',
+        'fp8e4b8' : 'DType::kFloat8e4m3fnuz',
+        'fp8e5b16' : 'DType::kFloat8e5m2fnuz',
         'fp32' : 'DType::kFloat32',
     }
     def __init__(self, grouped_arguments_as_set, possible_values, cat : ArgumentCategory, kdesc):
@@ -42,6 +42,8 @@ def select_pattern(arguments, prefix, trim_left=None, trim_right=None):
 class KernelDescription(object):
     ARGUMENTS = []
     SHIM_KERNEL_NAME = None
+    # Kernels sharing a Triton kernel with another shim share its tuning information
+    TUNING_KERNEL_NAME = None
     _ARGUMENT_CHOICES = None
     HEADER_TEMPLATE = get_template('shim.h')
     SOURCE_TEMPLATE = get_template('shim.cc')
@@ -129,7 +131,21 @@ class KernelDescription(object):
                 self.AUTOTUNE_KEYS_VALIDATED.append((key, self.AUTOTUNE_KEYS[key]))
 
     def gen_func_selections(self) -> 'tuple[ArgumentSelection]':
-        return itertools.product(*self._func_selections)
+        for fsels in itertools.product(*self._func_selections):
+            if not self.is_functional_disabled(self.functional_values(fsels)):
+                yield fsels
+
+    def is_functional_disabled(self, functionals : 'dict') -> bool:
+        '''
+        Returns True for combinations of functionals the shim code never
+        selects. They are neither compiled nor tuned, and their entries in the
+        kernel table are left empty.
+        '''
+        return False
+
+    @staticmethod
+    def functional_values(fsels : 'tuple[ArgumentSelection]') -> 'dict':
+        return { aname : fsel.argument_value for fsel in fsels for aname in fsel.argument_names }
 
     def gen_perf_selections(self) -> 'tuple[ArgumentSelection]':
         return itertools.product(*self._perf_selections)
@@ -235,6 +251,14 @@ class KernelDescription(object):
               'let_kernel_arguments' : let_kernel_arguments,
               'get_arch_number_body' : self.arch_number_body,
               'number_of_functionals': self._godel_number,
+              'perf_fields'         : ';\n    '.join(self.perf_fields),
+              'number_of_autotune_keys' : len(self.AUTOTUNE_KEYS_VALIDATED),
+              'lookup_key_values'   : self.lookup_key_values,
+              'copy_perf_fields_from_cache' : self.codegen_copy_perf_fields('params', 'cached->', ' ' * 12),
+              'copy_perf_fields_to_cache' : self.codegen_copy_perf_fields('value', 'params.', ' ' * 8),
+              'number_of_perf_fields' : len(self.perf_field_names),
+              'perf_field_name_strings' : ', '.join([f'"{aname}"' for aname in self.perf_field_names]),
+              'perf_field_values'   : ', '.join([f'static_cast<int32_t>(params.{aname})' for aname in self.perf_field_names]),
               # 'copy_perf_fields_body': self.copy_perf_fields_body,
               # 'kernel_table_entry_declares' : self.codegen_kernel_table_entry_declares(object_files),
               'kernel_table_entries' : self.codegen_kernel_table_entries(object_files),
@@ -298,6 +322,18 @@ class KernelDescription(object):
         return ALIGN.join(lets)
     '''
 
+    @property
+    def perf_field_names(self):
+        return sum([m.argument_names for m in self._perf_meta], [])
+
+    @property
+    def lookup_key_values(self):
+        return ', '.join([f'static_cast<int64_t>(params.{key})' for key, _ in self.AUTOTUNE_KEYS_VALIDATED])
+
+    def codegen_copy_perf_fields(self, dst, src_prefix, indent):
+        lets = [f'{dst}.{aname} = {src_prefix}{aname}' for aname in self.perf_field_names]
+        return (';\n' + indent).join(lets)
+
     def incbin_mangle(self, arch, o):
         return f'INCBIN_{arch}_{self.KERNEL_FAMILY}_{self.SHIM_KERNEL_NAME}_{o.c_identifier_signature}'
 
@@ -324,6 +360,12 @@ class KernelDescription(object):
     def get_single_kernel_table_entry(self, arch : 'str', o : 'ObjectFileDescription'):
         image_symbol = self.incbin_mangle(arch, o)
 
+    def zstd_dictionary_name(self, gpu):
+        return f'{self.SHIM_KERNEL_NAME}-Gpu-{gpu}.zdict'
+
+    def zstd_dictionary_symbol(self, gpu):
+        return f'g_aotriton_FAMILY_{self.KERNEL_FAMILY}_KERNEL_{self.SHIM_KERNEL_NAME}_GPU_{gpu}_zstd_dictionary'
+
     def get_autotune_struct_name(self, arch_number, godel_number):
         return f'Autotune_{self.SHIM_KERNEL_NAME}__A{arch_number}__F{godel_number}'
 
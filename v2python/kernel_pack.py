@@ -0,0 +1,115 @@
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+'''
+Kernel pack: all GPU kernel images of one target GPU in a single file, which
+is memory mapped by the runtime instead of embedding the images with INCBIN.
+
+Layout (little endian), must match include/aotriton/_internal/kernel_pack.h
+
+    Header:  char magic[8] = "AOTKPACK", uint32 version, uint32 count
+    Table:   count x { uint64 offset, uint64 size }
+    Images:  each image starts at an offset aligned to ALIGNMENT
+'''
+
+import argparse
+import struct
+from pathlib import Path
+
+MAGIC = b'AOTKPACK'
+VERSION = 1
+ALIGNMENT = 4096
+HEADER = struct.Struct('<8sII')
+ENTRY = struct.Struct('<QQ')
+
+def pack_file_name(gpu):
+    return f'aotriton_v2.{gpu}.kpack'
+
+class KernelPackBuilder(object):
+    '''
+    Assigns indices to image files of one target GPU.
+    The same file always gets the same index.
+    '''
+    def __init__(self, gpu):
+        self._gpu = gpu
+        self._files = []
+        self._index = {}
+
+    @property
+    def gpu(self):
+        return self._gpu
+
+    @property
+    def file_name(self):
+        return pack_file_name(self._gpu)
+
+    @property
+    def files(self) -> 'list[Path]':
+        return self._files
+
+    def add(self, fn : Path) -> int:
+        fn = Path(fn).absolute()
+        if fn not in self._index:
+            self._index[fn] = len(self._files)
+            self._files.append(fn)
+        return self._index[fn]
+
+    def write_manifest(self, manifest : Path):
+        with open(manifest, 'w') as f:
+            for fn in self._files:
+                print(fn, file=f)
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def write_kernel_pack(output : Path, files : 'list[Path]'):
+    offset = _align(HEADER.size + ENTRY.size * len(files))
+    table = []
+    for fn in files:
+        size = Path(fn).stat().st_size
+        table.append((offset, size))
+        offset = _align(offset + size)
+    # Write to a temporary file so an interrupted build never leaves a
+    # truncated pack with a valid header behind.
+    output = Path(output)
+    tmp = output.with_name(output.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(files)))
+        for entry in table:
+            f.write(ENTRY.pack(*entry))
+        for fn, (offset, size) in zip(files, table):
+            f.seek(offset)
+            with open(fn, 'rb') as src:
+                data = src.read()
+            assert len(data) == size, f'{fn} changed while writing the kernel pack'
+            f.write(data)
+    tmp.replace(output)
+
+def read_kernel_pack(fn : Path) -> 'list[bytes]':
+    with open(fn, 'rb') as f:
+        data = f.read()
+    magic, version, count = HEADER.unpack_from(data, 0)
+    assert magic == MAGIC, f'{fn} is not a kernel pack'
+    assert version == VERSION, f'{fn} has unsupported version {version}'
+    images = []
+    for i in range(count):
+        offset, size = ENTRY.unpack_from(data, HEADER.size + i * ENTRY.size)
+        assert offset % ALIGNMENT == 0 and offset + size <= len(data), f'{fn} has a corrupted entry {i}'
+        images.append(data[offset:offset+size])
+    return images
+
+def parse():
+    p = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument("--manifest", type=str, required=True, help="File that lists the images, one path per line, in index order")
+    p.add_argument("--output", type=str, required=True, help="Kernel pack file")
+    args = p.parse_args()
+    return args
+
+def main():
+    args = parse()
+    with open(args.manifest) as f:
+        files = [Path(line.strip()) for line in f if line.strip()]
+    write_kernel_pack(args.output, files)
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,9 @@ class ObjectFileDescription(object):
         '*fp32' : 'const float*',
         '*fp16' : 'const __fp16*',
         '*bf16' : 'const __bf16*',
+        '*fp8e4b8'  : 'const uint8_t*',
+        '*fp8e5b16' : 'const uint8_t*',
+        '*i32'  : 'const int32_t*',
         'i32'   : 'int32_t',
         'i64'   : 'int64_t',
         'u32'   : 'uint32_t',
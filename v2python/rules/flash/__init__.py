@@ -2,14 +2,22 @@
 # SPDX-License-Identifier: MIT
 
 from .attn_fwd import attn_fwd
+from .attn_fwd_fp8 import attn_fwd_fp8
 from .bwd_preprocess import bwd_preprocess
+from .bwd_postprocess import bwd_postprocess
 from .bwd_kernel_dk_dv import bwd_kernel_dk_dv
 from .bwd_kernel_dq import bwd_kernel_dq
+from .attn_fwd_split import attn_fwd_split
+from .attn_fwd_split_reduce import attn_fwd_split_reduce
 
 SOURCE_FILE = 'tritonsrc/flash.py'
 kernels = [
     attn_fwd('attn_fwd', SOURCE_FILE),
+    attn_fwd_fp8('attn_fwd', SOURCE_FILE),
     bwd_preprocess('bwd_preprocess', SOURCE_FILE),
+    bwd_postprocess('bwd_postprocess', SOURCE_FILE),
     bwd_kernel_dk_dv('bwd_kernel_dk_dv', SOURCE_FILE),
     bwd_kernel_dq('bwd_kernel_dq', SOURCE_FILE),
+    attn_fwd_split('attn_fwd_split', SOURCE_FILE),
+    attn_fwd_split_reduce('attn_fwd_split_reduce', SOURCE_FILE),
 ]
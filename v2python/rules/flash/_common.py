@@ -6,3 +6,28 @@ from ...autotune_binning import BinningLessOrEqual, BinningExact
 
 class FlashKernel(KernelDescription):
     KERNEL_FAMILY = 'flash'
+
+    def is_functional_disabled(self, functionals):
+        # attn_fwd_compact_varlen and attn_bwd_compact_varlen reject bias
+        if functionals.get('VARLEN', False) and functionals.get('BIAS_TYPE', 0) != 0:
+            return True
+        # Sizes that are not powers of two only run exact head sizes of the
+        # common problems, see round_head_dim
+        if functionals.get('BLOCK_DMODEL', 16) not in POW2_HEAD_DIMS:
+            return (functionals['PADDED_HEAD'] or
+                    functionals.get('BIAS_TYPE', 0) != 0 or
+                    functionals.get('RETURN_ENCODED_SOFTMAX', False))
+        return False
+
+# BLOCK_DMODEL of the attention kernels. Kernels split the sizes that are not
+# powers of two into a power-of-two main part and tail (e.g. 96 = 64 + 32).
+# 112 would need three parts and runs as 128.
+POW2_HEAD_DIMS = [16, 32, 64, 128, 256]
+HEAD_DIMS = [16, 32, 48, 64, 80, 96, 128, 160, 192, 256]
+
+def tuned_head_dim(head_dim):
+    '''
+    The tuning database only has power-of-two BLOCK_DMODEL. Other sizes use the
+    tuning of the power-of-two kernel that used to run them.
+    '''
+    return 1 << (head_dim - 1).bit_length()
@@ -1,28 +1,36 @@
 # Copyright © 2023-2024 Advanced Micro Devices, Inc.
 # SPDX-License-Identifier: MIT
 
-from ._common import FlashKernel, select_pattern, BinningLessOrEqual, BinningExact
+from ._common import FlashKernel, select_pattern, BinningLessOrEqual, BinningExact, HEAD_DIMS, tuned_head_dim
 
 class attn_fwd(FlashKernel):
     ARGUMENTS = [
-        'Q', 'K', 'V', 'sm_scale', 'M', 'Out',
+        'Q', 'K', 'V', 'B', 'sm_scale', 'M', 'Out',
         'stride_qz', 'stride_qh', 'stride_qm', 'stride_qk',
         'stride_kz', 'stride_kh', 'stride_kn', 'stride_kk',
         'stride_vz', 'stride_vh', 'stride_vk', 'stride_vn',
         'stride_oz', 'stride_oh', 'stride_om', 'stride_on',
-        'seqlen_q', 'seqlen_k',
+        'stride_bz', 'stride_bh', 'stride_bm', 'stride_bn',
+        'num_head_q', 'num_head_k',
+        'cu_seqlens_q', 'cu_seqlens_k',
+        'seqlen_q', 'seqlen_k', # max_seqlens_q/max_seqlens_k in the kernel
         'head_dim',
+        'window_left', 'window_right',
         'dropout_p',
         'philox_seed',
         'philox_offset_base',
         'encoded_softmax',
-        'STAGE', # tl.constexpr starts here
+        'dropout_bitmask',
+        'q_descale', 'k_descale', 'v_descale',
+        'VARLEN', # tl.constexpr starts here
+        'STAGE',
         'BLOCK_M',
         'BLOCK_DMODEL',
         'BLOCK_N',
         'pre_load_v',
         'ENABLE_DROPOUT',
         'RETURN_ENCODED_SOFTMAX',
+        'BIAS_TYPE',
         'PADDED_HEAD',
     ]
     TENSOR_STRIDE_INPUTS = {
@@ -30,24 +38,32 @@ class attn_fwd(FlashKernel):
         'K' : select_pattern(ARGUMENTS, 'stride_k'),
         'V' : select_pattern(ARGUMENTS, 'stride_v'),
         'Out' : select_pattern(ARGUMENTS, 'stride_o'),
+        'B' : select_pattern(ARGUMENTS, 'stride_b'),
     }
     TYPE_CHOICES = {
-        frozenset(['Q', 'K', 'V', 'Out', 'encoded_softmax']) : ['*fp16:16', '*bf16:16'],
+        frozenset(['Q', 'K', 'V', 'B', 'Out', 'encoded_softmax']) : ['*fp16:16', '*bf16:16'],
         frozenset(['sm_scale']) : ['fp32'],
         frozenset(['M']) : ['*fp32:16'],
+        frozenset(['num_head_q', 'num_head_k']) : ['i32'],
+        frozenset(['cu_seqlens_q', 'cu_seqlens_k']) : ['*i32:16'],
         # frozenset(select_pattern(ARGUMENTS, 'stride_', trim=1)) : ['u64'],
         # frozenset(select_pattern(ARGUMENTS, 'stride_', trim=1)) : ['u64'],
         frozenset(['seqlen_q', 'seqlen_k']) : ['i32'],
         frozenset(['head_dim']) : ['u64'],
+        frozenset(['window_left', 'window_right']) : ['i32'],
         frozenset(['dropout_p']) : ['fp32'],
         frozenset(['philox_seed']) : ['u64'],
         frozenset(['philox_offset_base']) : ['u32'],
+        frozenset(['dropout_bitmask']) : ['*i32:16'],
+        frozenset(['q_descale', 'k_descale', 'v_descale']) : ['fp32'],
     }
     FEAT_CHOICES = {
+        frozenset(['VARLEN']) : [False, True],
         frozenset(['STAGE']) : [1, 3],
-        frozenset(['BLOCK_DMODEL']) : [16, 32, 64, 128, 256],
+        frozenset(['BLOCK_DMODEL']) : HEAD_DIMS,
         frozenset(['ENABLE_DROPOUT']) : [True, False],
         frozenset(['RETURN_ENCODED_SOFTMAX']) : [True, False],
+        frozenset(['BIAS_TYPE']) : [0, 1],
         frozenset(['PADDED_HEAD']) : [True, False],
     }
     PERF_CHOICES = {
@@ -58,12 +74,14 @@ class attn_fwd(FlashKernel):
     TENSOR_RANKS = {
         '_default' : 4,
         'M': 2,
+        'cu_seqlens_q': 1,
+        'cu_seqlens_k': 1,
     }
     EXPECTED_IDENTICAL_TENSOR_STRIDES = [
         # Not needed stride_o* exist
     ]
     LAUNCHER_PARAMETERS = [
-        'Q', 'K', 'V', 'sm_scale', 'M', 'Out',  # Basic functions
+        'Q', 'K', 'V', 'B', 'sm_scale', 'M', 'Out',  # Basic functions
         'dropout_p', 'philox_seed', 'philox_offset', 'encoded_softmax',  # dropout
         'is_causal',  # Causal
     ]
@@ -76,8 +94,9 @@ class attn_fwd(FlashKernel):
         'STAGE' : BinningExact,
     }
     # List of functionals that are not fully tuned in the tuning database
-    # First element of the tuple is name. Second is the value to use instead
-    PARTIALLY_TUNED_FUNCTIONALS = [('RETURN_ENCODED_SOFTMAX', False), ('PADDED_HEAD', None)]
+    # First element of the tuple is name. Second is the value to use instead,
+    # or a function that maps the selected value to it
+    PARTIALLY_TUNED_FUNCTIONALS = [('BLOCK_DMODEL', tuned_head_dim), ('RETURN_ENCODED_SOFTMAX', False), ('BIAS_TYPE', None), ('PADDED_HEAD', None), ('VARLEN', None)]
 
     # Python Trick: do not use @staticmethod, and also do not add 'self', and
     #               then there is no need to prefix the classname in DOWNGRADER list
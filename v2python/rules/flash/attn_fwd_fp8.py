@@ -0,0 +1,49 @@
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+from ._common import HEAD_DIMS
+from .attn_fwd import attn_fwd
+
+'''
+attn_fwd with FP8 Q/K/V (FNUZ formats of MI300) and fp16/bf16 outputs.
+
+A separate shim instead of more TYPE_CHOICES of attn_fwd, because Out cannot
+share the type of Q/K/V, and combining every Q type with every Out type and
+every feature of attn_fwd would multiply its kernel count. The kernels are
+for inference: there is no dropout, encoded softmax or bias.
+'''
+class attn_fwd_fp8(attn_fwd):
+    TYPE_CHOICES = {
+        frozenset(['Q', 'K', 'V']) : ['*fp8e4b8:16', '*fp8e5b16:16'],
+        frozenset(['B', 'Out', 'encoded_softmax']) : ['*fp16:16', '*bf16:16'],
+        frozenset(['sm_scale']) : ['fp32'],
+        frozenset(['M']) : ['*fp32:16'],
+        frozenset(['num_head_q', 'num_head_k']) : ['i32'],
+        frozenset(['cu_seqlens_q', 'cu_seqlens_k']) : ['*i32:16'],
+        frozenset(['seqlen_q', 'seqlen_k']) : ['i32'],
+        frozenset(['head_dim']) : ['u64'],
+        frozenset(['window_left', 'window_right']) : ['i32'],
+        frozenset(['dropout_p']) : ['fp32'],
+        frozenset(['philox_seed']) : ['u64'],
+        frozenset(['philox_offset_base']) : ['u32'],
+        frozenset(['dropout_bitmask']) : ['*i32:16'],
+        frozenset(['q_descale', 'k_descale', 'v_descale']) : ['fp32'],
+    }
+    FEAT_CHOICES = {
+        # attn_fwd_fp8 has no varlen entry point
+        frozenset(['VARLEN']) : [False],
+        frozenset(['STAGE']) : [1, 3],
+        frozenset(['BLOCK_DMODEL']) : HEAD_DIMS,
+        frozenset(['ENABLE_DROPOUT']) : [False],
+        frozenset(['RETURN_ENCODED_SOFTMAX']) : [False],
+        frozenset(['BIAS_TYPE']) : [0],
+        frozenset(['PADDED_HEAD']) : [True, False],
+    }
+    SHIM_KERNEL_NAME = 'attn_fwd_fp8'
+    # Same Triton kernel, FP8 entries are distinguished by Q.dtype
+    TUNING_KERNEL_NAME = 'attn_fwd'
+
+    # Until the database has FP8 entries, use the fp16 ones. Out has no key in
+    # the database.
+    PARTIALLY_TUNED_FUNCTIONALS = [('Q', '*fp16:16'), ('Out', None)] + attn_fwd.PARTIALLY_TUNED_FUNCTIONALS
+    DOWNGRADER = []
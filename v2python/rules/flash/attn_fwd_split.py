@@ -0,0 +1,56 @@
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+from ._common import FlashKernel, get_possible_types, select_pattern, BinningLessOrEqual, BinningExact, POW2_HEAD_DIMS
+from .attn_fwd import attn_fwd
+
+class attn_fwd_split(FlashKernel):
+    ARGUMENTS = [
+        'Q', 'K', 'V', 'sm_scale', 'Out_partial', 'M_partial',
+        'stride_qz', 'stride_qh', 'stride_qm', 'stride_qk',
+        'stride_kz', 'stride_kh', 'stride_kn', 'stride_kk',
+        'stride_vz', 'stride_vh', 'stride_vk', 'stride_vn',
+        'stride_opz', 'stride_oph', 'stride_opm', 'stride_opn',
+        'num_head_q', 'num_head_k',
+        'seqlen_q', 'seqlen_k',
+        'head_dim',
+        'num_splits',
+        'BLOCK_M', # tl.constexpr starts here
+        'BLOCK_DMODEL',
+        'BLOCK_N',
+        'PADDED_HEAD',
+    ]
+    TENSOR_STRIDE_INPUTS = {
+        'Q' : select_pattern(ARGUMENTS, 'stride_q'),
+        'K' : select_pattern(ARGUMENTS, 'stride_k'),
+        'V' : select_pattern(ARGUMENTS, 'stride_v'),
+        'Out_partial' : select_pattern(ARGUMENTS, 'stride_op'),
+    }
+    TENSOR_RANKS = {
+        '_default' : 4,
+        'M_partial' : 2,
+    }
+    TYPE_CHOICES = {
+        frozenset(['Q', 'K', 'V']) : get_possible_types(attn_fwd, 'Q'),
+        frozenset(['sm_scale']) : ['fp32'],
+        frozenset(['Out_partial', 'M_partial']) : ['*fp32:16'],
+        frozenset(['num_head_q', 'num_head_k']) : ['i32'],
+        frozenset(['seqlen_q', 'seqlen_k']) : ['i32'],
+        frozenset(['head_dim']) : ['u64'],
+        frozenset(['num_splits']) : ['i32'],
+    }
+    FEAT_CHOICES = {
+        frozenset(['BLOCK_DMODEL']) : POW2_HEAD_DIMS,
+        frozenset(['PADDED_HEAD']) : [False, True],
+    }
+    PERF_CHOICES = {
+        frozenset(['BLOCK_M']) : [16], # Minimal size of tl.dot, seqlen_q is usually 1
+        frozenset(['BLOCK_N']) : [64],
+    }
+    DEFAULT_NUM_WARPS=4
+    DEFAULT_NUM_STAGES=1
+    SHIM_KERNEL_NAME = 'attn_fwd_split'
+
+    AUTOTUNE_KEYS = { }
+    PARTIALLY_TUNED_FUNCTIONALS = [('PADDED_HEAD', None)]
+    DOWNGRADER = []
@@ -0,0 +1,50 @@
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+from ._common import FlashKernel, get_possible_types, select_pattern, BinningLessOrEqual, BinningExact, POW2_HEAD_DIMS
+from .attn_fwd import attn_fwd
+
+class attn_fwd_split_reduce(FlashKernel):
+    ARGUMENTS = [
+        'Out_partial', 'M_partial', 'Out', 'M',
+        'stride_opz', 'stride_oph', 'stride_opm', 'stride_opn',
+        'stride_oz', 'stride_oh', 'stride_om', 'stride_on',
+        'num_head_q',
+        'seqlen_q',
+        'head_dim',
+        'num_splits',
+        'BLOCK_M', # tl.constexpr starts here
+        'BLOCK_DMODEL',
+        'PADDED_HEAD',
+    ]
+    TENSOR_STRIDE_INPUTS = {
+        'Out_partial' : select_pattern(ARGUMENTS, 'stride_op'),
+        'Out' : ['stride_oz', 'stride_oh', 'stride_om', 'stride_on'],
+    }
+    TENSOR_RANKS = {
+        '_default' : 4,
+        'M_partial' : 2,
+        'M' : 2,
+    }
+    TYPE_CHOICES = {
+        frozenset(['Out_partial', 'M_partial', 'M']) : ['*fp32:16'],
+        frozenset(['Out']) : get_possible_types(attn_fwd, 'Out'),
+        frozenset(['num_head_q']) : ['i32'],
+        frozenset(['seqlen_q']) : ['i32'],
+        frozenset(['head_dim']) : ['u64'],
+        frozenset(['num_splits']) : ['i32'],
+    }
+    FEAT_CHOICES = {
+        frozenset(['BLOCK_DMODEL']) : POW2_HEAD_DIMS,
+        frozenset(['PADDED_HEAD']) : [False, True],
+    }
+    PERF_CHOICES = {
+        frozenset(['BLOCK_M']) : [16],
+    }
+    DEFAULT_NUM_WARPS=4
+    DEFAULT_NUM_STAGES=1
+    SHIM_KERNEL_NAME = 'attn_fwd_split_reduce'
+
+    AUTOTUNE_KEYS = { }
+    PARTIALLY_TUNED_FUNCTIONALS = [('PADDED_HEAD', None)]
+    DOWNGRADER = []
@@ -1,31 +1,41 @@
 # Copyright © 2023-2024 Advanced Micro Devices, Inc.
 # SPDX-License-Identifier: MIT
 
-from ._common import FlashKernel, get_possible_types, select_pattern, BinningLessOrEqual, BinningExact
+from ._common import FlashKernel, get_possible_types, select_pattern, BinningLessOrEqual, BinningExact, HEAD_DIMS, tuned_head_dim
 from .attn_fwd import attn_fwd
 from .bwd_kernel_dk_dv import bwd_kernel_dk_dv
 
 class bwd_kernel_dq(FlashKernel):
     ARGUMENTS = [
-        'Q', 'K', 'V', 'sm_scale', 'Out', 'dO',
-        'dQ',
+        'Q', 'K', 'V', 'B', 'sm_scale', 'Out', 'dO',
+        'dQ', 'dB',
         'L', 'D',
         'stride_qz', 'stride_qh', 'stride_qm', 'stride_qk',
         'stride_kz', 'stride_kh', 'stride_kn', 'stride_kk',
         'stride_vz', 'stride_vh', 'stride_vk', 'stride_vn',
         'stride_oz', 'stride_oh', 'stride_om', 'stride_ok',
+        'stride_doz', 'stride_doh', 'stride_dom', 'stride_dok',
         'stride_dqz', 'stride_dqh', 'stride_dqm', 'stride_dqk',
-        'seqlen_q', 'seqlen_k',
+        'stride_bz', 'stride_bh', 'stride_bm', 'stride_bn',
+        'stride_dbz', 'stride_dbh', 'stride_dbm', 'stride_dbn',
+        'num_head_q', 'num_head_k',
+        'cu_seqlens_q', 'cu_seqlens_k',
+        'seqlen_q', 'seqlen_k', # max_seqlens_q/max_seqlens_k in the kernel
         'head_dim',
+        'window_left', 'window_right',
         'dropout_p',
         'philox_seed',
         'philox_offset_base',
+        'dropout_bitmask',
         'BLOCK_M', # tl.constexpr starts here
         'BLOCK_DMODEL',
         'BLOCK_N',
         'CAUSAL',
         'ENABLE_DROPOUT',
+        'BIAS_TYPE',
         'PADDED_HEAD',
+        'VARLEN',
+        'INLINE_DELTA',
     ]
     match_fwd = lambda aname : get_possible_types(attn_fwd, aname)
     match_kv = lambda aname : get_possible_types(bwd_kernel_dk_dv, aname)
@@ -33,33 +43,46 @@ class bwd_kernel_dq(FlashKernel):
         'Q' : select_pattern(ARGUMENTS, 'stride_q'),
         'K' : select_pattern(ARGUMENTS, 'stride_k'),
         'V' : select_pattern(ARGUMENTS, 'stride_v'),
-        'dO' : select_pattern(ARGUMENTS, 'stride_o'),
+        'Out' : select_pattern(ARGUMENTS, 'stride_o'),
+        'dO' : select_pattern(ARGUMENTS, 'stride_do'),
         'dQ' : select_pattern(ARGUMENTS, 'stride_dq'),
+        'B' : select_pattern(ARGUMENTS, 'stride_b'),
+        'dB' : select_pattern(ARGUMENTS, 'stride_db'),
     }
     TENSOR_RANKS = {
         '_default' : 4,
         'L': 2,
         'D': 2,
+        'cu_seqlens_q': 1,
+        'cu_seqlens_k': 1,
     }
     TYPE_CHOICES = {
-        frozenset(['Q', 'K', 'V', 'Out', 'dO', 'dQ']) : match_fwd('Q'),
+        frozenset(['Q', 'K', 'V', 'B', 'Out', 'dO', 'dQ', 'dB']) : match_fwd('Q'),
         frozenset(['sm_scale']) : match_fwd( 'sm_scale'),
         frozenset(['L', 'D']) : ['*fp32:16'],
+        frozenset(['num_head_q', 'num_head_k']) : match_fwd('num_head_q'),
+        frozenset(['cu_seqlens_q', 'cu_seqlens_k']) : match_fwd('cu_seqlens_q'),
         frozenset(['seqlen_q', 'seqlen_k']) : ['u64'],
         frozenset(['head_dim']) : ['i32'],
+        frozenset(['window_left', 'window_right']) : match_fwd('window_left'),
         frozenset(['dropout_p']) : match_fwd('dropout_p'),
         frozenset(['philox_seed']) : match_fwd('philox_seed'),
         frozenset(['philox_offset_base']) : match_fwd('philox_offset_base'),
+        frozenset(['dropout_bitmask']) : match_fwd('dropout_bitmask'),
     }
     FEAT_CHOICES = {
-        frozenset(['BLOCK_DMODEL']) : [16, 32, 64, 128, 256],
+        frozenset(['BLOCK_DMODEL']) : HEAD_DIMS,
         frozenset(['CAUSAL']) : match_kv('CAUSAL'),
         frozenset(['ENABLE_DROPOUT']) : match_fwd('ENABLE_DROPOUT'),
+        frozenset(['BIAS_TYPE']) : match_kv('BIAS_TYPE'),
         frozenset(['PADDED_HEAD']) : [False, True],
+        frozenset(['VARLEN']) : match_fwd('VARLEN'),
     }
     PERF_CHOICES = {
         frozenset(['BLOCK_M']) : match_fwd('BLOCK_M'),
         frozenset(['BLOCK_N']) : match_fwd('BLOCK_N'),
+        # Computes delta instead of bwd_preprocess, see attn_bwd
+        frozenset(['INLINE_DELTA']) : [False, True],
     }
     EXPECTED_IDENTICAL_TENSOR_STRIDES = [
     ]
@@ -72,5 +95,5 @@ class bwd_kernel_dq(FlashKernel):
         'seqlen_q' : BinningLessOrEqual,
         'seqlen_k' : BinningLessOrEqual,
     }
-    PARTIALLY_TUNED_FUNCTIONALS = [('PADDED_HEAD', None)]
+    PARTIALLY_TUNED_FUNCTIONALS = [('BLOCK_DMODEL', tuned_head_dim), ('BIAS_TYPE', None), ('PADDED_HEAD', None), ('VARLEN', None)]
     DOWNGRADER = []
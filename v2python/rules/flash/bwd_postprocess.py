@@ -0,0 +1,49 @@
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+from ._common import FlashKernel, get_possible_types, select_pattern, BinningLessOrEqual, BinningExact, POW2_HEAD_DIMS
+from .attn_fwd import attn_fwd
+
+class bwd_postprocess(FlashKernel):
+    ARGUMENTS = [
+        'DQ_ACC', 'DQ',
+        'stride_accz', 'stride_acch', 'stride_accm', 'stride_accn',
+        'stride_dqz', 'stride_dqh', 'stride_dqm', 'stride_dqn',
+        'cu_seqlens_q',
+        'seqlen_q', # max_seqlens_q in the kernel
+        'head_dim',
+        'BLOCK_M', # tl.constexpr starts here
+        'D_HEAD',
+        'PADDED_HEAD',
+        'VARLEN',
+    ]
+    TENSOR_STRIDE_INPUTS = {
+        'DQ_ACC' : select_pattern(ARGUMENTS, 'stride_acc'),
+        'DQ' : select_pattern(ARGUMENTS, 'stride_dq'),
+    }
+    TENSOR_RANKS = {
+        '_default' : 4,
+        'cu_seqlens_q' : 1,
+    }
+    TYPE_CHOICES = {
+        frozenset(['DQ_ACC']) : ['*fp32:16'],
+        frozenset(['DQ']) : ['*fp16:16', '*bf16:16'],
+        frozenset(['cu_seqlens_q']) : get_possible_types(attn_fwd, 'cu_seqlens_q'),
+        frozenset(['seqlen_q']) : ['u64'],
+        frozenset(['head_dim']) : ['i32'],
+    }
+    FEAT_CHOICES = {
+        frozenset(['D_HEAD']) : POW2_HEAD_DIMS,
+        frozenset(['PADDED_HEAD']) : [False, True],
+        frozenset(['VARLEN']) : get_possible_types(attn_fwd, 'VARLEN'),
+    }
+    PERF_CHOICES = {
+        frozenset(['BLOCK_M']) : [128],
+    }
+    DEFAULT_NUM_WARPS=4
+    DEFAULT_NUM_STAGES=1
+    SHIM_KERNEL_NAME = 'bwd_postprocess'
+
+    AUTOTUNE_KEYS = { }
+    PARTIALLY_TUNED_FUNCTIONALS = [('PADDED_HEAD', None), ('VARLEN', None)]
+    DOWNGRADER = []
@@ -1,7 +1,7 @@
 # Copyright © 2023-2024 Advanced Micro Devices, Inc.
 # SPDX-License-Identifier: MIT
 
-from ._common import FlashKernel, get_possible_types, select_pattern, BinningLessOrEqual, BinningExact
+from ._common import FlashKernel, get_possible_types, select_pattern, BinningLessOrEqual, BinningExact, POW2_HEAD_DIMS
 from .attn_fwd import attn_fwd
 
 class bwd_preprocess(FlashKernel):
@@ -10,11 +10,13 @@ class bwd_preprocess(FlashKernel):
         'Delta',
         'stride_oz', 'stride_oh', 'stride_om', 'stride_on',
         'stride_doz', 'stride_doh', 'stride_dom', 'stride_don',
-        'seqlen_q',
+        'cu_seqlens_q',
+        'seqlen_q', # max_seqlens_q in the kernel
         'head_dim',
         'BLOCK_M', # tl.constexpr starts here
         'D_HEAD',
         'PADDED_HEAD',
+        'VARLEN',
     ]
     TENSOR_STRIDE_INPUTS = {
         'Out' : select_pattern(ARGUMENTS, 'stride_o'),
@@ -23,16 +25,19 @@ class bwd_preprocess(FlashKernel):
     TENSOR_RANKS = {
         '_default' : 4,
         'Delta' : 2,
+        'cu_seqlens_q' : 1,
     }
     TYPE_CHOICES = {
         frozenset(['Out', 'DO']) : ['*fp16:16', '*bf16:16'],
         frozenset(['Delta']) : ['*fp32:16'],
+        frozenset(['cu_seqlens_q']) : get_possible_types(attn_fwd, 'cu_seqlens_q'),
         frozenset(['seqlen_q']) : ['u64'],
         frozenset(['head_dim']) : ['i32'],
     }
     FEAT_CHOICES = {
-        frozenset(['D_HEAD']) : get_possible_types(attn_fwd, 'BLOCK_DMODEL'),
+        frozenset(['D_HEAD']) : POW2_HEAD_DIMS,
         frozenset(['PADDED_HEAD']) : [False, True],
+        frozenset(['VARLEN']) : get_possible_types(attn_fwd, 'VARLEN'),
     }
     PERF_CHOICES = {
         frozenset(['BLOCK_M']) : [128], # TODO: All possible values?
@@ -42,5 +47,5 @@ class bwd_preprocess(FlashKernel):
     SHIM_KERNEL_NAME = 'bwd_preprocess'
 
     AUTOTUNE_KEYS = { }
-    PARTIALLY_TUNED_FUNCTIONALS = [('PADDED_HEAD', None)]
+    PARTIALLY_TUNED_FUNCTIONALS = [('PADDED_HEAD', None), ('VARLEN', None)]
     DOWNGRADER = []
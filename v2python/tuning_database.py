@@ -76,7 +76,8 @@ class KernelTuningDatabaseForArch(object):
 
     def _load_json_with_filter(self, f):
         j = json.load(f)
-        tune_info = [ ti for ti in j['tune_info'] if ti['kernel_name'] == self._kdesc.SHIM_KERNEL_NAME]
+        kernel_name = self._kdesc.TUNING_KERNEL_NAME or self._kdesc.SHIM_KERNEL_NAME
+        tune_info = [ ti for ti in j['tune_info'] if ti['kernel_name'] == kernel_name]
         j['tune_info'] = tune_info
         return j
 
@@ -156,6 +157,10 @@ class KernelTuningDatabaseForArch(object):
                     return '*fp16:16'
                 elif value == 'torch.bfloat16':
                     return '*bf16:16'
+                elif value == 'torch.float8_e4m3fnuz':
+                    return '*fp8e4b8:16'
+                elif value == 'torch.float8_e5m2fnuz':
+                    return '*fp8e5b16:16'
                 else:
                     assert False, f'Unknown datatype {value}'
             return value
@@ -172,6 +177,9 @@ class KernelTuningDatabaseForArch(object):
                 offset = self._fsel_positions.index(fsel.meta.first_apperance)
                 if use_fallback_for_partially_tuned and fsel.meta.incomplete_tuning:
                     value = fsel.meta.fallback_tuning_value
+                    # Fallback values can depend on the selected value
+                    if callable(value):
+                        value = value(fsel.argument_value)
                     fallback_applied.append(fsel)
                 else:
                     value = fsel.argument_value
@@ -225,7 +233,8 @@ class KernelTuningDatabaseForArch(object):
             co['waves_per_eu'] = ps['waves_per_eu']
             # co['_debug'] = dict(tinfo)
             del ps['waves_per_eu']
-        return [TunedArgument(meta, ps[meta.argument_names[0]]) for meta in perf_meta], co
+        # Performance arguments added after the database was tuned take their defaults
+        return [TunedArgument(meta, ps.get(meta.argument_names[0], meta.default_value)) for meta in perf_meta], co
 
     def get_lut(self,
                 kdesc : 'KernelDescription',
@@ -94,32 +94,49 @@ class KernelTuningEntryForFunctionalOnGPU(object):
             o = self._kdesc.build_object_file_description(kernel_image_dir, sig)
             yield o.c_identifier_signature, o._hsaco_kernel_path, o
 
-    def codegen_incbin_code(self, kernel_image_dir, compressed=False):
+    @staticmethod
+    def image_file(hsaco_kernel_path, compressed):
+        fn = hsaco_kernel_path.absolute()
+        if compressed:
+            fn = fn.parent / (fn.name + '.zst')
+        return fn
+
+    def codegen_incbin_code(self, kernel_image_dir, compressed=False, kernel_pack=None):
+        # Images are loaded from the kernel pack at runtime
+        if kernel_pack is not None:
+            return ''
         # INCBIN({incbin_symbol_name}, "{hsaco_kernel_path}");
         incbin_lines = []
         for incbin_symbol_name, hsaco_kernel_path, _ in self.gen_kernel_symbols(kernel_image_dir):
-            fn = hsaco_kernel_path.absolute()
-            if compressed:
-                fn = fn.parent / (fn.name + '.zst')
+            fn = self.image_file(hsaco_kernel_path, compressed)
             # incbin_lines.append(f'INCBIN({incbin_symbol_name}, "../gpu_kernel_image.{self._kdesc.SHIM_KERNEL_NAME}/{hsaco_kernel_path.name}")')
             incbin_lines.append(f'INCBIN({incbin_symbol_name}, "{fn}")')
         return ";\n".join(incbin_lines)
 
-    def codegen_incbin_names(self, kernel_image_dir, compressed=False):
-        incbin_lines = []
-        for incbin_symbol_name, _, _ in self.gen_kernel_symbols(kernel_image_dir):
-            incbin_lines.append(f'"{incbin_symbol_name}"')
-        return 'static const char* incbin_kernel_names[] = {\n  ' + ",\n  ".join(incbin_lines) + "\n};"
-
-    def codegen_kernel_image_objects(self, kernel_image_dir):
+    def codegen_kernel_image_objects(self, kernel_image_dir, compressed=False, kernel_pack=None, zstd_dictionary=False):
         kernel_image_symbols = []
-        for incbin_symbol_name, _, o in self.gen_kernel_symbols(kernel_image_dir):
+        for incbin_symbol_name, hsaco_kernel_path, o in self.gen_kernel_symbols(kernel_image_dir):
             assert o.compiled_files_exist, f'Compiled file {o._hsaco_kernel_path} not exists'
             shared_memory_size = o._metadata['shared']
-            kernel_image_symbols.append(f'{{ mangle({incbin_symbol_name}), smangle({incbin_symbol_name}), {{ {o.num_warps * o.warp_size} , 1, 1 }}, {shared_memory_size} }},')
+            if kernel_pack is not None:
+                index = kernel_pack.add(self.image_file(hsaco_kernel_path, compressed))
+                image = f'aotriton::PackedImage {{ "{kernel_pack.file_name}", {index} }}'
+            else:
+                image = f'mangle({incbin_symbol_name}), smangle({incbin_symbol_name})'
+            dictionary = f', &{self.zstd_dictionary_symbol}' if zstd_dictionary else ''
+            kernel_image_symbols.append(f'{{ {image}, {{ {o.num_warps * o.warp_size} , 1, 1 }}, {shared_memory_size}, "{incbin_symbol_name}"{dictionary} }},')
         ALIGN = '\n' + 4 * ' '
         return ALIGN.join(kernel_image_symbols)
 
+    @property
+    def zstd_dictionary_symbol(self):
+        return self._kdesc.zstd_dictionary_symbol(self._dba._gpu)
+
+    def codegen_zstd_dictionary_declaration(self, zstd_dictionary):
+        if not zstd_dictionary:
+            return ''
+        return f'extern aotriton::ZstdDictionary {self.zstd_dictionary_symbol};'
+
     def codegen_kernel_image_perfs(self, kernel_image_dir):
         kernel_image_perfs = []
         for sig in self._sigs:
@@ -127,7 +144,7 @@ class KernelTuningEntryForFunctionalOnGPU(object):
         ALIGN = ',\n' + 4 * ' '
         return ALIGN.join(kernel_image_perfs)
 
-    def write_lut_source(self, outdir : 'pathlib.Path', compressed):
+    def write_lut_source(self, outdir : 'pathlib.Path', compressed, kernel_pack=None, zstd_dictionary=False):
         gpu_kernel_image_dir = outdir.parent / f'gpu_kernel_image.{self._kdesc.SHIM_KERNEL_NAME}'
         lut_tensor, sigs = self.get_lut()
         try:
@@ -139,13 +156,14 @@ class KernelTuningEntryForFunctionalOnGPU(object):
         ofn = outdir / f'{first_sig.functional_signature}_{first_sig.target_gpu}.cc'
         with open(ofn, 'w') as f:
             d = {
-                'incbin_kernel_images'  : self.codegen_incbin_code(gpu_kernel_image_dir, compressed=compressed),
-                'incbin_kernel_names'   : self.codegen_incbin_names(gpu_kernel_image_dir, compressed=compressed),
+                'incbin_kernel_images'  : self.codegen_incbin_code(gpu_kernel_image_dir, compressed=compressed, kernel_pack=kernel_pack),
                 'kernel_family_name'    : self._kdesc.KERNEL_FAMILY,
                 'shim_kernel_name'      : self._kdesc.SHIM_KERNEL_NAME,
                 'godel_number'          : godel_number,
                 'perf_fields'           : ';\n    '.join(self._kdesc.perf_fields),
-                'kernel_image_objects'  : self.codegen_kernel_image_objects(gpu_kernel_image_dir),
+                'kernel_image_objects'  : self.codegen_kernel_image_objects(gpu_kernel_image_dir, compressed=compressed,
+                                                                       kernel_pack=kernel_pack, zstd_dictionary=zstd_dictionary),
+                'zstd_dictionary_declaration' : self.codegen_zstd_dictionary_declaration(zstd_dictionary),
                 'kernel_image_perfs'    : self.codegen_kernel_image_perfs(gpu_kernel_image_dir),
                 'lut_dtype'             : self._lut_cdtype,
                 'lut_shape'             : self._lut_cshape,
@@ -0,0 +1,101 @@
+# Copyright © 2023-2024 Advanced Micro Devices, Inc.
+# SPDX-License-Identifier: MIT
+
+'''
+Compares per-file zstd compression of the compiled kernel images with
+compression using a dictionary trained per (kernel, GPU), which is what
+generate_compile.py --zstd_dictionary does.
+
+Reports the total compressed size, including the dictionary, and the mean
+decompression time per image of both methods.
+
+Requires the zstandard python module. Usage:
+    python -m v2python.zstd_report --build_dir build/v2src
+'''
+
+import argparse
+import json
+import re
+import time
+from collections import defaultdict
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+IMAGE_PATTERN = re.compile(r'(?P<kernel>.+)-Sig-.*-Gpu-(?P<gpu>[^-]+)\.hsaco$')
+
+def parse():
+    p = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument("--build_dir", type=str, default='build/', help="build directory of generate_compile")
+    p.add_argument("--level", type=int, default=3, help="zstd compression level, 3 is the default of the zstd command")
+    p.add_argument("--maxdict", type=int, default=112640, help="Maximal dictionary size, same as generate_compile.py")
+    p.add_argument("--repeat", type=int, default=5, help="Number of times each image is decompressed when timing")
+    p.add_argument("--json", type=str, default=None, help="Also write the report to this file")
+    args = p.parse_args()
+    return args
+
+def collect_images(build_dir : Path) -> 'dict[tuple[str, str], list[Path]]':
+    groups = defaultdict(list)
+    for fn in sorted(build_dir.glob('*/gpu_kernel_image.*/*.hsaco')):
+        m = IMAGE_PATTERN.match(fn.name)
+        if m:
+            groups[(m.group('kernel'), m.group('gpu'))].append(fn)
+    return groups
+
+def time_decompression(dctx, frames, repeat):
+    tic = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            dctx.decompress(frame)
+    return (time.perf_counter() - tic) / (repeat * len(frames))
+
+def report_group(images : 'list[bytes]', level, maxdict, repeat):
+    r = {
+        'images': len(images),
+        'raw_bytes': sum([len(data) for data in images]),
+    }
+    cctx = zstandard.ZstdCompressor(level=level)
+    frames = [cctx.compress(data) for data in images]
+    r['per_file_bytes'] = sum([len(frame) for frame in frames])
+    r['per_file_decompress_us'] = 1e6 * time_decompression(zstandard.ZstdDecompressor(), frames, repeat)
+    try:
+        dictionary = zstandard.train_dictionary(maxdict, images, level=level)
+    except zstandard.ZstdError:
+        # Too few samples. generate_compile falls back to per-file compression.
+        r['dictionary_bytes'] = 0
+        r['dictionary_total_bytes'] = r['per_file_bytes']
+        r['dictionary_decompress_us'] = r['per_file_decompress_us']
+        return r
+    cctx = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+    frames = [cctx.compress(data) for data in images]
+    dict_bytes = len(dictionary.as_bytes())
+    r['dictionary_bytes'] = dict_bytes
+    r['dictionary_total_bytes'] = dict_bytes + sum([len(frame) for frame in frames])
+    dctx = zstandard.ZstdDecompressor(dict_data=dictionary)
+    r['dictionary_decompress_us'] = 1e6 * time_decompression(dctx, frames, repeat)
+    return r
+
+def main():
+    args = parse()
+    assert zstandard is not None, 'zstd_report requires the zstandard module (pip install zstandard)'
+    groups = collect_images(Path(args.build_dir))
+    report = {}
+    print(f'{"kernel":<24} {"gpu":<8} {"images":>7} {"raw MiB":>9} {"per-file MiB":>13} {"dict MiB":>9} {"ratio":>6} {"per-file us":>12} {"dict us":>8}')
+    for (kernel, gpu), files in groups.items():
+        images = [fn.read_bytes() for fn in files]
+        r = report_group(images, args.level, args.maxdict, args.repeat)
+        report[f'{kernel}/{gpu}'] = r
+        MiB = 1024 * 1024
+        print(f'{kernel:<24} {gpu:<8} {r["images"]:>7} {r["raw_bytes"]/MiB:>9.2f}',
+              f'{r["per_file_bytes"]/MiB:>13.2f} {r["dictionary_total_bytes"]/MiB:>9.2f}',
+              f'{r["dictionary_total_bytes"]/r["per_file_bytes"]:>6.3f}',
+              f'{r["per_file_decompress_us"]:>12.1f} {r["dictionary_decompress_us"]:>8.1f}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -3,45 +3,322 @@
 
 #include <aotriton/flash.h>
 #include <aotriton/util.h>
+#include <aotriton/_internal/stream_fork.h>
 #include <aotriton/_internal/util.h>
 #include <flash/shim.bwd_kernel_dk_dv.h>
 #include <flash/shim.bwd_kernel_dq.h>
+#include <flash/shim.bwd_postprocess.h>
 #include <flash/shim.bwd_preprocess.h>
-#include <iostream>
 
 namespace aotriton::v2::flash {
 
-hipError_t
-bwd_preprocess(T4 out, T4 dout, T2 delta, aotriton::Stream stream_wrap) {
-  hipError_t err;
-  auto stream = stream_wrap.native();
-  auto arch = getArchFromStream(stream);
-  auto grid_calculator = [](const BwdPreprocessParams& params) -> dim3 {
-    dim3 grid {
-      aotriton::cdiv<uint32_t>(params.Out->size(2), params.BLOCK_M),
-      uint32_t(params.Out->size(1)),
-      uint32_t(params.Out->size(0)),
-    };
-    // std::cerr << "Grid conf " << grid.x << " " << grid.y << " " << grid.z << std::endl;
-    return grid;
+namespace {
+
+struct HipRuntime {
+  using Error = hipError_t;
+  using Stream = hipStream_t;
+  using Event = hipEvent_t;
+  using Device = hipDevice_t;
+  static constexpr hipError_t kSuccess = hipSuccess;
+
+  static hipError_t stream_get_device(hipStream_t stream, hipDevice_t* device) {
+    return hipStreamGetDevice(stream, device);
+  }
+  static hipError_t stream_create(hipDevice_t device, hipStream_t* stream) {
+    return with_device(device, [stream]() { return hipStreamCreateWithFlags(stream, hipStreamNonBlocking); });
+  }
+  static hipError_t event_create(hipDevice_t device, hipEvent_t* event) {
+    return with_device(device, [event]() { return hipEventCreateWithFlags(event, hipEventDisableTiming); });
+  }
+  static hipError_t event_record(hipEvent_t event, hipStream_t stream) {
+    return hipEventRecord(event, stream);
+  }
+  static hipError_t stream_wait_event(hipStream_t stream, hipEvent_t event) {
+    return hipStreamWaitEvent(stream, event, 0);
+  }
+
+private:
+  template<typename Func>
+  static hipError_t with_device(hipDevice_t device, Func func) {
+    int current;
+    hipError_t err = hipGetDevice(&current);
+    if (err != hipSuccess)
+      return err;
+    if (current != device) {
+      err = hipSetDevice(device);
+      if (err != hipSuccess)
+        return err;
+    }
+    hipError_t ret = func();
+    if (current != device)
+      (void)hipSetDevice(current);
+    return ret;
+  }
+};
+
+// Note: bwd_preprocess and bwd_postprocess only have power-of-two D_HEAD,
+//       unlike the head dimensions of bwd_kernel_dk_dv and bwd_kernel_dq
+//       (round_head_dim).
+constexpr int kPreprocessMinHeadDimCompiled = 16;
+
+// cu_seqlens of dense problems
+const T1 kNoSeqlens;
+
+// Problems without dropout bitmask
+const T4 kNoDropoutBitmask;
+
+// Split backward passes, which compute dQ in bwd_kernel_dq
+const T4 kNoDqAcc;
+
+// For VARLEN, grids cover the max sequence length of every sequence, and the
+// kernels return early for blocks past the end of shorter sequences.
+template<typename Params>
+uint32_t
+num_seqs(const Params& params, const T4& t) {
+  return params.VARLEN ? params.cu_seqlens_q->size(0) - 1 : t.size(0);
+}
+
+dim3
+calculate_preprocess_grid(const BwdPreprocessParams& params) {
+  dim3 grid {
+    aotriton::cdiv<uint32_t>(params.seqlen_q, params.BLOCK_M),
+    uint32_t(params.Out->size(1)),
+    num_seqs(params, *params.Out),
   };
-  // Note: do not unify this constexpr.
-  //       Different kernels may have different rules.
-  constexpr int kMinHeadDimCompiled = 16;
+  return grid;
+}
+
+// Tensors are referenced by the returned params and must outlive it
+BwdPreprocessParams
+make_preprocess_params(const T4& out,
+                       const T4& dout,
+                       const T2& delta,
+                       const T1& cu_seqlens_q,
+                       uint64_t max_seqlen_q) {
   int head_size = out.size(3);
-  int head_size_rounded = std::max(kMinHeadDimCompiled, bit_ceil(head_size));
+  int head_size_rounded = std::max(kPreprocessMinHeadDimCompiled, bit_ceil(head_size));
   // Requires C++ 20
   BwdPreprocessParams params = {
     .Out = &out,
     .DO = &dout,
     .Delta = &delta,
-    .seqlen_q = out.size(2),
+    .cu_seqlens_q = &cu_seqlens_q,
+    .seqlen_q = max_seqlen_q,
     .head_dim = head_size,
     .D_HEAD = bit_ceil(head_size),
     .PADDED_HEAD = head_size_rounded != head_size,
+    .VARLEN = bool(cu_seqlens_q),
+  };
+  return params;
+}
+
+dim3
+calculate_postprocess_grid(const BwdPostprocessParams& params) {
+  dim3 grid {
+    aotriton::cdiv<uint32_t>(params.seqlen_q, params.BLOCK_M),
+    uint32_t(params.DQ->size(1)),
+    num_seqs(params, *params.DQ),
+  };
+  return grid;
+}
+
+BwdPostprocessParams
+make_postprocess_params(const T4& dq_acc,
+                        const T4& dq,
+                        const T1& cu_seqlens_q,
+                        uint64_t max_seqlen_q) {
+  int head_size = dq.size(3);
+  int head_size_rounded = std::max(kPreprocessMinHeadDimCompiled, bit_ceil(head_size));
+  BwdPostprocessParams params = {
+    .DQ_ACC = &dq_acc,
+    .DQ = &dq,
+    .cu_seqlens_q = &cu_seqlens_q,
+    .seqlen_q = max_seqlen_q,
+    .head_dim = head_size,
+    .D_HEAD = bit_ceil(head_size),
+    .PADDED_HEAD = head_size_rounded != head_size,
+    .VARLEN = bool(cu_seqlens_q),
+  };
+  return params;
+}
+
+dim3
+calculate_dk_dv_grid(const BwdKernelDkDvParams& params) {
+  // One program per head of K/V, which reduces dK/dV over its group of heads
+  // of Q (GQA/MQA)
+  dim3 grid {
+    aotriton::cdiv<uint32_t>(params.seqlen_k, params.BLOCK_N),
+    uint32_t(params.K->size(1)),
+    num_seqs(params, *params.Q),
+  };
+  return grid;
+}
+
+BwdKernelDkDvParams
+make_dk_dv_params(const T4& q,
+                  const T4& k,
+                  const T4& v,
+                  const T4& b,
+                  float sm_scale,
+                  const T4& out,
+                  const T4& dout,
+                  const T4& dk,
+                  const T4& dv,
+                  const T4& dq_acc,
+                  const T2& softmax_lse,
+                  const T2& delta,
+                  float dropout_p,
+                  uint64_t philox_seed,
+                  uint64_t philox_offset,
+                  const T4& dropout_bitmask,
+                  bool is_causal,
+                  int32_t window_left,
+                  int32_t window_right,
+                  const T1& cu_seqlens_q,
+                  const T1& cu_seqlens_k,
+                  uint64_t max_seqlen_q,
+                  uint64_t max_seqlen_k) {
+  int head_size = q.size(3);
+  int head_size_rounded = round_head_dim(head_size, !b);
+  BwdKernelDkDvParams params = {
+    .Q = &q,
+    .K = &k,
+    .V = &v,
+    .B = &b,
+    .Out = &out,
+    .DO = &dout,
+    .DK = &dk,
+    .DV = &dv,
+    .sm_scale = sm_scale,
+    .DQ_ACC = &dq_acc,
+    .L = &softmax_lse,
+    .D = &delta,
+    .num_head_q = static_cast<int32_t>(q.size(1)),
+    .num_head_k = static_cast<int32_t>(k.size(1)),
+    .cu_seqlens_q = &cu_seqlens_q,
+    .cu_seqlens_k = &cu_seqlens_k,
+    .seqlen_q = max_seqlen_q,
+    .seqlen_k = max_seqlen_k,
+    .head_dim = head_size,
+    .window_left = kernel_window_size(window_left, max_seqlen_q, max_seqlen_k),
+    .window_right = kernel_window_size(window_right, max_seqlen_q, max_seqlen_k),
+    .dropout_p = dropout_p,
+    .philox_seed = philox_seed,
+    .philox_offset_base = static_cast<uint32_t>(philox_offset),
+    .dropout_bitmask = &dropout_bitmask,
+    .BLOCK_DMODEL = head_size_rounded,
+    .CAUSAL = is_causal,
+    .ENABLE_DROPOUT = dropout_p > 0.0,
+    .BIAS_TYPE = b ? 1 : 0,
+    .PADDED_HEAD = head_size_rounded != head_size,
+    .VARLEN = bool(cu_seqlens_q),
+  };
+  return params;
+}
+
+dim3
+calculate_dq_grid(const BwdKernelDqParams& params) {
+  dim3 grid {
+    aotriton::cdiv<uint32_t>(params.seqlen_q, params.BLOCK_M),
+    uint32_t(params.Q->size(1)),
+    num_seqs(params, *params.Q),
+  };
+  return grid;
+}
+
+BwdKernelDqParams
+make_dq_params(const T4& q,
+               const T4& k,
+               const T4& v,
+               const T4& b,
+               float sm_scale,
+               const T4& out,
+               const T4& dout,
+               const T4& dq,
+               const T4& db,
+               const T2& softmax_lse,
+               const T2& delta,
+               float dropout_p,
+               uint64_t philox_seed,
+               uint64_t philox_offset,
+               const T4& dropout_bitmask,
+               bool is_causal,
+               int32_t window_left,
+               int32_t window_right,
+               const T1& cu_seqlens_q,
+               const T1& cu_seqlens_k,
+               uint64_t max_seqlen_q,
+               uint64_t max_seqlen_k) {
+  int head_size = q.size(3);
+  int head_size_rounded = round_head_dim(head_size, !b);
+  BwdKernelDqParams params = {
+    .Q = &q,
+    .K = &k,
+    .V = &v,
+    .B = &b,
+    .Out = &out,
+    .dO = &dout,
+    .dQ = &dq,
+    .dB = &db,
+    .sm_scale = sm_scale,
+    .L = &softmax_lse,
+    .D = &delta,
+    .num_head_q = static_cast<int32_t>(q.size(1)),
+    .num_head_k = static_cast<int32_t>(k.size(1)),
+    .cu_seqlens_q = &cu_seqlens_q,
+    .cu_seqlens_k = &cu_seqlens_k,
+    .seqlen_q = max_seqlen_q,
+    .seqlen_k = max_seqlen_k,
+    .head_dim = head_size,
+    .window_left = kernel_window_size(window_left, max_seqlen_q, max_seqlen_k),
+    .window_right = kernel_window_size(window_right, max_seqlen_q, max_seqlen_k),
+    .dropout_p = dropout_p,
+    .philox_seed = philox_seed,
+    .philox_offset_base = static_cast<uint32_t>(philox_offset),
+    .dropout_bitmask = &dropout_bitmask,
+    .BLOCK_DMODEL = head_size_rounded,
+    .CAUSAL = is_causal,
+    .ENABLE_DROPOUT = dropout_p > 0.0,
+    .BIAS_TYPE = b ? 1 : 0,
+    .PADDED_HEAD = head_size_rounded != head_size,
+    .VARLEN = bool(cu_seqlens_q),
   };
+  return params;
+}
+
+// db requires b. Both are optional.
+bool
+valid_bias(const T4& q, const T4& b, const T4& db) {
+  if (!valid_optional_input(b, q.dtype()) || !valid_optional_input(db, q.dtype()))
+    return false;
+  return b || !db;
+}
+
+// bwd_preprocess only computes delta, which the selected kernels may compute
+// in place instead. This saves a launch and a pass over out and dout, which
+// matters for short sequences.
+bool
+needs_preprocess(const BwdKernelDkDvParams& dk_dv_params, const BwdKernelDqParams& dq_params) {
+  return !(dk_dv_params.INLINE_DELTA && dq_params.INLINE_DELTA);
+}
+
+}
+
+hipError_t
+bwd_preprocess(T4 out,
+               T4 dout,
+               T2 delta,
+               const T1& cu_seqlens_q,
+               uint64_t max_seqlen_q,
+               aotriton::Stream stream_wrap) {
+  hipError_t err;
+  auto stream = stream_wrap.native();
+  auto arch = getArchFromStream(stream);
+  if (arch == GPU_ARCH_UNKNOWN && is_stream_capturing(stream))
+    return hipErrorStreamCaptureUnsupported;
+  BwdPreprocessParams params = make_preprocess_params(out, dout, delta, cu_seqlens_q, max_seqlen_q);
   BwdPreprocessContext context;
-  context.grid_calculator = grid_calculator;
+  context.grid_calculator = calculate_preprocess_grid;
   err = context.lookup_optimal(params, arch);
   if (err != hipSuccess) {
     return err;
@@ -54,6 +331,7 @@ hipError_t
 bwd_kernel_dk_dv(T4 q,
                  T4 k,
                  T4 v,
+                 T4 b,
                  float sm_scale,
                  T4 out,
                  T4 dout,
@@ -64,48 +342,45 @@ bwd_kernel_dk_dv(T4 q,
                  float dropout_p,
                  uint64_t philox_seed,
                  uint64_t philox_offset,
+                 const T4& dropout_bitmask,
                  bool is_causal,
+                 int32_t window_left,
+                 int32_t window_right,
+                 const T1& cu_seqlens_q,
+                 const T1& cu_seqlens_k,
+                 uint64_t max_seqlen_q,
+                 uint64_t max_seqlen_k,
                  aotriton::Stream stream_wrap) {
   hipError_t err;
   auto stream = stream_wrap.native();
   auto arch = getArchFromStream(stream);
-  uint32_t seqlen_q = q.size(2);
-  uint32_t seqlen_k = k.size(2);
-  auto grid_calculator = [seqlen_k](const BwdKernelDkDvParams& params) -> dim3 {
-    dim3 grid {
-      aotriton::cdiv<uint32_t>(seqlen_k, params.BLOCK_N),
-      uint32_t(params.Q->size(1)),
-      uint32_t(params.Q->size(0)),
-    };
-    return grid;
-  };
-  constexpr int kMinHeadDimCompiled = 16;
-  int head_size = q.size(3);
-  int head_size_rounded = std::max(kMinHeadDimCompiled, bit_ceil(head_size));
-  BwdKernelDkDvParams params = {
-    .Q = &q,
-    .K = &k,
-    .V = &v,
-    .Out = &out,
-    .DO = &dout,
-    .DK = &dk,
-    .DV = &dv,
-    .sm_scale = sm_scale,
-    .L = &softmax_lse,
-    .D = &delta,
-    .seqlen_q = seqlen_q,
-    .seqlen_k = seqlen_k,
-    .head_dim = head_size,
-    .dropout_p = dropout_p,
-    .philox_seed = philox_seed,
-    .philox_offset_base = static_cast<uint32_t>(philox_offset),
-    .BLOCK_DMODEL = head_size_rounded,
-    .CAUSAL = is_causal,
-    .ENABLE_DROPOUT = dropout_p > 0.0,
-    .PADDED_HEAD = head_size_rounded != head_size,
-  };
+  if (arch == GPU_ARCH_UNKNOWN && is_stream_capturing(stream))
+    return hipErrorStreamCaptureUnsupported;
+  BwdKernelDkDvParams params = make_dk_dv_params(q,
+                                                 k,
+                                                 v,
+                                                 b,
+                                                 sm_scale,
+                                                 out,
+                                                 dout,
+                                                 dk,
+                                                 dv,
+                                                 kNoDqAcc,
+                                                 softmax_lse,
+                                                 delta,
+                                                 dropout_p,
+                                                 philox_seed,
+                                                 philox_offset,
+                                                 dropout_bitmask,
+                                                 is_causal,
+                                                 window_left,
+                                                 window_right,
+                                                 cu_seqlens_q,
+                                                 cu_seqlens_k,
+                                                 max_seqlen_q,
+                                                 max_seqlen_k);
   BwdKernelDkDvContext context;
-  context.grid_calculator = grid_calculator;
+  context.grid_calculator = calculate_dk_dv_grid;
   err = context.lookup_optimal(params, arch);
   if (err != hipSuccess) {
     return err;
@@ -118,56 +393,55 @@ hipError_t
 bwd_kernel_dq(T4 q,
               T4 k,
               T4 v,
+              T4 b,
               float sm_scale,
               T4 out,
               T4 dout,
               T4 dq,
+              T4 db,
               T2 softmax_lse,
               T2 delta,
               float dropout_p,
               uint64_t philox_seed,
               uint64_t philox_offset,
+              const T4& dropout_bitmask,
               bool is_causal,
+              int32_t window_left,
+              int32_t window_right,
+              const T1& cu_seqlens_q,
+              const T1& cu_seqlens_k,
+              uint64_t max_seqlen_q,
+              uint64_t max_seqlen_k,
               aotriton::Stream stream_wrap) {
   hipError_t err;
   auto stream = stream_wrap.native();
   auto arch = getArchFromStream(stream);
-  uint32_t seqlen_q = q.size(2);
-  uint32_t seqlen_k = k.size(2);
-  auto grid_calculator = [seqlen_q](const BwdKernelDqParams& params) -> dim3 {
-    dim3 grid {
-      aotriton::cdiv<uint32_t>(seqlen_q, params.BLOCK_M),
-      uint32_t(params.Q->size(1)),
-      uint32_t(params.Q->size(0)),
-    };
-    return grid;
-  };
-  constexpr int kMinHeadDimCompiled = 16;
-  int head_size = q.size(3);
-  int head_size_rounded = std::max(kMinHeadDimCompiled, bit_ceil(head_size));
-  BwdKernelDqParams params = {
-    .Q = &q,
-    .K = &k,
-    .V = &v,
-    .Out = &out,
-    .dO = &dout,
-    .dQ = &dq,
-    .sm_scale = sm_scale,
-    .L = &softmax_lse,
-    .D = &delta,
-    .seqlen_q = seqlen_q,
-    .seqlen_k = seqlen_k,
-    .head_dim = head_size,
-    .dropout_p = dropout_p,
-    .philox_seed = philox_seed,
-    .philox_offset_base = static_cast<uint32_t>(philox_offset),
-    .BLOCK_DMODEL = bit_ceil(head_size),
-    .CAUSAL = is_causal,
-    .ENABLE_DROPOUT = dropout_p > 0.0,
-    .PADDED_HEAD = head_size_rounded != head_size,
-  };
+  if (arch == GPU_ARCH_UNKNOWN && is_stream_capturing(stream))
+    return hipErrorStreamCaptureUnsupported;
+  BwdKernelDqParams params = make_dq_params(q,
+                                            k,
+                                            v,
+                                            b,
+                                            sm_scale,
+                                            out,
+                                            dout,
+                                            dq,
+                                            db,
+                                            softmax_lse,
+                                            delta,
+                                            dropout_p,
+                                            philox_seed,
+                                            philox_offset,
+                                            dropout_bitmask,
+                                            is_causal,
+                                            window_left,
+                                            window_right,
+                                            cu_seqlens_q,
+                                            cu_seqlens_k,
+                                            max_seqlen_q,
+                                            max_seqlen_k);
   BwdKernelDqContext context;
-  context.grid_calculator = grid_calculator;
+  context.grid_calculator = calculate_dq_grid;
   err = context.lookup_optimal(params, arch);
   if (err != hipSuccess) {
     return err;
@@ -176,60 +450,702 @@ bwd_kernel_dq(T4 q,
   return err;
 }
 
+namespace {
+
+// Selections of bwd_kernel_dk_dv with FUSED_DQ accumulate dQ into dq_acc,
+// which bwd_postprocess converts into dq. This replaces bwd_kernel_dq, and
+// with INLINE_DELTA also bwd_preprocess. *fused is false if the tuning
+// database selected the split kernels for the problem, and nothing is launched.
+hipError_t
+run_fused_bwd(T4 q,
+              T4 k,
+              T4 v,
+              T4 b,
+              const T1& cu_seqlens_q,
+              const T1& cu_seqlens_k,
+              uint64_t max_seqlen_q,
+              uint64_t max_seqlen_k,
+              float sm_scale,
+              T4 out,
+              T4 dout,
+              T4 dq,
+              T4 dk,
+              T4 dv,
+              const T4& dq_acc,
+              T2 softmax_lse,
+              T2 delta,
+              float dropout_p,
+              uint64_t philox_seed,
+              uint64_t philox_offset,
+              const T4& dropout_bitmask,
+              bool is_causal,
+              int32_t window_left,
+              int32_t window_right,
+              hipStream_t stream,
+              bool* fused) {
+  *fused = false;
+  hipError_t err;
+  auto arch = getArchFromStream(stream);
+  if (arch == GPU_ARCH_UNKNOWN && is_stream_capturing(stream))
+    return hipErrorStreamCaptureUnsupported;
+  BwdKernelDkDvParams params = make_dk_dv_params(q,
+                                                 k,
+                                                 v,
+                                                 b,
+                                                 sm_scale,
+                                                 out,
+                                                 dout,
+                                                 dk,
+                                                 dv,
+                                                 dq_acc,
+                                                 softmax_lse,
+                                                 delta,
+                                                 dropout_p,
+                                                 philox_seed,
+                                                 philox_offset,
+                                                 dropout_bitmask,
+                                                 is_causal,
+                                                 window_left,
+                                                 window_right,
+                                                 cu_seqlens_q,
+                                                 cu_seqlens_k,
+                                                 max_seqlen_q,
+                                                 max_seqlen_k);
+  BwdKernelDkDvContext context;
+  context.grid_calculator = calculate_dk_dv_grid;
+  err = context.lookup_optimal(params, arch);
+  if (err != hipSuccess)
+    return err;
+  if (!params.FUSED_DQ)
+    return hipSuccess;
+  *fused = true;
+  BwdPostprocessParams postprocess_params = make_postprocess_params(dq_acc, dq, cu_seqlens_q, max_seqlen_q);
+  BwdPostprocessContext postprocess_context;
+  postprocess_context.grid_calculator = calculate_postprocess_grid;
+  err = postprocess_context.lookup_optimal(postprocess_params, arch);
+  if (err != hipSuccess)
+    return err;
+  size_t bytes = dq_acc.size(0) * dq_acc.stride(0) * sizeof(float);
+  err = hipMemsetAsync(const_cast<void*>(dq_acc.data_ptr()), 0, bytes, stream);
+  if (err != hipSuccess)
+    return err;
+  if (!params.INLINE_DELTA) {
+    err = bwd_preprocess(out, dout, delta, cu_seqlens_q, max_seqlen_q, stream);
+    if (err != hipSuccess)
+      return err;
+  }
+  err = context.launch(params, stream);
+  if (err != hipSuccess)
+    return err;
+  return postprocess_context.launch(postprocess_params, stream);
+}
+
+// Performs the lookups of run_fused_bwd and loads the modules it launches, so
+// that it can be captured.
+hipError_t
+prepare_fused_bwd(T4 q,
+                  T4 k,
+                  T4 v,
+                  T4 b,
+                  T4 out,
+                  T4 dout,
+                  T4 dq,
+                  T4 dk,
+                  T4 dv,
+                  const T4& dq_acc,
+                  T2 softmax_lse,
+                  T2 delta,
+                  float dropout_p,
+                  const T4& dropout_bitmask,
+                  bool is_causal,
+                  int32_t window_left,
+                  int32_t window_right,
+                  hipStream_t stream) {
+  auto arch = getArchFromStream(stream);
+  BwdKernelDkDvParams params = make_dk_dv_params(q,
+                                                 k,
+                                                 v,
+                                                 b,
+                                                 0.0f,
+                                                 out,
+                                                 dout,
+                                                 dk,
+                                                 dv,
+                                                 dq_acc,
+                                                 softmax_lse,
+                                                 delta,
+                                                 dropout_p,
+                                                 0,
+                                                 0,
+                                                 dropout_bitmask,
+                                                 is_causal,
+                                                 window_left,
+                                                 window_right,
+                                                 kNoSeqlens,
+                                                 kNoSeqlens,
+                                                 q.size(2),
+                                                 k.size(2));
+  BwdKernelDkDvContext context;
+  hipError_t err = context.lookup_optimal(params, arch);
+  if (err != hipSuccess || !params.FUSED_DQ)
+    return err;
+  err = context.preload(params);
+  if (err != hipSuccess)
+    return err;
+  BwdPostprocessParams postprocess_params = make_postprocess_params(dq_acc, dq, kNoSeqlens, q.size(2));
+  BwdPostprocessContext postprocess_context;
+  err = postprocess_context.lookup_optimal(postprocess_params, arch);
+  if (err != hipSuccess)
+    return err;
+  err = postprocess_context.preload(postprocess_params);
+  if (err != hipSuccess || params.INLINE_DELTA)
+    return err;
+  BwdPreprocessParams preprocess_params = make_preprocess_params(out, dout, delta, kNoSeqlens, q.size(2));
+  BwdPreprocessContext preprocess_context;
+  err = preprocess_context.lookup_optimal(preprocess_params, arch);
+  if (err != hipSuccess)
+    return err;
+  return preprocess_context.preload(preprocess_params);
+}
+
+hipError_t
+run_attn_bwd(T4 q,
+             T4 k,
+             T4 v,
+             T4 b,
+             const T1& cu_seqlens_q,
+             const T1& cu_seqlens_k,
+             uint64_t max_seqlen_q,
+             uint64_t max_seqlen_k,
+             float sm_scale,
+             T4 out,
+             T4 dout,
+             T4 dq,
+             T4 dk,
+             T4 dv,
+             T4 db,
+             T2 softmax_lse,
+             T2 delta,
+             float dropout_p,
+             uint64_t philox_seed,
+             uint64_t philox_offset,
+             bool is_causal,
+             int32_t window_left,
+             int32_t window_right,
+             aotriton::Stream stream,
+             const BwdExtraArguments* extargs) {
+  if (!valid_bias(q, b, db) || !valid_head_groups(q, k, v) ||
+      !contiguous_head_dim(q, k, v, out, dout, dq, dk, dv))
+    return hipErrorInvalidValue;
+  const T4& dropout_bitmask = extargs ? extargs->dropout_bitmask : kNoDropoutBitmask;
+  if (!valid_dropout_bitmask(dropout_bitmask, q, k) || (dropout_bitmask && cu_seqlens_q))
+    return hipErrorInvalidValue;
+  const T4& dq_acc = extargs ? extargs->dq_acc : kNoDqAcc;
+  if (!valid_dq_acc(dq_acc, q))
+    return hipErrorInvalidValue;
+  hipError_t ret;
+  // The fused kernel does not compute db
+  if (dq_acc && !db) {
+    bool fused;
+    ret = run_fused_bwd(q,
+                        k,
+                        v,
+                        b,
+                        cu_seqlens_q,
+                        cu_seqlens_k,
+                        max_seqlen_q,
+                        max_seqlen_k,
+                        sm_scale,
+                        out,
+                        dout,
+                        dq,
+                        dk,
+                        dv,
+                        dq_acc,
+                        softmax_lse,
+                        delta,
+                        dropout_p,
+                        philox_seed,
+                        philox_offset,
+                        dropout_bitmask,
+                        is_causal,
+                        window_left,
+                        window_right,
+                        stream.native(),
+                        &fused);
+    if (ret != hipSuccess || fused)
+      return ret;
+  }
+  auto arch = getArchFromStream(stream.native());
+  if (arch == GPU_ARCH_UNKNOWN && is_stream_capturing(stream.native()))
+    return hipErrorStreamCaptureUnsupported;
+  BwdKernelDkDvParams dk_dv_params = make_dk_dv_params(q,
+                                                       k,
+                                                       v,
+                                                       b,
+                                                       sm_scale,
+                                                       out,
+                                                       dout,
+                                                       dk,
+                                                       dv,
+                                                       kNoDqAcc,
+                                                       softmax_lse,
+                                                       delta,
+                                                       dropout_p,
+                                                       philox_seed,
+                                                       philox_offset,
+                                                       dropout_bitmask,
+                                                       is_causal,
+                                                       window_left,
+                                                       window_right,
+                                                       cu_seqlens_q,
+                                                       cu_seqlens_k,
+                                                       max_seqlen_q,
+                                                       max_seqlen_k);
+  BwdKernelDkDvContext dk_dv_context;
+  dk_dv_context.grid_calculator = calculate_dk_dv_grid;
+  ret = dk_dv_context.lookup_optimal(dk_dv_params, arch);
+  if (ret != hipSuccess)
+    return ret;
+  BwdKernelDqParams dq_params = make_dq_params(q,
+                                               k,
+                                               v,
+                                               b,
+                                               sm_scale,
+                                               out,
+                                               dout,
+                                               dq,
+                                               db,
+                                               softmax_lse,
+                                               delta,
+                                               dropout_p,
+                                               philox_seed,
+                                               philox_offset,
+                                               dropout_bitmask,
+                                               is_causal,
+                                               window_left,
+                                               window_right,
+                                               cu_seqlens_q,
+                                               cu_seqlens_k,
+                                               max_seqlen_q,
+                                               max_seqlen_k);
+  BwdKernelDqContext dq_context;
+  dq_context.grid_calculator = calculate_dq_grid;
+  ret = dq_context.lookup_optimal(dq_params, arch);
+  if (ret != hipSuccess)
+    return ret;
+  if (needs_preprocess(dk_dv_params, dq_params)) {
+    ret = bwd_preprocess(out, dout, delta, cu_seqlens_q, max_seqlen_q, stream);
+    if (ret != hipSuccess)
+      return ret;
+  }
+  auto dk_dv = [&](hipStream_t s) -> hipError_t {
+    return dk_dv_context.launch(dk_dv_params, s);
+  };
+  auto dq_func = [&](hipStream_t s) -> hipError_t {
+    return dq_context.launch(dq_params, s);
+  };
+  if (extargs && extargs->concurrent_dq) {
+    ForkResources<HipRuntime> res;
+    ret = get_fork_resources<HipRuntime>(stream.native(), &res);
+    if (ret != hipSuccess)
+      return ret;
+    return fork_join<HipRuntime>(stream.native(), res, dk_dv, dq_func);
+  }
+  ret = dk_dv(stream.native());
+  if (ret != hipSuccess)
+    return ret;
+  ret = dq_func(stream.native());
+  return ret;
+}
+
+}
+
 hipError_t
 attn_bwd(T4 q,
          T4 k,
          T4 v,
+         T4 b,
          float sm_scale,
          T4 out,
          T4 dout,
          T4 dq,
          T4 dk,
          T4 dv,
+         T4 db,
          T2 softmax_lse,
          T2 delta,
          float dropout_p,
          uint64_t philox_seed,
          uint64_t philox_offset,
          bool is_causal,
-         aotriton::Stream stream) {
-  hipError_t ret;
-  ret = bwd_preprocess(out, dout, delta, stream);
-  if (ret != hipSuccess)
-    return ret;
-  ret = bwd_kernel_dk_dv(q,
-                         k,
-                         v,
-                         sm_scale,
-                         out,
-                         dout,
-                         dk,
-                         dv,
-                         softmax_lse,
-                         delta,
-                         dropout_p,
-                         philox_seed,
-                         philox_offset,
-                         is_causal,
-                         stream);
+         int32_t window_left,
+         int32_t window_right,
+         aotriton::Stream stream,
+         const BwdExtraArguments* extargs) {
+  return run_attn_bwd(q,
+                      k,
+                      v,
+                      b,
+                      kNoSeqlens,
+                      kNoSeqlens,
+                      q.size(2),
+                      k.size(2),
+                      sm_scale,
+                      out,
+                      dout,
+                      dq,
+                      dk,
+                      dv,
+                      db,
+                      softmax_lse,
+                      delta,
+                      dropout_p,
+                      philox_seed,
+                      philox_offset,
+                      is_causal,
+                      window_left,
+                      window_right,
+                      stream,
+                      extargs);
+}
 
-  if (ret != hipSuccess)
-    return ret;
-  ret = bwd_kernel_dq(q,
+hipError_t
+attn_bwd_compact_varlen(T4 q,
+                        T4 k,
+                        T4 v,
+                        T4 b,
+                        T1 cu_seqlens_q,
+                        T1 cu_seqlens_k,
+                        int32_t max_seqlen_q,
+                        int32_t max_seqlen_k,
+                        float sm_scale,
+                        T4 out,
+                        T4 dout,
+                        T4 dq,
+                        T4 dk,
+                        T4 dv,
+                        T4 db,
+                        T2 softmax_lse,
+                        T2 delta,
+                        float dropout_p,
+                        uint64_t philox_seed,
+                        uint64_t philox_offset,
+                        bool is_causal,
+                        int32_t window_left,
+                        int32_t window_right,
+                        aotriton::Stream stream,
+                        const BwdExtraArguments* extargs) {
+  if (!cu_seqlens_q || !cu_seqlens_k)
+    return hipErrorInvalidValue;
+  if (cu_seqlens_q.dtype() != DType::kInt32 || cu_seqlens_k.dtype() != DType::kInt32)
+    return hipErrorInvalidValue;
+  if (cu_seqlens_q.size(0) != cu_seqlens_k.size(0) || cu_seqlens_q.size(0) < 2)
+    return hipErrorInvalidValue;
+  if (q.size(0) != 1 || k.size(0) != 1 || v.size(0) != 1 || out.size(0) != 1)
+    return hipErrorInvalidValue;
+  // Variable-length kernels are not compiled with bias
+  if (b || db)
+    return hipErrorInvalidValue;
+  return run_attn_bwd(q,
                       k,
                       v,
+                      b,
+                      cu_seqlens_q,
+                      cu_seqlens_k,
+                      max_seqlen_q,
+                      max_seqlen_k,
                       sm_scale,
                       out,
                       dout,
                       dq,
+                      dk,
+                      dv,
+                      db,
                       softmax_lse,
                       delta,
                       dropout_p,
                       philox_seed,
                       philox_offset,
                       is_causal,
-                      stream);
-  return ret;
+                      window_left,
+                      window_right,
+                      stream,
+                      extargs);
+}
+
+struct AttnBwdPlan::Impl {
+  // Storage of tensors referenced by params
+  T4 q, k, v, b, out, dout, dq, dk, dv, db, dropout_bitmask;
+  T2 softmax_lse, delta;
+  BwdPreprocessParams preprocess_params;
+  BwdPreprocessContext preprocess_context;
+  dim3 preprocess_grid;
+  BwdKernelDkDvParams dk_dv_params;
+  BwdKernelDkDvContext dk_dv_context;
+  dim3 dk_dv_grid;
+  BwdKernelDqParams dq_params;
+  BwdKernelDqContext dq_context;
+  dim3 dq_grid;
+};
+
+AttnBwdPlan::AttnBwdPlan() = default;
+AttnBwdPlan::~AttnBwdPlan() = default;
+AttnBwdPlan::AttnBwdPlan(AttnBwdPlan&&) = default;
+AttnBwdPlan& AttnBwdPlan::operator=(AttnBwdPlan&&) = default;
+
+hipError_t
+AttnBwdPlan::prepare(T4 q,
+                     T4 k,
+                     T4 v,
+                     T4 b,
+                     T4 out,
+                     T4 dout,
+                     T4 dq,
+                     T4 dk,
+                     T4 dv,
+                     T4 db,
+                     T2 softmax_lse,
+                     T2 delta,
+                     float dropout_p,
+                     bool is_causal,
+                     int32_t window_left,
+                     int32_t window_right,
+                     aotriton::Stream stream_wrap) {
+  if (!valid_bias(q, b, db) || !valid_head_groups(q, k, v) ||
+      !contiguous_head_dim(q, k, v, out, dout, dq, dk, dv))
+    return hipErrorInvalidValue;
+  hipError_t err;
+  auto impl = std::make_unique<Impl>();
+  impl->q = q;
+  impl->k = k;
+  impl->v = v;
+  impl->b = b;
+  impl->out = out;
+  impl->dout = dout;
+  impl->dq = dq;
+  impl->dk = dk;
+  impl->dv = dv;
+  impl->db = db;
+  impl->softmax_lse = softmax_lse;
+  impl->delta = delta;
+  auto stream = stream_wrap.native();
+  // Kernel selection may query the device and load modules
+  if (is_stream_capturing(stream))
+    return hipErrorStreamCaptureUnsupported;
+  auto arch = getArchFromStream(stream);
+  impl->dk_dv_params = make_dk_dv_params(impl->q,
+                                         impl->k,
+                                         impl->v,
+                                         impl->b,
+                                         0.0f,
+                                         impl->out,
+                                         impl->dout,
+                                         impl->dk,
+                                         impl->dv,
+                                         kNoDqAcc,
+                                         impl->softmax_lse,
+                                         impl->delta,
+                                         dropout_p,
+                                         0,
+                                         0,
+                                         impl->dropout_bitmask,
+                                         is_causal,
+                                         window_left,
+                                         window_right,
+                                         kNoSeqlens,
+                                         kNoSeqlens,
+                                         impl->q.size(2),
+                                         impl->k.size(2));
+  err = impl->dk_dv_context.lookup_optimal(impl->dk_dv_params, arch);
+  if (err != hipSuccess)
+    return err;
+  err = impl->dk_dv_context.preload(impl->dk_dv_params);
+  if (err != hipSuccess)
+    return err;
+  impl->dk_dv_grid = calculate_dk_dv_grid(impl->dk_dv_params);
+  impl->dq_params = make_dq_params(impl->q,
+                                   impl->k,
+                                   impl->v,
+                                   impl->b,
+                                   0.0f,
+                                   impl->out,
+                                   impl->dout,
+                                   impl->dq,
+                                   impl->db,
+                                   impl->softmax_lse,
+                                   impl->delta,
+                                   dropout_p,
+                                   0,
+                                   0,
+                                   impl->dropout_bitmask,
+                                   is_causal,
+                                   window_left,
+                                   window_right,
+                                   kNoSeqlens,
+                                   kNoSeqlens,
+                                   impl->q.size(2),
+                                   impl->k.size(2));
+  err = impl->dq_context.lookup_optimal(impl->dq_params, arch);
+  if (err != hipSuccess)
+    return err;
+  err = impl->dq_context.preload(impl->dq_params);
+  if (err != hipSuccess)
+    return err;
+  impl->dq_grid = calculate_dq_grid(impl->dq_params);
+  if (needs_preprocess(impl->dk_dv_params, impl->dq_params)) {
+    impl->preprocess_params =
+        make_preprocess_params(impl->out, impl->dout, impl->delta, kNoSeqlens, impl->q.size(2));
+    err = impl->preprocess_context.lookup_optimal(impl->preprocess_params, arch);
+    if (err != hipSuccess)
+      return err;
+    err = impl->preprocess_context.preload(impl->preprocess_params);
+    if (err != hipSuccess)
+      return err;
+    impl->preprocess_grid = calculate_preprocess_grid(impl->preprocess_params);
+  }
+  pimpl_ = std::move(impl);
+  return hipSuccess;
+}
+
+hipError_t
+AttnBwdPlan::execute(T4 q,
+                     T4 k,
+                     T4 v,
+                     T4 b,
+                     float sm_scale,
+                     T4 out,
+                     T4 dout,
+                     T4 dq,
+                     T4 dk,
+                     T4 dv,
+                     T4 db,
+                     T2 softmax_lse,
+                     T2 delta,
+                     uint64_t philox_seed,
+                     uint64_t philox_offset,
+                     aotriton::Stream stream_wrap,
+                     const BwdExtraArguments* extargs) {
+  if (!pimpl_)
+    return hipErrorNotReady;
+  Impl& impl = *pimpl_;
+  if (!same_layout(q, impl.q) || !same_layout(k, impl.k) || !same_layout(v, impl.v) ||
+      !same_layout(out, impl.out) || !same_layout(dout, impl.dout) || !same_layout(dq, impl.dq) ||
+      !same_layout(dk, impl.dk) || !same_layout(dv, impl.dv) || !same_layout(softmax_lse, impl.softmax_lse) ||
+      !same_layout(delta, impl.delta))
+    return hipErrorInvalidValue;
+  if (bool(b) != bool(impl.b) || (b && !same_layout(b, impl.b)))
+    return hipErrorInvalidValue;
+  if (bool(db) != bool(impl.db) || (db && !same_layout(db, impl.db)))
+    return hipErrorInvalidValue;
+  const T4& dropout_bitmask = extargs ? extargs->dropout_bitmask : kNoDropoutBitmask;
+  if (!valid_dropout_bitmask(dropout_bitmask, q, k))
+    return hipErrorInvalidValue;
+  impl.q = q;
+  impl.k = k;
+  impl.v = v;
+  impl.b = b;
+  impl.out = out;
+  impl.dout = dout;
+  impl.dq = dq;
+  impl.dk = dk;
+  impl.dv = dv;
+  impl.db = db;
+  impl.dropout_bitmask = dropout_bitmask;
+  impl.softmax_lse = softmax_lse;
+  impl.delta = delta;
+  impl.dk_dv_params.sm_scale = sm_scale;
+  impl.dk_dv_params.philox_seed = philox_seed;
+  impl.dk_dv_params.philox_offset_base = static_cast<uint32_t>(philox_offset);
+  impl.dq_params.sm_scale = sm_scale;
+  impl.dq_params.philox_seed = philox_seed;
+  impl.dq_params.philox_offset_base = static_cast<uint32_t>(philox_offset);
+  auto stream = stream_wrap.native();
+  hipError_t err;
+  if (needs_preprocess(impl.dk_dv_params, impl.dq_params)) {
+    err = impl.preprocess_context.launch(impl.preprocess_params, impl.preprocess_grid, stream);
+    if (err != hipSuccess)
+      return err;
+  }
+  auto dk_dv = [&impl](hipStream_t s) -> hipError_t {
+    return impl.dk_dv_context.launch(impl.dk_dv_params, impl.dk_dv_grid, s);
+  };
+  auto dq_func = [&impl](hipStream_t s) -> hipError_t {
+    return impl.dq_context.launch(impl.dq_params, impl.dq_grid, s);
+  };
+  if (extargs && extargs->concurrent_dq) {
+    ForkResources<HipRuntime> res;
+    err = get_fork_resources<HipRuntime>(stream, &res);
+    if (err != hipSuccess)
+      return err;
+    return fork_join<HipRuntime>(stream, res, dk_dv, dq_func);
+  }
+  err = dk_dv(stream);
+  if (err != hipSuccess)
+    return err;
+  return dq_func(stream);
+}
+
+bool
+AttnBwdPlan::prepared() const {
+  return bool(pimpl_);
+}
+
+hipError_t
+prepare_attn_bwd_for_capture(T4 q,
+                             T4 k,
+                             T4 v,
+                             T4 b,
+                             T4 out,
+                             T4 dout,
+                             T4 dq,
+                             T4 dk,
+                             T4 dv,
+                             T4 db,
+                             T2 softmax_lse,
+                             T2 delta,
+                             float dropout_p,
+                             bool is_causal,
+                             int32_t window_left,
+                             int32_t window_right,
+                             aotriton::Stream stream,
+                             const BwdExtraArguments* extargs) {
+  AttnBwdPlan plan;
+  hipError_t err = plan.prepare(q, k, v, b, out, dout, dq, dk, dv, db, softmax_lse, delta, dropout_p, is_causal,
+                                window_left, window_right, stream);
+  if (err != hipSuccess)
+    return err;
+  // attn_bwd takes the fused path with dq_acc, which AttnBwdPlan ignores
+  if (extargs && extargs->dq_acc && !db) {
+    if (!valid_dq_acc(extargs->dq_acc, q))
+      return hipErrorInvalidValue;
+    err = prepare_fused_bwd(q,
+                            k,
+                            v,
+                            b,
+                            out,
+                            dout,
+                            dq,
+                            dk,
+                            dv,
+                            extargs->dq_acc,
+                            softmax_lse,
+                            delta,
+                            dropout_p,
+                            extargs->dropout_bitmask,
+                            is_causal,
+                            window_left,
+                            window_right,
+                            stream.native());
+    if (err != hipSuccess)
+      return err;
+  }
+  if (extargs && extargs->concurrent_dq) {
+    // Secondary stream and events cannot be created during capture
+    ForkResources<HipRuntime> res;
+    err = get_fork_resources<HipRuntime>(stream.native(), &res);
+  }
+  return err;
 }
 
 }
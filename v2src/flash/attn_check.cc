@@ -5,8 +5,11 @@
 #include <aotriton/runtime.h>
 #include <aotriton/util.h>
 #include <flash/shim.attn_fwd.h>
+#include <flash/shim.attn_fwd_split.h>
+#include <flash/shim.attn_fwd_split_reduce.h>
 #include <flash/shim.bwd_kernel_dk_dv.h>
 #include <flash/shim.bwd_kernel_dq.h>
+#include <flash/shim.bwd_postprocess.h>
 #include <flash/shim.bwd_preprocess.h>
 #include <iostream>
 
@@ -17,7 +20,9 @@ check_gpu(aotriton::Stream stream_wrap) {
   auto stream = stream_wrap.native();
   auto arch = getArchFromStream(stream);
   if (AttnFwdContext::get_arch_number(arch) < 0 || BwdPreprocessContext::get_arch_number(arch) < 0 ||
-      BwdKernelDkDvContext::get_arch_number(arch) < 0 || BwdKernelDqContext::get_arch_number(arch) < 0) {
+      BwdKernelDkDvContext::get_arch_number(arch) < 0 || BwdKernelDqContext::get_arch_number(arch) < 0 ||
+      AttnFwdSplitContext::get_arch_number(arch) < 0 || AttnFwdSplitReduceContext::get_arch_number(arch) < 0 ||
+      BwdPostprocessContext::get_arch_number(arch) < 0) {
     return hipErrorNoBinaryForGpu;
   }
   return hipSuccess;
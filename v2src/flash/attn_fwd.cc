@@ -5,84 +5,429 @@
 #include <aotriton/util.h>
 #include <aotriton/_internal/util.h>
 #include <flash/shim.attn_fwd.h>
-#include <iostream>
-
-#ifdef NDEBUG
-#define AOTRITON_VERBOSE 0
-#else
-#define AOTRITON_VERBOSE 1
-#endif
+#include <flash/shim.attn_fwd_fp8.h>
+#include <array>
+#include <utility>
 
 namespace aotriton::v2::flash {
 
-hipError_t
-attn_fwd(T4 q,
-         T4 k,
-         T4 v,
-         float sm_scale,
-         T2 softmax_lse,
-         T4 out,
-         float dropout_p,
-         uint64_t philox_seed,
-         uint64_t philox_offset,
-         T4 encoded_softmax,
-         bool is_causal,
-         aotriton::Stream stream_wrap) {
-  hipError_t err;
-  auto stream = stream_wrap.native();
-  auto arch = getArchFromStream(stream);
+namespace {
+
+// cu_seqlens of dense problems
+const T1 kNoSeqlens;
+
+// Problems without dropout bitmask
+const T4 kNoDropoutBitmask;
+
+// Bits of one word of the dropout bitmask
+constexpr int32_t kDropoutBitmaskWordBits = 32;
+
+bool
+is_fp8(DType dtype) {
+  return dtype == DType::kFloat8e4m3fnuz || dtype == DType::kFloat8e5m2fnuz;
+}
+
+// For VARLEN, the grid covers max_seqlen_q of every sequence, and the kernel
+// returns early for blocks past the end of shorter sequences.
+template<typename Params>
+dim3
+calculate_grid(const Params& params) {
+  uint32_t num_seqs = params.VARLEN ? params.cu_seqlens_q->size(0) - 1 : params.Q->size(0);
+  dim3 grid {
+    aotriton::cdiv<uint32_t>(params.seqlen_q, params.BLOCK_M),
+    uint32_t(params.Q->size(1)),
+    num_seqs,
+  };
+  return grid;
+}
+
+// Tensors are referenced by the returned params and must outlive it.
+// Params is AttnFwdParams, or AttnFwdFp8Params that shares its fields.
+template<typename Params = AttnFwdParams>
+Params
+make_params(const T4& q,
+            const T4& k,
+            const T4& v,
+            const T4& b,
+            float sm_scale,
+            const T2& softmax_lse,
+            const T4& out,
+            float dropout_p,
+            uint64_t philox_seed,
+            uint64_t philox_offset,
+            const T4& encoded_softmax,
+            bool is_causal,
+            int32_t window_left,
+            int32_t window_right,
+            const T1& cu_seqlens_q,
+            const T1& cu_seqlens_k,
+            int32_t max_seqlen_q,
+            int32_t max_seqlen_k,
+            const T4& dropout_bitmask = kNoDropoutBitmask,
+            float q_descale = 1.0f,
+            float k_descale = 1.0f,
+            float v_descale = 1.0f) {
   constexpr int kUseCausalBits = 3;
   constexpr int kNoCausalBits = 1;
-  auto grid_calculator = [](const AttnFwdParams& params) -> dim3 {
-#if AOTRITON_VERBOSE
-    std::cerr << "Selected Kernel "
-              << " BLOCK_M = " << params.BLOCK_M << " BLOCK_N = " << params.BLOCK_N
-              << " pre_load_v = " << params.pre_load_v << std::endl;
-#endif
-    dim3 grid {
-      aotriton::cdiv<uint32_t>(params.seqlen_q, params.BLOCK_M),
-      uint32_t(params.Q->size(1)),
-      uint32_t(params.Q->size(0)),
-    };
-#if AOTRITON_VERBOSE
-    std::cerr << "Grid conf " << grid.x << " " << grid.y << " " << grid.z << std::endl;
-#endif
-    return grid;
-  };
-  int seqlen_q = q.size(2);
-  int seqlen_k = k.size(2);
   int head_size = q.size(3);
-  int head_dim_rounded = std::max<int>(16, aotriton::bit_ceil(head_size));
+  int head_dim_rounded = aotriton::round_head_dim(head_size, !b && !encoded_softmax);
   // Requires C++ 20
-  AttnFwdParams params = {
+  Params params = {
     .Q = &q,
     .K = &k,
     .V = &v,
+    .B = &b,
     .Out = &out,
     .encoded_softmax = &encoded_softmax,
     .sm_scale = sm_scale,
     .M = &softmax_lse,
-    .seqlen_q = seqlen_q,
-    .seqlen_k = seqlen_k,
+    .num_head_q = static_cast<int32_t>(q.size(1)),
+    .num_head_k = static_cast<int32_t>(k.size(1)),
+    .cu_seqlens_q = &cu_seqlens_q,
+    .cu_seqlens_k = &cu_seqlens_k,
+    .seqlen_q = max_seqlen_q,
+    .seqlen_k = max_seqlen_k,
     .head_dim = static_cast<uint64_t>(head_size),
+    .window_left = kernel_window_size(window_left, max_seqlen_q, max_seqlen_k),
+    .window_right = kernel_window_size(window_right, max_seqlen_q, max_seqlen_k),
     .dropout_p = dropout_p,
     .philox_seed = philox_seed,
     .philox_offset_base = static_cast<uint32_t>(philox_offset),
+    .dropout_bitmask = &dropout_bitmask,
+    .q_descale = q_descale,
+    .k_descale = k_descale,
+    .v_descale = v_descale,
+    .VARLEN = bool(cu_seqlens_q),
     .STAGE = is_causal ? kUseCausalBits : kNoCausalBits,
     .BLOCK_DMODEL = head_dim_rounded,
     .ENABLE_DROPOUT = dropout_p > 0.0,
     .RETURN_ENCODED_SOFTMAX = bool(encoded_softmax),
+    .BIAS_TYPE = b ? 1 : 0,
     .PADDED_HEAD = head_dim_rounded != head_size,
   };
-  AttnFwdContext context;
-  context.grid_calculator = grid_calculator;
-  // .grid_calculator = grid_calculator
+  return params;
+}
+
+template<typename Context, typename Params>
+hipError_t
+select_and_launch(Params& params, aotriton::Stream stream_wrap) {
+  if (!valid_head_groups(*params.Q, *params.K, *params.V) ||
+      !contiguous_head_dim(*params.Q, *params.K, *params.V, *params.Out))
+    return hipErrorInvalidValue;
+  hipError_t err;
+  auto stream = stream_wrap.native();
+  auto arch = getArchFromStream(stream);
+  if (arch == GPU_ARCH_UNKNOWN && is_stream_capturing(stream))
+    return hipErrorStreamCaptureUnsupported;
+  Context context;
+  context.grid_calculator = calculate_grid<Params>;
   err = context.lookup_optimal(params, arch);
   if (err != hipSuccess) {
     return err;
   }
+  // Tiles narrower than a word of the dropout bitmask OR their bits into it
+  const T4& bitmask = *params.dropout_bitmask;
+  if (bitmask && params.ENABLE_DROPOUT && params.BLOCK_N < kDropoutBitmaskWordBits) {
+    size_t bytes = bitmask.size(0) * bitmask.stride(0) * sizeof(int32_t);
+    err = hipMemsetAsync(const_cast<void*>(bitmask.data_ptr()), 0, bytes, stream);
+    if (err != hipSuccess) {
+      return err;
+    }
+  }
   err = context.launch(params, stream);
   return err;
 }
 
 }
+
+hipError_t
+dropout_bitmask_shape(T4 q, T4 k, float dropout_p, uint64_t budget_bytes, std::array<uint64_t, 4>* shape) {
+  if (!shape)
+    return hipErrorInvalidValue;
+  std::array<uint64_t, 4> bitmask_shape = {
+    q.size(0),
+    q.size(1),
+    q.size(2),
+    aotriton::cdiv<uint64_t>(k.size(2), kDropoutBitmaskWordBits),
+  };
+  uint64_t words = bitmask_shape[0] * bitmask_shape[1] * bitmask_shape[2] * bitmask_shape[3];
+  bool use_bitmask = dropout_p > 0.0 && words * sizeof(int32_t) <= budget_bytes && words <= INT32_MAX;
+  *shape = use_bitmask ? bitmask_shape : std::array<uint64_t, 4> {};
+  return hipSuccess;
+}
+
+hipError_t
+attn_fwd(T4 q,
+         T4 k,
+         T4 v,
+         T4 b,
+         float sm_scale,
+         T2 softmax_lse,
+         T4 out,
+         float dropout_p,
+         uint64_t philox_seed,
+         uint64_t philox_offset,
+         T4 encoded_softmax,
+         bool is_causal,
+         int32_t window_left,
+         int32_t window_right,
+         aotriton::Stream stream_wrap,
+         const FwdExtraArguments* extargs) {
+  const T4& dropout_bitmask = extargs ? extargs->dropout_bitmask : kNoDropoutBitmask;
+  if (!valid_optional_input(b, q.dtype()) || !valid_dropout_bitmask(dropout_bitmask, q, k))
+    return hipErrorInvalidValue;
+  AttnFwdParams params = make_params(q,
+                                     k,
+                                     v,
+                                     b,
+                                     sm_scale,
+                                     softmax_lse,
+                                     out,
+                                     dropout_p,
+                                     philox_seed,
+                                     philox_offset,
+                                     encoded_softmax,
+                                     is_causal,
+                                     window_left,
+                                     window_right,
+                                     kNoSeqlens,
+                                     kNoSeqlens,
+                                     q.size(2),
+                                     k.size(2),
+                                     dropout_bitmask);
+  return select_and_launch<AttnFwdContext>(params, stream_wrap);
+}
+
+hipError_t
+attn_fwd_compact_varlen(T4 q,
+                        T4 k,
+                        T4 v,
+                        T4 b,
+                        T1 cu_seqlens_q,
+                        T1 cu_seqlens_k,
+                        int32_t max_seqlen_q,
+                        int32_t max_seqlen_k,
+                        float sm_scale,
+                        T2 softmax_lse,
+                        T4 out,
+                        float dropout_p,
+                        uint64_t philox_seed,
+                        uint64_t philox_offset,
+                        T4 encoded_softmax,
+                        bool is_causal,
+                        int32_t window_left,
+                        int32_t window_right,
+                        aotriton::Stream stream_wrap) {
+  if (!cu_seqlens_q || !cu_seqlens_k)
+    return hipErrorInvalidValue;
+  if (cu_seqlens_q.dtype() != DType::kInt32 || cu_seqlens_k.dtype() != DType::kInt32)
+    return hipErrorInvalidValue;
+  if (cu_seqlens_q.size(0) != cu_seqlens_k.size(0) || cu_seqlens_q.size(0) < 2)
+    return hipErrorInvalidValue;
+  if (q.size(0) != 1 || k.size(0) != 1 || v.size(0) != 1 || out.size(0) != 1)
+    return hipErrorInvalidValue;
+  // Variable-length kernels are not compiled with bias
+  if (b)
+    return hipErrorInvalidValue;
+  AttnFwdParams params = make_params(q,
+                                     k,
+                                     v,
+                                     b,
+                                     sm_scale,
+                                     softmax_lse,
+                                     out,
+                                     dropout_p,
+                                     philox_seed,
+                                     philox_offset,
+                                     encoded_softmax,
+                                     is_causal,
+                                     window_left,
+                                     window_right,
+                                     cu_seqlens_q,
+                                     cu_seqlens_k,
+                                     max_seqlen_q,
+                                     max_seqlen_k);
+  return select_and_launch<AttnFwdContext>(params, stream_wrap);
+}
+
+hipError_t
+attn_fwd_fp8(T4 q,
+             T4 k,
+             T4 v,
+             float q_descale,
+             float k_descale,
+             float v_descale,
+             float sm_scale,
+             T2 softmax_lse,
+             T4 out,
+             bool is_causal,
+             int32_t window_left,
+             int32_t window_right,
+             aotriton::Stream stream_wrap) {
+  if (!is_fp8(q.dtype()) || k.dtype() != q.dtype() || v.dtype() != q.dtype())
+    return hipErrorInvalidValue;
+  if (out.dtype() != DType::kFloat16 && out.dtype() != DType::kBFloat16)
+    return hipErrorInvalidValue;
+  T4 no_bias, no_encoded_softmax;
+  auto params = make_params<AttnFwdFp8Params>(q,
+                                              k,
+                                              v,
+                                              no_bias,
+                                              sm_scale,
+                                              softmax_lse,
+                                              out,
+                                              0.0f,
+                                              0,
+                                              0,
+                                              no_encoded_softmax,
+                                              is_causal,
+                                              window_left,
+                                              window_right,
+                                              kNoSeqlens,
+                                              kNoSeqlens,
+                                              q.size(2),
+                                              k.size(2),
+                                              kNoDropoutBitmask,
+                                              q_descale,
+                                              k_descale,
+                                              v_descale);
+  return select_and_launch<AttnFwdFp8Context>(params, stream_wrap);
+}
+
+struct AttnFwdPlan::Impl {
+  // Storage of tensors referenced by params
+  T4 q, k, v, b, out, encoded_softmax;
+  T2 softmax_lse;
+  AttnFwdParams params;
+  AttnFwdContext context;
+  dim3 grid;
+};
+
+AttnFwdPlan::AttnFwdPlan() = default;
+AttnFwdPlan::~AttnFwdPlan() = default;
+AttnFwdPlan::AttnFwdPlan(AttnFwdPlan&&) = default;
+AttnFwdPlan& AttnFwdPlan::operator=(AttnFwdPlan&&) = default;
+
+hipError_t
+AttnFwdPlan::prepare(T4 q,
+                     T4 k,
+                     T4 v,
+                     T4 b,
+                     T2 softmax_lse,
+                     T4 out,
+                     float dropout_p,
+                     T4 encoded_softmax,
+                     bool is_causal,
+                     int32_t window_left,
+                     int32_t window_right,
+                     aotriton::Stream stream_wrap) {
+  if (!valid_optional_input(b, q.dtype()) || !valid_head_groups(q, k, v) ||
+      !contiguous_head_dim(q, k, v, out))
+    return hipErrorInvalidValue;
+  auto impl = std::make_unique<Impl>();
+  impl->q = q;
+  impl->k = k;
+  impl->v = v;
+  impl->b = b;
+  impl->softmax_lse = softmax_lse;
+  impl->out = out;
+  impl->encoded_softmax = encoded_softmax;
+  impl->params = make_params(impl->q,
+                             impl->k,
+                             impl->v,
+                             impl->b,
+                             0.0f,
+                             impl->softmax_lse,
+                             impl->out,
+                             dropout_p,
+                             0,
+                             0,
+                             impl->encoded_softmax,
+                             is_causal,
+                             window_left,
+                             window_right,
+                             kNoSeqlens,
+                             kNoSeqlens,
+                             impl->q.size(2),
+                             impl->k.size(2));
+  auto stream = stream_wrap.native();
+  // Kernel selection may query the device and load modules
+  if (is_stream_capturing(stream))
+    return hipErrorStreamCaptureUnsupported;
+  auto arch = getArchFromStream(stream);
+  hipError_t err = impl->context.lookup_optimal(impl->params, arch);
+  if (err != hipSuccess) {
+    return err;
+  }
+  err = impl->context.preload(impl->params);
+  if (err != hipSuccess) {
+    return err;
+  }
+  impl->grid = calculate_grid(impl->params);
+  pimpl_ = std::move(impl);
+  return hipSuccess;
+}
+
+hipError_t
+AttnFwdPlan::execute(T4 q,
+                     T4 k,
+                     T4 v,
+                     T4 b,
+                     float sm_scale,
+                     T2 softmax_lse,
+                     T4 out,
+                     uint64_t philox_seed,
+                     uint64_t philox_offset,
+                     T4 encoded_softmax,
+                     aotriton::Stream stream_wrap) {
+  if (!pimpl_)
+    return hipErrorNotReady;
+  Impl& impl = *pimpl_;
+  if (!same_layout(q, impl.q) || !same_layout(k, impl.k) || !same_layout(v, impl.v) ||
+      !same_layout(softmax_lse, impl.softmax_lse) || !same_layout(out, impl.out))
+    return hipErrorInvalidValue;
+  if (bool(encoded_softmax) != impl.params.RETURN_ENCODED_SOFTMAX)
+    return hipErrorInvalidValue;
+  if (encoded_softmax && !same_layout(encoded_softmax, impl.encoded_softmax))
+    return hipErrorInvalidValue;
+  if (bool(b) != bool(impl.params.BIAS_TYPE))
+    return hipErrorInvalidValue;
+  if (b && !same_layout(b, impl.b))
+    return hipErrorInvalidValue;
+  impl.q = q;
+  impl.k = k;
+  impl.v = v;
+  impl.b = b;
+  impl.softmax_lse = softmax_lse;
+  impl.out = out;
+  impl.encoded_softmax = encoded_softmax;
+  impl.params.sm_scale = sm_scale;
+  impl.params.philox_seed = philox_seed;
+  impl.params.philox_offset_base = static_cast<uint32_t>(philox_offset);
+  return impl.context.launch(impl.params, impl.grid, stream_wrap.native());
+}
+
+bool
+AttnFwdPlan::prepared() const {
+  return bool(pimpl_);
+}
+
+hipError_t
+prepare_attn_fwd_for_capture(T4 q,
+                             T4 k,
+                             T4 v,
+                             T4 b,
+                             T2 softmax_lse,
+                             T4 out,
+                             float dropout_p,
+                             T4 encoded_softmax,
+                             bool is_causal,
+                             int32_t window_left,
+                             int32_t window_right,
+                             aotriton::Stream stream) {
+  AttnFwdPlan plan;
+  return plan.prepare(q, k, v, b, softmax_lse, out, dropout_p, encoded_softmax, is_causal, window_left, window_right,
+                      stream);
+}
+
+}
@@ -0,0 +1,169 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#include <aotriton/flash.h>
+#include <aotriton/util.h>
+#include <aotriton/_internal/util.h>
+#include <flash/shim.attn_fwd_split.h>
+#include <flash/shim.attn_fwd_split_reduce.h>
+#include <algorithm>
+
+namespace aotriton::v2::flash {
+
+namespace {
+
+// BLOCK_M of attn_fwd_split, only used to estimate the size of the grid
+constexpr int64_t kSplitBlockM = 16;
+// Each split processes at least this many keys, so that the partial results
+// are not dominated by the prologue of attn_fwd_split and the reduction
+constexpr int64_t kMinKeysPerSplit = 256;
+constexpr int64_t kMaxSplits = 64;
+
+// Splits seqlen_k until every CU gets a workgroup. Problems that already fill
+// the GPU are not split.
+int32_t
+decode_num_splits(int64_t num_cus, int64_t batch, int64_t num_heads, int64_t seqlen_q, int64_t seqlen_k) {
+  int64_t num_blocks = batch * num_heads * aotriton::cdiv<int64_t>(seqlen_q, kSplitBlockM);
+  if (num_blocks >= num_cus)
+    return 1;
+  int64_t splits = std::min(aotriton::cdiv<int64_t>(num_cus, num_blocks),
+                            aotriton::cdiv<int64_t>(seqlen_k, kMinKeysPerSplit));
+  return static_cast<int32_t>(std::clamp<int64_t>(splits, 1, kMaxSplits));
+}
+
+dim3
+calculate_split_grid(const AttnFwdSplitParams& params) {
+  dim3 grid {
+    aotriton::cdiv<uint32_t>(params.seqlen_q, params.BLOCK_M) * params.num_splits,
+    uint32_t(params.Q->size(1)),
+    uint32_t(params.Q->size(0)),
+  };
+  return grid;
+}
+
+dim3
+calculate_reduce_grid(const AttnFwdSplitReduceParams& params) {
+  dim3 grid {
+    aotriton::cdiv<uint32_t>(params.seqlen_q, params.BLOCK_M),
+    uint32_t(params.Out->size(1)),
+    uint32_t(params.Out->size(0)),
+  };
+  return grid;
+}
+
+// The workspaces are fp32 and written densely, apart from out_partial whose
+// strides are passed to the kernels.
+bool
+valid_workspaces(const T4& q, const T4& out_partial, const T2& lse_partial) {
+  if (!out_partial || !lse_partial)
+    return false;
+  if (out_partial.dtype() != DType::kFloat32 || lse_partial.dtype() != DType::kFloat32)
+    return false;
+  uint64_t batch = q.size(0);
+  if (out_partial.size(0) == 0 || out_partial.size(0) % batch != 0)
+    return false;
+  for (int i = 1; i < 4; i++)
+    if (out_partial.size(i) != q.size(i))
+      return false;
+  if (out_partial.stride(3) != 1)
+    return false;
+  uint64_t num_splits = out_partial.size(0) / batch;
+  return lse_partial.size(0) == num_splits * batch * q.size(1) && lse_partial.size(1) == q.size(2) &&
+         lse_partial.stride(0) == q.size(2) && lse_partial.stride(1) == 1;
+}
+
+// The reduction writes out and softmax_lse like attn_fwd does
+bool
+valid_outputs(const T4& q, const T2& softmax_lse, const T4& out) {
+  if (!out || out.dtype() != q.dtype() || out.sizes() != q.sizes())
+    return false;
+  if (!softmax_lse || softmax_lse.dtype() != DType::kFloat32)
+    return false;
+  return softmax_lse.size(0) == q.size(0) * q.size(1) && softmax_lse.size(1) == q.size(2) &&
+         softmax_lse.stride(0) == q.size(2) && softmax_lse.stride(1) == 1;
+}
+
+}
+
+hipError_t
+attn_fwd_decode_num_splits(T4 q, T4 k, aotriton::Stream stream_wrap, int32_t* num_splits) {
+  if (!num_splits)
+    return hipErrorInvalidValue;
+  hipDevice_t dev;
+  hipError_t err = hipStreamGetDevice(stream_wrap.native(), &dev);
+  if (err != hipSuccess)
+    return err;
+  int num_cus = 0;
+  err = hipDeviceGetAttribute(&num_cus, hipDeviceAttributeMultiprocessorCount, dev);
+  if (err != hipSuccess)
+    return err;
+  *num_splits = decode_num_splits(num_cus, q.size(0), q.size(1), q.size(2), k.size(2));
+  return hipSuccess;
+}
+
+hipError_t
+attn_fwd_decode(T4 q,
+                T4 k,
+                T4 v,
+                float sm_scale,
+                T2 softmax_lse,
+                T4 out,
+                T4 out_partial,
+                T2 lse_partial,
+                aotriton::Stream stream_wrap) {
+  if (!valid_head_groups(q, k, v) || !contiguous_head_dim(q, k, v, out) || q.size(2) == 0 || k.size(2) == 0)
+    return hipErrorInvalidValue;
+  if (!valid_outputs(q, softmax_lse, out) || !valid_workspaces(q, out_partial, lse_partial))
+    return hipErrorInvalidValue;
+  auto stream = stream_wrap.native();
+  auto arch = getArchFromStream(stream);
+  if (arch == GPU_ARCH_UNKNOWN && is_stream_capturing(stream))
+    return hipErrorStreamCaptureUnsupported;
+  int head_size = q.size(3);
+  int head_dim_rounded = std::max<int>(16, aotriton::bit_ceil(head_size));
+  int32_t num_splits = out_partial.size(0) / q.size(0);
+  AttnFwdSplitParams split_params = {
+    .Q = &q,
+    .K = &k,
+    .V = &v,
+    .sm_scale = sm_scale,
+    .Out_partial = &out_partial,
+    .M_partial = &lse_partial,
+    .num_head_q = static_cast<int32_t>(q.size(1)),
+    .num_head_k = static_cast<int32_t>(k.size(1)),
+    .seqlen_q = static_cast<int32_t>(q.size(2)),
+    .seqlen_k = static_cast<int32_t>(k.size(2)),
+    .head_dim = static_cast<uint64_t>(head_size),
+    .num_splits = num_splits,
+    .BLOCK_DMODEL = head_dim_rounded,
+    .PADDED_HEAD = head_dim_rounded != head_size,
+  };
+  AttnFwdSplitReduceParams reduce_params = {
+    .Out_partial = &out_partial,
+    .M_partial = &lse_partial,
+    .M = &softmax_lse,
+    .Out = &out,
+    .num_head_q = static_cast<int32_t>(q.size(1)),
+    .seqlen_q = static_cast<int32_t>(q.size(2)),
+    .head_dim = static_cast<uint64_t>(head_size),
+    .num_splits = num_splits,
+    .BLOCK_DMODEL = head_dim_rounded,
+    .PADDED_HEAD = head_dim_rounded != head_size,
+  };
+  AttnFwdSplitContext split_context;
+  split_context.grid_calculator = calculate_split_grid;
+  hipError_t err = split_context.lookup_optimal(split_params, arch);
+  if (err != hipSuccess)
+    return err;
+  AttnFwdSplitReduceContext reduce_context;
+  reduce_context.grid_calculator = calculate_reduce_grid;
+  err = reduce_context.lookup_optimal(reduce_params, arch);
+  if (err != hipSuccess)
+    return err;
+  err = split_context.launch(split_params, stream);
+  if (err != hipSuccess)
+    return err;
+  return reduce_context.launch(reduce_params, stream);
+}
+
+}
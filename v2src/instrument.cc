@@ -0,0 +1,264 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#include <aotriton/_internal/instrument.h>
+#include <aotriton/_internal/util.h>
+#include <cstdio>
+#include <cstdlib>
+#include <map>
+#include <mutex>
+#include <string_view>
+#include <tuple>
+#include <unordered_map>
+
+namespace aotriton::v2 {
+
+namespace {
+
+int32_t
+mode_from_env() {
+  const char* env = std::getenv("AOTRITON_INSTRUMENT");
+  if (!env)
+    return kInstrumentOff;
+  std::string_view value(env);
+  if (value == "timing")
+    return kInstrumentTiming;
+  if (value == "count" || value == "1")
+    return kInstrumentCount;
+  return kInstrumentOff;
+}
+
+// Kernel and image names are string literals of generated code,
+// hence comparing pointers is sufficient.
+using RecordKey = std::tuple<const char*, GpuArch, int64_t, int32_t, const char*>;
+
+struct PendingTiming {
+  RecordKey key;
+  hipDevice_t device;
+  hipEvent_t start;
+  hipEvent_t stop;
+};
+
+struct InstrumentState {
+  std::mutex mutex;
+  std::map<RecordKey, LaunchRecord> records;
+  std::vector<PendingTiming> pending;
+  // Events are recycled. They are never destroyed since the state may
+  // outlive the HIP runtime at process exit.
+  std::unordered_map<hipDevice_t, std::vector<hipEvent_t>> free_events;
+
+  hipError_t acquire_event(hipDevice_t device, hipEvent_t* event) {
+    auto& pool = free_events[device];
+    if (!pool.empty()) {
+      *event = pool.back();
+      pool.pop_back();
+      return hipSuccess;
+    }
+    int current;
+    hipError_t err = hipGetDevice(&current);
+    if (err != hipSuccess)
+      return err;
+    if (current != device) {
+      err = hipSetDevice(device);
+      if (err != hipSuccess)
+        return err;
+    }
+    err = hipEventCreate(event);
+    if (current != device)
+      (void)hipSetDevice(current);
+    return err;
+  }
+
+  void release_event(hipDevice_t device, hipEvent_t event) {
+    free_events[device].push_back(event);
+  }
+
+  LaunchRecord& record_of(const RecordKey& key) {
+    auto iter = records.find(key);
+    if (iter != records.end())
+      return iter->second;
+    LaunchRecord& record = records[key];
+    record.kernel = std::get<0>(key);
+    record.arch = gpu_arch_name(std::get<1>(key));
+    record.functional = std::get<2>(key);
+    record.image_index = std::get<3>(key);
+    record.image = std::get<4>(key) ? std::get<4>(key) : "";
+    return record;
+  }
+
+  void resolve_pending(bool synchronize) {
+    std::vector<PendingTiming> still_pending;
+    for (const auto& p : pending) {
+      if (synchronize)
+        (void)hipEventSynchronize(p.stop);
+      hipError_t err = hipEventQuery(p.stop);
+      if (err == hipErrorNotReady) {
+        still_pending.push_back(p);
+        continue;
+      }
+      float ms = 0.0;
+      if (err == hipSuccess && hipEventElapsedTime(&ms, p.start, p.stop) == hipSuccess) {
+        LaunchRecord& record = record_of(p.key);
+        if (record.timed_launches == 0 || ms < record.min_ms)
+          record.min_ms = ms;
+        if (record.timed_launches == 0 || ms > record.max_ms)
+          record.max_ms = ms;
+        record.timed_launches += 1;
+        record.total_ms += ms;
+      }
+      release_event(p.device, p.start);
+      release_event(p.device, p.stop);
+    }
+    pending.swap(still_pending);
+  }
+};
+
+InstrumentState&
+state() {
+  static InstrumentState s;
+  return s;
+}
+
+void
+append_json_string(std::string& out, const std::string& s) {
+  out += '"';
+  for (char c : s) {
+    if (c == '"' || c == '\\') {
+      out += '\\';
+      out += c;
+    } else if (static_cast<unsigned char>(c) < 0x20) {
+      char buf[8];
+      std::snprintf(buf, sizeof(buf), "\\u%04x", c);
+      out += buf;
+    } else {
+      out += c;
+    }
+  }
+  out += '"';
+}
+
+}
+
+std::atomic<int32_t> g_instrument_mode { mode_from_env() };
+
+hipError_t
+instrument_launch(const LaunchKey& key, hipStream_t stream, const std::function<hipError_t()>& launch) {
+  RecordKey rkey { key.kernel, key.arch, key.functional, key.image_index, key.image };
+  bool timing = g_instrument_mode.load(std::memory_order_relaxed) == kInstrumentTiming;
+  if (timing && is_stream_capturing(stream))
+    timing = false;
+  hipDevice_t device = 0;
+  hipEvent_t start = nullptr, stop = nullptr;
+  if (timing) {
+    timing = hipStreamGetDevice(stream, &device) == hipSuccess;
+  }
+  if (timing) {
+    auto& s = state();
+    std::lock_guard<std::mutex> lock(s.mutex);
+    if (s.acquire_event(device, &start) != hipSuccess) {
+      timing = false;
+    } else if (s.acquire_event(device, &stop) != hipSuccess) {
+      s.release_event(device, start);
+      timing = false;
+    }
+  }
+  if (timing && hipEventRecord(start, stream) != hipSuccess) {
+    // Fall back to counting only, the events are returned to the pool below
+    timing = false;
+  }
+  hipError_t err = launch();
+  bool timed = timing && err == hipSuccess && hipEventRecord(stop, stream) == hipSuccess;
+  auto& s = state();
+  std::lock_guard<std::mutex> lock(s.mutex);
+  if (err == hipSuccess)
+    s.record_of(rkey).launches += 1;
+  if (timed) {
+    // Drains completed timings, otherwise pending and the event pools grow
+    // without bound until the next snapshot
+    s.resolve_pending(false);
+    s.pending.push_back({ rkey, device, start, stop });
+  } else if (start) {
+    s.release_event(device, start);
+    s.release_event(device, stop);
+  }
+  return err;
+}
+
+void
+set_instrumentation(InstrumentMode mode) {
+  g_instrument_mode.store(mode, std::memory_order_relaxed);
+}
+
+InstrumentMode
+get_instrumentation() {
+  return static_cast<InstrumentMode>(g_instrument_mode.load(std::memory_order_relaxed));
+}
+
+std::vector<LaunchRecord>
+get_instrumentation_snapshot(bool synchronize) {
+  auto& s = state();
+  std::lock_guard<std::mutex> lock(s.mutex);
+  s.resolve_pending(synchronize);
+  std::map<RecordKey, uint64_t> pending_count;
+  for (const auto& p : s.pending)
+    pending_count[p.key] += 1;
+  std::vector<LaunchRecord> ret;
+  ret.reserve(s.records.size());
+  for (const auto& [key, record] : s.records) {
+    ret.push_back(record);
+    auto iter = pending_count.find(key);
+    ret.back().pending_timings = iter == pending_count.end() ? 0 : iter->second;
+  }
+  return ret;
+}
+
+std::string
+get_instrumentation_json(bool synchronize) {
+  auto records = get_instrumentation_snapshot(synchronize);
+  std::string out = "{\"mode\": ";
+  out += std::to_string(static_cast<int>(get_instrumentation()));
+  out += ", \"launches\": [";
+  bool first = true;
+  for (const auto& r : records) {
+    if (!first)
+      out += ", ";
+    first = false;
+    out += "{\"kernel\": ";
+    append_json_string(out, r.kernel);
+    out += ", \"arch\": ";
+    append_json_string(out, r.arch);
+    out += ", \"functional\": " + std::to_string(r.functional);
+    out += ", \"image_index\": " + std::to_string(r.image_index);
+    out += ", \"image\": ";
+    append_json_string(out, r.image);
+    out += ", \"launches\": " + std::to_string(r.launches);
+    out += ", \"timed_launches\": " + std::to_string(r.timed_launches);
+    out += ", \"pending_timings\": " + std::to_string(r.pending_timings);
+    char buf[128];
+    std::snprintf(buf,
+                  sizeof(buf),
+                  ", \"total_ms\": %.6f, \"min_ms\": %.6f, \"max_ms\": %.6f}",
+                  r.total_ms,
+                  r.min_ms,
+                  r.max_ms);
+    out += buf;
+  }
+  out += "]}";
+  return out;
+}
+
+void
+reset_instrumentation() {
+  auto& s = state();
+  std::lock_guard<std::mutex> lock(s.mutex);
+  for (const auto& p : s.pending) {
+    // Events may still be in flight, wait before recycling
+    (void)hipEventSynchronize(p.stop);
+    s.release_event(p.device, p.start);
+    s.release_event(p.device, p.stop);
+  }
+  s.pending.clear();
+  s.records.clear();
+}
+
+} // namespace aotriton::v2
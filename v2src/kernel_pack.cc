@@ -0,0 +1,80 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#include <aotriton/_internal/kernel_pack.h>
+#include <cstdlib>
+#include <dlfcn.h>
+#include <fcntl.h>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+namespace aotriton {
+
+namespace {
+
+std::string
+kernel_pack_dir() {
+  const char* env = std::getenv("AOTRITON_KERNEL_PACK_DIR");
+  if (env && env[0])
+    return env;
+  Dl_info info;
+  if (dladdr(reinterpret_cast<const void*>(&kernel_pack_dir), &info) && info.dli_fname) {
+    std::string fname(info.dli_fname);
+    auto slash = fname.rfind('/');
+    if (slash != std::string::npos)
+      return fname.substr(0, slash);
+  }
+  return ".";
+}
+
+// Maps the whole file read-only. Returns nullptr on failure.
+const void*
+map_file(const std::string& path, size_t* size) {
+  int fd = ::open(path.c_str(), O_RDONLY | O_CLOEXEC);
+  if (fd < 0)
+    return nullptr;
+  struct stat st;
+  void* addr = MAP_FAILED;
+  if (::fstat(fd, &st) == 0 && st.st_size > 0)
+    addr = ::mmap(nullptr, st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+  // The mapping keeps the file alive
+  ::close(fd);
+  if (addr == MAP_FAILED)
+    return nullptr;
+  *size = st.st_size;
+  return addr;
+}
+
+}
+
+// Mappings are never released, images are referenced by loaded modules
+// until process exit.
+const KernelPack*
+KernelPack::open(const char* file_name) {
+  static std::mutex mutex;
+  static std::map<std::string, std::unique_ptr<KernelPack>> packs;
+  std::lock_guard<std::mutex> lock(mutex);
+  auto iter = packs.find(file_name);
+  if (iter != packs.end())
+    return iter->second.get();
+  const KernelPack* ret = nullptr;
+  size_t size = 0;
+  const void* data = map_file(kernel_pack_dir() + "/" + file_name, &size);
+  if (data) {
+    auto pack = std::make_unique<KernelPack>();
+    if (pack->view_.parse(data, size)) {
+      ret = pack.get();
+      packs.emplace(file_name, std::move(pack));
+    } else {
+      ::munmap(const_cast<void*>(data), size);
+    }
+  }
+  return ret;
+}
+
+}
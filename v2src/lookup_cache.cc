@@ -0,0 +1,86 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#include <aotriton/_internal/lookup_cache.h>
+#include <mutex>
+#include <vector>
+
+namespace aotriton::v2 {
+
+std::atomic<bool> g_lookup_cache_enabled { true };
+std::atomic<uint64_t> g_lookup_cache_generation { 1 };
+
+namespace {
+
+// Function-local statics avoid the static initialization order problem,
+// because LookupCacheCounters objects are global objects in shim sources.
+std::mutex&
+registry_mutex() {
+  static std::mutex m;
+  return m;
+}
+
+std::vector<LookupCacheCounters*>&
+registry() {
+  static std::vector<LookupCacheCounters*> counters;
+  return counters;
+}
+
+}
+
+LookupCacheCounters::LookupCacheCounters(const char* kernel_name)
+  : kernel_name_(kernel_name) {
+  std::lock_guard<std::mutex> lock(registry_mutex());
+  registry().push_back(this);
+}
+
+LookupCacheStats
+LookupCacheCounters::stats() const {
+  LookupCacheStats ret;
+  ret.hits = hits_.load(std::memory_order_relaxed);
+  ret.misses = misses_.load(std::memory_order_relaxed);
+  return ret;
+}
+
+void
+LookupCacheCounters::reset() {
+  hits_.store(0, std::memory_order_relaxed);
+  misses_.store(0, std::memory_order_relaxed);
+}
+
+void
+set_lookup_cache_enabled(bool enabled) {
+  g_lookup_cache_enabled.store(enabled, std::memory_order_relaxed);
+}
+
+bool
+get_lookup_cache_enabled() {
+  return lookup_cache_enabled();
+}
+
+std::map<std::string, LookupCacheStats>
+get_lookup_cache_stats() {
+  std::map<std::string, LookupCacheStats> ret;
+  std::lock_guard<std::mutex> lock(registry_mutex());
+  for (auto counters : registry()) {
+    auto stats = counters->stats();
+    auto& entry = ret[counters->kernel_name()];
+    entry.hits += stats.hits;
+    entry.misses += stats.misses;
+  }
+  return ret;
+}
+
+void
+reset_lookup_cache_stats() {
+  std::lock_guard<std::mutex> lock(registry_mutex());
+  for (auto counters : registry())
+    counters->reset();
+}
+
+void
+clear_lookup_cache() {
+  g_lookup_cache_generation.fetch_add(1, std::memory_order_relaxed);
+}
+
+} // namespace aotriton::v2
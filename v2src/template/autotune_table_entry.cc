@@ -11,16 +11,12 @@
 #include "../shim.[[shim_kernel_name]].h"
 #include <aotriton/_internal/triton_kernel.h>
 #include <incbin.h>
-#include <iostream>
 
 // [[human_readable_signature]]
 #define CURRENT_ENTRY_PUBLIC Autotune_[[shim_kernel_name]]__A[[arch_number]]__F[[godel_number]]
 
 [[incbin_kernel_images]];
-
-#ifndef NDEBUG
-[[incbin_kernel_names]];
-#endif
+[[zstd_dictionary_declaration]]
 
 namespace { // Anonymous namespace
 
@@ -48,10 +44,7 @@ void CURRENT_ENTRY_PUBLIC::operator()([[param_class_name]]& params) {
     [[binning_autotune_keys]]
     auto kernel_index = lut[[binned_indices]];
     params.selected_kernel = &image_list[kernel_index];
-#ifndef NDEBUG
-    std::cerr << __FILE__ << " kernel_index = " << int(kernel_index) << std::endl;
-    params._debug_kernel_name = incbin_kernel_names[kernel_index];
-#endif
+    params._selected_image_index = kernel_index;
     const auto& perf = image_perf_list[kernel_index];
     [[perf_field_assignment]];
 }
@@ -4,9 +4,33 @@
 // clang-format off
 #include "shim.[[shim_kernel_name]].h"
 #include <aotriton/util.h>
+#include <aotriton/_internal/instrument.h>
+#include <aotriton/_internal/lookup_cache.h>
+#include <aotriton/_internal/trace.h>
+#include <aotriton/_internal/util.h>
+#include <array>
 
 namespace aotriton::v2::[[kernel_family_name]] {
 
+namespace {
+
+// Selection result of lookup_optimal
+struct LookupValue {
+    TritonKernel* selected_kernel;
+    int32_t _selected_image_index;
+    [[perf_fields]];
+};
+
+// Key: arch number, godel number, followed by autotune keys
+using ShimLookupCache = LookupCache<2 + [[number_of_autotune_keys]], LookupValue>;
+
+LookupCacheCounters lookup_counters("[[shim_kernel_name]]");
+thread_local ShimLookupCache lookup_cache;
+
+const std::array<const char*, [[number_of_perf_fields]]> perf_names = { [[perf_field_name_strings]] };
+
+}
+
 int64_t [[param_class_name]]::godel_number() const
 {
     int64_t sum = 0;
@@ -16,25 +40,88 @@ int64_t [[param_class_name]]::godel_number() const
 
 hipError_t
 [[context_class_name]]::lookup_optimal([[param_class_name]]& params, GpuArch arch) {
+    TraceTimer timer(params._lookup_ns);
     int64_t arch_number = get_arch_number(arch);
     if (arch_number < 0) {
         return hipErrorNoBinaryForGpu;
     }
+    params._selected_arch = arch;
+    int64_t godel_number = params.godel_number();
+    bool use_cache = lookup_cache_enabled();
+    ShimLookupCache::Key key = { arch_number, godel_number, [[lookup_key_values]] };
+    if (use_cache) {
+        const LookupValue* cached = lookup_cache.find(key);
+        if (cached) {
+            lookup_counters.hit();
+            params.selected_kernel = cached->selected_kernel;
+            params._selected_image_index = cached->_selected_image_index;
+            [[copy_perf_fields_from_cache]];
+            return hipSuccess;
+        }
+        lookup_counters.miss();
+    }
     params.selected_kernel = nullptr;
-    auto tune_func = autotune_table[arch_number][params.godel_number()];
+    auto tune_func = autotune_table[arch_number][godel_number];
     tune_func(params);
     if (!params.selected_kernel)
         return hipErrorSharedObjectSymbolNotFound;
+    if (use_cache) {
+        LookupValue value;
+        value.selected_kernel = params.selected_kernel;
+        value._selected_image_index = params._selected_image_index;
+        [[copy_perf_fields_to_cache]];
+        lookup_cache.insert(key, value);
+    }
     return hipSuccess;
 }
 
 hipError_t
 [[context_class_name]]::launch(const [[param_class_name]]& params, hipStream_t stream) {
-    auto arch = getArchFromStream(stream);
+    dim3 grid = grid_calculator(params);
+    return launch(params, grid, stream);
+}
+
+hipError_t
+[[context_class_name]]::launch(const [[param_class_name]]& params, dim3 grid, hipStream_t stream) {
     [[put_kernel_arguments_on_stack]];
     std::vector<void*> args = { [[let_kernel_arguments]] };
-    dim3 grid = grid_calculator(params);
-    return params.selected_kernel->invoke("[[triton_kernel_name]]", grid, args, stream);
+    hipError_t err;
+    if (instrument_enabled()) {
+        LaunchKey key = { "[[shim_kernel_name]]",
+                          params._selected_arch,
+                          params.godel_number(),
+                          params._selected_image_index,
+                          params.selected_kernel->image_name() };
+        err = instrument_launch(key, stream, [&]() {
+            return params.selected_kernel->invoke("[[triton_kernel_name]]", grid, args, stream);
+        });
+    } else {
+        err = params.selected_kernel->invoke("[[triton_kernel_name]]", grid, args, stream);
+    }
+    if (const TraceHook* hook = trace_hook()) {
+        const std::array<int32_t, [[number_of_perf_fields]]> perf_values = { [[perf_field_values]] };
+        TraceEvent event = {
+            .kernel = "[[shim_kernel_name]]",
+            .image = params.selected_kernel->image_name(),
+            .arch = gpu_arch_name(params._selected_arch),
+            .functional = params.godel_number(),
+            .image_index = params._selected_image_index,
+            .grid = grid,
+            .stream = stream,
+            .status = err,
+            .num_perf_fields = [[number_of_perf_fields]],
+            .perf_names = perf_names.data(),
+            .perf_values = perf_values.data(),
+            .lookup_ns = params._lookup_ns,
+        };
+        hook->callback(event, hook->user_data);
+    }
+    return err;
+}
+
+hipError_t
+[[context_class_name]]::preload(const [[param_class_name]]& params) {
+    return params.selected_kernel->load("[[triton_kernel_name]]");
 }
 
 int64_t
@@ -19,7 +19,10 @@ struct [[param_class_name]] {
     [[perf_fields]];
 
     TritonKernel* selected_kernel = nullptr;
-    const char* _debug_kernel_name = nullptr;
+    // Bookkeeping of lookup_optimal, for instrumentation and tracing
+    GpuArch _selected_arch = GPU_ARCH_UNKNOWN;
+    int32_t _selected_image_index = -1;
+    uint64_t _lookup_ns = 0;
 
     int64_t godel_number() const;
 };
@@ -30,6 +33,10 @@ public:
 
     hipError_t lookup_optimal([[param_class_name]]& params, GpuArch arch);
     hipError_t launch(const [[param_class_name]]& params, hipStream_t stream);
+    // Launch with a grid computed in advance (e.g. by an execution plan)
+    hipError_t launch(const [[param_class_name]]& params, dim3 grid, hipStream_t stream);
+    // Load the module of selected kernel, required before stream capture
+    hipError_t preload(const [[param_class_name]]& params);
     static int64_t get_arch_number(GpuArch arch);
 
 private:
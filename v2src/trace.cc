@@ -0,0 +1,25 @@
+// Copyright © 2023-2024 Advanced Micro Devices, Inc.
+// SPDX-License-Identifier: MIT
+
+#include <aotriton/_internal/trace.h>
+#include <mutex>
+#include <vector>
+
+namespace aotriton::v2 {
+
+std::atomic<const TraceHook*> g_trace_hook { nullptr };
+
+void
+set_trace_callback(TraceCallback callback, void* user_data) {
+  // Hooks are never freed because other threads may still be calling the
+  // previous one. Registration is rare so the leak is bounded in practice.
+  static std::mutex mutex;
+  static std::vector<const TraceHook*> retired;
+  std::lock_guard<std::mutex> lock(mutex);
+  const TraceHook* hook = callback ? new TraceHook { callback, user_data } : nullptr;
+  const TraceHook* old = g_trace_hook.exchange(hook, std::memory_order_acq_rel);
+  if (old)
+    retired.push_back(old);
+}
+
+} // namespace aotriton::v2
@@ -1,20 +1,18 @@
 // Copyright © 2023-2024 Advanced Micro Devices, Inc.
 // SPDX-License-Identifier: MIT
 
+#include <aotriton/_internal/kernel_pack.h>
 #include <aotriton/_internal/triton_kernel.h>
+#include <aotriton/_internal/util.h>
 #include <aotriton/runtime.h>
 #include <incbin.h>
-#include <iostream>
+#include <stdexcept>
 #if AOTRITON_USE_ZSTD
+#include <cstdlib>
+#include <memory>
 #include <zstd.h>
 #endif
 
-#ifdef NDEBUG
-#define AOTRITON_KERNEL_VERBOSE 0
-#else
-#define AOTRITON_KERNEL_VERBOSE 1
-#endif
-
 #define AOTRITON_HIP_CHECK_RETURN(expr)                                                                      \
   do {                                                                                                       \
     auto r = (expr);                                                                                         \
@@ -24,94 +22,191 @@
 
 namespace aotriton {
 
-TritonKernel::TritonKernel(const void* image, size_t image_size, dim3 block, int shared_memory_size)
+TritonKernel::TritonKernel(const void* image,
+                           size_t image_size,
+                           dim3 block,
+                           int shared_memory_size,
+                           const char* image_name
+#if AOTRITON_USE_ZSTD
+                           ,
+                           ZstdDictionary* dictionary
+#endif
+                           )
   : kernel_image_(image)
   , image_size_(image_size)
   , block_(block)
-  , shared_memory_size_(shared_memory_size) {
+  , shared_memory_size_(shared_memory_size)
+  , image_name_(image_name)
+#if AOTRITON_USE_ZSTD
+  , dictionary_(dictionary)
+#endif
+{
 }
 
-hipError_t
-TritonKernel::invoke(const char* kernel_name, dim3 grid, std::vector<void*>& args, hipStream_t stream) {
-#if AOTRITON_KERNEL_VERBOSE
-  std::cerr << "Invoking TritonKernel " << this << " with kernel_name = " << kernel_name << std::endl;
+TritonKernel::TritonKernel(PackedImage packed_image,
+                           dim3 block,
+                           int shared_memory_size,
+                           const char* image_name
+#if AOTRITON_USE_ZSTD
+                           ,
+                           ZstdDictionary* dictionary
 #endif
-  if (fun_ == nullptr) {
-    hipJitOption opt[] = { hipJitOptionErrorLogBufferSizeBytes,
-                           hipJitOptionErrorLogBuffer,
-                           hipJitOptionInfoLogBufferSizeBytes,
-                           hipJitOptionInfoLogBuffer,
-                           hipJitOptionLogVerbose };
-    const unsigned int errbufsize = 8192;
-    const unsigned int logbufsize = 8192;
-    std::vector<char> err(errbufsize, 0);
-    std::vector<char> log(errbufsize, 0);
-    void* optval[] = {
-      (void*)(uintptr_t)err.size(), err.data(), (void*)(uintptr_t)log.size(), log.data(), (void*)(uintptr_t)1
-    };
-
+                           )
+  : packed_image_(packed_image)
+  , block_(block)
+  , shared_memory_size_(shared_memory_size)
+  , image_name_(image_name)
 #if AOTRITON_USE_ZSTD
-    auto image = decompress_kernel();
-#if AOTRITON_KERNEL_VERBOSE
-    std::cerr << "Decompress kernel from " << kernel_image_ << " with size " << image_size_ << " to " << image
-              << " with size " << decompressed_kernel_image_.size() << std::endl;
+  , dictionary_(dictionary)
 #endif
-    if (!image)
+{
+}
+
+hipError_t
+TritonKernel::invoke(const char* kernel_name, dim3 grid, std::vector<void*>& args, hipStream_t stream) {
+  hipFunction_t fun = fun_.load(std::memory_order_acquire);
+  if (fun == nullptr) {
+    if (is_stream_capturing(stream))
+      return hipErrorStreamCaptureUnsupported;
+    hipError_t err = load(kernel_name);
+    if (err != hipSuccess)
+      return err;
+    fun = fun_.load(std::memory_order_acquire);
+  }
+  return hipModuleLaunchKernel(
+    fun, grid.x, grid.y, grid.z, block_.x, block_.y, block_.z, shared_memory_size_, stream, args.data(), 0);
+}
+
+hipError_t
+TritonKernel::load(const char* kernel_name) {
+  std::lock_guard<std::mutex> lock(load_mutex_);
+  if (fun_.load(std::memory_order_relaxed) != nullptr)
+    return hipSuccess;
+  if (kernel_image_ == nullptr && packed_image_.pack_name != nullptr) {
+    const KernelPack* pack = KernelPack::open(packed_image_.pack_name);
+    if (!pack)
+      return hipErrorFileNotFound;
+    if (!pack->view().image(packed_image_.index, &kernel_image_, &image_size_))
       return hipErrorInvalidImage;
+  }
+  hipJitOption opt[] = { hipJitOptionErrorLogBufferSizeBytes,
+                         hipJitOptionErrorLogBuffer,
+                         hipJitOptionInfoLogBufferSizeBytes,
+                         hipJitOptionInfoLogBuffer,
+                         hipJitOptionLogVerbose };
+  const unsigned int errbufsize = 8192;
+  const unsigned int logbufsize = 8192;
+  std::vector<char> err(errbufsize, 0);
+  std::vector<char> log(errbufsize, 0);
+  void* optval[] = {
+    (void*)(uintptr_t)err.size(), err.data(), (void*)(uintptr_t)log.size(), log.data(), (void*)(uintptr_t)1
+  };
+
+#if AOTRITON_USE_ZSTD
+  auto image = decompress_kernel();
+  if (!image)
+    return hipErrorInvalidImage;
 #else
-    auto image = kernel_image_;
+  auto image = kernel_image_;
 #endif
-    AOTRITON_HIP_CHECK_RETURN(hipModuleLoadDataEx(&mod_, image, 5, opt, optval));
-    AOTRITON_HIP_CHECK_RETURN(hipModuleGetFunction(&fun_, mod_, kernel_name));
-  }
-  return hipModuleLaunchKernel(
-    fun_, grid.x, grid.y, grid.z, block_.x, block_.y, block_.z, shared_memory_size_, stream, args.data(), 0);
+  hipFunction_t fun = nullptr;
+  AOTRITON_HIP_CHECK_RETURN(hipModuleLoadDataEx(&mod_, image, 5, opt, optval));
+  AOTRITON_HIP_CHECK_RETURN(hipModuleGetFunction(&fun, mod_, kernel_name));
+  fun_.store(fun, std::memory_order_release);
+  return hipSuccess;
 }
 
 #if AOTRITON_USE_ZSTD
+ZstdDictionary::ZstdDictionary(const void* data, size_t size)
+  : data_(data)
+  , size_(size) {
+}
+
+ZstdDictionary::~ZstdDictionary() {
+  if (ddict_)
+    ZSTD_freeDDict(ddict_);
+}
+
+const ZSTD_DDict*
+ZstdDictionary::ddict() {
+  std::call_once(once_, [this]() {
+    if (size_ > 0)
+      ddict_ = ZSTD_createDDict(data_, size_);
+  });
+  return ddict_;
+}
+
+namespace {
+
+// Decompression context reused by all images decompressed on this thread
+ZSTD_DCtx*
+thread_dctx() {
+  thread_local std::unique_ptr<ZSTD_DCtx, size_t (*)(ZSTD_DCtx*)> dctx(ZSTD_createDCtx(), ZSTD_freeDCtx);
+  return dctx.get();
+}
+
+// Optional node-wide cache of decompressed images, configured by
+//   AOTRITON_IMAGE_CACHE_DIR:    cache directory, e.g. /dev/shm/aotriton.
+//                                The cache is disabled if unset.
+//   AOTRITON_IMAGE_CACHE_MAX_MB: size cap, 1024 MiB by default
+const DecompressedImageCache&
+image_cache() {
+  static const DecompressedImageCache cache = []() {
+    const char* dir = std::getenv("AOTRITON_IMAGE_CACHE_DIR");
+    const char* max_mb = std::getenv("AOTRITON_IMAGE_CACHE_MAX_MB");
+    uint64_t max_bytes = (max_mb ? std::strtoull(max_mb, nullptr, 10) : 1024) << 20;
+    return DecompressedImageCache(dir ? dir : "", max_bytes);
+  }();
+  return cache;
+}
+
+}
+
 void
 TritonKernel::clear_decompressed_image() {
   decompressed_kernel_image_.clear();
+  decompressed_kernel_image_.shrink_to_fit();
+  cached_kernel_image_.reset();
 }
 
-void*
+const void*
 TritonKernel::decompress_kernel() {
   if (!decompressed_kernel_image_.empty()) {
-#if AOTRITON_KERNEL_VERBOSE
-    std::cerr << "decompressed_kernel_image_ already initialized as "
-              << (void*)decompressed_kernel_image_.data()
-              << " with size: " << decompressed_kernel_image_.size() << std::endl;
-#endif
     return decompressed_kernel_image_.data();
   }
+  if (cached_kernel_image_.data()) {
+    return cached_kernel_image_.data();
+  }
   unsigned long long const decompressed_size = ZSTD_getFrameContentSize(kernel_image_, image_size_);
   if (decompressed_size == ZSTD_CONTENTSIZE_ERROR) {
-#if AOTRITON_KERNEL_VERBOSE
-    std::cerr << "Image not compressed by zstd" << std::endl;
-#endif
     return nullptr;
   }
   if (decompressed_size == ZSTD_CONTENTSIZE_UNKNOWN) {
-#if AOTRITON_KERNEL_VERBOSE
-    std::cerr << "Unknown original size" << std::endl;
-#endif
     return nullptr;
   }
   if (ZSTD_isError(decompressed_size))
     return nullptr;
-#if AOTRITON_KERNEL_VERBOSE
-  std::cerr << "decompressed_size read as " << decompressed_size << std::endl;
-#endif
-  decompressed_kernel_image_.resize(decompressed_size);
-#if AOTRITON_KERNEL_VERBOSE
-  std::cerr << "decompressed_kernel_image_ resized to " << (void*)decompressed_kernel_image_.data()
-            << " with size: " << decompressed_kernel_image_.size() << std::endl;
-#endif
-  auto err = ZSTD_decompress(
-    decompressed_kernel_image_.data(), decompressed_kernel_image_.size(), kernel_image_, image_size_);
-  if (ZSTD_isError(err))
-    return nullptr;
-  return decompressed_kernel_image_.data();
+  auto decompress = [this](void* dst, size_t size) {
+    const ZSTD_DDict* ddict = dictionary_ ? dictionary_->ddict() : nullptr;
+    ZSTD_DCtx* dctx = thread_dctx();
+    size_t err;
+    if (ddict && dctx) {
+      err = ZSTD_decompress_usingDDict(dctx, dst, size, kernel_image_, image_size_, ddict);
+    } else {
+      err = ZSTD_decompress(dst, size, kernel_image_, image_size_);
+    }
+    return !ZSTD_isError(err);
+  };
+  const void* image = decompress_cached(image_cache(),
+                                        kernel_image_,
+                                        image_size_,
+                                        decompressed_size,
+                                        &cached_kernel_image_,
+                                        &decompressed_kernel_image_,
+                                        decompress);
+  if (!image)
+    decompressed_kernel_image_.clear();
+  return image;
 }
 
 #endif
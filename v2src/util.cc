@@ -2,6 +2,8 @@
 // SPDX-License-Identifier: MIT
 
 #include <aotriton/util.h>
+#include <aotriton/_internal/util.h>
+#include <mutex>
 #include <string>
 #include <unordered_map>
 
@@ -34,14 +36,23 @@ std::unordered_map<std::string, GpuArch> LazyArch::string_to_arch = {
 
 GpuArch
 getArchFromStream(hipStream_t stream) {
+  static std::mutex mutex;
   static std::unordered_map<hipDevice_t, GpuArch> device_to_arch;
   hipDevice_t dev;
   hipError_t err = hipStreamGetDevice(stream, &dev);
   if (err != hipSuccess)
     return GPU_ARCH_UNKNOWN;
-  LazyArch lazy(dev);
-  device_to_arch.try_emplace(dev, lazy);
-  return device_to_arch[dev];
+  std::lock_guard<std::mutex> lock(mutex);
+  auto iter = device_to_arch.find(dev);
+  if (iter != device_to_arch.end())
+    return iter->second;
+  // Device properties are not queried during stream capture.
+  // Callers can tell this case from unsupported GPUs with is_stream_capturing()
+  if (is_stream_capturing(stream))
+    return GPU_ARCH_UNKNOWN;
+  GpuArch arch = LazyArch(dev);
+  device_to_arch.emplace(dev, arch);
+  return arch;
 }
 
 template class TensorView<1>;